@@ -0,0 +1,334 @@
+#!/usr/bin/env python
+"""
+archive.py - 古い終了済みセッションを月別のアーカイブファイルへ移動し、期間を指定して透過的に参照するスクリプト
+
+共有上の central_db.sqlite3 は増え続けるため、クライアントの書き込みのたびにファイルやインデックスの
+肥大化、SMB 越しのロック・ジャーナル処理の遅延の影響を受けます。本スクリプトは、起動日が指定日数より
+古い終了済みセッションを、月ごとのパーティションファイル（例: session_logs_2026_09.sqlite3）へ
+batch_size 件ずつ移動し、中央DB（ホットDB）を小さく保ちます。
+
+移動は1バッチごとに、パーティションファイルを ATTACH した1つのトランザクション内で
+「パーティションへの INSERT」と「ホットDBからの DELETE」を行うため、途中で中断しても
+行が失われたり二重に存在したりしません（session_id はそのまま引き継ぐため、再実行しても重複しません）。
+日別集計 (rollup.py) が未反映のセッションは移動しません。
+
+参照時は attach_range が、指定した期間と重なるパーティションだけを ATTACH し、
+ホットDBと合わせて1つの一時ビュー all_session_logs として参照できるようにします。
+
+提供する機能:
+  ・partition_path: 月に対応するパーティションファイルのパス
+  ・archive_sessions: 古い終了済みセッションをパーティションへ移動する
+  ・list_partitions: 既存のパーティションと件数・期間の一覧
+  ・attach_range: 期間と重なるパーティションを ATTACH し、all_session_logs ビューを作成した接続を返す
+
+使い方:
+    python archive.py <db_path> archive --max-age-days 180 [--batch-size 500] [--archive-dir DIR]
+    python archive.py <db_path> list
+    python archive.py <db_path> query --from 2026-01-01 --to 2026-03-31 [--pc PC001] [--user user01]
+"""
+
+import argparse
+import datetime
+import glob
+import json
+import logging
+import os
+import re
+import sqlite3
+import sys
+import time
+
+from init_db import get_schema_version
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+
+PARTITION_PREFIX = "session_logs_"
+PARTITION_PATTERN = re.compile(r"^session_logs_(\d{4})_(\d{2})\.sqlite3$")
+
+# 日別集計テーブルが存在するスキーマバージョン（rollup.py 参照）
+ROLLUP_SCHEMA_VERSION = 3
+
+# パーティションのスキーマ。session_id はホットDBの値をそのまま引き継ぐ
+PARTITION_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS {schema}.session_logs (
+        session_id INTEGER PRIMARY KEY,
+        pc_id TEXT NOT NULL,
+        user_account TEXT NOT NULL,
+        start_time DATETIME NOT NULL,
+        shutdown_time DATETIME,
+        duration INTEGER,
+        session_type TEXT,
+        weekday TEXT
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS {schema}.idx_session_logs_start_time ON session_logs (start_time)",
+    "CREATE INDEX IF NOT EXISTS {schema}.idx_session_logs_pc_start ON session_logs (pc_id, start_time)",
+]
+
+COLUMNS = "session_id, pc_id, user_account, start_time, shutdown_time, duration, session_type, weekday"
+
+
+def partition_path(archive_dir, month):
+    """
+    月に対応するパーティションファイルのパスを返す。
+
+    Parameters:
+        archive_dir (str): パーティションファイルを置くディレクトリ
+        month (str): "YYYY-MM" 形式の月
+
+    Returns:
+        str: パーティションファイルのパス（例: <archive_dir>/session_logs_2026_09.sqlite3）
+    """
+    return os.path.join(archive_dir, f"{PARTITION_PREFIX}{month.replace('-', '_')}.sqlite3")
+
+
+def _default_archive_dir(db_path):
+    return os.path.dirname(os.path.abspath(db_path))
+
+
+def _select_batch(conn, cutoff, batch_size):
+    """移動対象（cutoff より前に開始した終了済みセッション）の session_id と月を最大 batch_size 件取得する。"""
+    conditions = ["start_time < ?", "shutdown_time IS NOT NULL", "shutdown_time != ''"]
+    params = [cutoff]
+    if get_schema_version(conn) >= ROLLUP_SCHEMA_VERSION:
+        # 日別集計に未反映、または集計時点で未終了だったセッションは、集計が反映されるまで移動しない
+        conditions.append("session_id <= COALESCE((SELECT value FROM rollup_state WHERE name = 'last_session_id'), 0)")
+        conditions.append("session_id NOT IN (SELECT session_id FROM rollup_pending)")
+    query = f"""
+        SELECT session_id, strftime('%Y-%m', start_time) FROM session_logs
+        WHERE {" AND ".join(conditions)}
+        ORDER BY session_id
+        LIMIT ?
+    """
+    return conn.execute(query, params + [batch_size]).fetchall()
+
+
+def _move_batch(conn, archive_dir, rows):
+    """
+    1バッチ分のセッションを月ごとのパーティションへ移動する（1つのトランザクション）。
+    同時に ATTACH できるファイル数には上限があるため、上限を超える月の行は次のバッチに回す。
+
+    Returns:
+        dict: 月ごとの移動件数
+    """
+    by_month = {}
+    for session_id, month in rows:
+        by_month.setdefault(month, []).append(session_id)
+    for month in sorted(by_month)[conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED):]:
+        del by_month[month]
+
+    attached = []
+    try:
+        for i, month in enumerate(sorted(by_month)):
+            schema = f"part{i}"
+            conn.execute("ATTACH DATABASE ? AS " + schema, (partition_path(archive_dir, month),))
+            attached.append(schema)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for schema, month in zip(attached, sorted(by_month)):
+                for statement in PARTITION_SCHEMA:
+                    conn.execute(statement.format(schema=schema))
+                ids = by_month[month]
+                placeholders = ",".join("?" * len(ids))
+                conn.execute(f"""
+                    INSERT OR IGNORE INTO {schema}.session_logs ({COLUMNS})
+                    SELECT {COLUMNS} FROM main.session_logs WHERE session_id IN ({placeholders})
+                """, ids)
+                conn.execute(f"DELETE FROM main.session_logs WHERE session_id IN ({placeholders})", ids)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        for schema in attached:
+            conn.execute("DETACH DATABASE " + schema)
+    return {month: len(ids) for month, ids in by_month.items()}
+
+
+def archive_sessions(db_path, max_age_days, archive_dir=None, batch_size=500, pause=0.1, max_batches=None,
+                     timeout=5.0, vacuum=False):
+    """
+    起動日が max_age_days 日より前の終了済みセッションを、月別のパーティションファイルへ移動する。
+    バッチの間に pause 秒待機し、クライアントの書き込みがロックを取得できるようにする。
+
+    Parameters:
+        db_path (str): 中央データベース（ホットDB）のパス
+        max_age_days (int): この日数より前に開始したセッションを移動する
+        archive_dir (str or None): パーティションファイルを置くディレクトリ（None の場合はホットDBと同じ）
+        batch_size (int): 1トランザクションで移動する最大件数
+        pause (float): バッチ間の待機時間（秒）
+        max_batches (int or None): 実行するバッチ数の上限（None の場合は対象がなくなるまで）
+        timeout (float): SQLite接続時のタイムアウト秒数
+        vacuum (bool): 移動後に VACUUM でホットDBのファイルを縮小する（排他ロックを取るため保守時間に実行）
+
+    Returns:
+        dict: moved（移動件数の合計）、batches、months（月ごとの件数）、cutoff、elapsed（秒）
+    """
+    archive_dir = archive_dir or _default_archive_dir(db_path)
+    os.makedirs(archive_dir, exist_ok=True)
+    cutoff = (datetime.datetime.now() - datetime.timedelta(days=max_age_days)).strftime("%Y-%m-%d 00:00:00")
+    started = time.perf_counter()
+    result = {'moved': 0, 'batches': 0, 'months': {}, 'cutoff': cutoff}
+
+    conn = sqlite3.connect(db_path, timeout=timeout, isolation_level=None)
+    try:
+        while max_batches is None or result['batches'] < max_batches:
+            rows = _select_batch(conn, cutoff, batch_size)
+            if not rows:
+                break
+            moved = _move_batch(conn, archive_dir, rows)
+            result['batches'] += 1
+            for month, count in moved.items():
+                result['moved'] += count
+                result['months'][month] = result['months'].get(month, 0) + count
+            logging.info("Archived batch %d: %s", result['batches'],
+                         ", ".join(f"{m}={c}" for m, c in sorted(moved.items())))
+            if len(rows) < batch_size and sum(moved.values()) == len(rows):
+                break
+            time.sleep(pause)
+        if vacuum and result['moved']:
+            logging.info("Running VACUUM on %s...", db_path)
+            conn.execute("VACUUM")
+    finally:
+        conn.close()
+
+    result['elapsed'] = round(time.perf_counter() - started, 3)
+    logging.info("Archived %d session(s) older than %s in %d batch(es) (%.3f seconds).",
+                 result['moved'], cutoff, result['batches'], result['elapsed'])
+    return result
+
+
+def list_partitions(archive_dir):
+    """
+    アーカイブディレクトリ内のパーティションファイルを月順に返す。
+
+    Parameters:
+        archive_dir (str): パーティションファイルを置くディレクトリ
+
+    Returns:
+        list: (month ("YYYY-MM"), path) のリスト
+    """
+    partitions = []
+    for path in glob.glob(os.path.join(archive_dir, PARTITION_PREFIX + "*.sqlite3")):
+        match = PARTITION_PATTERN.match(os.path.basename(path))
+        if match:
+            partitions.append((f"{match.group(1)}-{match.group(2)}", path))
+    return sorted(partitions)
+
+
+def attach_range(db_path, date_from=None, date_to=None, archive_dir=None, timeout=5.0):
+    """
+    ホットDBを開き、期間 [date_from, date_to] と重なる月のパーティションだけを ATTACH して、
+    ホットDBとパーティションを UNION ALL した一時ビュー all_session_logs を作成する。
+
+    Parameters:
+        db_path (str): 中央データベース（ホットDB）のパス
+        date_from (str or None): 期間の開始日（YYYY-MM-DD）。None の場合は最も古いパーティションから
+        date_to (str or None): 期間の終了日（YYYY-MM-DD）。None の場合は最新まで
+        archive_dir (str or None): パーティションファイルのディレクトリ（None の場合はホットDBと同じ）
+        timeout (float): SQLite接続時のタイムアウト秒数
+
+    Raises:
+        ValueError: 対象のパーティション数が ATTACH の上限を超える場合（期間を分けて参照すること）
+
+    Returns:
+        sqlite3.Connection: all_session_logs ビューを持つ接続（呼び出し側で close すること）
+    """
+    archive_dir = archive_dir or _default_archive_dir(db_path)
+    first = date_from[:7] if date_from else None
+    last = date_to[:7] if date_to else None
+    partitions = [(month, path) for month, path in list_partitions(archive_dir)
+                  if (first is None or month >= first) and (last is None or month <= last)]
+
+    conn = sqlite3.connect(db_path, timeout=timeout)
+    try:
+        limit = conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+        if len(partitions) > limit:
+            raise ValueError(f"The range covers {len(partitions)} partitions but only {limit} can be attached "
+                             "at once; query a shorter range.")
+        selects = ["SELECT * FROM main.session_logs"]
+        for month, path in partitions:
+            schema = f"archive_{month.replace('-', '_')}"
+            conn.execute(f"ATTACH DATABASE ? AS {schema}", (path,))
+            selects.append(f"SELECT * FROM {schema}.session_logs")
+        conn.execute("CREATE TEMP VIEW all_session_logs AS " + " UNION ALL ".join(selects))
+        # 参照専用の接続として、誤ってホットDBやパーティションを書き換えないようにする
+        conn.execute("PRAGMA query_only = ON")
+    except Exception:
+        conn.close()
+        raise
+    logging.debug("Attached %d partition(s) for %s..%s.", len(partitions), date_from, date_to)
+    return conn
+
+
+def query_sessions(db_path, date_from=None, date_to=None, pc_id=None, user_account=None, archive_dir=None,
+                   timeout=5.0):
+    """
+    ホットDBとパーティションをまたいで、期間・PC・ユーザーを指定してセッションを取得する。
+
+    Returns:
+        list: session_logs の列を持つ dict のリスト（start_time 順）
+    """
+    conditions, params = [], []
+    if date_from:
+        conditions.append("start_time >= ?")
+        params.append(date_from)
+    if date_to:
+        # date_to の日を含める
+        conditions.append("start_time < date(?, '+1 day')")
+        params.append(date_to)
+    if pc_id:
+        conditions.append("pc_id = ?")
+        params.append(pc_id)
+    if user_account:
+        conditions.append("user_account = ?")
+        params.append(user_account)
+    where = "WHERE " + " AND ".join(conditions) if conditions else ""
+    conn = attach_range(db_path, date_from, date_to, archive_dir, timeout)
+    conn.row_factory = sqlite3.Row
+    try:
+        return [dict(row) for row in conn.execute(
+            f"SELECT * FROM all_session_logs {where} ORDER BY start_time, session_id", params)]
+    finally:
+        conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="PCActivityTracker 月別アーカイブの作成・参照")
+    parser.add_argument("db_path", help="中央SQLiteデータベース（ホットDB）のパス")
+    parser.add_argument("--archive-dir", help="パーティションファイルのディレクトリ（省略時はホットDBと同じ）")
+    parser.add_argument("--timeout", type=float, default=5.0, help="SQLite接続時のタイムアウト秒数")
+    sub = parser.add_subparsers(dest="command", required=True)
+    a = sub.add_parser("archive", help="古い終了済みセッションを月別ファイルへ移動する")
+    a.add_argument("--max-age-days", type=int, default=180, help="この日数より前に開始したセッションを移動する")
+    a.add_argument("--batch-size", type=int, default=500, help="1トランザクションで移動する最大件数")
+    a.add_argument("--pause", type=float, default=0.1, help="バッチ間の待機時間（秒）")
+    a.add_argument("--max-batches", type=int, default=None, help="実行するバッチ数の上限")
+    a.add_argument("--vacuum", action="store_true", help="移動後に VACUUM でホットDBを縮小する（保守時間に実行）")
+    sub.add_parser("list", help="パーティションの一覧と件数を表示する")
+    q = sub.add_parser("query", help="期間を指定してセッションを表示する（ホットDBとパーティションを横断）")
+    q.add_argument("--from", dest="date_from", help="期間の開始日（YYYY-MM-DD）")
+    q.add_argument("--to", dest="date_to", help="期間の終了日（YYYY-MM-DD）")
+    q.add_argument("--pc", dest="pc_id", help="PCで絞り込む")
+    q.add_argument("--user", dest="user_account", help="ユーザーで絞り込む")
+    args = parser.parse_args(argv)
+
+    if args.command == "archive":
+        archive_sessions(args.db_path, args.max_age_days, args.archive_dir, args.batch_size, args.pause,
+                         args.max_batches, args.timeout, args.vacuum)
+    elif args.command == "list":
+        for month, path in list_partitions(args.archive_dir or _default_archive_dir(args.db_path)):
+            with sqlite3.connect(path, timeout=args.timeout) as conn:
+                count, first, last = conn.execute(
+                    "SELECT COUNT(*), MIN(start_time), MAX(start_time) FROM session_logs").fetchone()
+            print(f"{month}  {count:>8} session(s)  {first} .. {last}  {path}")
+    else:
+        for row in query_sessions(args.db_path, args.date_from, args.date_to, args.pc_id, args.user_account,
+                                  args.archive_dir, args.timeout):
+            print(json.dumps(row, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,322 @@
+#!/usr/bin/env python
+"""
+collector.py - 中央データベースの手前で動作するイベント集約サービス（単一ライター）
+
+多数のPCがネットワーク共有上の同じSQLiteファイルへ直接書き込むと、始業時刻などに
+「database is locked」による再試行が集中します。本サービスはDBと同じサーバー上で動作し、
+各PCから TCP で受け取った起動／シャットダウンイベントをメモリ上にまとめ、
+batch_delay_ms ミリ秒ごと、または batch_size 件ごとに、1つの書き込み用接続・1つのトランザクションで
+コミットします（グループコミット）。応答はコミット完了後に返すため、応答を受け取ったイベントは永続化済みです。
+
+イベントの反映処理は pc_client/utils.py の apply_events_on_connection を共有しており、
+event_id による冪等性（spool_events テーブル）もクライアントの直接書き込みと同じです。
+クライアントは config.ini の [Transport] mode = collector で本サービスを利用し、
+接続できない場合は従来どおりDBへ直接書き込みます。通信形式は pc_client/transport.py を参照。
+
+書き込み用接続の PRAGMA は --profile で選択します（pc_client/connection.py のプロファイル）。
+既定の share-safe はクライアントの直接書き込み（集約サービスに接続できない場合の代替経路）と共存できます。
+DBファイルを共有せず、すべての書き込みが本サービス経由になる構成では local-collector（WAL）を指定できます。
+--write-mode events の場合は、クライアントの [Database] write_mode = events と同じく、イベントを
+session_events へ追記するだけにします（session_logs への反映は pair_events.py が行う）。
+
+使い方:
+    python collector.py <db_path> [--host 127.0.0.1] [--port 8765] [--batch-size 200] [--batch-delay-ms 50]
+                        [--profile share-safe] [--write-mode update|events] [--commit-deadline 2.0]
+                        [--max-request-bytes 1048576]
+
+--commit-deadline（既定 2 秒）はクライアントの [Transport] timeout（既定 3 秒）より短くすること。
+応答待ちがタイムアウトしたクライアントは同じ event_id でDBへ直接反映するため、コミット済みでも二重には記録されません。
+1リクエストの大きさは --max-request-bytes（既定 1 MiB）までとします。クライアントはスプールの未反映分を
+transport.MAX_EVENTS_PER_REQUEST 件ずつのリクエストに分けて送信するため、通常はこの上限に達しません。
+イベントは種別ごとに項目の型と値（NULL・空文字でないこと、時刻の形式）を検証し、不正なリクエストはキューに入れません。
+グループコミットが失敗した場合は、まとめたリクエストを1つずつコミットし直し、失敗したリクエストにだけエラーを返します。
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# イベント反映処理はクライアントと共通の utils.py を利用する
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "pc_client"))
+from utils import WRITE_MODES, apply_events_on_connection, set_write_mode  # noqa: E402
+import connection  # noqa: E402
+from retry import RetryPolicy, is_retryable, run_with_retry  # noqa: E402
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+
+EVENT_KINDS = ("startup", "shutdown")
+
+# 1リクエスト（改行までの1行）の最大バイト数
+MAX_REQUEST_BYTES = 1024 * 1024
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# 種別ごとの必須項目と型（"time" は TIME_FORMAT の時刻の文字列、"name" は空でない文字列）
+FIELD_TYPES = {
+    "startup": {"pc_id": "name", "user_account": "name", "start_time": "time", "shutdown_time": str,
+                "duration": int, "session_type": "name", "weekday": str},
+    "shutdown": {"pc_id": "name", "user_account": "name", "shutdown_time": "time", "session_type": "name",
+                 "weekday": str},
+}
+
+
+def _field_error(value, expected):
+    """項目の値が expected に合わなければ理由を返す（合う場合は None）。"""
+    if value is None:
+        return "must not be null"
+    if expected == int:
+        return None if isinstance(value, int) and not isinstance(value, bool) else "must be an integer"
+    if not isinstance(value, str):
+        return "must be a string"
+    if expected == "name" and not value.strip():
+        return "must not be empty"
+    if expected == "time":
+        try:
+            datetime.datetime.strptime(value, TIME_FORMAT)
+        except ValueError:
+            return f"must be a time in the form {TIME_FORMAT}"
+    return None
+
+
+def validate_events(events):
+    """
+    リクエストに含まれるイベントの形式と、種別ごとの項目の型・値を検証する
+    （グループコミットの途中で NOT NULL 制約などに違反し、同じバッチの他のリクエストまで失敗させないようにする）。
+
+    Parameters:
+        events (list): クライアントから受け取ったイベントのリスト
+
+    Raises:
+        ValueError: 形式が不正な場合
+    """
+    if not isinstance(events, list) or not events:
+        raise ValueError("'events' must be a non-empty list")
+    for event in events:
+        if not isinstance(event, dict) or not isinstance(event.get('event_id'), str):
+            raise ValueError("each event needs a string 'event_id'")
+        if event.get('kind') not in EVENT_KINDS:
+            raise ValueError(f"unknown event kind: {event.get('kind')!r}")
+        record = event.get('record')
+        if not isinstance(record, dict):
+            raise ValueError(f"event {event['event_id']} has no 'record'")
+        fields = FIELD_TYPES[event['kind']]
+        missing = [k for k in fields if k not in record]
+        if missing:
+            raise ValueError(f"event {event['event_id']} is missing fields: {', '.join(missing)}")
+        for key, expected in fields.items():
+            error = _field_error(record[key], expected)
+            if error:
+                raise ValueError(f"event {event['event_id']} field {key!r} {error}")
+
+
+class EventCollector:
+    """
+    イベントを受け付け、単一の書き込み用接続でグループコミットする集約サービス。
+
+    Parameters:
+        db_path (str): 中央データベースファイルのパス
+        timeout (float): SQLite接続時のタイムアウト秒数（クライアントからの受信待ちにも使用）
+        batch_size (int): 1トランザクションでコミットする最大イベント数
+        batch_delay_ms (float): 最初のイベント受信からコミットまでに他のイベントを待つ最大時間（ミリ秒）
+        profile (str): 書き込み用接続のプロファイル名（connection.PROFILES）
+        commit_deadline (float): 1バッチのコミット（ロック待ちと再試行を含む）の上限秒数。
+            クライアントの [Transport] timeout より短くし、コミット済みのイベントが応答待ちのタイムアウトで
+            未送信とみなされにくくする（その場合もクライアントは同じ event_id で反映するため二重にはならない）
+        max_request_bytes (int): 1リクエストの最大バイト数（超えるリクエストはエラーを返す）
+    """
+
+    def __init__(self, db_path, timeout=5.0, batch_size=200, batch_delay_ms=50, profile=connection.DEFAULT_PROFILE,
+                 commit_deadline=2.0, max_request_bytes=MAX_REQUEST_BYTES):
+        self.db_path = db_path
+        self.max_request_bytes = max_request_bytes
+        self.profile = connection.get_profile(profile)
+        self.timeout = timeout
+        self.commit_deadline = commit_deadline
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay_ms / 1000.0
+        # 書き込みはこのスレッド1本だけで行う（接続もこのスレッドでのみ使用する）
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="collector-writer")
+        self._conn = None
+        # 集約サービス以外（直接書き込みのクライアントや管理ツール）とのロック競合に備えて再試行する
+        self.retry_policy = RetryPolicy(max_retries=5, base_delay=0.05, max_delay=1.0, deadline=commit_deadline,
+                                        attempt_timeout=min(timeout, commit_deadline))
+        self._queue = None
+        self._writer_task = None
+        self.stats = {'requests': 0, 'events': 0, 'batches': 0, 'errors': 0}
+
+    def _commit_batch(self, events):
+        if self._conn is None:
+            # 1回のロック待ち (busy_timeout) もコミットの上限を超えないようにする
+            self._conn = connection.open_connection(self.db_path, min(self.timeout, self.commit_deadline),
+                                                    self.profile, check_same_thread=False)
+        return run_with_retry(lambda: apply_events_on_connection(self._conn, events), self.retry_policy,
+                              "Group commit of %d event(s)" % len(events))
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def _writer_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            count = len(batch[0][0])
+            deadline = loop.time() + self.batch_delay
+            while count < self.batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(item)
+                count += len(item[0])
+
+            events = [event for item_events, _ in batch for event in item_events]
+            started = time.perf_counter()
+            try:
+                results = await loop.run_in_executor(self._executor, self._commit_batch, events)
+            except Exception as e:
+                # 1つのバッチの失敗でサービスを止めず、リクエストごとにコミットし直して失敗したものにだけエラーを返す
+                logging.error("Group commit of %d event(s) failed: %s", len(events), e)
+                await self._commit_each(batch, e)
+                continue
+            self.stats['batches'] += 1
+            self.stats['events'] += len(events)
+            logging.debug("Committed %d event(s) from %d request(s) in %.1f ms.",
+                          len(events), len(batch), (time.perf_counter() - started) * 1000)
+            for item_events, future in batch:
+                if not future.done():
+                    future.set_result({e['event_id']: results.get(e['event_id']) for e in item_events})
+
+    async def _commit_each(self, batch, error):
+        """
+        グループコミットに失敗したバッチを、リクエストごとの別々のトランザクションでコミットし直す。
+        ロック待ちの失敗（is_retryable）はリクエストの内容によらないため、コミットし直さずにすべてへエラーを返す。
+        """
+        loop = asyncio.get_running_loop()
+        if len(batch) == 1 or is_retryable(error):
+            self.stats['errors'] += 1
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        for item_events, future in batch:
+            try:
+                results = await loop.run_in_executor(self._executor, self._commit_batch, item_events)
+            except Exception as e:
+                logging.error("Commit of a request with %d event(s) failed: %s", len(item_events), e)
+                self.stats['errors'] += 1
+                if not future.done():
+                    future.set_exception(e)
+                continue
+            self.stats['batches'] += 1
+            self.stats['events'] += len(item_events)
+            if not future.done():
+                future.set_result({e['event_id']: results.get(e['event_id']) for e in item_events})
+
+    async def _read_request(self, reader):
+        try:
+            return await asyncio.wait_for(reader.readline(), self.timeout)
+        except ValueError as e:
+            # StreamReader の limit (max_request_bytes) を超えた
+            raise ValueError(f"request exceeds {self.max_request_bytes} bytes") from e
+
+    async def handle_client(self, reader, writer):
+        """1接続につき1リクエストを受け取り、コミット完了後に応答を返す。"""
+        try:
+            line = await self._read_request(reader)
+            request = json.loads(line.decode("utf-8"))
+            events = request.get('events') if isinstance(request, dict) else None
+            validate_events(events)
+            self.stats['requests'] += 1
+            future = asyncio.get_running_loop().create_future()
+            await self._queue.put((events, future))
+            response = {'ok': True, 'results': await future}
+        except (ValueError, UnicodeDecodeError) as e:
+            response = {'ok': False, 'error': f"bad request: {e}"}
+        except asyncio.TimeoutError:
+            response = {'ok': False, 'error': "request timed out"}
+        except Exception as e:
+            response = {'ok': False, 'error': str(e)}
+        try:
+            writer.write((json.dumps(response, ensure_ascii=False) + "\n").encode("utf-8"))
+            await writer.drain()
+        except OSError as e:
+            logging.warning("Could not send response to client: %s", e)
+        finally:
+            writer.close()
+
+    async def start(self, host, port):
+        """
+        待ち受けを開始し、asyncio.Server を返す（port=0 の場合は空きポートを使用）。
+        """
+        self._queue = asyncio.Queue()
+        self._writer_task = asyncio.create_task(self._writer_loop())
+        server = await asyncio.start_server(self.handle_client, host, port, limit=self.max_request_bytes)
+        addr = server.sockets[0].getsockname()
+        logging.info("Collector listening on %s:%d (batch_size=%d, batch_delay=%.0f ms, db=%s)",
+                     addr[0], addr[1], self.batch_size, self.batch_delay * 1000, self.db_path)
+        return server
+
+    async def stop(self, server):
+        """待ち受けを停止し、書き込みスレッドと接続を閉じる。"""
+        server.close()
+        await server.wait_closed()
+        if self._writer_task:
+            self._writer_task.cancel()
+            try:
+                await self._writer_task
+            except asyncio.CancelledError:
+                pass
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._close)
+        self._executor.shutdown(wait=True)
+        logging.info("Collector stopped. Stats: %s", self.stats)
+
+
+async def serve(args):
+    collector = EventCollector(args.db_path, args.timeout, args.batch_size, args.batch_delay_ms, args.profile,
+                               args.commit_deadline, args.max_request_bytes)
+    server = await collector.start(args.host, args.port)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await collector.stop(server)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="PCActivityTracker イベント集約サービス（単一ライター）")
+    parser.add_argument("db_path", help="中央SQLiteデータベースファイルのパス（サービスと同じサーバー上のローカルパス推奨）")
+    parser.add_argument("--host", default="127.0.0.1", help="待ち受けアドレス（既定: 127.0.0.1）")
+    parser.add_argument("--port", type=int, default=8765, help="待ち受けポート（既定: 8765）")
+    parser.add_argument("--timeout", type=float, default=5.0, help="SQLite接続・受信待ちのタイムアウト秒数")
+    parser.add_argument("--batch-size", type=int, default=200, help="1トランザクションでコミットする最大イベント数")
+    parser.add_argument("--batch-delay-ms", type=float, default=50, help="コミットまでに他のイベントを待つ最大時間（ミリ秒）")
+    parser.add_argument("--commit-deadline", type=float, default=2.0,
+                        help="1バッチのコミット（ロック待ち・再試行を含む）の上限秒数。クライアントの [Transport] timeout より短くする")
+    parser.add_argument("--max-request-bytes", type=int, default=MAX_REQUEST_BYTES,
+                        help="1リクエストの最大バイト数（既定: 1 MiB）")
+    parser.add_argument("--profile", choices=("share-safe", "local-collector"), default=connection.DEFAULT_PROFILE,
+                        help="書き込み用接続の PRAGMA プロファイル（DBを共有しない構成では local-collector）")
+    parser.add_argument("--write-mode", choices=WRITE_MODES, default="update",
+                        help="記録方式（events: session_events へ追記のみ。スキーマバージョン8以上）")
+    args = parser.parse_args(argv)
+    set_write_mode(args.write_mode)
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,423 @@
+#!/usr/bin/env python
+"""
+concurrency.py - 同時利用台数の推移（分単位のタイムライン）、曜日 × 時間帯のヒートマップ、PC別の稼働率を集計するスクリプト
+
+「各時刻に何台のPCが使われていたか」を数か月分の session_logs から求めるには、セッションごとに
+Python のループで時刻を数えると時間がかかりすぎるため、NumPy の配列演算で集計します。
+  ・読み込み: 開始・終了時刻と PC を chunk_size 件ずつ session_id 順に読み、整数の配列に変換する
+    （チャンクの間は読み取りロックを保持しない。コンパクト形式では start_ts / shutdown_ts をそのまま使う）
+  ・PC単位への統合: 同じPCの重なるセッション（重複ログオンなど）を1つの利用区間にまとめる
+    （PCごとにずらした時刻の累積最大値で、区間の切れ目を配列演算で求める）
+  ・タイムライン: 各区間の開始・終了を分（--step 秒）の番号に変換し、+1 / -1 の件数 (bincount) の累積和で
+    各時刻の利用台数を求める。最大同時利用台数は、開始・終了を時刻順に並べた +1 / -1 の累積和で正確に求める
+  ・ヒートマップ: タイムラインの各時刻を曜日 × 時間帯に振り分け、平均・最大の利用台数を求める
+  ・稼働率: PCごとの利用区間の合計時間 ÷ 集計期間
+時刻はすべてPCの現地時刻（session_logs の表記と同じ）で扱います。未終了のセッションは、ハートビート
+（スキーマバージョン7以上）があれば最終確認時刻までを利用中とし、なければ集計から除きます
+（reconcile.py で終了させておくと含まれます）。
+
+NumPy が必要です（pip install numpy）。クライアントの EXE には同梱しません。
+--snapshot を指定した場合は、中央DBを直接読まず、snapshot.py のスナップショットを更新してから読みます。
+
+使い方:
+    python concurrency.py <db_path> --from 2026-07-01 --to 2026-09-30
+    python concurrency.py <db_path> --from 2026-09-01 --to 2026-09-30 --report heatmap
+    python concurrency.py <db_path> --report timeline --step 300 --csv timeline.csv
+    python concurrency.py <db_path> --report pcs --top 20
+"""
+
+import argparse
+import calendar
+import csv
+import datetime
+import logging
+import os
+import sys
+import time
+
+from init_db import get_schema_version
+
+# 読み取り用接続のプロファイルはクライアントと共通の connection.py を利用する
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "pc_client"))
+import connection  # noqa: E402
+import snapshot  # noqa: E402
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+
+# session_logs がコンパクト形式 (sessions) の互換ビューになるバージョン
+COMPACT_SCHEMA_VERSION = 5
+
+# session_heartbeats を作成する移行のバージョン
+HEARTBEAT_SCHEMA_VERSION = 7
+
+# 集計期間の開始より前に始まったセッションを読み込む範囲（秒）。これより長いセッションは期間の開始から数えない
+LOOKBACK = 2 * 86400
+
+REPORTS = ("summary", "timeline", "heatmap", "pcs")
+WEEKDAYS = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+
+
+def _require_numpy():
+    if np is None:
+        raise RuntimeError("concurrency.py requires NumPy; install it with 'pip install numpy'.")
+
+
+def _wall_clock(epoch):
+    """UNIX 秒（UTC）の配列を、現地時刻の表記を UTC とみなした秒（壁時計の秒）に変換する（夏時間を含む）。"""
+    hours, inverse = np.unique(epoch // 3600, return_inverse=True)
+    offsets = np.array([calendar.timegm(time.localtime(int(h) * 3600)) - int(h) * 3600 for h in hours],
+                       dtype=np.int64)
+    return epoch + offsets[inverse.ravel()]
+
+
+def load_sessions(conn, date_from=None, date_to=None, chunk_size=200000):
+    """
+    終了済み（ハートビートがあれば未終了も）のセッションの PC・開始時刻・終了時刻を配列として読み込む。
+    時刻は壁時計の秒（"YYYY-MM-DD HH:MM:SS" の現地時刻を UTC とみなした UNIX 秒）にそろえる。
+
+    Parameters:
+        conn (sqlite3.Connection): isolation_level=None で開いた接続
+        date_from (str or None): 集計期間の開始日（YYYY-MM-DD）。この日の LOOKBACK 秒前以降に開始したセッションを読む
+        date_to (str or None): 集計期間の終了日（YYYY-MM-DD、この日を含む）
+        chunk_size (int): 1回の読み取りの最大件数
+
+    Returns:
+        dict: pc（PC番号の配列）、start / end（int64 の配列）、pc_names（PC番号に対応する PC名のリスト）、
+              sessions（読み込んだ件数）、skipped_open（終了時刻が分からず除いた件数）
+    """
+    _require_numpy()
+    version = get_schema_version(conn)
+    compact = version >= COMPACT_SCHEMA_VERSION
+    params = {}
+    conditions = []
+    if compact:
+        end = "s.shutdown_ts"
+        join = ""
+        if version >= HEARTBEAT_SCHEMA_VERSION:
+            end = "COALESCE(s.shutdown_ts, h.last_seen_ts)"
+            join = "LEFT JOIN session_heartbeats AS h ON h.session_id = s.session_id"
+        query = f"""
+            SELECT s.session_id, s.pc_key, s.start_ts, COALESCE({end}, -1)
+            FROM sessions AS s {join}
+            WHERE s.session_id > :after {{where}}
+            ORDER BY s.session_id LIMIT :limit
+        """
+        if date_from:
+            conditions.append("s.start_ts >= CAST(strftime('%s', :date_from, 'utc') AS INTEGER) - :lookback")
+        if date_to:
+            conditions.append("s.start_ts < CAST(strftime('%s', :date_to, '+1 day', 'utc') AS INTEGER)")
+    else:
+        query = """
+            SELECT s.session_id, s.pc_id, CAST(strftime('%s', s.start_time) AS INTEGER),
+                   COALESCE(CAST(strftime('%s', NULLIF(s.shutdown_time, '')) AS INTEGER), -1)
+            FROM session_logs AS s
+            WHERE s.session_id > :after {where}
+            ORDER BY s.session_id LIMIT :limit
+        """
+        if date_from:
+            conditions.append("s.start_time >= datetime(:date_from, '-' || :lookback || ' seconds')")
+        if date_to:
+            conditions.append("s.start_time < date(:date_to, '+1 day')")
+    query = query.format(where="".join(" AND " + c for c in conditions))
+    params.update(date_from=date_from, date_to=date_to, lookback=LOOKBACK, limit=chunk_size)
+
+    pcs, starts, ends = [], [], []
+    after = 0
+    while True:
+        rows = conn.execute(query, dict(params, after=after)).fetchall()
+        if not rows:
+            break
+        after = rows[-1][0]
+        if compact:
+            # すべて整数の列は行のリストから一度に配列へ変換する
+            block = np.array(rows, dtype=np.int64)
+            pcs.append(block[:, 1])
+            starts.append(block[:, 2])
+            ends.append(block[:, 3])
+        else:
+            _, pc, start, end = zip(*rows)
+            pcs.append(np.array(pc))
+            starts.append(np.array(start, dtype=np.int64))
+            ends.append(np.array(end, dtype=np.int64))
+        if len(rows) < chunk_size:
+            break
+
+    if starts:
+        start = np.concatenate(starts)
+        end = np.concatenate(ends)
+    else:
+        start = end = np.zeros(0, dtype=np.int64)
+    # PC名（従来の形式）または pc_key（コンパクト形式）を 0 からの番号に置き換える
+    keys, pc = np.unique(np.concatenate(pcs) if pcs else np.zeros(0, dtype=np.int64), return_inverse=True)
+    pc = pc.ravel()
+    if compact:
+        names = dict(conn.execute("SELECT pc_key, pc_id FROM pcs"))
+        pc_names = [names.get(int(key), str(key)) for key in keys]
+    else:
+        pc_names = [str(key) for key in keys]
+
+    known = end >= start
+    skipped_open = int(np.count_nonzero(end < 0))
+    pc, start, end = pc[known], start[known], end[known]
+    if compact:
+        start, end = _wall_clock(start), _wall_clock(end)
+    return {'pc': pc, 'start': start, 'end': end, 'pc_names': pc_names, 'sessions': int(np.count_nonzero(known)),
+            'skipped_open': skipped_open}
+
+
+def merge_by_pc(pc, start, end):
+    """
+    同じPCの重なる（または接する）区間を1つにまとめる。
+
+    Returns:
+        tuple: まとめた区間の (pc, start, end) の配列（PC、開始時刻の順）
+    """
+    if start.size == 0:
+        return pc, start, end
+    # PCごとに時刻をずらすと、全体の累積最大値がPC内の累積最大値と等しくなる
+    span = int(end.max() - start.min()) + 1
+    base = start.min()
+    shift = pc.astype(np.int64) * span - base
+    order = np.lexsort((start, pc))
+    s = start[order] + shift[order]
+    e = end[order] + shift[order]
+    reach = np.maximum.accumulate(e)
+    # 直前までの区間の終了より後に始まる区間で、新しい利用区間が始まる
+    first = np.empty(s.size, dtype=bool)
+    first[0] = True
+    first[1:] = s[1:] > reach[:-1]
+    heads = np.flatnonzero(first)
+    tails = np.append(heads[1:], s.size) - 1
+    merged_pc = pc[order][heads]
+    return merged_pc, s[heads] - shift[order][heads], reach[tails] - shift[order][heads]
+
+
+def peak_concurrency(start, end):
+    """
+    開始・終了を時刻順に並べた +1 / -1 の累積和から、最大同時利用台数とその時刻を求める
+    （同じ時刻の終了は開始より先に数える）。
+
+    Returns:
+        tuple: (最大同時利用台数, その時刻（壁時計の秒）または None)
+    """
+    if start.size == 0:
+        return 0, None
+    times = np.concatenate([start, end])
+    deltas = np.concatenate([np.ones(start.size, dtype=np.int64), -np.ones(end.size, dtype=np.int64)])
+    order = np.lexsort((deltas, times))
+    running = np.cumsum(deltas[order])
+    index = int(np.argmax(running))
+    return int(running[index]), int(times[order][index])
+
+
+def timeline(start, end, lo, hi, step=60):
+    """
+    lo から step 秒ごとの各時刻に利用中の区間の数（start <= t < end）を求める。
+
+    Returns:
+        numpy.ndarray: 各時刻（lo + i * step、hi より前）の利用台数
+    """
+    count = max(0, -(-(hi - lo) // step))
+    s = np.clip(start, lo, hi)
+    e = np.clip(end, lo, hi)
+    inside = e > s
+    # 開始以降の最初の時刻の番号に +1、終了以降の最初の時刻の番号に -1
+    first = -(-(s[inside] - lo) // step)
+    stop = -(-(e[inside] - lo) // step)
+    deltas = np.bincount(first, minlength=count + 1) - np.bincount(stop, minlength=count + 1)
+    return np.cumsum(deltas[:count])
+
+
+def heatmap(counts, lo, step=60):
+    """
+    タイムラインの各時刻を曜日（月〜日）× 時間帯（0〜23時）に振り分け、平均と最大の利用台数を求める。
+
+    Returns:
+        tuple: (平均 7x24 の配列（時刻がない枠は nan）, 最大 7x24 の配列)
+    """
+    t = lo + np.arange(counts.size, dtype=np.int64) * step
+    # 1970-01-01 は木曜日（月曜日 = 0 とする）
+    cell = ((t // 86400 + 3) % 7) * 24 + (t % 86400) // 3600
+    samples = np.bincount(cell, minlength=168)
+    total = np.bincount(cell, weights=counts, minlength=168)
+    peak = np.zeros(168, dtype=np.int64)
+    np.maximum.at(peak, cell, counts)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.where(samples > 0, total / samples, np.nan)
+    return mean.reshape(7, 24), peak.reshape(7, 24)
+
+
+def utilisation(pc, start, end, lo, hi, pc_count):
+    """
+    PCごとに、集計期間 [lo, hi) と重なる利用区間の合計時間（秒）と稼働率（%）を求める。
+
+    Returns:
+        tuple: (合計時間の配列, 稼働率の配列)（PC番号の順）
+    """
+    seconds = np.clip(np.minimum(end, hi) - np.maximum(start, lo), 0, None)
+    used = np.bincount(pc, weights=seconds, minlength=pc_count)
+    return used, used / max(1, hi - lo) * 100
+
+
+def _wall_seconds(day):
+    return calendar.timegm(datetime.datetime.strptime(day, "%Y-%m-%d").timetuple())
+
+
+def _format_wall(seconds):
+    return datetime.datetime.fromtimestamp(seconds, datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def analyze(db_path, date_from=None, date_to=None, step=60, chunk_size=200000, timeout=5.0):
+    """
+    セッションを読み込み、PC単位にまとめた利用区間からタイムライン・ヒートマップ・稼働率を求める。
+    期間を指定しない場合は、読み込んだセッションの最初の開始日から最後の終了日までを集計する。
+
+    Parameters:
+        db_path (str): 中央データベースファイルのパス
+        date_from, date_to (str or None): 集計期間（YYYY-MM-DD、両端の日を含む）
+        step (int): タイムラインの間隔（秒）
+        chunk_size (int): 1回の読み取りの最大件数
+        timeout (float): SQLite接続時のタイムアウト秒数
+
+    Raises:
+        RuntimeError: NumPy がインストールされていない場合
+
+    Returns:
+        dict: 集計期間（lo, hi）、step、タイムライン（counts）、ヒートマップ（heat_mean, heat_peak）、
+              PC別の利用時間・稼働率、最大同時利用台数とその時刻、件数と所要時間（load_s, compute_s）
+    """
+    _require_numpy()
+    started = time.perf_counter()
+    conn = connection.open_connection(db_path, timeout, "readonly-report")
+    try:
+        data = load_sessions(conn, date_from, date_to, chunk_size)
+    finally:
+        conn.close()
+    loaded = time.perf_counter()
+
+    pc, start, end = merge_by_pc(data['pc'], data['start'], data['end'])
+    if date_from:
+        lo = _wall_seconds(date_from)
+    else:
+        lo = int(start.min()) // 86400 * 86400 if start.size else 0
+    if date_to:
+        hi = _wall_seconds(date_to) + 86400
+    else:
+        hi = (int(end.max()) // 86400 + 1) * 86400 if end.size else lo
+    inside = (end > lo) & (start < hi)
+    pc, start, end = pc[inside], np.maximum(start[inside], lo), np.minimum(end[inside], hi)
+
+    counts = timeline(start, end, lo, hi, step)
+    heat_mean, heat_peak = heatmap(counts, lo, step)
+    used, percent = utilisation(pc, start, end, lo, hi, len(data['pc_names']))
+    peak, peak_at = peak_concurrency(start, end)
+    finished = time.perf_counter()
+    result = {
+        'lo': lo, 'hi': hi, 'step': step, 'counts': counts, 'heat_mean': heat_mean, 'heat_peak': heat_peak,
+        'pc_names': data['pc_names'], 'used_seconds': used, 'utilisation': percent,
+        'peak': peak, 'peak_at': peak_at, 'sessions': data['sessions'], 'intervals': int(start.size),
+        'skipped_open': data['skipped_open'], 'pcs_active': int(np.count_nonzero(used)),
+        'load_s': round(loaded - started, 3), 'compute_s': round(finished - loaded, 3),
+    }
+    logging.info("Analyzed %d session(s) (%d per-PC interval(s), %d open skipped) in %.3f + %.3f seconds.",
+                 result['sessions'], result['intervals'], result['skipped_open'], result['load_s'],
+                 result['compute_s'])
+    return result
+
+
+def report_rows(result, report, top=0):
+    """
+    集計結果から表示・CSV 出力用の行（dict のリスト）を作る。
+
+    Parameters:
+        result (dict): analyze の戻り値
+        report (str): "summary"、"timeline"、"heatmap" または "pcs"
+        top (int): pcs で稼働率の高い順に出力する件数（0 で全件）
+    """
+    counts = result['counts']
+    if report == "summary":
+        return [{
+            'from': _format_wall(result['lo']), 'to': _format_wall(result['hi']),
+            'sessions': result['sessions'], 'open_skipped': result['skipped_open'],
+            'pcs_active': result['pcs_active'],
+            'peak': result['peak'], 'peak_at': _format_wall(result['peak_at']) if result['peak_at'] is not None else None,
+            'mean': round(float(counts.mean()), 2) if counts.size else None,
+            'p95': int(np.percentile(counts, 95, method="inverted_cdf")) if counts.size else None,
+            'load_s': result['load_s'], 'compute_s': result['compute_s'],
+        }]
+    if report == "timeline":
+        return [{'time': _format_wall(result['lo'] + i * result['step']), 'in_use': int(c)}
+                for i, c in enumerate(counts)]
+    if report == "heatmap":
+        rows = []
+        for day, name in enumerate(WEEKDAYS):
+            row = {'weekday': name}
+            for hour in range(24):
+                value = result['heat_mean'][day, hour]
+                row["%02d" % hour] = None if np.isnan(value) else round(float(value), 1)
+            row['peak'] = int(result['heat_peak'][day].max())
+            rows.append(row)
+        return rows
+    order = np.argsort(-result['utilisation'], kind="stable")
+    rows = [{'pc_id': result['pc_names'][i], 'used_hours': round(float(result['used_seconds'][i]) / 3600, 2),
+             'utilisation_pct': round(float(result['utilisation'][i]), 2)} for i in order]
+    return rows[:top] if top else rows
+
+
+def _print_table(rows):
+    if not rows:
+        print("(no rows)")
+        return
+    headers = list(rows[0].keys())
+    cells = [["-" if r[h] is None else str(r[h]) for h in headers] for r in rows]
+    widths = [max(len(h), *(len(c[i]) for c in cells)) for i, h in enumerate(headers)]
+    print("  ".join(h.ljust(w) for h, w in zip(headers, widths)))
+    print("  ".join("-" * w for w in widths))
+    for c in cells:
+        print("  ".join(v.ljust(w) for v, w in zip(c, widths)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="PCActivityTracker 同時利用台数・稼働率の集計")
+    parser.add_argument("db_path", help="中央SQLiteデータベースファイルのパス")
+    parser.add_argument("--report", choices=REPORTS, default="summary",
+                        help="出力内容（summary: 最大・平均の同時利用台数、timeline: 時刻ごとの利用台数、"
+                             "heatmap: 曜日 × 時間帯の平均利用台数、pcs: PC別の稼働率）")
+    parser.add_argument("--from", dest="date_from", help="集計期間の開始日（YYYY-MM-DD）")
+    parser.add_argument("--to", dest="date_to", help="集計期間の終了日（YYYY-MM-DD、この日を含む）")
+    parser.add_argument("--step", type=int, default=60, help="タイムラインの間隔（秒）")
+    parser.add_argument("--top", type=int, default=0, help="pcs で稼働率の高い順に表示する件数（0 で全件）")
+    parser.add_argument("--csv", help="結果を CSV ファイルに書き出す（省略時は表で表示）")
+    parser.add_argument("--chunk-size", type=int, default=200000, help="1回の読み取りの最大件数")
+    parser.add_argument("--timeout", type=float, default=5.0, help="SQLite接続時のタイムアウト秒数")
+    parser.add_argument("--snapshot", help="中央DBを直接読まず、このスナップショットを更新してから読む（snapshot.py）")
+    args = parser.parse_args(argv)
+    if np is None:
+        parser.error("NumPy is required; install it with 'pip install numpy'.")
+    if args.step <= 0:
+        parser.error("--step must be positive")
+
+    db_path = args.db_path
+    if args.snapshot:
+        db_path = snapshot.use_snapshot(args.db_path, args.snapshot, args.timeout)
+    result = analyze(db_path, args.date_from, args.date_to, args.step, args.chunk_size, args.timeout)
+    rows = report_rows(result, args.report, args.top)
+    if args.csv:
+        with open(args.csv, "w", encoding="utf-8", newline="") as f:
+            if rows:
+                writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+                writer.writeheader()
+                writer.writerows(rows)
+        logging.info("Wrote %d row(s) to %s.", len(rows), args.csv)
+    else:
+        _print_table(rows)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
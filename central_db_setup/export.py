@@ -0,0 +1,397 @@
+#!/usr/bin/env python
+"""
+export.py - セッション履歴を CSV / JSON Lines へ一定のメモリ使用量で書き出すスクリプト
+
+session_logs 全体を fetchall() で読むと、履歴の件数に比例してメモリを使い、読み取りの間
+共有ロックを保持し続けるため、クライアントの書き込みを遅らせます。本スクリプトは
+chunk_size 件ずつ別々の短い読み取り（1チャンク = 1回の SELECT と fetchmany）で読み、
+各チャンクを書き出してから次のチャンクを読みます。チャンクの間はロックを保持しません。
+次のチャンクは前のチャンクの最後の行の位置（キー）から読み始めるため（キーセットページング）、
+OFFSET のように読み飛ばす行を数え直すことはなく、1チャンクあたりの時間は履歴の件数に依存しません。
+
+出力方法:
+  ・期間指定 (--from / --to / --pc / --user): 開始時刻順に書き出す。期間とPCの条件は
+    idx_session_logs_start_time / idx_session_logs_pc_start（コンパクト形式では idx_sessions_start /
+    idx_sessions_pc_start）で検索する。ユーザーのみの条件はインデックスを使わないため、期間と組み合わせること
+  ・増分 (--state FILE): 前回書き出した最大の session_id より後の終了済みセッションを session_id 順に書き出す。
+    前回の時点で未終了だったセッションは状態ファイルに記録し、終了した時点で書き出す
+    （各セッションは終了後に1回だけ書き出される）。記録する未終了セッションは --max-pending 件までとし、
+    超える場合はその未終了セッションの手前で読み進めるのを止めて次回に読み直す（状態ファイルと毎回の
+    読み直しが孤立セッションの件数に比例して増えないようにする。reconcile.py で孤立セッションを終了させること）。
+    状態ファイルは出力の完了後に更新するため、途中で失敗した場合は次回に同じ位置から再実行される
+
+出力は一時ファイル (<output>.part) に書き込み、完了後に置き換えます。出力ファイル名が .gz で終わる場合
+（または --gzip 指定時）は gzip 圧縮します。読み取りには pc_client/connection.py の readonly-report プロファイルを使います。
+--snapshot を指定した場合は、中央DBを直接読まず、snapshot.py のスナップショットを更新してから読みます。
+
+使い方:
+    python export.py <db_path> --output sessions.csv --from 2026-01-01 --to 2026-03-31
+    python export.py <db_path> --output sessions.jsonl.gz --format jsonl --pc PC001
+    python export.py <db_path> --output new_sessions_20261018.csv --state export_state.json
+    python export.py <db_path> --output sessions.csv --from 2026-01-01 --snapshot C:\reports\central_snapshot.sqlite3
+"""
+
+import argparse
+import csv
+import datetime
+import gzip
+import json
+import logging
+import os
+import sys
+import time
+
+from init_db import get_schema_version
+
+# 読み取り用接続のプロファイルはクライアントと共通の connection.py を利用する
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "pc_client"))
+import connection  # noqa: E402
+import snapshot  # noqa: E402
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+
+# session_logs がコンパクト形式 (sessions) の互換ビューになるバージョン
+COMPACT_SCHEMA_VERSION = 5
+
+COLUMNS = ("session_id", "pc_id", "user_account", "start_time", "shutdown_time", "duration", "session_type",
+           "weekday")
+
+FORMATS = ("csv", "jsonl")
+
+# SQLite のパラメータ数上限を考慮した IN 句の分割サイズ
+IN_CHUNK = 500
+
+# 増分出力の状態ファイルに記録する未終了セッションの件数の上限
+MAX_PENDING = 10000
+
+
+def _source(compact):
+    """
+    スキーマに応じた FROM 句と、開始時刻・PC・ユーザー・終了済みの条件に使う式を返す。
+    コンパクト形式では sessions を直接検索し（整数の start_ts のインデックスを使う）、
+    列の値は互換ビュー session_logs から session_id（主キー）で取得する。
+    """
+    select = ", ".join(f"l.{c}" for c in COLUMNS)
+    if compact:
+        return {
+            'select': select,
+            'from': "sessions AS s JOIN session_logs AS l ON l.session_id = s.session_id",
+            'start': "s.start_ts",
+            'bound': lambda param: f"CAST(strftime('%s', {param}, 'utc') AS INTEGER)",
+            'pc': "s.pc_key = (SELECT pc_key FROM pcs WHERE pc_id = :pc_id)",
+            'user': "s.user_key = (SELECT user_key FROM users WHERE user_account = :user_account)",
+            'closed': "s.shutdown_ts IS NOT NULL",
+            'id': "s.session_id",
+        }
+    return {
+        'select': select,
+        'from': "session_logs AS l",
+        'start': "l.start_time",
+        'bound': lambda param: param,
+        'pc': "l.pc_id = :pc_id",
+        'user': "l.user_account = :user_account",
+        'closed': "(l.shutdown_time IS NOT NULL AND l.shutdown_time != '')",
+        'id': "l.session_id",
+    }
+
+
+def _filters(src, date_from, date_to, pc_id, user_account):
+    conditions, params = [], {}
+    if date_from:
+        conditions.append(f"{src['start']} >= {src['bound'](':date_from')}")
+        params['date_from'] = date_from
+    if date_to:
+        # date_to の日を含める
+        upper = src['bound']("date(:date_to, '+1 day')")
+        conditions.append(f"{src['start']} < {upper}")
+        params['date_to'] = date_to
+    if pc_id:
+        conditions.append(src['pc'])
+        params['pc_id'] = pc_id
+    if user_account:
+        conditions.append(src['user'])
+        params['user_account'] = user_account
+    return conditions, params
+
+
+def _normalize(row):
+    """未終了の表記（NULL または空文字）を None にそろえる。"""
+    row = list(row)
+    if row[4] == "":
+        row[4] = None
+    return tuple(row)
+
+
+def iter_range(conn, date_from=None, date_to=None, pc_id=None, user_account=None, chunk_size=5000, pause=0.0):
+    """
+    期間・PC・ユーザーを指定してセッションを開始時刻順に読み、chunk_size 件ずつのリストを返すジェネレーター。
+    各チャンクは (開始時刻, session_id) の続きから読む1回の SELECT で、読み終えてから呼び出し側へ返すため、
+    呼び出し側の書き出し中はロックを保持しない。
+
+    Parameters:
+        conn (sqlite3.Connection): isolation_level=None で開いた接続
+        date_from (str or None): 期間の開始日（YYYY-MM-DD、この日を含む）
+        date_to (str or None): 期間の終了日（YYYY-MM-DD、この日を含む）
+        pc_id (str or None): PCで絞り込む場合に指定
+        user_account (str or None): ユーザーで絞り込む場合に指定
+        chunk_size (int): 1回の読み取りの最大件数
+        pause (float): チャンクの間の待機時間（秒）
+
+    Yields:
+        list: COLUMNS の順の行（tuple）のリスト
+    """
+    src = _source(get_schema_version(conn) >= COMPACT_SCHEMA_VERSION)
+    conditions, params = _filters(src, date_from, date_to, pc_id, user_account)
+    key = None
+    while True:
+        where = list(conditions)
+        if key is not None:
+            where.append(f"{src['start']} >= :key_start AND ({src['start']} > :key_start OR {src['id']} > :key_id)")
+            params.update(key_start=key[0], key_id=key[1])
+        cursor = conn.execute(f"""
+            SELECT {src['select']}, {src['start']} FROM {src['from']}
+            {"WHERE " + " AND ".join(where) if where else ""}
+            ORDER BY {src['start']}, {src['id']} LIMIT :limit
+        """, dict(params, limit=chunk_size))
+        rows = cursor.fetchmany(chunk_size)
+        cursor.close()
+        if not rows:
+            return
+        key = (rows[-1][-1], rows[-1][0])
+        yield [_normalize(row[:-1]) for row in rows]
+        if len(rows) < chunk_size:
+            return
+        if pause:
+            time.sleep(pause)
+
+
+def iter_incremental(conn, state, pc_id=None, user_account=None, chunk_size=5000, pause=0.0,
+                     max_pending=MAX_PENDING):
+    """
+    state['last_session_id'] より後の終了済みセッションと、state['pending'] のうち終了したセッションを
+    session_id 順に読み、chunk_size 件ずつのリストを返すジェネレーター。
+    読み終えた位置と、まだ未終了のセッションの session_id は state に反映する（呼び出し側で保存する）。
+    未終了のセッションが max_pending 件に達した場合は、それを超える未終了セッションの手前で読み進めるのを止め
+    （state['capped'] を True にする）、その位置から次回に読み直す。
+
+    Parameters:
+        conn (sqlite3.Connection): isolation_level=None で開いた接続
+        state (dict): last_session_id（int）と pending（session_id のリスト）を持つ状態
+        pc_id (str or None): PCで絞り込む場合に指定
+        user_account (str or None): ユーザーで絞り込む場合に指定
+        chunk_size (int): 1回の読み取りの最大件数
+        pause (float): チャンクの間の待機時間（秒）
+        max_pending (int): state['pending'] に記録する未終了セッションの件数の上限
+
+    Yields:
+        list: COLUMNS の順の行（tuple）のリスト
+    """
+    src = _source(get_schema_version(conn) >= COMPACT_SCHEMA_VERSION)
+    conditions, params = _filters(src, None, None, pc_id, user_account)
+    filters = "".join(" AND " + c for c in conditions)
+    closed = f"CASE WHEN {src['closed']} THEN 1 ELSE 0 END"
+
+    # 前回まで未終了だったセッションのうち、終了したもの
+    still_open = []
+    pending = sorted(state.get('pending', []))
+    for i in range(0, len(pending), IN_CHUNK):
+        ids = pending[i:i + IN_CHUNK]
+        marks = ", ".join(f":p{n}" for n in range(len(ids)))
+        cursor = conn.execute(f"""
+            SELECT {src['select']}, {closed} FROM {src['from']}
+            WHERE {src['id']} IN ({marks}){filters}
+            ORDER BY {src['id']}
+        """, dict(params, **{f"p{n}": value for n, value in enumerate(ids)}))
+        rows = cursor.fetchmany(len(ids))
+        cursor.close()
+        still_open.extend(row[0] for row in rows if not row[-1])
+        done = [_normalize(row[:-1]) for row in rows if row[-1]]
+        if done:
+            yield done
+
+    # 前回の位置より後のセッション（未終了のものは次回以降に回す）
+    state['capped'] = False
+    while True:
+        cursor = conn.execute(f"""
+            SELECT {src['select']}, {closed} FROM {src['from']}
+            WHERE {src['id']} > :after{filters}
+            ORDER BY {src['id']} LIMIT :limit
+        """, dict(params, after=state['last_session_id'], limit=chunk_size))
+        rows = cursor.fetchmany(chunk_size)
+        cursor.close()
+        if not rows:
+            break
+        done = []
+        for row in rows:
+            if not row[-1]:
+                if len(still_open) >= max_pending:
+                    # 上限を超える未終了セッションは記録せず、その手前までを読んだことにする
+                    state['capped'] = True
+                    break
+                still_open.append(row[0])
+            else:
+                done.append(_normalize(row[:-1]))
+            state['last_session_id'] = row[0]
+        if done:
+            yield done
+        if state['capped'] or len(rows) < chunk_size:
+            break
+        if pause:
+            time.sleep(pause)
+    state['pending'] = still_open
+
+
+def _open_output(path, compress):
+    if compress:
+        return gzip.open(path, "wt", encoding="utf-8", newline="")
+    return open(path, "w", encoding="utf-8", newline="")
+
+
+def _write_rows(f, fmt, chunks):
+    """チャンクを順に書き出し、(行数, チャンク数) を返す。"""
+    rows = count = 0
+    if fmt == "csv":
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        for chunk in chunks:
+            writer.writerows(chunk)
+            rows += len(chunk)
+            count += 1
+    else:
+        for chunk in chunks:
+            f.writelines(json.dumps(dict(zip(COLUMNS, row)), ensure_ascii=False) + "\n" for row in chunk)
+            rows += len(chunk)
+            count += 1
+    return rows, count
+
+
+def load_state(state_path):
+    """増分出力の状態ファイルを読み込む（存在しない場合は初回の状態を返す）。"""
+    if not os.path.exists(state_path):
+        return {'last_session_id': 0, 'pending': [], 'filters': None}
+    with open(state_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_state(state_path, state):
+    """増分出力の状態ファイルを書き込む（一時ファイルへの書き込みと置き換えで、途中で壊れないようにする）。"""
+    temp_path = state_path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(temp_path, state_path)
+
+
+def export_sessions(db_path, output, fmt="csv", date_from=None, date_to=None, pc_id=None, user_account=None,
+                    state_path=None, compress=None, chunk_size=5000, pause=0.0, timeout=5.0,
+                    max_pending=MAX_PENDING):
+    """
+    セッション履歴を CSV / JSON Lines のファイルへ書き出す。
+
+    Parameters:
+        db_path (str): 中央データベースファイルのパス
+        output (str): 出力ファイルのパス（"-" の場合は標準出力）
+        fmt (str): "csv" または "jsonl"
+        date_from, date_to, pc_id, user_account: 絞り込み条件（増分出力では date_from / date_to は指定できない）
+        state_path (str or None): 増分出力の状態ファイル（指定した場合は増分出力）
+        compress (bool or None): gzip 圧縮する場合は True（None の場合は出力ファイル名が .gz で終わるかで判断）
+        chunk_size (int): 1回の読み取りの最大件数（メモリ使用量の上限の目安）
+        pause (float): チャンクの間の待機時間（秒）。クライアントの書き込みにロックを譲る
+        timeout (float): SQLite接続時のタイムアウト秒数
+        max_pending (int): 増分出力で状態ファイルに記録する未終了セッションの件数の上限
+
+    Raises:
+        ValueError: 形式が不正な場合、増分出力に期間を指定した場合、状態ファイルと絞り込み条件が異なる場合
+
+    Returns:
+        dict: rows（書き出した行数）、chunks、elapsed（秒）、増分出力の場合は last_session_id、pending（件数）、
+              capped（未終了セッションが上限に達して途中で止めた場合は True）
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt!r}; choose from {', '.join(FORMATS)}.")
+    if compress is None:
+        compress = output.endswith(".gz")
+    filters = {'pc_id': pc_id, 'user_account': user_account}
+    state = None
+    if state_path:
+        if date_from or date_to:
+            raise ValueError("Incremental export (--state) resumes by session_id and cannot be combined with a "
+                             "date range.")
+        state = load_state(state_path)
+        if state.get('filters') not in (None, filters):
+            raise ValueError(f"State file {state_path} was created with filters {state['filters']}; "
+                             "use a separate state file for different filters.")
+
+    started = time.perf_counter()
+    conn = connection.open_connection(db_path, timeout, "readonly-report")
+    try:
+        if state is not None:
+            chunks = iter_incremental(conn, state, pc_id, user_account, chunk_size, pause, max_pending)
+        else:
+            chunks = iter_range(conn, date_from, date_to, pc_id, user_account, chunk_size, pause)
+        if output == "-":
+            rows, count = _write_rows(sys.stdout, fmt, chunks)
+        else:
+            # 完了するまでは一時ファイルに書き込み、途中で失敗しても前回の出力や不完全なファイルを残さない
+            temp_path = output + ".part"
+            try:
+                with _open_output(temp_path, compress) as f:
+                    rows, count = _write_rows(f, fmt, chunks)
+                os.replace(temp_path, output)
+            except BaseException:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+    finally:
+        conn.close()
+
+    result = {'rows': rows, 'chunks': count, 'elapsed': round(time.perf_counter() - started, 3)}
+    if state is not None:
+        result['capped'] = state.pop('capped', False)
+        state['filters'] = filters
+        state['exported_at'] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        save_state(state_path, state)
+        result['last_session_id'] = state['last_session_id']
+        result['pending'] = len(state['pending'])
+        if result['capped']:
+            logging.warning("Incremental export stopped at session_id %d: %d open session(s) reached "
+                            "--max-pending; close orphaned sessions with reconcile.py so the export can advance.",
+                            state['last_session_id'], result['pending'])
+    logging.info("Exported %d session(s) in %d chunk(s) to %s (%.3f seconds).",
+                 rows, count, output, result['elapsed'])
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="PCActivityTracker セッション履歴の CSV / JSON Lines 出力")
+    parser.add_argument("db_path", help="中央SQLiteデータベースファイルのパス")
+    parser.add_argument("--output", required=True, help="出力ファイル（.gz で終わる場合は gzip 圧縮、- は標準出力）")
+    parser.add_argument("--format", dest="fmt", choices=FORMATS, default="csv", help="出力形式")
+    parser.add_argument("--gzip", dest="compress", action="store_const", const=True, default=None,
+                        help="出力ファイル名に関係なく gzip 圧縮する")
+    parser.add_argument("--from", dest="date_from", help="期間の開始日（YYYY-MM-DD）")
+    parser.add_argument("--to", dest="date_to", help="期間の終了日（YYYY-MM-DD）")
+    parser.add_argument("--pc", dest="pc_id", help="PCで絞り込む")
+    parser.add_argument("--user", dest="user_account", help="ユーザーで絞り込む")
+    parser.add_argument("--state", dest="state_path",
+                        help="増分出力の状態ファイル（前回の続きから終了済みのセッションを出力する）")
+    parser.add_argument("--max-pending", type=int, default=MAX_PENDING,
+                        help="増分出力で状態ファイルに記録する未終了セッションの件数の上限")
+    parser.add_argument("--chunk-size", type=int, default=5000, help="1回の読み取りの最大件数")
+    parser.add_argument("--pause", type=float, default=0.0, help="チャンクの間の待機時間（秒）")
+    parser.add_argument("--timeout", type=float, default=5.0, help="SQLite接続時のタイムアウト秒数")
+    parser.add_argument("--snapshot", help="中央DBを直接読まず、このスナップショットを更新してから読む（snapshot.py）")
+    args = parser.parse_args(argv)
+    if args.output == "-":
+        # 標準出力をデータに使うため、ログは標準エラー出力の警告以上のみとする
+        logging.getLogger().setLevel(logging.WARNING)
+    db_path = args.db_path
+    if args.snapshot:
+        db_path = snapshot.use_snapshot(args.db_path, args.snapshot, args.timeout)
+    export_sessions(db_path, args.output, args.fmt, args.date_from, args.date_to, args.pc_id,
+                    args.user_account, args.state_path, args.compress, args.chunk_size, args.pause, args.timeout,
+                    args.max_pending)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,555 @@
+#!/usr/bin/env python
+"""
+init_db.py - 中央SQLiteデータベースの初期化およびスキーマ移行（マイグレーション）を行うスクリプト
+
+PRAGMA user_version をスキーマのバージョン番号として利用し、MIGRATIONS に定義された移行のうち
+未適用のものだけを番号順に適用します。各移行は BEGIN IMMEDIATE による単一トランザクション内で実行し、
+user_version の更新も同じトランザクションでコミットするため、途中で失敗しても中途半端な状態は残りません。
+
+クライアント (pc_client/utils.py) は起動のたびに DDL を実行するのではなく、
+PRAGMA user_version を1回読むだけでスキーマが最新かどうかを判定します。
+
+移行5は session_logs の未コピーの行を1つの書き込みトランザクションで sessions へ移すため、その間は
+すべてのクライアントの書き込みが待たされます。--target を指定しない場合、session_logs に
+V2_SWITCH_MAX_ROWS 件を超える未コピーの行があれば移行4で止め、migrate_v2.py による分割コピーを案内します
+（コピー後に migrate_v2.py switch、または --target 5 以上を明示して実行すると移行5を適用します）。
+
+提供する機能:
+  ・MIGRATIONS: スキーマ移行の定義（バージョン番号、説明、SQL文のリスト）
+  ・get_schema_version: データベースの現在のスキーマバージョンを取得
+  ・apply_migrations: 未適用の移行を順番に適用
+  ・init_db: データベースファイルを開き、最新（または指定）バージョンまで移行する
+
+使い方:
+    python init_db.py <db_path>              # 最新バージョンまで移行
+    python init_db.py <db_path> --status     # 現在のバージョンと未適用の移行を表示
+    python init_db.py <db_path> --target 1   # 指定バージョンまで移行（移行5の停止も行わない）
+"""
+
+import argparse
+import logging
+import sqlite3
+import sys
+import time
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+
+
+def to_epoch(expr):
+    """
+    'YYYY-MM-DD HH:MM:SS'（ローカル時刻）の文字列を UNIX 秒（UTC）の整数に変換する SQL 式を返す。
+    NULL または空文字（従来の未終了の表記）は NULL になる。
+    """
+    return f"CAST(strftime('%s', NULLIF({expr}, ''), 'utc') AS INTEGER)"
+
+
+# session_logs から sessions へのコピー（migrate_v2.py とスキーマ移行5で共通）
+V2_COPY_SELECT = f"""
+    SELECT l.session_id, p.pc_key, u.user_key, {to_epoch("l.start_time")}, {to_epoch("l.shutdown_time")},
+           l.duration, l.session_type
+    FROM session_logs AS l
+    JOIN pcs AS p ON p.pc_id = l.pc_id
+    JOIN users AS u ON u.user_account = l.user_account
+"""
+
+# session_logs を sessions へ移して互換ビューに置き換える移行と、--target の指定なしで適用する未コピーの行数の上限
+# （migrate_v2.py の1チャンクと同じ。上限を超える場合はクライアントを長く待たせるため、移行4で止める）
+V2_SWITCH_VERSION = 5
+V2_SWITCH_MAX_ROWS = 5000
+
+# migrate_v2.py でまだコピーしていない、またはコピー後に変更された可能性がある行
+V2_UNCOPIED = ("(session_id > COALESCE((SELECT value FROM v2_copy_state WHERE name = 'last_session_id'), 0)"
+               " OR session_id IN (SELECT session_id FROM v2_copy_pending))")
+
+# open_sessions を sessions の未終了セッションから作り直す（スキーマ移行9と open_sessions.py rebuild で共通）。
+# PC・ユーザーごとに開始時刻が最も新しいもの（同じ場合は session_id が大きいもの）を参照する
+OPEN_SESSIONS_REBUILD = """
+    INSERT INTO open_sessions (pc_key, user_key, session_id, start_ts)
+    SELECT pc_key, user_key, session_id, start_ts FROM (
+        SELECT pc_key, user_key, session_id, start_ts,
+               ROW_NUMBER() OVER (PARTITION BY pc_key, user_key ORDER BY start_ts DESC, session_id DESC) AS rank
+        FROM sessions WHERE shutdown_ts IS NULL
+    ) WHERE rank = 1
+"""
+
+# sessions のトリガーで NEW の行を open_sessions に反映する文
+OPEN_SESSIONS_UPSERT = """
+            INSERT INTO open_sessions (pc_key, user_key, session_id, start_ts)
+            VALUES (NEW.pc_key, NEW.user_key, NEW.session_id, NEW.start_ts)
+            ON CONFLICT (pc_key, user_key) DO UPDATE
+            SET session_id = excluded.session_id, start_ts = excluded.start_ts
+            WHERE excluded.start_ts >= open_sessions.start_ts;"""
+
+
+def open_sessions_refill(row):
+    """
+    sessions のトリガーで row (NEW / OLD) のセッションの参照を削除した後、同じPC・ユーザーに
+    より古い未終了セッションが残っていれば、その最新のものを参照させる文を返す（idx_sessions_open を使用）。
+    """
+    return f"""
+            INSERT INTO open_sessions (pc_key, user_key, session_id, start_ts)
+            SELECT pc_key, user_key, session_id, start_ts FROM sessions
+            WHERE pc_key = {row}.pc_key AND user_key = {row}.user_key AND shutdown_ts IS NULL
+              AND NOT EXISTS (SELECT 1 FROM open_sessions WHERE pc_key = {row}.pc_key AND user_key = {row}.user_key)
+            ORDER BY start_ts DESC, session_id DESC LIMIT 1;"""
+
+# スキーマ移行の定義: (バージョン番号, 説明, 実行するSQL文のリスト)
+# 一度リリースした移行は変更せず、変更が必要な場合は新しいバージョンを末尾に追加すること。
+MIGRATIONS = [
+    (1, "session_logs テーブルと未終了セッション検索用・集計用インデックスの作成", [
+        """
+        CREATE TABLE IF NOT EXISTS session_logs (
+            session_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            pc_id TEXT NOT NULL,
+            user_account TEXT NOT NULL,
+            start_time DATETIME NOT NULL,
+            shutdown_time DATETIME,
+            duration INTEGER,
+            session_type TEXT,
+            weekday TEXT
+        )
+        """,
+        # シャットダウン時の未終了セッション検索用の部分インデックス。
+        # WHERE 句はクライアントのクエリと同一の式にしておく必要がある（SQLiteが部分インデックスを選択する条件）。
+        """
+        CREATE INDEX IF NOT EXISTS idx_session_logs_open
+            ON session_logs (pc_id, user_account, start_time)
+            WHERE shutdown_time IS NULL OR shutdown_time = ''
+        """,
+        # 期間指定の集計・レポート用
+        """
+        CREATE INDEX IF NOT EXISTS idx_session_logs_start_time
+            ON session_logs (start_time)
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_session_logs_pc_start
+            ON session_logs (pc_id, start_time)
+        """,
+    ]),
+    (2, "スプール反映済みイベントを記録する spool_events テーブルの作成", [
+        # クライアントのローカルスプールから反映したイベントIDを記録し、再反映時の二重登録を防ぐ
+        """
+        CREATE TABLE IF NOT EXISTS spool_events (
+            event_id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            applied_at DATETIME NOT NULL
+        ) WITHOUT ROWID
+        """,
+    ]),
+    (3, "日別利用集計 (daily_usage) と増分更新の管理テーブルの作成", [
+        # 日 × PC × ユーザーごとの利用集計。rollup.py が session_logs の新規・終了セッションのみを反映して更新する
+        """
+        CREATE TABLE IF NOT EXISTS daily_usage (
+            day TEXT NOT NULL,
+            pc_id TEXT NOT NULL,
+            user_account TEXT NOT NULL,
+            weekday TEXT NOT NULL,
+            total_duration INTEGER NOT NULL DEFAULT 0,
+            session_count INTEGER NOT NULL DEFAULT 0,
+            first_seen DATETIME NOT NULL,
+            last_seen DATETIME NOT NULL,
+            PRIMARY KEY (day, pc_id, user_account)
+        ) WITHOUT ROWID
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_daily_usage_user_day
+            ON daily_usage (user_account, day)
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_daily_usage_pc_day
+            ON daily_usage (pc_id, day)
+        """,
+        # 集計の進捗（最後に反映した session_id など）
+        """
+        CREATE TABLE IF NOT EXISTS rollup_state (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        ) WITHOUT ROWID
+        """,
+        # 集計時点で未終了だったセッション。終了後に利用時間を加算するために保持する
+        """
+        CREATE TABLE IF NOT EXISTS rollup_pending (
+            session_id INTEGER PRIMARY KEY
+        )
+        """,
+    ]),
+    (4, "コンパクト形式 (v2) のテーブル sessions / pcs / users の作成（データ移行前）", [
+        # PC名・ユーザー名は辞書テーブルに1回だけ保存し、sessions からは整数IDで参照する
+        """
+        CREATE TABLE IF NOT EXISTS pcs (
+            pc_key INTEGER PRIMARY KEY,
+            pc_id TEXT NOT NULL UNIQUE
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            user_key INTEGER PRIMARY KEY,
+            user_account TEXT NOT NULL UNIQUE
+        )
+        """,
+        # 時刻は UNIX 秒（UTC）の整数。未終了のセッションは shutdown_ts が NULL（空文字は使わない）。
+        # session_id は session_logs の値を引き継ぎ、日別集計の増分更新のため再利用しない (AUTOINCREMENT)
+        """
+        CREATE TABLE IF NOT EXISTS sessions (
+            session_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            pc_key INTEGER NOT NULL REFERENCES pcs (pc_key),
+            user_key INTEGER NOT NULL REFERENCES users (user_key),
+            start_ts INTEGER NOT NULL,
+            shutdown_ts INTEGER,
+            duration INTEGER,
+            session_type TEXT
+        )
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_sessions_open
+            ON sessions (pc_key, user_key, start_ts)
+            WHERE shutdown_ts IS NULL
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_sessions_start
+            ON sessions (start_ts)
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_sessions_pc_start
+            ON sessions (pc_key, start_ts)
+        """,
+        # migrate_v2.py による分割コピーの進捗（コピー済みの最大 session_id）と、
+        # コピー時点で未終了だったセッション（切り替え時に再コピーする）
+        """
+        CREATE TABLE IF NOT EXISTS v2_copy_state (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        ) WITHOUT ROWID
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS v2_copy_pending (
+            session_id INTEGER PRIMARY KEY
+        )
+        """,
+    ]),
+    (5, "session_logs のデータを sessions へ移し、session_logs を互換ビューに置き換える", [
+        # migrate_v2.py で未コピーの行（最大 session_id より後の行、コピー時に未終了だった行）だけを移す。
+        # migrate_v2.py を使わずに適用した場合は、全件をこのトランザクション内でコピーする
+        f"""
+        INSERT OR IGNORE INTO pcs (pc_id)
+        SELECT DISTINCT pc_id FROM session_logs WHERE {V2_UNCOPIED}
+        """,
+        f"""
+        INSERT OR IGNORE INTO users (user_account)
+        SELECT DISTINCT user_account FROM session_logs WHERE {V2_UNCOPIED}
+        """,
+        # コピー後にアーカイブ等で削除された行を除く
+        """
+        DELETE FROM sessions WHERE session_id NOT IN (SELECT session_id FROM session_logs)
+        """,
+        f"""
+        INSERT OR REPLACE INTO sessions (session_id, pc_key, user_key, start_ts, shutdown_ts, duration, session_type)
+        {V2_COPY_SELECT}
+        WHERE {V2_UNCOPIED.replace("session_id", "l.session_id")}
+        """,
+        "DROP TABLE session_logs",
+        "DROP TABLE v2_copy_state",
+        "DROP TABLE v2_copy_pending",
+        # 従来の形式の参照・書き込み（旧バージョンのクライアント、レポート、rollup.py、archive.py）用の互換ビュー
+        """
+        CREATE VIEW session_logs AS
+        SELECT s.session_id AS session_id,
+               p.pc_id AS pc_id,
+               u.user_account AS user_account,
+               datetime(s.start_ts, 'unixepoch', 'localtime') AS start_time,
+               datetime(s.shutdown_ts, 'unixepoch', 'localtime') AS shutdown_time,
+               s.duration AS duration,
+               s.session_type AS session_type,
+               substr('SunMonTueWedThuFriSat',
+                      1 + 3 * CAST(strftime('%w', s.start_ts, 'unixepoch', 'localtime') AS INTEGER), 3) AS weekday
+        FROM sessions AS s
+        JOIN pcs AS p ON p.pc_key = s.pc_key
+        JOIN users AS u ON u.user_key = s.user_key
+        """,
+        f"""
+        CREATE TRIGGER session_logs_insert INSTEAD OF INSERT ON session_logs
+        BEGIN
+            INSERT OR IGNORE INTO pcs (pc_id) VALUES (NEW.pc_id);
+            INSERT OR IGNORE INTO users (user_account) VALUES (NEW.user_account);
+            INSERT INTO sessions (session_id, pc_key, user_key, start_ts, shutdown_ts, duration, session_type)
+            VALUES (NEW.session_id,
+                    (SELECT pc_key FROM pcs WHERE pc_id = NEW.pc_id),
+                    (SELECT user_key FROM users WHERE user_account = NEW.user_account),
+                    {to_epoch("NEW.start_time")}, {to_epoch("NEW.shutdown_time")},
+                    NEW.duration, NEW.session_type);
+        END
+        """,
+        f"""
+        CREATE TRIGGER session_logs_update INSTEAD OF UPDATE ON session_logs
+        BEGIN
+            INSERT OR IGNORE INTO pcs (pc_id) VALUES (NEW.pc_id);
+            INSERT OR IGNORE INTO users (user_account) VALUES (NEW.user_account);
+            UPDATE sessions
+            SET pc_key = (SELECT pc_key FROM pcs WHERE pc_id = NEW.pc_id),
+                user_key = (SELECT user_key FROM users WHERE user_account = NEW.user_account),
+                start_ts = {to_epoch("NEW.start_time")},
+                shutdown_ts = {to_epoch("NEW.shutdown_time")},
+                duration = NEW.duration,
+                session_type = NEW.session_type
+            WHERE session_id = OLD.session_id;
+        END
+        """,
+        """
+        CREATE TRIGGER session_logs_delete INSTEAD OF DELETE ON session_logs
+        BEGIN
+            DELETE FROM sessions WHERE session_id = OLD.session_id;
+        END
+        """,
+    ]),
+    (6, "PCごとのシャードファイルの取り込み状況 (shard_state / shard_sessions) の作成", [
+        # shard_merge.py がシャードごとに取り込み済みの変更連番（シャードの shard_changes.seq）を記録する。
+        # shard_uid はシャード作成時の識別子で、シャードが作り直された場合に連番を最初から読み直すために使う
+        """
+        CREATE TABLE IF NOT EXISTS shard_state (
+            shard TEXT PRIMARY KEY,
+            shard_uid TEXT NOT NULL,
+            last_seq INTEGER NOT NULL,
+            merged_at DATETIME NOT NULL
+        ) WITHOUT ROWID
+        """,
+        # シャード内の session_id と中央DBの session_id の対応（更新の取り込み時に使用）
+        """
+        CREATE TABLE IF NOT EXISTS shard_sessions (
+            shard TEXT NOT NULL,
+            shard_session_id INTEGER NOT NULL,
+            session_id INTEGER NOT NULL,
+            PRIMARY KEY (shard, shard_session_id)
+        ) WITHOUT ROWID
+        """,
+    ]),
+    (7, "常駐エージェントのハートビート（セッションごとの最終確認時刻）session_heartbeats の作成", [
+        # pc_client/agent.py が一定間隔で未終了セッションの最終確認時刻（UNIX 秒）を更新する。
+        # 電源断などでシャットダウンが記録されなかったセッションを、この時刻で終了させるために使う。
+        # sessions の行を更新せず別テーブルにすることで、ハートビートの書き込みは小さな1行の UPSERT で済む
+        """
+        CREATE TABLE IF NOT EXISTS session_heartbeats (
+            session_id INTEGER PRIMARY KEY,
+            last_seen_ts INTEGER NOT NULL
+        )
+        """,
+        # セッションの削除（アーカイブなど）に合わせてハートビートも削除する
+        """
+        CREATE TRIGGER IF NOT EXISTS sessions_delete_heartbeat AFTER DELETE ON sessions
+        BEGIN
+            DELETE FROM session_heartbeats WHERE session_id = OLD.session_id;
+        END
+        """,
+    ]),
+    (8, "追記専用の起動・シャットダウンのイベントログ session_events と取り込み位置 event_pairing_state の作成", [
+        # config.ini の [Database] write_mode = events のクライアントは、起動・シャットダウンを
+        # このテーブルへの1行の INSERT だけで記録する（検索・更新は行わない）。
+        # event_seq はコミット順の連番で、pair_events.py が前回の取り込み位置より後のイベントから
+        # session_logs の行を作成・終了させる。AUTOINCREMENT により、古いイベントを削除しても連番は再利用されない。
+        # kind は "startup" / "shutdown"（将来の lock / unlock / sleep などもこの列で区別する）
+        """
+        CREATE TABLE IF NOT EXISTS session_events (
+            event_seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            event_id TEXT NOT NULL UNIQUE,
+            kind TEXT NOT NULL,
+            pc_id TEXT NOT NULL,
+            user_account TEXT NOT NULL,
+            event_time DATETIME NOT NULL,
+            session_type TEXT
+        )
+        """,
+        # 取り込みの進捗（最後に取り込んだ event_seq など）
+        """
+        CREATE TABLE IF NOT EXISTS event_pairing_state (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        ) WITHOUT ROWID
+        """,
+    ]),
+    (9, "PC・ユーザーごとの未終了セッションの参照 open_sessions と、sessions の変更に合わせて更新するトリガーの作成", [
+        # シャットダウンの記録は、sessions の未終了セッションを検索する代わりに、この表の主キーで
+        # 最新の未終了セッション（idx_sessions_open の検索で得られるものと同じ）を1件取得する。
+        # 行はトリガーが sessions の挿入・終了・削除と同じ文の中で更新するため、どの書き込み経路でも
+        # 同じトランザクションで一致する（不整合が疑われる場合は open_sessions.py rebuild で作り直す）
+        """
+        CREATE TABLE IF NOT EXISTS open_sessions (
+            pc_key INTEGER NOT NULL,
+            user_key INTEGER NOT NULL,
+            session_id INTEGER NOT NULL,
+            start_ts INTEGER NOT NULL,
+            PRIMARY KEY (pc_key, user_key)
+        ) WITHOUT ROWID
+        """,
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_open_sessions_session
+            ON open_sessions (session_id)
+        """,
+        OPEN_SESSIONS_REBUILD,
+        # 開始時刻が同じか新しい未終了セッションで置き換える（スプールの再送などで古い起動が後から届いた場合は置き換えない）
+        f"""
+        CREATE TRIGGER IF NOT EXISTS sessions_open_insert AFTER INSERT ON sessions
+        WHEN NEW.shutdown_ts IS NULL
+        BEGIN
+            {OPEN_SESSIONS_UPSERT}
+        END
+        """,
+        # 終了したセッションの参照を削除し、同じPC・ユーザーにより古い未終了セッション（孤立セッション）が
+        # あればそれを参照させる（従来の検索と同じく、次のシャットダウンはそのセッションを終了させる）
+        f"""
+        CREATE TRIGGER IF NOT EXISTS sessions_open_close AFTER UPDATE OF shutdown_ts ON sessions
+        WHEN NEW.shutdown_ts IS NOT NULL
+        BEGIN
+            DELETE FROM open_sessions WHERE session_id = NEW.session_id;
+            {open_sessions_refill("NEW")}
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS sessions_open_reopen AFTER UPDATE OF shutdown_ts ON sessions
+        WHEN NEW.shutdown_ts IS NULL AND OLD.shutdown_ts IS NOT NULL
+        BEGIN
+            {OPEN_SESSIONS_UPSERT}
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS sessions_open_delete AFTER DELETE ON sessions
+        BEGIN
+            DELETE FROM open_sessions WHERE session_id = OLD.session_id;
+            {open_sessions_refill("OLD")}
+        END
+        """,
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(conn):
+    """
+    PRAGMA user_version から現在のスキーマバージョンを取得する。
+
+    Parameters:
+        conn (sqlite3.Connection): データベース接続
+
+    Returns:
+        int: スキーマバージョン（未初期化の場合は 0）
+    """
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def uncopied_rows(conn):
+    """
+    移行5が1つのトランザクションでコピーする session_logs の行数（移行4の適用後に呼び出す）。
+    migrate_v2.py でコピー済みの最大 session_id より後の行と、コピー時に未終了だった行の合計。
+    """
+    after = conn.execute("SELECT value FROM v2_copy_state WHERE name = 'last_session_id'").fetchone()
+    rows = conn.execute("SELECT COUNT(*) FROM session_logs WHERE session_id > ?", (after[0] if after else 0,))
+    return rows.fetchone()[0] + conn.execute("SELECT COUNT(*) FROM v2_copy_pending").fetchone()[0]
+
+
+def apply_migrations(conn, target=None):
+    """
+    現在のスキーマバージョンより新しい移行を、target バージョンまで順番に適用する。
+    各移行は BEGIN IMMEDIATE のトランザクション内で実行し、user_version も同時に更新する。
+    target が None の場合、未コピーの行（uncopied_rows）が V2_SWITCH_MAX_ROWS 件を超えていれば
+    移行5の手前で止める（target を指定した場合は止めない）。
+
+    Parameters:
+        conn (sqlite3.Connection): isolation_level=None で開いたデータベース接続
+        target (int or None): 移行先のバージョン（None の場合は最新）
+
+    Raises:
+        ValueError: target が定義済みの範囲外の場合
+        sqlite3.Error: 移行の実行に失敗した場合（該当移行はロールバックされる）
+
+    Returns:
+        int: 移行後のスキーマバージョン
+    """
+    explicit = target is not None
+    if target is None:
+        target = LATEST_VERSION
+    if target < 0 or target > LATEST_VERSION:
+        raise ValueError(f"Target version {target} is out of range (0..{LATEST_VERSION}).")
+
+    current = get_schema_version(conn)
+    if current > LATEST_VERSION:
+        logging.warning("Database schema version %d is newer than this script (%d).", current, LATEST_VERSION)
+        return current
+
+    for version, description, statements in MIGRATIONS:
+        if version <= current or version > target:
+            continue
+        if version == V2_SWITCH_VERSION and not explicit:
+            remaining = uncopied_rows(conn)
+            if remaining > V2_SWITCH_MAX_ROWS:
+                logging.warning("Stopped before migration %d: %d session_logs row(s) would be copied in one write "
+                                "transaction, locking out all clients. Copy them online with 'migrate_v2.py "
+                                "<db_path> copy', then run 'migrate_v2.py <db_path> switch' (or pass --target %d "
+                                "to apply it in one transaction anyway).", version, remaining, version)
+                break
+        logging.info("Applying migration %d: %s", version, description)
+        started = time.perf_counter()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for statement in statements:
+                conn.execute(statement)
+            # PRAGMA はパラメータバインドできないため、整数値を直接埋め込む
+            conn.execute(f"PRAGMA user_version = {int(version)}")
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            logging.error("Migration %d failed; rolled back.", version)
+            raise
+        current = version
+        logging.info("Migration %d applied in %.3f seconds.", version, time.perf_counter() - started)
+
+    return current
+
+
+def init_db(db_path, timeout=5.0, target=None):
+    """
+    指定されたデータベースファイルを開き（存在しなければ作成し）、スキーマを移行する。
+
+    Parameters:
+        db_path (str): データベースファイルのパス
+        timeout (float): SQLite接続時のタイムアウト秒数
+        target (int or None): 移行先のバージョン（None の場合は最新）
+
+    Returns:
+        int: 移行後のスキーマバージョン
+    """
+    conn = sqlite3.connect(db_path, timeout=timeout, isolation_level=None)
+    try:
+        before = get_schema_version(conn)
+        after = apply_migrations(conn, target)
+        if before == after:
+            logging.info("Database %s is already at schema version %d.", db_path, after)
+        else:
+            logging.info("Database %s migrated from version %d to %d.", db_path, before, after)
+        return after
+    finally:
+        conn.close()
+
+
+def main(argv=None):
+    """移行後のバージョンが最新でない場合（移行5の手前で止めた場合）は 1 を返す。"""
+    parser = argparse.ArgumentParser(description="PCActivityTracker 中央データベースの初期化・スキーマ移行")
+    parser.add_argument("db_path", help="中央SQLiteデータベースファイルのパス")
+    parser.add_argument("--timeout", type=float, default=5.0, help="SQLite接続時のタイムアウト秒数")
+    parser.add_argument("--target", type=int, default=None, help="移行先のスキーマバージョン（省略時は最新）")
+    parser.add_argument("--status", action="store_true", help="現在のバージョンと未適用の移行を表示して終了する")
+    args = parser.parse_args(argv)
+
+    if args.status:
+        with sqlite3.connect(args.db_path, timeout=args.timeout) as conn:
+            current = get_schema_version(conn)
+        print(f"current version: {current} (latest: {LATEST_VERSION})")
+        for version, description, _ in MIGRATIONS:
+            mark = "applied" if version <= current else "pending"
+            print(f"  [{mark}] {version}: {description}")
+        return 0
+
+    version = init_db(args.db_path, args.timeout, args.target)
+    return 0 if args.target is not None or version >= LATEST_VERSION else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,325 @@
+#!/usr/bin/env python
+"""
+maintenance.py - 利用の少ない時間帯に中央データベースの保守（統計の更新・空き領域の解放・整合性確認）を行うスクリプト
+
+クエリプランナーの統計 (sqlite_stat1) が古いままだったり、削除（アーカイブなど）で空いたページが
+ファイル内に残ったままだと、クライアントの書き込みのたびに余分な読み込みが発生します。
+本スクリプトはタスクスケジューラなどから定期的に（例: 毎時）実行し、--window で指定した時間帯の場合だけ
+以下の手順を行います（時間帯の外では何もせずに終了します）。
+
+  ・analyze : テーブルごとに ANALYZE を実行する（PRAGMA analysis_limit で1テーブルあたりの読み込みを制限）
+  ・vacuum  : PRAGMA incremental_vacuum(--vacuum-pages) を繰り返し、空きページをファイルから解放する
+              （auto_vacuum = INCREMENTAL のデータベースのみ。--enable-incremental-vacuum で1回だけ切り替える）
+  ・check   : テーブルごとに PRAGMA quick_check を実行する
+
+ロックの保持時間の制限:
+  ・各手順は小さな単位（1テーブル、または --vacuum-pages ページ）ごとの自動コミットの文に分け、
+    単位の間でロックを解放する
+  ・各手順は --step-seconds 秒で打ち切る（実行中の文も進捗ハンドラーで中断する）
+  ・ロックの取得は --busy-timeout 秒しか待たず、クライアントの書き込みと競合した場合はその単位を見送り、
+    待機時間を倍にしながら（最大 --max-backoff 秒）再度試みる
+  ・実行前後の状態とテーブルの一覧の読み取りも --busy-timeout 秒しか待たず、競合した場合は
+    手順を実行せずに（実行後の読み取りの場合は実行後の状態なしで）"busy" として終了する
+実行前後のファイルサイズ・ページ数・空きページ数と、手順ごとの所要時間・競合回数をログに出力します。
+
+使い方:
+    python maintenance.py <db_path> [--window 22:00-05:00] [--steps analyze,vacuum,check] [--step-seconds 60]
+    python maintenance.py <db_path> --force --enable-incremental-vacuum    # 初回のみ（全体の VACUUM を伴う）
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import sqlite3
+import sys
+import time
+
+# ロック競合の判定はクライアントと共通の retry.py を利用する
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "pc_client"))
+from retry import is_retryable  # noqa: E402
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+
+STEPS = ("analyze", "vacuum", "check")
+
+# PRAGMA auto_vacuum の値
+AUTO_VACUUM_MODES = {0: "none", 1: "full", 2: "incremental"}
+
+# 進捗ハンドラーを呼び出す間隔（SQLite の仮想マシンの命令数）
+PROGRESS_INTERVAL = 10000
+
+
+def parse_window(text):
+    """
+    "HH:MM-HH:MM" 形式の時間帯を (開始, 終了)（0時からの分）に変換する。終了が開始より前の場合は日をまたぐ。
+
+    Raises:
+        ValueError: 形式が正しくない場合
+    """
+    try:
+        start, end = (datetime.datetime.strptime(part.strip(), "%H:%M") for part in text.split("-"))
+    except ValueError:
+        raise ValueError(f"Invalid window '{text}' (expected HH:MM-HH:MM).") from None
+    return start.hour * 60 + start.minute, end.hour * 60 + end.minute
+
+
+def in_window(window, now=None):
+    """now（省略時は現在時刻）が時間帯 window（parse_window の結果）に含まれる場合は True を返す。"""
+    now = now or datetime.datetime.now()
+    minute = now.hour * 60 + now.minute
+    start, end = window
+    if start <= end:
+        return start <= minute < end
+    return minute >= start or minute < end
+
+
+def file_stats(conn, db_path):
+    """ファイルサイズ、ページサイズ、ページ数、空きページ数、auto_vacuum の設定を返す。"""
+    return {
+        'size_bytes': os.path.getsize(db_path),
+        'page_size': conn.execute("PRAGMA page_size").fetchone()[0],
+        'page_count': conn.execute("PRAGMA page_count").fetchone()[0],
+        'freelist_count': conn.execute("PRAGMA freelist_count").fetchone()[0],
+        'auto_vacuum': AUTO_VACUUM_MODES.get(conn.execute("PRAGMA auto_vacuum").fetchone()[0], "unknown"),
+    }
+
+
+def _tables(conn):
+    """統計の更新・整合性確認の対象とするテーブル名の一覧（SQLite の内部テーブルを除く）。"""
+    return [row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_schema WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name")]
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+class _Step:
+    """
+    1つの手順の実行状況。単位ごとの文を時間の上限とロック競合時の待機付きで実行する。
+
+    Attributes:
+        name (str): 手順名
+        deadline (float): 打ち切る時刻（time.monotonic の値）
+        status (str): "done"、時間切れの "timeout"、競合が続いたため打ち切った "busy"、実行しなかった "skipped"
+        units (int): 実行を終えた文の数
+        busy (int): ロック競合で見送った回数
+    """
+
+    def __init__(self, name, step_seconds, backoff, max_backoff):
+        self.name = name
+        self.started = time.monotonic()
+        self.deadline = self.started + step_seconds
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.status = "done"
+        self.units = 0
+        self.busy = 0
+
+    def run(self, conn, sql):
+        """
+        sql を実行して結果の行を返す。ロック競合の間は待機時間を倍にしながら再実行し、
+        時間の上限を超えた場合（実行中の文の中断を含む）は None を返す。
+        """
+        delay = self.backoff
+        while True:
+            if time.monotonic() >= self.deadline:
+                self.status = "timeout"
+                return None
+            conn.set_progress_handler(lambda: time.monotonic() >= self.deadline, PROGRESS_INTERVAL)
+            try:
+                rows = conn.execute(sql).fetchall()
+                self.units += 1
+                return rows
+            except sqlite3.OperationalError as e:
+                if "interrupted" in str(e).lower():
+                    self.status = "timeout"
+                    return None
+                if not is_retryable(e):
+                    raise
+                self.busy += 1
+                if time.monotonic() + delay >= self.deadline:
+                    self.status = "busy"
+                    return None
+                logging.info("%s: database is busy; backing off for %.1f seconds.", self.name, delay)
+                time.sleep(delay)
+                delay = min(delay * 2, self.max_backoff)
+            finally:
+                conn.set_progress_handler(None, 0)
+
+    def summary(self):
+        return {'status': self.status, 'units': self.units, 'busy': self.busy,
+                'elapsed_ms': round((time.monotonic() - self.started) * 1000, 1)}
+
+
+def _analyze(conn, step, tables, analysis_limit):
+    conn.execute(f"PRAGMA analysis_limit = {int(analysis_limit)}")
+    for table in tables:
+        if step.run(conn, "ANALYZE " + _quote(table)) is None:
+            return
+
+
+def _vacuum(conn, step, vacuum_pages):
+    rows = step.run(conn, "PRAGMA auto_vacuum")
+    if rows is None:
+        return
+    if rows[0][0] != 2:
+        logging.info("auto_vacuum is not INCREMENTAL; run with --enable-incremental-vacuum once "
+                     "to allow incremental vacuum.")
+        step.status = "skipped"
+        return
+    while True:
+        # 空きページ数の読み取りもロックを取得するため、競合時は他の単位と同じく待機する
+        rows = step.run(conn, "PRAGMA freelist_count")
+        if rows is None or rows[0][0] == 0:
+            return
+        if step.run(conn, f"PRAGMA incremental_vacuum({int(vacuum_pages)})") is None:
+            return
+
+
+def _check(conn, step, tables, errors):
+    for table in tables:
+        rows = step.run(conn, f"PRAGMA quick_check({_quote(table)})")
+        if rows is None:
+            return
+        errors.extend(row[0] for row in rows if row[0] != "ok")
+
+
+def enable_incremental_vacuum(db_path, timeout=5.0):
+    """
+    auto_vacuum を INCREMENTAL に切り替える（全体の VACUUM を1回実行するため、実行中はクライアントの書き込みを待たせる）。
+
+    Returns:
+        float: 所要時間（秒）
+    """
+    started = time.perf_counter()
+    conn = sqlite3.connect(db_path, timeout=timeout, isolation_level=None)
+    try:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+    elapsed = time.perf_counter() - started
+    logging.info("Switched %s to auto_vacuum = INCREMENTAL in %.1f seconds.", db_path, elapsed)
+    return elapsed
+
+
+def maintain(db_path, window=None, steps=STEPS, step_seconds=60.0, vacuum_pages=200, analysis_limit=1000,
+             busy_timeout=0.2, backoff=0.5, max_backoff=8.0, force=False):
+    """
+    時間帯 window の場合に、steps の保守手順を順番に実行する。
+
+    Parameters:
+        db_path (str): 中央データベースファイルのパス
+        window (tuple or None): parse_window の結果（None の場合は時間帯を確認しない）
+        steps (sequence): 実行する手順（STEPS の部分集合、記載順に実行）
+        step_seconds (float): 1つの手順の実行時間の上限（秒）
+        vacuum_pages (int): incremental_vacuum の1回あたりのページ数
+        analysis_limit (int): ANALYZE で1テーブル（インデックス）あたりに読み込む行数の目安（0 で制限なし）
+        busy_timeout (float): ロックの取得を待つ最大時間（秒）。超えた場合は競合とみなして待機する
+                              （実行前後の状態の読み取りでは待機せず、busy として終了する）
+        backoff (float): 競合時の最初の待機時間（秒）
+        max_backoff (float): 競合時の待機時間の上限（秒）
+        force (bool): True の場合は時間帯の外でも実行する
+
+    Returns:
+        dict: 実行前後のファイルの状態 (before / after)、手順ごとの結果 (steps)、整合性確認の異常 (check_errors)。
+              時間帯の外で実行しなかった場合は skipped が True、実行前後の状態の読み取りが
+              ロック競合で失敗した場合は busy が True（読み取れなかった状態は None）
+
+    Raises:
+        sqlite3.OperationalError: ロック競合以外の理由でデータベースを読み書きできない場合
+    """
+    if window and not force and not in_window(window):
+        logging.info("Outside the maintenance window; nothing to do.")
+        return {'skipped': True}
+    # すべての文は短い待機で競合を検出する（各手順の文は _Step.run の待機（バックオフ）に任せる）
+    conn = sqlite3.connect(db_path, timeout=busy_timeout, isolation_level=None)
+    results = {}
+    errors = []
+    after = None
+    try:
+        try:
+            before = file_stats(conn, db_path)
+            tables = _tables(conn)
+        except sqlite3.OperationalError as e:
+            if not is_retryable(e):
+                raise
+            logging.warning("Database is busy; skipping maintenance until the next run (%s).", e)
+            return {'skipped': False, 'busy': True, 'before': None, 'after': None, 'steps': results,
+                    'check_errors': errors}
+        logging.info("Before: %s", before)
+        for name in steps:
+            if window and not force and not in_window(window):
+                logging.info("Maintenance window ended; skipping the remaining steps.")
+                break
+            step = _Step(name, step_seconds, backoff, max_backoff)
+            if name == "analyze":
+                _analyze(conn, step, tables, analysis_limit)
+            elif name == "vacuum":
+                _vacuum(conn, step, vacuum_pages)
+            elif name == "check":
+                _check(conn, step, tables, errors)
+            results[name] = step.summary()
+            logging.info("Step %s: %s", name, results[name])
+        try:
+            after = file_stats(conn, db_path)
+        except sqlite3.OperationalError as e:
+            if not is_retryable(e):
+                raise
+            logging.warning("Database is busy; could not read the state after maintenance (%s).", e)
+    finally:
+        conn.close()
+    if after is not None:
+        logging.info("After: %s (size %+d bytes, free pages %+d)", after,
+                     after['size_bytes'] - before['size_bytes'], after['freelist_count'] - before['freelist_count'])
+    if errors:
+        logging.error("quick_check reported %d problem(s): %s", len(errors), "; ".join(errors[:10]))
+    return {'skipped': False, 'busy': after is None, 'before': before, 'after': after, 'steps': results,
+            'check_errors': errors}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="PCActivityTracker 中央データベースの保守（時間帯・時間制限付き）")
+    parser.add_argument("db_path", help="中央SQLiteデータベースファイルのパス")
+    parser.add_argument("--window", default="22:00-05:00", help="実行する時間帯（HH:MM-HH:MM、日をまたいでもよい）")
+    parser.add_argument("--force", action="store_true", help="時間帯の外でも実行する")
+    parser.add_argument("--steps", default=",".join(STEPS), help="実行する手順（カンマ区切り: analyze, vacuum, check）")
+    parser.add_argument("--step-seconds", type=float, default=60.0, help="1つの手順の実行時間の上限（秒）")
+    parser.add_argument("--vacuum-pages", type=int, default=200, help="incremental_vacuum の1回あたりのページ数")
+    parser.add_argument("--analysis-limit", type=int, default=1000,
+                        help="ANALYZE で1テーブルあたりに読み込む行数の目安（0 で制限なし）")
+    parser.add_argument("--busy-timeout", type=float, default=0.2, help="ロックの取得を待つ最大時間（秒）")
+    parser.add_argument("--max-backoff", type=float, default=8.0, help="ロック競合時の待機時間の上限（秒）")
+    parser.add_argument("--enable-incremental-vacuum", action="store_true",
+                        help="auto_vacuum を INCREMENTAL に切り替えてから実行する（全体の VACUUM を1回伴う）")
+    parser.add_argument("--timeout", type=float, default=5.0,
+                        help="--enable-incremental-vacuum の VACUUM でロックを待つタイムアウト秒数")
+    parser.add_argument("--json", action="store_true", help="結果を JSON で出力する")
+    args = parser.parse_args(argv)
+
+    steps = [name.strip() for name in args.steps.split(",") if name.strip()]
+    unknown = [name for name in steps if name not in STEPS]
+    if unknown:
+        parser.error(f"Unknown step(s): {', '.join(unknown)} (expected {', '.join(STEPS)}).")
+    try:
+        window = parse_window(args.window)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.enable_incremental_vacuum:
+        if not args.force and not in_window(window):
+            logging.info("Outside the maintenance window; nothing to do.")
+            return 0
+        enable_incremental_vacuum(args.db_path, args.timeout)
+    result = maintain(args.db_path, window, steps, args.step_seconds, args.vacuum_pages, args.analysis_limit,
+                      args.busy_timeout, max_backoff=args.max_backoff, force=args.force)
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    return 1 if result.get('check_errors') else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
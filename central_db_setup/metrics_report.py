@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+"""
+metrics_report.py - 各PCから収集したフェーズ別の計測結果（pc_client/metrics.py の metrics.jsonl）を集計するスクリプト
+
+起動・シャットダウンの実行ごとに記録された1行の JSON を読み込み、以下を集計します。
+  ・phases : 実行の種類 × フェーズごとの所要時間のパーセンタイル（どの処理段階に時間がかかっているか）
+  ・hosts  : PCごとの実行回数、エラー・スプール残りの件数、再試行回数と、全体（または --phase のフェーズ）の
+             所要時間のパーセンタイル（遅いPCの特定）
+  ・targets: 書き込み先 (db_path) ごとの同様の集計（遅い共有パスの特定）
+パーセンタイルは最近傍順位法で求めます（pc_client/metrics.py の percentile。pc_server_test/load_test.py と共通）。
+
+入力にはファイル、フォルダー（配下の metrics.jsonl* を再帰的に検索）、ワイルドカードを指定できます。
+途中で途切れた行や JSON として読めない行は読み飛ばします。
+
+使い方:
+    python metrics_report.py \\\\server\\share\\metrics --by phase
+    python metrics_report.py collected/*.jsonl --by host --phase shutdown.lock --top 20
+    python metrics_report.py collected --by target --kind shutdown --from 2026-10-01 --json
+"""
+
+import argparse
+import glob
+import json
+import logging
+import os
+import sys
+
+# パーセンタイルの算出はクライアントの metrics.py と共通の関数を利用する
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "pc_client"))
+from metrics import percentile  # noqa: E402
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+
+GROUP_KEYS = {'host': "host", 'target': "db_path"}
+
+# 全体の所要時間を表す疑似フェーズ名
+TOTAL_PHASE = "total"
+
+
+def summarize(values_ms):
+    """所要時間（ミリ秒）の一覧から件数・平均・p50/p95/p99・最大を求める。"""
+    values = sorted(values_ms)
+    if not values:
+        return {'count': 0, 'mean': None, 'p50': None, 'p95': None, 'p99': None, 'max': None}
+    return {
+        'count': len(values),
+        'mean': round(sum(values) / len(values), 1),
+        'p50': round(percentile(values, 50), 1),
+        'p95': round(percentile(values, 95), 1),
+        'p99': round(percentile(values, 99), 1),
+        'max': round(values[-1], 1),
+    }
+
+
+def find_files(inputs):
+    """
+    入力（ファイル、フォルダー、ワイルドカード）から記録ファイルの一覧を返す。
+
+    Returns:
+        list: 記録ファイルのパス（重複を除き、名前順）
+    """
+    files = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            files.update(glob.glob(os.path.join(item, "**", "metrics.jsonl*"), recursive=True))
+        elif glob.has_magic(item):
+            files.update(path for path in glob.glob(item) if os.path.isfile(path))
+        elif os.path.isfile(item):
+            files.add(item)
+        else:
+            logging.warning("Input %s not found.", item)
+    return sorted(files)
+
+
+def load_records(files, kind=None, host=None, date_from=None, date_to=None):
+    """
+    記録ファイルを読み込み、条件に合う記録を返す。
+
+    Parameters:
+        files (list): 記録ファイルのパス
+        kind (str or None): 実行の種類（"startup" / "shutdown"）で絞り込む
+        host (str or None): PC（ホスト名）で絞り込む
+        date_from, date_to (str or None): 実行日（YYYY-MM-DD、両端を含む）で絞り込む
+
+    Returns:
+        list: 記録（dict）のリスト
+    """
+    records, skipped = [], 0
+    for path in files:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    skipped += 1
+                    continue
+                if not isinstance(record, dict) or 'phases' not in record:
+                    skipped += 1
+                    continue
+                day = str(record.get('ts', ""))[:10]
+                if kind and record.get('kind') != kind:
+                    continue
+                if host and record.get('host') != host:
+                    continue
+                if (date_from and day < date_from) or (date_to and day > date_to):
+                    continue
+                records.append(record)
+    if skipped:
+        logging.warning("Skipped %d unreadable line(s).", skipped)
+    logging.info("Loaded %d record(s) from %d file(s).", len(records), len(files))
+    return records
+
+
+def _phase_value(record, phase):
+    if phase == TOTAL_PHASE:
+        return record.get('total_ms')
+    return record['phases'].get(phase)
+
+
+def report_phases(records):
+    """
+    実行の種類 × フェーズごとの所要時間を集計する（フェーズを実行しなかった記録は件数に含めない）。
+
+    Returns:
+        list: kind, phase, count, mean, p50, p95, p99, max の dict のリスト（p95 の降順）
+    """
+    values = {}
+    for record in records:
+        kind = record.get('kind')
+        values.setdefault((kind, TOTAL_PHASE), []).append(record.get('total_ms') or 0.0)
+        for phase, ms in record['phases'].items():
+            values.setdefault((kind, phase), []).append(ms)
+    rows = [dict({'kind': kind, 'phase': phase}, **summarize(v)) for (kind, phase), v in values.items()]
+    rows.sort(key=lambda r: (str(r['kind']), -(r['p95'] or 0)))
+    return rows
+
+
+def report_groups(records, by="host", phase=TOTAL_PHASE):
+    """
+    PC（by="host"）または書き込み先（by="target"）ごとに、実行回数、エラー・スプール残りの件数、
+    再試行回数、ロック待ち時間の合計と、phase の所要時間のパーセンタイルを集計する。
+
+    Returns:
+        list: 集計結果の dict のリスト（p95 の降順）
+    """
+    key = GROUP_KEYS[by]
+    groups = {}
+    for record in records:
+        group = groups.setdefault(record.get(key) or "(unknown)", {
+            'runs': 0, 'errors': 0, 'spooled': 0, 'retries': 0, 'lock_wait_ms': 0.0, 'values': []})
+        group['runs'] += 1
+        outcome = record.get('outcome')
+        if outcome == "error":
+            group['errors'] += 1
+        elif outcome == "spooled":
+            group['spooled'] += 1
+        for entry in record.get('retries', {}).values():
+            group['retries'] += entry.get('retries', 0)
+            group['lock_wait_ms'] += entry.get('lock_wait_ms', 0.0)
+        value = _phase_value(record, phase)
+        if value is not None:
+            group['values'].append(value)
+    rows = []
+    for name, group in groups.items():
+        row = {by: name, 'runs': group['runs'], 'errors': group['errors'], 'spooled': group['spooled'],
+               'retries': group['retries'], 'lock_wait_ms': round(group['lock_wait_ms'], 1)}
+        row.update(summarize(group['values']))
+        rows.append(row)
+    rows.sort(key=lambda r: -(r['p95'] or 0))
+    return rows
+
+
+def _print_table(rows):
+    if not rows:
+        print("(no rows)")
+        return
+    headers = list(rows[0].keys())
+    cells = [["-" if r[h] is None else str(r[h]) for h in headers] for r in rows]
+    widths = [max(len(h), *(len(c[i]) for c in cells)) for i, h in enumerate(headers)]
+    print("  ".join(h.ljust(w) for h, w in zip(headers, widths)))
+    print("  ".join("-" * w for w in widths))
+    for c in cells:
+        print("  ".join(v.ljust(w) for v, w in zip(c, widths)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="PCActivityTracker フェーズ別計測結果の集計")
+    parser.add_argument("inputs", nargs="+", help="記録ファイル、フォルダー、またはワイルドカード")
+    parser.add_argument("--by", choices=("phase", "host", "target"), default="phase",
+                        help="集計の単位（phase: フェーズ別、host: PC別、target: 書き込み先別）")
+    parser.add_argument("--phase", default=TOTAL_PHASE,
+                        help="host / target の集計で比較するフェーズ（例: shutdown.lock、既定は全体の所要時間）")
+    parser.add_argument("--kind", choices=("startup", "shutdown"), help="実行の種類で絞り込む")
+    parser.add_argument("--host", help="PC（ホスト名）で絞り込む")
+    parser.add_argument("--from", dest="date_from", help="期間の開始日（YYYY-MM-DD）")
+    parser.add_argument("--to", dest="date_to", help="期間の終了日（YYYY-MM-DD）")
+    parser.add_argument("--top", type=int, default=0, help="p95 の大きい順に表示する件数（0 で全件）")
+    parser.add_argument("--json", action="store_true", help="JSON で出力する")
+    args = parser.parse_args(argv)
+
+    records = load_records(find_files(args.inputs), args.kind, args.host, args.date_from, args.date_to)
+    if args.by == "phase":
+        rows = report_phases(records)
+    else:
+        rows = report_groups(records, args.by, args.phase)
+    if args.top:
+        rows = rows[:args.top]
+    if args.json:
+        print(json.dumps(rows, ensure_ascii=False, indent=2))
+    else:
+        _print_table(rows)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
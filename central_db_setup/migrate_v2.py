@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+"""
+migrate_v2.py - session_logs をコンパクト形式 (v2) の sessions / pcs / users へ稼働中に移行するスクリプト
+
+v2 形式では、時刻を 'YYYY-MM-DD HH:MM:SS' の文字列ではなく UNIX 秒（UTC）の整数で保存し、
+PC名・ユーザー名は辞書テーブル (pcs / users) の整数IDで参照します。冗長な weekday 列は持たず、
+未終了のセッションは shutdown_time（shutdown_ts）が NULL の場合のみとします。
+これにより1行あたりのサイズが小さくなり、インデックスの検索も整数の比較になります。
+
+init_db.py の移行4で空のテーブルを作成した後、本スクリプトの copy で既存データを chunk_size 件ずつ
+別々の短いトランザクションでコピーします（クライアントの書き込みはその間も session_logs へ行われます）。
+コピー時点で未終了だったセッションは v2_copy_pending に記録し、終了した時点で再コピーします。
+最後に switch で残りの差分をコピーし、移行5（session_logs の削除と互換ビューへの置き換え）を適用します。
+移行5の適用後は、session_logs は sessions / pcs / users を結合したビューになり、INSTEAD OF トリガーにより
+従来の形式の INSERT / UPDATE / DELETE もそのまま動作します。
+
+注意:
+  ・コピー済みの終了済みセッションを switch までの間に手作業で修正した場合、その修正は反映されない
+  ・時刻の変換はこのスクリプト（移行5）を実行するサーバーのタイムゾーンをローカル時刻として行う
+  ・switch の前にデータベースファイルのバックアップを取り、switch 後に VACUUM でファイルを縮小すること
+
+使い方:
+    python init_db.py <db_path> --target 4
+    python migrate_v2.py <db_path> copy [--chunk-size 5000] [--pause 0.05]
+    python migrate_v2.py <db_path> status
+    python migrate_v2.py <db_path> switch
+"""
+
+import argparse
+import logging
+import sqlite3
+import sys
+import time
+
+from init_db import V2_COPY_SELECT, apply_migrations, get_schema_version
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+
+# v2 のテーブルを作成する移行と、互換ビューへ切り替える移行のバージョン
+COPY_VERSION = 4
+SWITCH_VERSION = 5
+
+OPEN = "(l.shutdown_time IS NULL OR l.shutdown_time = '')"
+
+
+def _require_copy_phase(conn):
+    version = get_schema_version(conn)
+    if version != COPY_VERSION:
+        raise RuntimeError(f"Database schema version is {version}; copying requires version {COPY_VERSION} "
+                           f"(run init_db.py --target {COPY_VERSION} first, or the migration is already complete).")
+
+
+def _last_copied(conn):
+    row = conn.execute("SELECT value FROM v2_copy_state WHERE name = 'last_session_id'").fetchone()
+    return row[0] if row else 0
+
+
+def _copy_rows(conn, where, params=()):
+    """条件に一致する session_logs の行の PC名・ユーザー名を辞書に登録し、sessions へコピーする。"""
+    for table, column in (("pcs", "pc_id"), ("users", "user_account")):
+        conn.execute(f"INSERT OR IGNORE INTO {table} ({column}) "
+                     f"SELECT DISTINCT l.{column} FROM session_logs AS l WHERE {where}", params)
+    conn.execute(f"""
+        INSERT OR REPLACE INTO sessions (session_id, pc_key, user_key, start_ts, shutdown_ts, duration, session_type)
+        {V2_COPY_SELECT}
+        WHERE {where}
+    """, params)
+
+
+def copy_chunk(conn, chunk_size):
+    """
+    未コピーの行を session_id 順に最大 chunk_size 件コピーし、前回までに未終了だった行のうち
+    終了したものを再コピーする（1つの BEGIN IMMEDIATE トランザクション）。
+
+    Parameters:
+        conn (sqlite3.Connection): isolation_level=None で開いた接続
+        chunk_size (int): 1トランザクションでコピーする最大件数
+
+    Returns:
+        tuple: (コピーした新規の行数, 再コピーした終了済みの行数)
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        closed = conn.execute(f"""
+            SELECT COUNT(*) FROM v2_copy_pending AS p JOIN session_logs AS l ON l.session_id = p.session_id
+            WHERE NOT {OPEN}
+        """).fetchone()[0]
+        if closed:
+            _copy_rows(conn, f"l.session_id IN (SELECT session_id FROM v2_copy_pending) AND NOT {OPEN}")
+            conn.execute(f"""
+                DELETE FROM v2_copy_pending WHERE session_id IN (
+                    SELECT l.session_id FROM v2_copy_pending AS p JOIN session_logs AS l ON l.session_id = p.session_id
+                    WHERE NOT {OPEN}
+                )
+            """)
+
+        low = _last_copied(conn)
+        high, count = conn.execute("""
+            SELECT MAX(session_id), COUNT(*) FROM (
+                SELECT session_id FROM session_logs WHERE session_id > ? ORDER BY session_id LIMIT ?
+            )
+        """, (low, chunk_size)).fetchone()
+        if count:
+            params = {'low': low, 'high': high}
+            where = "l.session_id > :low AND l.session_id <= :high"
+            _copy_rows(conn, where, params)
+            conn.execute(f"INSERT OR IGNORE INTO v2_copy_pending (session_id) "
+                         f"SELECT l.session_id FROM session_logs AS l WHERE {where} AND {OPEN}", params)
+            conn.execute("""
+                INSERT INTO v2_copy_state (name, value) VALUES ('last_session_id', ?)
+                ON CONFLICT (name) DO UPDATE SET value = excluded.value
+            """, (high,))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return count, closed
+
+
+def copy_all(db_path, chunk_size=5000, pause=0.05, timeout=5.0):
+    """
+    未コピーの行がなくなるまで copy_chunk を繰り返す。チャンクの間に pause 秒待機し、
+    クライアントの書き込みがロックを取得できるようにする。
+
+    Returns:
+        dict: copied（新規コピー行数）、recopied（再コピー行数）、chunks、elapsed（秒）
+    """
+    started = time.perf_counter()
+    result = {'copied': 0, 'recopied': 0, 'chunks': 0}
+    conn = sqlite3.connect(db_path, timeout=timeout, isolation_level=None)
+    try:
+        _require_copy_phase(conn)
+        while True:
+            copied, recopied = copy_chunk(conn, chunk_size)
+            result['chunks'] += 1
+            result['copied'] += copied
+            result['recopied'] += recopied
+            if copied:
+                logging.info("Copied %d row(s) up to session_id %d.", copied, _last_copied(conn))
+            if copied < chunk_size:
+                break
+            time.sleep(pause)
+    finally:
+        conn.close()
+    result['elapsed'] = round(time.perf_counter() - started, 3)
+    logging.info("Copy pass finished: %d new, %d re-copied row(s) in %d chunk(s) (%.3f seconds).",
+                 result['copied'], result['recopied'], result['chunks'], result['elapsed'])
+    return result
+
+
+def status(db_path, timeout=5.0):
+    """
+    移行の進捗を返す。
+
+    Returns:
+        dict: version、phase（"not-started" / "copying" / "complete"）、件数など
+    """
+    with sqlite3.connect(db_path, timeout=timeout) as conn:
+        version = get_schema_version(conn)
+        info = {'version': version}
+        if version < COPY_VERSION:
+            info['phase'] = "not-started"
+        elif version == COPY_VERSION:
+            info['phase'] = "copying"
+            info['source_rows'] = conn.execute("SELECT COUNT(*) FROM session_logs").fetchone()[0]
+            info['copied_rows'] = conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+            info['last_session_id'] = _last_copied(conn)
+            info['pending_open'] = conn.execute("SELECT COUNT(*) FROM v2_copy_pending").fetchone()[0]
+        else:
+            info['phase'] = "complete"
+            info['rows'] = conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+        for table in ("pcs", "users"):
+            if version >= COPY_VERSION:
+                info[table] = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    return info
+
+
+def switch(db_path, chunk_size=5000, timeout=5.0):
+    """
+    残りの差分をコピーした後、移行5を適用して session_logs を互換ビューに置き換える。
+    移行5のトランザクション内で最後の差分（直前に追加・終了した行）もコピーするため、行は失われない。
+
+    Returns:
+        int: 移行後のスキーマバージョン
+    """
+    copy_all(db_path, chunk_size, pause=0, timeout=timeout)
+    conn = sqlite3.connect(db_path, timeout=timeout, isolation_level=None)
+    try:
+        return apply_migrations(conn, SWITCH_VERSION)
+    finally:
+        conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="PCActivityTracker session_logs のコンパクト形式 (v2) への移行")
+    parser.add_argument("db_path", help="中央SQLiteデータベースファイルのパス")
+    parser.add_argument("--timeout", type=float, default=5.0, help="SQLite接続時のタイムアウト秒数")
+    parser.add_argument("--chunk-size", type=int, default=5000, help="1トランザクションでコピーする最大件数")
+    sub = parser.add_subparsers(dest="command", required=True)
+    c = sub.add_parser("copy", help="未コピーの行を分割してコピーする（繰り返し実行可能）")
+    c.add_argument("--pause", type=float, default=0.05, help="チャンク間の待機時間（秒）")
+    sub.add_parser("status", help="移行の進捗を表示する")
+    sub.add_parser("switch", help="残りをコピーし、session_logs を互換ビューに置き換える（移行5）")
+    args = parser.parse_args(argv)
+
+    if args.command == "copy":
+        copy_all(args.db_path, args.chunk_size, args.pause, args.timeout)
+    elif args.command == "status":
+        for key, value in status(args.db_path, args.timeout).items():
+            print(f"{key}: {value}")
+    else:
+        switch(args.db_path, args.chunk_size, args.timeout)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
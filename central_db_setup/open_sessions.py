@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+"""
+open_sessions.py - PC・ユーザーごとの未終了セッションの参照 (open_sessions) を確認・作り直すスクリプト
+
+スキーマバージョン9以上では、シャットダウンの記録は sessions の未終了セッションを検索せず、
+open_sessions の主キー (pc_key, user_key) で最新の未終了セッションを取得し、session_id 指定で更新します。
+open_sessions は sessions のトリガー（init_db.py の移行9）が挿入・終了・削除と同じ文の中で更新するため、
+通常は作り直す必要はありません。バックアップからの復元、トリガーを外した状態での手作業の修正、
+ファイルの破損からの復旧などの後に check で確認し、不一致があれば rebuild で作り直します。
+
+  ・check  : sessions の未終了セッションから求めた参照と open_sessions を比較し、不足・余分・異なる参照の件数を出力する
+  ・rebuild: 1つの BEGIN IMMEDIATE トランザクションで open_sessions を削除し、sessions の未終了セッションから作り直す
+             （PC・ユーザーごとに開始時刻が最も新しいもの。移行9と同じ文 init_db.OPEN_SESSIONS_REBUILD を使う）
+
+使い方:
+    python open_sessions.py <db_path> check [--json]
+    python open_sessions.py <db_path> rebuild [--json]
+"""
+
+import argparse
+import json
+import logging
+import sqlite3
+import sys
+import time
+
+from init_db import OPEN_SESSIONS_REBUILD, get_schema_version
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+
+# open_sessions を作成する移行のバージョン
+OPEN_SESSIONS_SCHEMA_VERSION = 9
+
+# sessions の未終了セッションから求めた参照（OPEN_SESSIONS_REBUILD と同じ選び方）と open_sessions の比較
+_EXPECTED = """
+    SELECT pc_key, user_key, session_id, start_ts FROM (
+        SELECT pc_key, user_key, session_id, start_ts,
+               ROW_NUMBER() OVER (PARTITION BY pc_key, user_key ORDER BY start_ts DESC, session_id DESC) AS rank
+        FROM sessions WHERE shutdown_ts IS NULL
+    ) WHERE rank = 1
+"""
+
+_COMPARE_QUERY = f"""
+    WITH expected AS ({_EXPECTED})
+    SELECT
+        (SELECT COUNT(*) FROM expected AS e
+         WHERE NOT EXISTS (SELECT 1 FROM open_sessions AS o WHERE o.pc_key = e.pc_key AND o.user_key = e.user_key)),
+        (SELECT COUNT(*) FROM open_sessions AS o
+         WHERE NOT EXISTS (SELECT 1 FROM expected AS e WHERE e.pc_key = o.pc_key AND e.user_key = o.user_key)),
+        (SELECT COUNT(*) FROM open_sessions AS o JOIN expected AS e USING (pc_key, user_key)
+         WHERE o.session_id != e.session_id OR o.start_ts != e.start_ts),
+        (SELECT COUNT(*) FROM expected),
+        (SELECT COUNT(*) FROM open_sessions)
+"""
+
+
+def _require_schema(conn):
+    version = get_schema_version(conn)
+    if version < OPEN_SESSIONS_SCHEMA_VERSION:
+        raise RuntimeError(f"Database schema version {version} has no open_sessions table; "
+                           f"run init_db.py to migrate to version {OPEN_SESSIONS_SCHEMA_VERSION} or later.")
+
+
+def _compare(conn):
+    missing, extra, stale, expected, current = conn.execute(_COMPARE_QUERY).fetchone()
+    return {'expected': expected, 'current': current, 'missing': missing, 'extra': extra, 'stale': stale}
+
+
+def check_open_sessions(db_path, timeout=5.0):
+    """
+    open_sessions と sessions の未終了セッションを比較する（読み取りのみ）。
+
+    Parameters:
+        db_path (str): 中央データベースファイルのパス
+        timeout (float): SQLite接続時のタイムアウト秒数
+
+    Raises:
+        RuntimeError: スキーマバージョンが open_sessions に対応していない場合
+
+    Returns:
+        dict: expected（あるべき参照の件数）、current（open_sessions の件数）、missing（不足）、
+              extra（未終了セッションのないPC・ユーザーの参照）、stale（異なるセッションを指す参照）、consistent、elapsed_ms
+    """
+    started = time.perf_counter()
+    conn = sqlite3.connect(db_path, timeout=timeout)
+    try:
+        _require_schema(conn)
+        result = _compare(conn)
+    finally:
+        conn.close()
+    result['consistent'] = not (result['missing'] or result['extra'] or result['stale'])
+    result['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    log = logging.info if result['consistent'] else logging.warning
+    log("open_sessions: %d pointer(s), %d expected (missing=%d, extra=%d, stale=%d) in %.1f ms.", result['current'],
+        result['expected'], result['missing'], result['extra'], result['stale'], result['elapsed_ms'])
+    return result
+
+
+def rebuild_open_sessions(db_path, timeout=5.0):
+    """
+    open_sessions を削除し、sessions の未終了セッションから作り直す（1つの BEGIN IMMEDIATE トランザクション）。
+
+    Parameters:
+        db_path (str): 中央データベースファイルのパス
+        timeout (float): SQLite接続時のタイムアウト秒数
+
+    Raises:
+        RuntimeError: スキーマバージョンが open_sessions に対応していない場合
+
+    Returns:
+        dict: 作り直す前の比較結果（check_open_sessions と同じ項目）、rows（作り直した参照の件数）、elapsed_ms
+    """
+    started = time.perf_counter()
+    conn = sqlite3.connect(db_path, timeout=timeout, isolation_level=None)
+    try:
+        _require_schema(conn)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = _compare(conn)
+            conn.execute("DELETE FROM open_sessions")
+            result['rows'] = conn.execute(OPEN_SESSIONS_REBUILD).rowcount
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+    result['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    logging.info("Rebuilt open_sessions with %d pointer(s) (was missing=%d, extra=%d, stale=%d) in %.1f ms.",
+                 result['rows'], result['missing'], result['extra'], result['stale'], result['elapsed_ms'])
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="PCActivityTracker 未終了セッションの参照 (open_sessions) の確認・作り直し")
+    parser.add_argument("db_path", help="中央SQLiteデータベースファイルのパス")
+    parser.add_argument("command", choices=["check", "rebuild"], help="check: 不一致の確認 / rebuild: 作り直し")
+    parser.add_argument("--timeout", type=float, default=5.0, help="SQLite接続時のタイムアウト秒数")
+    parser.add_argument("--json", action="store_true", help="結果を JSON で出力する")
+    args = parser.parse_args(argv)
+    try:
+        if args.command == "check":
+            result = check_open_sessions(args.db_path, args.timeout)
+        else:
+            result = rebuild_open_sessions(args.db_path, args.timeout)
+    except RuntimeError as e:
+        parser.error(str(e))
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    return 0 if args.command == "rebuild" or result['consistent'] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
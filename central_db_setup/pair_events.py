@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+"""
+pair_events.py - 追記専用のイベントログ (session_events) から session_logs の行を増分で作成するスクリプト
+
+config.ini の [Database] write_mode = events のクライアント（および --write-mode events の集約サービス）は、
+起動・シャットダウンを session_events への1行の INSERT だけで記録します。未終了セッションの検索と
+更新は書き込みロックを保持したまま行う必要があるため、クライアントからは行わず本スクリプトにまとめます。
+
+本スクリプトは前回取り込んだ位置 (event_pairing_state の last_event_seq) より後のイベントを
+event_seq（コミット順）の順に読み、クライアントの直接書き込みと同じ処理 (utils.apply_events_to_sessions) で反映します。
+  ・起動イベントは未終了のセッションとして session_logs に挿入する
+  ・シャットダウンイベントは、同じPC・ユーザーの最新の未終了セッションを終了させ、利用時間を算出する
+    （該当がなければ、起動時刻をシャットダウン時刻で代替したセッションを挿入する）
+  ・それ以外の種別（将来の lock / unlock / sleep など）は session_logs へは反映せず、イベントログに残す
+反映と取り込み位置の更新は batch_size 件ごとに1つの BEGIN IMMEDIATE トランザクションで行うため、
+途中で中断しても再実行で重複・欠落しません。バッチの間に pause 秒待機し、クライアントの書き込みを待たせません。
+--keep-days を指定した場合は、取り込み済みで指定日数より古いイベントを削除します。削除したイベントの event_id は
+spool_events に残すため、長期間オフラインだったPCのスプールから同じイベントが再送されても二重に取り込みません。
+
+使い方:
+    python pair_events.py <db_path> [--batch-size 2000] [--pause 0.05] [--keep-days 90] [--json]
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import sqlite3
+import sys
+import time
+
+from init_db import get_schema_version
+
+# イベントの反映処理はクライアントと共通の utils.py を利用する
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "pc_client"))
+from utils import (COMPACT_SCHEMA_VERSION, EVENT_LOG_SCHEMA_VERSION, OPEN_SESSIONS_SCHEMA_VERSION,  # noqa: E402
+                   apply_events_to_sessions)
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+
+# session_logs へ反映するイベントの種別
+PAIRED_KINDS = ("startup", "shutdown")
+
+_SELECT_EVENTS_QUERY = """
+    SELECT event_seq, event_id, kind, pc_id, user_account, event_time, session_type
+    FROM session_events WHERE event_seq > ? ORDER BY event_seq LIMIT ?
+"""
+
+
+# --keep-days で削除する、取り込み済みで指定日数より古いイベント
+_PRUNE_CONDITION = "event_seq <= ? AND event_time < ?"
+
+
+def _to_event(row):
+    """session_events の1行を、utils.apply_events_to_sessions が扱うイベント（spool.new_event と同形式）に変換する。"""
+    _, event_id, kind, pc_id, user_account, event_time, session_type = row
+    weekday = datetime.datetime.strptime(event_time, "%Y-%m-%d %H:%M:%S").strftime("%a")
+    record = {'pc_id': pc_id, 'user_account': user_account, 'session_type': session_type or "normal",
+              'weekday': weekday, 'duration': 0}
+    if kind == "startup":
+        record['start_time'] = event_time
+        record['shutdown_time'] = ""
+    else:
+        record['shutdown_time'] = event_time
+    return {'event_id': event_id, 'kind': kind, 'record': record}
+
+
+def get_last_seq(conn):
+    """取り込み済みの最後の event_seq を返す（未実行の場合は 0）。"""
+    row = conn.execute("SELECT value FROM event_pairing_state WHERE name = 'last_event_seq'").fetchone()
+    return row[0] if row else 0
+
+
+def pair_events(db_path, batch_size=2000, pause=0.05, keep_days=0, timeout=5.0):
+    """
+    前回の取り込み位置より後のイベントを session_logs へ反映する。
+
+    Parameters:
+        db_path (str): 中央データベースファイルのパス
+        batch_size (int): 1トランザクションで反映する最大イベント数
+        pause (float): バッチ間の待機時間（秒）
+        keep_days (float): 取り込み済みのイベントをこの日数だけ残し、より古いものを削除する（0 で削除しない）
+        timeout (float): SQLite接続時のタイムアウト秒数
+
+    Raises:
+        RuntimeError: スキーマバージョンが session_events に対応していない場合
+
+    Returns:
+        dict: 反映したイベント数（events）、種別ごとの件数（startup、shutdown_update、shutdown_insert、other）、
+              バッチ数、最後に取り込んだ event_seq、削除したイベント数、所要時間（ミリ秒）
+    """
+    started = time.perf_counter()
+    result = {'events': 0, 'startup': 0, 'shutdown_update': 0, 'shutdown_insert': 0, 'other': 0, 'batches': 0,
+              'last_seq': 0, 'pruned': 0}
+    conn = sqlite3.connect(db_path, timeout=timeout, isolation_level=None)
+    try:
+        version = get_schema_version(conn)
+        if version < EVENT_LOG_SCHEMA_VERSION:
+            raise RuntimeError(f"Database schema version {version} has no session_events table; "
+                               f"run init_db.py to migrate to version {EVENT_LOG_SCHEMA_VERSION} or later.")
+        compact = version >= COMPACT_SCHEMA_VERSION
+        pointer = version >= OPEN_SESSIONS_SCHEMA_VERSION
+        while True:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # 取り込み位置は書き込みロックの取得後に読み、同時に実行された場合も二重に反映しない
+                last_seq = get_last_seq(conn)
+                rows = conn.execute(_SELECT_EVENTS_QUERY, (last_seq, batch_size)).fetchall()
+                if not rows:
+                    conn.execute("COMMIT")
+                    result['last_seq'] = last_seq
+                    break
+                events = [_to_event(row) for row in rows if row[2] in PAIRED_KINDS]
+                results = apply_events_to_sessions(conn.cursor(), events, compact, pointer)
+                last_seq = rows[-1][0]
+                conn.execute("""
+                    INSERT INTO event_pairing_state (name, value) VALUES ('last_event_seq', ?)
+                    ON CONFLICT (name) DO UPDATE SET value = excluded.value
+                """, (last_seq,))
+                conn.execute("COMMIT")
+            except sqlite3.Error:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                raise
+            for value in results.values():
+                if isinstance(value, dict):
+                    result['shutdown_' + value['action']] += 1
+                else:
+                    result['startup'] += 1
+            result['events'] += len(rows)
+            result['other'] += len(rows) - len(events)
+            result['batches'] += 1
+            result['last_seq'] = last_seq
+            if len(rows) < batch_size:
+                break
+            time.sleep(pause)
+
+        if keep_days:
+            now = datetime.datetime.now()
+            params = (result['last_seq'], (now - datetime.timedelta(days=keep_days)).strftime("%Y-%m-%d %H:%M:%S"))
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # 削除するイベントの event_id を spool_events に残し、スプールから再送されても再び追記させない
+                conn.execute(f"""
+                    INSERT OR IGNORE INTO spool_events (event_id, kind, applied_at)
+                    SELECT event_id, kind, ? FROM session_events WHERE {_PRUNE_CONDITION}
+                """, (now.strftime("%Y-%m-%d %H:%M:%S"),) + params)
+                result['pruned'] = conn.execute(f"DELETE FROM session_events WHERE {_PRUNE_CONDITION}",
+                                                params).rowcount
+                conn.execute("COMMIT")
+            except sqlite3.Error:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                raise
+    finally:
+        conn.close()
+    result['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    logging.info("Paired %d event(s) in %d batch(es) up to event_seq %d (startup=%d, shutdown_update=%d, "
+                 "shutdown_insert=%d, other=%d, pruned=%d) in %.1f ms.", result['events'], result['batches'],
+                 result['last_seq'], result['startup'], result['shutdown_update'], result['shutdown_insert'],
+                 result['other'], result['pruned'], result['elapsed_ms'])
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="PCActivityTracker イベントログからのセッションの作成")
+    parser.add_argument("db_path", help="中央SQLiteデータベースファイルのパス")
+    parser.add_argument("--batch-size", type=int, default=2000, help="1トランザクションで反映する最大イベント数")
+    parser.add_argument("--pause", type=float, default=0.05, help="バッチ間の待機時間（秒）")
+    parser.add_argument("--keep-days", type=float, default=0,
+                        help="取り込み済みのイベントを残す日数（より古いものを削除する。0 で削除しない）")
+    parser.add_argument("--timeout", type=float, default=5.0, help="SQLite接続時のタイムアウト秒数")
+    parser.add_argument("--json", action="store_true", help="結果を JSON で出力する")
+    args = parser.parse_args(argv)
+    try:
+        result = pair_events(args.db_path, args.batch_size, args.pause, args.keep_days, args.timeout)
+    except RuntimeError as e:
+        parser.error(str(e))
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+"""
+reconcile.py - 未終了のまま残ったセッション（孤立セッション）をまとめて終了させるスクリプト
+
+電源断、ハングアップ、シャットダウン記録の失敗、同じPCでの重複ログオンにより、session_logs には
+未終了のセッション（shutdown_time が NULL または空）が残ります。従来はシャットダウンの記録時に
+そのPC・ユーザーの分だけが副次的に修正されていました。本スクリプトは全PCの孤立セッションを
+集合演算でまとめて検出し、一括の UPDATE で終了させます。
+
+孤立セッションの判定と終了時刻:
+  ・同じPC（--partition pc-user の場合は同じPC・ユーザー）に、より後に開始したセッションがある未終了セッション
+  ・次のセッションの開始時刻はウィンドウ関数 LEAD(start) OVER (PARTITION BY pc ORDER BY start) で求める
+  ・ハートビート（session_heartbeats、スキーマバージョン7以上）がある場合は最終確認時刻で終了させる
+    （次のセッションの開始時刻を上限とする）。session_type は "heartbeat"
+  ・ハートビートがない場合は次のセッションの開始時刻（--without-heartbeat start の場合は開始時刻 = 利用時間0）で
+    終了させる。session_type は "orphan"
+  ・--stale-hours を指定した場合、次のセッションがなくても、最終確認時刻が指定時間より古いセッションを終了させる
+
+処理はPCの範囲ごとのバッチに分け、バッチごとに1つの BEGIN IMMEDIATE トランザクションで
+検出（未終了セッションの部分インデックスと (pc, start) のインデックスを使用）と UPDATE を行います。
+バッチの間に pause 秒待機し、クライアントの書き込みが長く待たされないようにします。
+
+使い方:
+    python reconcile.py <db_path> [--batch-pcs 200] [--pause 0.1] [--partition pc|pc-user]
+    python reconcile.py <db_path> --stale-hours 48 --dry-run
+"""
+
+import argparse
+import json
+import logging
+import sqlite3
+import sys
+import time
+
+from init_db import get_schema_version
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+
+# session_logs がコンパクト形式 (sessions) の互換ビューになるバージョン
+COMPACT_SCHEMA_VERSION = 5
+
+# session_heartbeats を作成する移行のバージョン
+HEARTBEAT_SCHEMA_VERSION = 7
+
+PARTITIONS = ("pc", "pc-user")
+FALLBACKS = ("next-start", "start")
+
+
+def _source(compact, partition):
+    """
+    スキーマの形式に応じた、テーブル名・列名・式（SQL の断片）を返す。
+    コンパクト形式は sessions（時刻は UNIX 秒）、従来の形式は session_logs テーブル（時刻は文字列）を直接扱う。
+    """
+    if compact:
+        src = {
+            'table': "sessions",
+            'pc': "pc_key",
+            'user': "user_key",
+            'start': "start_ts",
+            'shutdown': "shutdown_ts",
+            'open': "shutdown_ts IS NULL",
+            'duration': "MAX(0, b.close_at - sessions.start_ts)",
+        }
+    else:
+        src = {
+            'table': "session_logs",
+            'pc': "pc_id",
+            'user': "user_account",
+            'start': "start_time",
+            'shutdown': "shutdown_time",
+            'open': "(shutdown_time IS NULL OR shutdown_time = '')",
+            'duration': ("MAX(0, CAST(strftime('%s', b.close_at) AS INTEGER)"
+                         " - CAST(strftime('%s', session_logs.start_time) AS INTEGER))"),
+        }
+    src['partition'] = [src['pc'], src['user']] if partition == "pc-user" else [src['pc']]
+    return src
+
+
+def _candidates_query(src, heartbeats, fallback):
+    """
+    PCの範囲 (:lo〜:hi) の孤立セッションと終了時刻を一時テーブル reconcile_batch に入れる INSERT 文を返す。
+    各PCの最も古い未終了セッション以降の行だけを (pc, start) のインデックスで読み、LEAD で次の開始時刻を求める。
+    """
+    last_seen = "h.last_seen_ts" if heartbeats else "NULL"
+    join = "LEFT JOIN session_heartbeats AS h ON h.session_id = o.session_id" if heartbeats else ""
+    without = "o.next_start" if fallback == "next-start" else "o.start"
+    return f"""
+        INSERT INTO temp.reconcile_batch (session_id, close_at, kind, stale)
+        WITH open_pcs AS (
+            SELECT {src['pc']} AS pc, MIN({src['start']}) AS first_open FROM {src['table']}
+            WHERE {src['open']} AND {src['pc']} BETWEEN :lo AND :hi
+            GROUP BY {src['pc']}
+        ), ordered AS (
+            SELECT s.session_id, s.{src['start']} AS start, s.{src['shutdown']} AS shutdown,
+                   LEAD(s.{src['start']}) OVER (
+                       PARTITION BY {", ".join("s." + column for column in src['partition'])}
+                       ORDER BY s.{src['start']}, s.session_id) AS next_start
+            FROM open_pcs AS p
+            JOIN {src['table']} AS s ON s.{src['pc']} = p.pc AND s.{src['start']} >= p.first_open
+        )
+        SELECT o.session_id,
+               CASE WHEN {last_seen} IS NULL THEN {without}
+                    ELSE MAX(o.start, MIN({last_seen}, COALESCE(o.next_start, {last_seen}))) END,
+               CASE WHEN {last_seen} IS NULL THEN 'orphan' ELSE 'heartbeat' END,
+               o.next_start IS NULL
+        FROM ordered AS o {join}
+        WHERE (o.shutdown IS NULL OR o.shutdown = '')
+          AND (o.next_start IS NOT NULL OR {last_seen} < :stale_before)
+    """
+
+
+def _next_range(conn, src, after, batch_pcs):
+    """未終了セッションがあるPCを、after より後から batch_pcs 件取り、(lo, hi) を返す（なければ None）。"""
+    rows = conn.execute(f"""
+        SELECT {src['pc']} FROM {src['table']}
+        WHERE {src['open']} AND {src['pc']} > ?
+        GROUP BY {src['pc']} ORDER BY {src['pc']} LIMIT ?
+    """, (after, batch_pcs)).fetchall()
+    if not rows:
+        return None
+    return rows[0][0], rows[-1][0]
+
+
+def reconcile_sessions(db_path, batch_pcs=200, pause=0.1, partition="pc", fallback="next-start", stale_hours=0,
+                       dry_run=False, timeout=5.0):
+    """
+    全PCの孤立セッションを検出し、PCの範囲ごとのバッチで終了させる。
+
+    Parameters:
+        db_path (str): 中央データベースファイルのパス
+        batch_pcs (int): 1バッチ（1トランザクション）で処理するPCの数
+        pause (float): バッチ間の待機時間（秒）。クライアントの書き込みにロックを譲る
+        partition (str): "pc"（同じPCの後のセッションで判定）または "pc-user"（同じPC・ユーザーで判定）
+        fallback (str): ハートビートがない場合の終了時刻（"next-start" または "start"）
+        stale_hours (float): 0 より大きい場合、最終確認時刻がこの時間より古い最後のセッションも終了させる
+        dry_run (bool): True の場合は件数だけを数え、変更はロールバックする
+        timeout (float): SQLite接続時のタイムアウト秒数
+
+    Raises:
+        ValueError: partition または fallback が不正な場合
+
+    Returns:
+        dict: batches、closed（終了させた件数）、heartbeat / orphan（終了時刻の決め方ごとの件数）、
+              stale（次のセッションがなく最終確認時刻で終了させた件数）、max_batch_ms、elapsed（秒）
+    """
+    if partition not in PARTITIONS:
+        raise ValueError(f"Unknown partition {partition!r}; choose from {', '.join(PARTITIONS)}.")
+    if fallback not in FALLBACKS:
+        raise ValueError(f"Unknown fallback {fallback!r}; choose from {', '.join(FALLBACKS)}.")
+    started = time.perf_counter()
+    result = {'batches': 0, 'closed': 0, 'heartbeat': 0, 'orphan': 0, 'stale': 0, 'max_batch_ms': 0.0}
+
+    conn = sqlite3.connect(db_path, timeout=timeout, isolation_level=None)
+    try:
+        version = get_schema_version(conn)
+        compact = version >= COMPACT_SCHEMA_VERSION
+        heartbeats = version >= HEARTBEAT_SCHEMA_VERSION
+        if stale_hours and not heartbeats:
+            logging.warning("Schema version %d has no heartbeats; --stale-hours is ignored.", version)
+        src = _source(compact, partition)
+        insert_candidates = _candidates_query(src, heartbeats, fallback)
+        stale_before = int(time.time() - stale_hours * 3600) if stale_hours and heartbeats else None
+        conn.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS reconcile_batch (
+                session_id INTEGER PRIMARY KEY,
+                close_at NOT NULL,
+                kind TEXT NOT NULL,
+                stale INTEGER NOT NULL
+            )
+        """)
+
+        after = 0 if compact else ""
+        while True:
+            batch_started = time.perf_counter()
+            # 検出から更新までを1つのトランザクションで行い、検出後にクライアントが記録したシャットダウンを上書きしない
+            conn.execute("BEGIN" if dry_run else "BEGIN IMMEDIATE")
+            try:
+                bounds = _next_range(conn, src, after, batch_pcs)
+                if bounds is None:
+                    conn.execute("ROLLBACK")
+                    break
+                conn.execute("DELETE FROM temp.reconcile_batch")
+                conn.execute(insert_candidates, {'lo': bounds[0], 'hi': bounds[1], 'stale_before': stale_before})
+                counts = dict(conn.execute("SELECT kind, COUNT(*) FROM temp.reconcile_batch GROUP BY kind"))
+                stale = conn.execute("SELECT COUNT(*) FROM temp.reconcile_batch WHERE stale").fetchone()[0]
+                cursor = conn.execute(f"""
+                    UPDATE {src['table']} SET ({src['shutdown']}, duration, session_type) = (
+                        SELECT b.close_at, {src['duration']}, b.kind
+                        FROM temp.reconcile_batch AS b WHERE b.session_id = {src['table']}.session_id)
+                    WHERE session_id IN (SELECT session_id FROM temp.reconcile_batch) AND {src['open']}
+                """)
+                closed = cursor.rowcount
+                conn.execute("ROLLBACK" if dry_run else "COMMIT")
+            except Exception:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                raise
+            batch_ms = (time.perf_counter() - batch_started) * 1000
+
+            result['batches'] += 1
+            result['closed'] += closed
+            result['heartbeat'] += counts.get('heartbeat', 0)
+            result['orphan'] += counts.get('orphan', 0)
+            result['stale'] += stale
+            result['max_batch_ms'] = round(max(result['max_batch_ms'], batch_ms), 3)
+            logging.info("Batch %d (pc %s..%s): %d session(s) %s in %.1f ms.", result['batches'], bounds[0],
+                         bounds[1], closed, "would be closed" if dry_run else "closed", batch_ms)
+            after = bounds[1]
+            if pause:
+                time.sleep(pause)
+    finally:
+        conn.close()
+
+    result['elapsed'] = round(time.perf_counter() - started, 3)
+    logging.info("%s %d orphaned session(s) (%d at last heartbeat, %d without heartbeat, %d stale) "
+                 "in %d batch(es) (%.3f seconds).", "Would close" if dry_run else "Closed", result['closed'],
+                 result['heartbeat'], result['orphan'], result['stale'], result['batches'], result['elapsed'])
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="PCActivityTracker 孤立セッションの一括終了")
+    parser.add_argument("db_path", help="中央SQLiteデータベースファイルのパス")
+    parser.add_argument("--batch-pcs", type=int, default=200, help="1トランザクションで処理するPCの数")
+    parser.add_argument("--pause", type=float, default=0.1, help="バッチ間の待機時間（秒）")
+    parser.add_argument("--partition", choices=PARTITIONS, default="pc",
+                        help="後のセッションを探す範囲（pc: 同じPC、pc-user: 同じPC・ユーザー）")
+    parser.add_argument("--without-heartbeat", dest="fallback", choices=FALLBACKS, default="next-start",
+                        help="ハートビートがない場合の終了時刻（next-start: 次のセッションの開始時刻、start: 利用時間0）")
+    parser.add_argument("--stale-hours", type=float, default=0,
+                        help="最終確認時刻がこの時間より古い最後のセッションも終了させる（0 で無効）")
+    parser.add_argument("--dry-run", action="store_true", help="件数だけを表示し、変更しない")
+    parser.add_argument("--timeout", type=float, default=5.0, help="SQLite接続時のタイムアウト秒数")
+    parser.add_argument("--json", action="store_true", help="結果を JSON で出力する")
+    args = parser.parse_args(argv)
+    result = reconcile_sessions(args.db_path, args.batch_pcs, args.pause, args.partition, args.fallback,
+                                args.stale_hours, args.dry_run, args.timeout)
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
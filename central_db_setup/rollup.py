@@ -0,0 +1,350 @@
+#!/usr/bin/env python
+"""
+rollup.py - 日別の利用集計テーブル (daily_usage) の増分更新と参照を行うスクリプト
+
+PC別・ユーザー別の当日の利用時間などを session_logs から毎回集計すると、履歴全体を読む間
+共有ロックを保持し続けるため、クライアントの書き込みを遅らせます。本スクリプトは
+日 × PC × ユーザー（× 曜日）ごとの合計利用時間、セッション数、最初／最後の記録時刻を
+daily_usage テーブルに保持し、参照はこのテーブルだけで完結させます。
+
+更新は増分で行います。
+  ・rollup_state の last_session_id（最後に反映した session_id）より新しい行だけを読み、集計に加算する
+  ・その時点で未終了のセッションは rollup_pending に記録し、セッション数と開始時刻のみを加算する
+  ・次回以降の更新で rollup_pending のセッションが終了していれば、利用時間と最終時刻を加算して削除する
+いずれも session_id（主キー）による検索のみで、履歴の件数に関係なく更新・参照の時間は一定です。
+日付はセッションの開始日 (start_time の日付) に計上します（日をまたぐセッションも開始日に計上）。
+
+提供する機能:
+  ・refresh_rollups: 新規・終了したセッションを daily_usage に反映する（1つの BEGIN IMMEDIATE トランザクション）
+  ・rebuild_rollups: 集計を削除し、session_logs 全体から作り直す（終了済みセッションを修正した場合など）
+  ・query_usage: daily_usage から期間・PC・ユーザーを指定して集計結果を取得する
+  ・query_usage_on_connection: query_usage の本体（既に開いている接続で実行する。usage_api.py と共通）
+
+使い方:
+    python rollup.py <db_path> refresh
+    python rollup.py <db_path> rebuild
+    python rollup.py <db_path> query --from 2026-10-01 --to 2026-10-18 --by user
+    python rollup.py <db_path> query --pc PC001 --by day --json
+"""
+
+import argparse
+import json
+import logging
+import sqlite3
+import sys
+import time
+
+from init_db import get_schema_version
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+
+# daily_usage を作成する移行のバージョン（init_db.py の MIGRATIONS）
+ROLLUP_SCHEMA_VERSION = 3
+
+# session_logs がコンパクト形式 (sessions) の互換ビューになるバージョン
+COMPACT_SCHEMA_VERSION = 5
+
+# 終了済みセッションの判定（未終了は shutdown_time が NULL または空文字）
+CLOSED = "(s.shutdown_time IS NOT NULL AND s.shutdown_time != '')"
+
+# 曜日は日付から算出し、クライアントのロケールに依存しない表記 ("Mon" など) にする
+WEEKDAY = "substr('SunMonTueWedThuFriSat', 1 + 3 * CAST(strftime('%w', date(s.start_time)) AS INTEGER), 3)"
+
+# 集計結果を daily_usage に加算する UPSERT の共通部分
+_UPSERT = f"""
+    INSERT INTO daily_usage
+        (day, pc_id, user_account, weekday, total_duration, session_count, first_seen, last_seen)
+    SELECT date(s.start_time), s.pc_id, s.user_account, {WEEKDAY},
+           {{duration}}, {{count}}, MIN(s.start_time), {{last_seen}}
+    FROM {{source}}
+    WHERE {{where}}
+    GROUP BY date(s.start_time), s.pc_id, s.user_account
+    ON CONFLICT (day, pc_id, user_account) DO UPDATE SET
+        total_duration = total_duration + excluded.total_duration,
+        session_count = session_count + excluded.session_count,
+        first_seen = min(first_seen, excluded.first_seen),
+        last_seen = max(last_seen, excluded.last_seen)
+"""
+
+# 新規セッション: 件数を加算し、終了済みのものは利用時間も加算する
+_ADD_NEW_SESSIONS = _UPSERT.format(
+    duration=f"SUM(CASE WHEN {CLOSED} THEN COALESCE(s.duration, 0) ELSE 0 END)",
+    count="COUNT(*)",
+    last_seen=f"MAX(CASE WHEN {CLOSED} THEN s.shutdown_time ELSE s.start_time END)",
+    source="session_logs AS s",
+    where="s.session_id > :low AND s.session_id <= :high",
+)
+
+# 前回まで未終了だったセッションのうち終了したもの: 件数は加算済みのため利用時間と最終時刻のみ加算する
+_ADD_CLOSED_PENDING = _UPSERT.format(
+    duration="SUM(COALESCE(s.duration, 0))",
+    count="0",
+    last_seen="MAX(s.shutdown_time)",
+    source="rollup_pending AS p JOIN session_logs AS s ON s.session_id = p.session_id",
+    where=CLOSED,
+)
+
+
+def _require_schema(conn):
+    version = get_schema_version(conn)
+    if version < ROLLUP_SCHEMA_VERSION:
+        raise RuntimeError(f"Database schema version {version} has no rollup tables; "
+                           f"run init_db.py to migrate to version {ROLLUP_SCHEMA_VERSION} or later.")
+
+
+def _get_state(conn, name):
+    row = conn.execute("SELECT value FROM rollup_state WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else 0
+
+
+def _set_state(conn, name, value):
+    conn.execute("""
+        INSERT INTO rollup_state (name, value) VALUES (?, ?)
+        ON CONFLICT (name) DO UPDATE SET value = excluded.value
+    """, (name, value))
+
+
+def refresh_on_connection(conn):
+    """
+    新規・終了したセッションを daily_usage に反映する（呼び出し側でトランザクションを管理する）。
+
+    Parameters:
+        conn (sqlite3.Connection): isolation_level=None で開き、BEGIN IMMEDIATE 済みの接続
+
+    Returns:
+        dict: low / high（反映した session_id の範囲）、new_sessions、closed_sessions、pending
+    """
+    low = _get_state(conn, 'last_session_id')
+    # 互換ビューに対する MAX() は全件の結合になるため、コンパクト形式では sessions の主キーから直接求める
+    table = "sessions" if get_schema_version(conn) >= COMPACT_SCHEMA_VERSION else "session_logs"
+    high = conn.execute(f"SELECT COALESCE(MAX(session_id), 0) FROM {table}").fetchone()[0]
+
+    # 1. 前回未終了だったセッションのうち、終了したものの利用時間を加算する
+    closed = conn.execute(f"""
+        SELECT COUNT(*) FROM rollup_pending AS p JOIN session_logs AS s ON s.session_id = p.session_id
+        WHERE {CLOSED}
+    """).fetchone()[0]
+    if closed:
+        conn.execute(_ADD_CLOSED_PENDING)
+    # 終了したもの、および削除された（アーカイブ・整理された）セッションを未終了の一覧から外す
+    conn.execute(f"""
+        DELETE FROM rollup_pending WHERE session_id NOT IN (
+            SELECT s.session_id FROM rollup_pending AS p JOIN session_logs AS s ON s.session_id = p.session_id
+            WHERE NOT {CLOSED}
+        )
+    """)
+
+    # 2. 新規セッションを加算し、未終了のものを記録する
+    new_sessions = 0
+    if high > low:
+        params = {'low': low, 'high': high}
+        new_sessions = conn.execute(
+            "SELECT COUNT(*) FROM session_logs WHERE session_id > :low AND session_id <= :high", params
+        ).fetchone()[0]
+        conn.execute(_ADD_NEW_SESSIONS, params)
+        conn.execute(f"""
+            INSERT OR IGNORE INTO rollup_pending (session_id)
+            SELECT s.session_id FROM session_logs AS s
+            WHERE s.session_id > :low AND s.session_id <= :high AND NOT {CLOSED}
+        """, params)
+        _set_state(conn, 'last_session_id', high)
+
+    pending = conn.execute("SELECT COUNT(*) FROM rollup_pending").fetchone()[0]
+    return {'low': low, 'high': max(low, high), 'new_sessions': new_sessions,
+            'closed_sessions': closed, 'pending': pending}
+
+
+def refresh_rollups(db_path, timeout=5.0):
+    """
+    daily_usage を増分更新する。1つの BEGIN IMMEDIATE トランザクションで実行するため、
+    クライアントの書き込みと競合してもロック待ちの後に一貫した状態で反映される。
+
+    Parameters:
+        db_path (str): 中央データベースファイルのパス
+        timeout (float): SQLite接続時のタイムアウト秒数
+
+    Raises:
+        RuntimeError: スキーマに集計テーブルがない場合
+        sqlite3.Error: 更新に失敗した場合（ロールバックされる）
+
+    Returns:
+        dict: refresh_on_connection の結果に elapsed_ms を加えたもの
+    """
+    started = time.perf_counter()
+    conn = sqlite3.connect(db_path, timeout=timeout, isolation_level=None)
+    try:
+        _require_schema(conn)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = refresh_on_connection(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+    result['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 3)
+    logging.info("Rollup refreshed: sessions %d..%d (%d new, %d closed, %d still open) in %.1f ms.",
+                 result['low'], result['high'], result['new_sessions'], result['closed_sessions'],
+                 result['pending'], result['elapsed_ms'])
+    return result
+
+
+def rebuild_rollups(db_path, timeout=5.0):
+    """
+    集計テーブルと進捗を削除し、session_logs 全体から作り直す。
+    終了済みセッションの利用時間を後から修正した場合など、増分更新では反映されない変更を取り込むために使用する。
+
+    Parameters:
+        db_path (str): 中央データベースファイルのパス
+        timeout (float): SQLite接続時のタイムアウト秒数
+
+    Returns:
+        dict: refresh_rollups と同じ形式の結果
+    """
+    started = time.perf_counter()
+    conn = sqlite3.connect(db_path, timeout=timeout, isolation_level=None)
+    try:
+        _require_schema(conn)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM daily_usage")
+            conn.execute("DELETE FROM rollup_pending")
+            conn.execute("DELETE FROM rollup_state WHERE name = 'last_session_id'")
+            result = refresh_on_connection(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+    result['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 3)
+    logging.info("Rollup rebuilt from %d session(s) in %.1f ms.", result['new_sessions'], result['elapsed_ms'])
+    return result
+
+
+# query_usage の集計単位と GROUP BY に使う列
+GROUP_BY = {
+    'day': ("day", "weekday"),
+    'pc': ("pc_id",),
+    'user': ("user_account",),
+    'pc-user': ("pc_id", "user_account"),
+    'day-pc': ("day", "weekday", "pc_id"),
+    'day-user': ("day", "weekday", "user_account"),
+    'detail': ("day", "weekday", "pc_id", "user_account"),
+    'weekday': ("weekday",),
+}
+
+# 集計単位の列の順以外で並べる場合の ORDER BY（曜日は月曜日から順に並べる）
+ORDER_BY = {
+    'weekday': "(CAST(strftime('%w', MIN(day)) AS INTEGER) + 6) % 7",
+}
+
+
+def query_usage(db_path, date_from=None, date_to=None, pc_id=None, user_account=None, by='detail', timeout=5.0):
+    """
+    daily_usage から利用集計を取得する（session_logs は読まない）。
+
+    Parameters:
+        db_path (str): 中央データベースファイルのパス
+        date_from (str or None): 集計開始日（YYYY-MM-DD、この日を含む）
+        date_to (str or None): 集計終了日（YYYY-MM-DD、この日を含む）
+        pc_id (str or None): PCで絞り込む場合に指定
+        user_account (str or None): ユーザーで絞り込む場合に指定
+        by (str): 集計単位（GROUP_BY のキー）
+        timeout (float): SQLite接続時のタイムアウト秒数
+
+    Raises:
+        ValueError: by が不正な場合
+
+    Returns:
+        list: 集計単位の列と total_duration, session_count, first_seen, last_seen を持つ dict のリスト
+    """
+    conn = sqlite3.connect(db_path, timeout=timeout)
+    try:
+        return query_usage_on_connection(conn, date_from, date_to, pc_id, user_account, by)
+    finally:
+        conn.close()
+
+
+def query_usage_on_connection(conn, date_from=None, date_to=None, pc_id=None, user_account=None, by='detail'):
+    """
+    既に開いている接続（読み取り専用でもよい）で daily_usage から利用集計を取得する。
+    引数と戻り値は query_usage と同じ。
+
+    Raises:
+        ValueError: by が不正な場合
+        RuntimeError: スキーマバージョンが daily_usage に対応していない場合
+    """
+    if by not in GROUP_BY:
+        raise ValueError(f"Unknown grouping {by!r}; choose from {', '.join(GROUP_BY)}.")
+    conditions, params = [], []
+    for column, op, value in (("day", ">=", date_from), ("day", "<=", date_to),
+                              ("pc_id", "=", pc_id), ("user_account", "=", user_account)):
+        if value is not None:
+            conditions.append(f"{column} {op} ?")
+            params.append(value)
+    columns = ", ".join(GROUP_BY[by])
+    query = f"""
+        SELECT {columns}, SUM(total_duration) AS total_duration, SUM(session_count) AS session_count,
+               MIN(first_seen) AS first_seen, MAX(last_seen) AS last_seen
+        FROM daily_usage
+        {"WHERE " + " AND ".join(conditions) if conditions else ""}
+        GROUP BY {columns}
+        ORDER BY {ORDER_BY.get(by, columns)}
+    """
+    _require_schema(conn)
+    cursor = conn.execute(query, params)
+    names = [column[0] for column in cursor.description]
+    return [dict(zip(names, row)) for row in cursor]
+
+
+def _print_table(rows):
+    if not rows:
+        print("(no rows)")
+        return
+    headers = list(rows[0].keys())
+    widths = [max(len(h), *(len(str(r[h])) for r in rows)) for h in headers]
+    print("  ".join(h.ljust(w) for h, w in zip(headers, widths)))
+    print("  ".join("-" * w for w in widths))
+    for r in rows:
+        print("  ".join(str(r[h]).ljust(w) for h, w in zip(headers, widths)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="PCActivityTracker 日別利用集計の更新・参照")
+    parser.add_argument("db_path", help="中央SQLiteデータベースファイルのパス")
+    parser.add_argument("--timeout", type=float, default=5.0, help="SQLite接続時のタイムアウト秒数")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("refresh", help="新規・終了したセッションを集計に反映する")
+    sub.add_parser("rebuild", help="集計を session_logs 全体から作り直す")
+    q = sub.add_parser("query", help="集計結果を表示する")
+    q.add_argument("--from", dest="date_from", help="集計開始日（YYYY-MM-DD）")
+    q.add_argument("--to", dest="date_to", help="集計終了日（YYYY-MM-DD）")
+    q.add_argument("--pc", dest="pc_id", help="PCで絞り込む")
+    q.add_argument("--user", dest="user_account", help="ユーザーで絞り込む")
+    q.add_argument("--by", choices=list(GROUP_BY), default="detail", help="集計単位")
+    q.add_argument("--no-refresh", dest="refresh", action="store_false", help="参照前に増分更新を行わない")
+    q.add_argument("--json", action="store_true", help="JSON で出力する")
+    args = parser.parse_args(argv)
+
+    if args.command == "refresh":
+        refresh_rollups(args.db_path, args.timeout)
+    elif args.command == "rebuild":
+        rebuild_rollups(args.db_path, args.timeout)
+    else:
+        if args.refresh:
+            refresh_rollups(args.db_path, args.timeout)
+        started = time.perf_counter()
+        rows = query_usage(args.db_path, args.date_from, args.date_to, args.pc_id, args.user_account,
+                           args.by, args.timeout)
+        logging.info("Query returned %d row(s) in %.1f ms.", len(rows), (time.perf_counter() - started) * 1000)
+        if args.json:
+            print(json.dumps(rows, ensure_ascii=False, indent=2))
+        else:
+            _print_table(rows)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+"""
+shard_merge.py - PCごとのシャードファイルを中央データベースの session_logs へ増分で取り込むスクリプト
+
+config.ini の [Transport] mode = shard の場合、各PCは中央DBではなく shard_dir 内の
+"<pc_id>.sqlite3"（このPC専用のファイル）へ書き込むため、PC同士で書き込みロックが競合しません。
+シャードでは行の追加・更新のたびにトリガーが shard_changes へ連番 (seq) を記録します。
+
+本スクリプトはシャードごとに前回取り込んだ連番 (shard_state.last_seq) より後の変更だけを読み、
+中央DBに反映します。
+  ・シャードの読み込みはワーカースレッドで並行に行う（各シャードは1つの読み取りトランザクションで一貫した状態を読む）
+  ・中央DBへの反映は batch_size 行ごとに1つの BEGIN IMMEDIATE トランザクションで行い、
+    新規行は executemany でまとめて挿入、取り込み済みの行（shard_sessions で対応を管理）はまとめて更新する
+  ・取り込み位置 (last_seq) は反映と同じトランザクションで更新するため、途中で中断しても再実行で重複・欠落しない
+  ・シャードが書き込み中でロックされている、または壊れている場合はそのシャードだけを次回に回す
+  ・シャードが削除・再作成された場合（shard_info の uid が変わった場合）は、連番を最初から読み直す
+
+使い方:
+    python shard_merge.py <db_path> [--shard-dir DIR] [--workers 8] [--batch-size 2000]
+"""
+
+import argparse
+import datetime
+import glob
+import logging
+import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from init_db import get_schema_version
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+
+# shard_state / shard_sessions を作成する移行のバージョン
+SHARD_SCHEMA_VERSION = 6
+
+# session_logs がコンパクト形式 (sessions) の互換ビューになるバージョン
+COMPACT_SCHEMA_VERSION = 5
+
+COLUMNS = ("pc_id", "user_account", "start_time", "shutdown_time", "duration", "session_type", "weekday")
+
+# SQLite のパラメータ数上限を考慮した IN 句の分割サイズ
+IN_CHUNK = 500
+
+
+class ShardChanges:
+    """
+    1つのシャードから読み込んだ変更。
+
+    Attributes:
+        shard (str): シャード名（ファイル名から拡張子を除いたもの = pc_id）
+        uid (str): シャード作成時の識別子
+        last_seq (int): 読み込んだ変更の最大連番
+        reset (bool): シャードが再作成されたため、対応表を破棄して最初から取り込む場合は True
+        rows (list): (shard_session_id, pc_id, user_account, start_time, shutdown_time, duration,
+                     session_type, weekday) のリスト
+    """
+
+    def __init__(self, shard, uid, last_seq, reset, rows):
+        self.shard = shard
+        self.uid = uid
+        self.last_seq = last_seq
+        self.reset = reset
+        self.rows = rows
+
+
+def list_shards(shard_dir):
+    """
+    シャードフォルダー内のシャードファイルを返す。
+
+    Returns:
+        list: (shard, path) のリスト（シャード名順）
+    """
+    shards = []
+    for path in glob.glob(os.path.join(shard_dir, "*.sqlite3")):
+        shards.append((os.path.splitext(os.path.basename(path))[0], path))
+    return sorted(shards)
+
+
+def read_shard(shard, path, state, timeout):
+    """
+    シャードから、前回取り込んだ連番より後に追加・更新された行を読み込む（ワーカースレッドで実行）。
+
+    Parameters:
+        shard (str): シャード名
+        path (str): シャードファイルのパス
+        state (tuple or None): 中央DBに記録された (shard_uid, last_seq)。初回は None
+        timeout (float): SQLite接続時のタイムアウト秒数
+
+    Returns:
+        ShardChanges or None: 変更がない場合は None
+    """
+    conn = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+    try:
+        # 連番の上限と行を同じ読み取りトランザクションで読み、クライアントの書き込み途中の状態を読まないようにする
+        conn.execute("BEGIN")
+        uid = conn.execute("SELECT value FROM shard_info WHERE name = 'uid'").fetchone()[0]
+        max_seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM shard_changes").fetchone()[0]
+        reset = state is not None and state[0] != uid
+        since = 0 if state is None or reset else state[1]
+        if max_seq <= since and not reset:
+            return None
+        rows = conn.execute(f"""
+            SELECT session_id, {", ".join(COLUMNS)} FROM session_logs
+            WHERE session_id IN (SELECT session_id FROM shard_changes WHERE seq > ? AND seq <= ?)
+            ORDER BY session_id
+        """, (since, max_seq)).fetchall()
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+    if reset:
+        logging.warning("Shard %s was recreated; re-reading it from the beginning.", shard)
+    return ShardChanges(shard, uid, max_seq, reset, rows)
+
+
+def _next_session_id(conn, compact):
+    """中央DBの次の session_id（AUTOINCREMENT の連番 sqlite_sequence から求める）"""
+    table = "sessions" if compact else "session_logs"
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,)).fetchone()
+    high = conn.execute(f"SELECT COALESCE(MAX(session_id), 0) FROM {table}").fetchone()[0]
+    return max(row[0] if row else 0, high) + 1
+
+
+def write_changes(conn, changes):
+    """
+    複数のシャードの変更を中央DBへ1つのトランザクションで反映し、取り込み位置を更新する。
+
+    Parameters:
+        conn (sqlite3.Connection): isolation_level=None で開いた中央DBの接続
+        changes (list): ShardChanges のリスト
+
+    Returns:
+        tuple: (挿入した行数, 更新した行数)
+    """
+    inserted = updated = 0
+    merged_at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        compact = get_schema_version(conn) >= COMPACT_SCHEMA_VERSION
+        next_id = _next_session_id(conn, compact)
+        for change in changes:
+            if change.reset:
+                conn.execute("DELETE FROM shard_sessions WHERE shard = ?", (change.shard,))
+            mapping = {}
+            ids = [row[0] for row in change.rows]
+            for i in range(0, len(ids), IN_CHUNK):
+                chunk = ids[i:i + IN_CHUNK]
+                mapping.update(conn.execute(
+                    "SELECT shard_session_id, session_id FROM shard_sessions "
+                    "WHERE shard = ? AND shard_session_id IN (%s)" % ",".join("?" * len(chunk)),
+                    [change.shard] + chunk).fetchall())
+
+            updates = [row[1:] + (mapping[row[0]],) for row in change.rows if row[0] in mapping]
+            inserts, links = [], []
+            for row in change.rows:
+                if row[0] not in mapping:
+                    inserts.append((next_id,) + row[1:])
+                    links.append((change.shard, row[0], next_id))
+                    next_id += 1
+
+            if updates:
+                conn.executemany(
+                    "UPDATE session_logs SET %s WHERE session_id = ?" % ", ".join(f"{c} = ?" for c in COLUMNS),
+                    updates)
+            if inserts:
+                conn.executemany(
+                    "INSERT INTO session_logs (session_id, %s) VALUES (?, %s)"
+                    % (", ".join(COLUMNS), ", ".join("?" * len(COLUMNS))), inserts)
+                conn.executemany(
+                    "INSERT INTO shard_sessions (shard, shard_session_id, session_id) VALUES (?, ?, ?)", links)
+            conn.execute("""
+                INSERT INTO shard_state (shard, shard_uid, last_seq, merged_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT (shard) DO UPDATE SET
+                    shard_uid = excluded.shard_uid, last_seq = excluded.last_seq, merged_at = excluded.merged_at
+            """, (change.shard, change.uid, change.last_seq, merged_at))
+            inserted += len(inserts)
+            updated += len(updates)
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return inserted, updated
+
+
+def merge_shards(db_path, shard_dir=None, workers=8, batch_size=2000, timeout=5.0):
+    """
+    シャードフォルダー内の全シャードの変更を中央DBへ取り込む。
+
+    Parameters:
+        db_path (str): 中央データベースのパス
+        shard_dir (str or None): シャードフォルダー（None の場合は中央DBと同じフォルダーの "shards"）
+        workers (int): シャードを並行して読み込むスレッド数
+        batch_size (int): 1トランザクションで反映する最大行数の目安（シャード単位で区切る）
+        timeout (float): SQLite接続時のタイムアウト秒数
+
+    Raises:
+        RuntimeError: 中央DBのスキーマにシャード取り込み用のテーブルがない場合
+
+    Returns:
+        dict: shards（シャード数）、changed（変更があったシャード数）、inserted、updated、
+              skipped（読み込めなかったシャード名のリスト）、elapsed（秒）
+    """
+    shard_dir = shard_dir or os.path.join(os.path.dirname(os.path.abspath(db_path)), "shards")
+    started = time.perf_counter()
+    result = {'shards': 0, 'changed': 0, 'inserted': 0, 'updated': 0, 'skipped': []}
+
+    conn = sqlite3.connect(db_path, timeout=timeout, isolation_level=None)
+    try:
+        version = get_schema_version(conn)
+        if version < SHARD_SCHEMA_VERSION:
+            raise RuntimeError(f"Database schema version {version} has no shard tables; "
+                               f"run init_db.py to migrate to version {SHARD_SCHEMA_VERSION} or later.")
+        states = {shard: (uid, seq) for shard, uid, seq
+                  in conn.execute("SELECT shard, shard_uid, last_seq FROM shard_state")}
+        shards = list_shards(shard_dir)
+        result['shards'] = len(shards)
+
+        pending, pending_rows = [], 0
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="shard-reader") as executor:
+            futures = {executor.submit(read_shard, shard, path, states.get(shard), timeout): shard
+                       for shard, path in shards}
+            for future in as_completed(futures):
+                shard = futures[future]
+                try:
+                    change = future.result()
+                except sqlite3.Error as e:
+                    # 書き込み中のロックや壊れたファイルは次回に回す（取り込み位置は進めない）
+                    logging.warning("Skipping shard %s: %s", shard, e)
+                    result['skipped'].append(shard)
+                    continue
+                if change is None:
+                    continue
+                result['changed'] += 1
+                pending.append(change)
+                pending_rows += len(change.rows)
+                if pending_rows >= batch_size:
+                    inserted, updated = write_changes(conn, pending)
+                    result['inserted'] += inserted
+                    result['updated'] += updated
+                    pending, pending_rows = [], 0
+        if pending:
+            inserted, updated = write_changes(conn, pending)
+            result['inserted'] += inserted
+            result['updated'] += updated
+    finally:
+        conn.close()
+
+    result['elapsed'] = round(time.perf_counter() - started, 3)
+    logging.info("Merged %d of %d shard(s): %d inserted, %d updated, %d skipped (%.3f seconds).",
+                 result['changed'], result['shards'], result['inserted'], result['updated'],
+                 len(result['skipped']), result['elapsed'])
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="PCActivityTracker シャードファイルの中央DBへの取り込み")
+    parser.add_argument("db_path", help="中央SQLiteデータベースファイルのパス")
+    parser.add_argument("--shard-dir", help="シャードファイルのフォルダー（省略時は中央DBと同じフォルダーの shards）")
+    parser.add_argument("--workers", type=int, default=8, help="シャードを並行して読み込むスレッド数")
+    parser.add_argument("--batch-size", type=int, default=2000, help="1トランザクションで反映する最大行数の目安")
+    parser.add_argument("--timeout", type=float, default=5.0, help="SQLite接続時のタイムアウト秒数")
+    args = parser.parse_args(argv)
+    result = merge_shards(args.db_path, args.shard_dir, args.workers, args.batch_size, args.timeout)
+    return 0 if not result['skipped'] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
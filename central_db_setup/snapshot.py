@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+"""
+snapshot.py - レポート・出力用に、中央データベースのローカルの読み取り専用スナップショットを作成するスクリプト
+
+集計や出力のツールがネットワーク共有上の中央DBを直接読むと、既定のロールバックジャーナル方式では
+読み取り中の共有ロックがクライアントのコミットを待たせ、クライアント側のロック再試行につながります。
+本スクリプトは SQLite のバックアップ API (sqlite3.Connection.backup) で中央DBをローカルのファイルへ複製します。
+
+  ・複製は --pages ページずつの小さな段階に分け、段階の間に --sleep 秒待機する。共有ロックは各段階の間だけ保持し、
+    待機中にクライアントがコミットできる（コミットがあった場合、バックアップ API は次の段階で最初からやり直す）
+  ・やり直しが --max-restarts 回を超えた場合は中断し、前回のスナップショットをそのまま残す（次回に再試行する）
+  ・中央DBの更新時刻（スナップショットの更新時刻として記録する）が前回の複製から変わっていない場合は複製しない。
+    --interval を指定して常駐させる場合は、PRAGMA data_version でもコミットの有無を確認する
+  ・複製は一時ファイル (<snapshot>.tmp) に作成し、完了後に os.replace で置き換えるため、
+    読み取り中のツールが作成途中のファイルを読むことはない
+
+export.py / concurrency.py は --snapshot を指定すると、このスナップショットを更新してから（変更がなければそのまま）
+スナップショットを読みます。スナップショットには書き込まないこと（次回の複製で置き換えられる）。
+
+使い方:
+    python snapshot.py <db_path> <snapshot_path> [--pages 256] [--sleep 0.05]
+    python snapshot.py <db_path> <snapshot_path> --interval 300        # 常駐して5分ごとに更新
+"""
+
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import sys
+import time
+
+# 読み取り専用の接続はクライアントと共通の connection.py を利用する
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "pc_client"))
+import connection  # noqa: E402
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+
+# 置き換え先のスナップショットを他のプロセスが開いている場合（Windows）の再試行
+REPLACE_RETRIES = 5
+REPLACE_DELAY = 0.5
+
+
+class SnapshotError(Exception):
+    """複製を完了できなかった場合の例外（前回のスナップショットはそのまま残る）。"""
+
+
+def is_current(db_path, snapshot_path):
+    """スナップショットが中央DBの現在の更新時刻から作成されたものであれば True を返す。"""
+    if not os.path.exists(snapshot_path):
+        return False
+    return os.stat(db_path).st_mtime_ns == os.stat(snapshot_path).st_mtime_ns
+
+
+def _replace(temp_path, snapshot_path):
+    """一時ファイルでスナップショットを置き換える。読み取り中で置き換えられない場合は少し待って再試行する。"""
+    for attempt in range(REPLACE_RETRIES):
+        try:
+            os.replace(temp_path, snapshot_path)
+            return
+        except PermissionError:
+            if attempt == REPLACE_RETRIES - 1:
+                raise
+            time.sleep(REPLACE_DELAY)
+
+
+def refresh_snapshot(db_path, snapshot_path, pages=256, sleep=0.05, max_restarts=20, force=False, timeout=5.0,
+                     source=None):
+    """
+    中央DBが前回の複製から更新されていれば、バックアップ API で段階的に複製してスナップショットを置き換える。
+
+    Parameters:
+        db_path (str): 中央データベースファイルのパス
+        snapshot_path (str): スナップショットのパス（ローカルのファイル）
+        pages (int): 1段階で複製するページ数
+        sleep (float): 段階の間の待機時間（秒）
+        max_restarts (int): 複製中のコミットによるやり直しの上限
+        force (bool): True の場合は更新の有無に関係なく複製する
+        timeout (float): SQLite接続時のタイムアウト秒数
+        source (sqlite3.Connection or None): 中央DBへの読み取り専用接続（常駐時に再利用する。None の場合は開いて閉じる）
+
+    Raises:
+        SnapshotError: やり直しが上限を超えた場合
+
+    Returns:
+        dict: copied（複製した場合は True）、pages（ページ数）、restarts、size_bytes、elapsed_ms
+    """
+    started = time.perf_counter()
+    if not force and is_current(db_path, snapshot_path):
+        logging.info("Snapshot %s is up to date.", snapshot_path)
+        return {'copied': False, 'pages': 0, 'restarts': 0, 'size_bytes': os.path.getsize(snapshot_path),
+                'elapsed_ms': round((time.perf_counter() - started) * 1000, 1)}
+
+    # 複製中に更新された場合も次回に複製し直すよう、開始前の更新時刻を記録する
+    mtime_ns = os.stat(db_path).st_mtime_ns
+    temp_path = snapshot_path + ".tmp"
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    progress = {'remaining': None, 'restarts': 0, 'total': 0}
+
+    def on_step(status, remaining, total):
+        # 残りページ数が減らない場合は、他の接続のコミットにより最初からやり直している
+        if progress['remaining'] is not None and remaining >= progress['remaining']:
+            progress['restarts'] += 1
+            if progress['restarts'] > max_restarts:
+                raise SnapshotError(f"Backup restarted more than {max_restarts} times because {db_path} kept "
+                                    "changing; keeping the previous snapshot.")
+        progress['remaining'] = remaining
+        progress['total'] = total
+        if remaining:
+            # 次の段階までロックを保持しない（この間にクライアントがコミットできる）
+            time.sleep(sleep)
+
+    conn = source if source is not None else connection.open_connection(db_path, timeout, "readonly-report")
+    try:
+        target = sqlite3.connect(temp_path)
+        try:
+            conn.backup(target, pages=pages, progress=on_step)
+        finally:
+            target.close()
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    finally:
+        if source is None:
+            conn.close()
+    os.utime(temp_path, ns=(time.time_ns(), mtime_ns))
+    _replace(temp_path, snapshot_path)
+
+    result = {'copied': True, 'pages': progress['total'], 'restarts': progress['restarts'],
+              'size_bytes': os.path.getsize(snapshot_path),
+              'elapsed_ms': round((time.perf_counter() - started) * 1000, 1)}
+    logging.info("Snapshot %s refreshed: %d page(s), %d restart(s), %d bytes in %.1f ms.", snapshot_path,
+                 result['pages'], result['restarts'], result['size_bytes'], result['elapsed_ms'])
+    return result
+
+
+def use_snapshot(db_path, snapshot_path, timeout=5.0):
+    """
+    レポート・出力のツールが読み取るスナップショットを更新し（変更がなければそのまま）、そのパスを返す。
+    中央DBの更新が続いて複製を完了できなかった場合は、前回のスナップショットがあればそれを返す。
+
+    Raises:
+        SnapshotError: 複製を完了できず、前回のスナップショットもない場合
+    """
+    try:
+        refresh_snapshot(db_path, snapshot_path, timeout=timeout)
+    except SnapshotError as e:
+        if not os.path.exists(snapshot_path):
+            raise
+        logging.warning("%s Reading the previous snapshot.", e)
+    return snapshot_path
+
+
+def run_replicator(db_path, snapshot_path, interval, pages=256, sleep=0.05, max_restarts=20, timeout=5.0):
+    """
+    interval 秒ごとにスナップショットを更新する（KeyboardInterrupt まで続ける）。
+    中央DBへの接続を保持し、PRAGMA data_version と更新時刻がどちらも変わっていなければ複製しない。
+    """
+    source = connection.open_connection(db_path, timeout, "readonly-report")
+    last_version = None
+    try:
+        while True:
+            try:
+                version = source.execute("PRAGMA data_version").fetchone()[0]
+                if version != last_version or not is_current(db_path, snapshot_path):
+                    refresh_snapshot(db_path, snapshot_path, pages, sleep, max_restarts, source=source,
+                                     force=last_version is not None and version != last_version)
+                    last_version = version
+            except (SnapshotError, sqlite3.Error, OSError) as e:
+                logging.warning("Snapshot refresh failed: %s", e)
+            time.sleep(interval)
+    finally:
+        source.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="PCActivityTracker レポート用スナップショットの作成")
+    parser.add_argument("db_path", help="中央SQLiteデータベースファイルのパス")
+    parser.add_argument("snapshot_path", help="スナップショットのパス（ローカルのファイル）")
+    parser.add_argument("--pages", type=int, default=256, help="1段階で複製するページ数")
+    parser.add_argument("--sleep", type=float, default=0.05, help="段階の間の待機時間（秒）")
+    parser.add_argument("--max-restarts", type=int, default=20, help="複製中の更新によるやり直しの上限")
+    parser.add_argument("--force", action="store_true", help="更新の有無に関係なく複製する")
+    parser.add_argument("--interval", type=float, default=0, help="常駐して更新する間隔（秒、0 で1回だけ実行）")
+    parser.add_argument("--timeout", type=float, default=5.0, help="SQLite接続時のタイムアウト秒数")
+    parser.add_argument("--json", action="store_true", help="結果を JSON で出力する")
+    args = parser.parse_args(argv)
+
+    if args.interval:
+        try:
+            run_replicator(args.db_path, args.snapshot_path, args.interval, args.pages, args.sleep,
+                           args.max_restarts, args.timeout)
+        except KeyboardInterrupt:
+            pass
+        return 0
+    try:
+        result = refresh_snapshot(args.db_path, args.snapshot_path, args.pages, args.sleep, args.max_restarts,
+                                  args.force, args.timeout)
+    except SnapshotError as e:
+        logging.error("%s", e)
+        return 1
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,380 @@
+#!/usr/bin/env python
+"""
+usage_api.py - 利用集計 (daily_usage) の参照をローカルの HTTP JSON API として提供するスクリプト
+
+ダッシュボードや表計算のクエリから同じ集計（今週のユーザー別・PC別など）が繰り返し要求されるため、
+rollup.py の query_usage と同じ集計の結果をキャッシュして返します。
+  ・結果は LRU のキャッシュに JSON の本文として保持する（--max-entries 件、--max-bytes バイト、--ttl 秒まで）
+  ・キャッシュは、中央DBの PRAGMA data_version（他の接続のコミットで変わる）と最大の session_id の
+    どちらかが変わった場合だけ無効にする。確認は専用の接続で最大 --check-interval 秒に1回行う
+  ・要求は --workers 個のスレッドのプールで処理し、各スレッドは readonly-report プロファイルの
+    読み取り専用の接続（スレッドごとに1つ）で参照する
+  ・/stats でキャッシュのヒット率と、エンドポイントごと（ヒット・ミス別）の応答時間を返す
+daily_usage を参照するため、rollup.py refresh を定期的に実行しておくこと（スキーマバージョン3以上）。
+外部に公開しないこと（既定では 127.0.0.1 で待ち受ける。認証は行わない）。
+
+エンドポイント:
+    GET /usage?by=user&from=2026-10-12&to=2026-10-18&pc=LAB0001&user=taro
+        by は rollup.py の集計単位（既定 user）。from / to を省略した場合は今週（月曜日から今日まで）
+    GET /stats
+
+使い方:
+    python usage_api.py <db_path> [--port 8470] [--workers 4] [--ttl 300] [--max-entries 256]
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import datetime
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from init_db import get_schema_version
+import rollup
+
+# 読み取り専用の接続はクライアントと共通の connection.py を利用する
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "pc_client"))
+import connection  # noqa: E402
+from metrics import percentile  # noqa: E402
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+
+# session_logs がコンパクト形式 (sessions) の互換ビューになるバージョン
+COMPACT_SCHEMA_VERSION = 5
+
+# /stats の応答時間の集計に使う直近の件数（エンドポイント・ヒット／ミスごと）
+LATENCY_SAMPLES = 1000
+
+# /usage のクエリ文字列と query_usage の引数の対応
+USAGE_PARAMS = {'from': 'date_from', 'to': 'date_to', 'pc': 'pc_id', 'user': 'user_account'}
+
+
+class UsageCache:
+    """
+    JSON の本文を保持する LRU キャッシュ。各エントリは作成時の中央DBの状態（トークン）を持ち、
+    現在のトークンと異なる場合、または ttl 秒を過ぎた場合は使わない。スレッドセーフ。
+    """
+
+    def __init__(self, max_entries=256, max_bytes=16 * 1024 * 1024, ttl=300.0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.counts = {'hits': 0, 'misses': 0, 'invalidations': 0, 'expirations': 0, 'evictions': 0}
+
+    def get(self, key, token):
+        """キーの本文を返す（ない場合・無効な場合は None）。"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry_token, created, body = entry
+                if entry_token != token:
+                    self.counts['invalidations'] += 1
+                    self._discard(key)
+                elif time.monotonic() - created > self.ttl:
+                    self.counts['expirations'] += 1
+                    self._discard(key)
+                else:
+                    self._entries.move_to_end(key)
+                    self.counts['hits'] += 1
+                    return body
+            self.counts['misses'] += 1
+            return None
+
+    def put(self, key, token, body):
+        """本文を保持し、件数・バイト数の上限を超えた分を古い順に削除する（max_bytes を超える本文は保持しない）。"""
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = (token, time.monotonic(), body)
+            self._bytes += len(body)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._discard(next(iter(self._entries)))
+                self.counts['evictions'] += 1
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(entry[2])
+
+    def stats(self):
+        """件数・バイト数・ヒット率などを dict で返す。"""
+        with self._lock:
+            lookups = self.counts['hits'] + self.counts['misses']
+            return dict(self.counts, entries=len(self._entries), bytes=self._bytes,
+                        max_entries=self.max_entries, max_bytes=self.max_bytes, ttl=self.ttl,
+                        hit_rate=round(self.counts['hits'] / lookups, 4) if lookups else None)
+
+
+class UsageService:
+    """
+    キャッシュ・中央DBの状態の確認・スレッドごとの読み取り専用接続をまとめ、要求に対する JSON の本文を作成する。
+
+    Parameters:
+        db_path (str): 中央データベースファイルのパス
+        cache (UsageCache): 結果のキャッシュ
+        check_interval (float): 中央DBの状態（data_version・最大の session_id）を確認する最短の間隔（秒）
+        timeout (float): SQLite接続時のタイムアウト秒数
+
+    Raises:
+        RuntimeError: スキーマバージョンが daily_usage に対応していない場合
+    """
+
+    def __init__(self, db_path, cache, check_interval=1.0, timeout=5.0):
+        self.db_path = db_path
+        self.cache = cache
+        self.check_interval = check_interval
+        self.timeout = timeout
+        self._local = threading.local()
+        self._readers = []
+        self._readers_lock = threading.Lock()
+        # data_version は接続ごとの値のため、同じ接続で確認し続ける（複数のスレッドからロックして使う）
+        self._version_conn = connection.open_connection(db_path, timeout, "readonly-report", check_same_thread=False)
+        self._version_lock = threading.Lock()
+        self._token = None
+        self._checked = 0.0
+        version = get_schema_version(self._version_conn)
+        if version < rollup.ROLLUP_SCHEMA_VERSION:
+            self._version_conn.close()
+            raise RuntimeError(f"Database schema version {version} has no daily_usage table; "
+                               f"run init_db.py to migrate to version {rollup.ROLLUP_SCHEMA_VERSION} or later.")
+        table = "sessions" if version >= COMPACT_SCHEMA_VERSION else "session_logs"
+        self._max_id_query = f"SELECT MAX(session_id) FROM {table}"
+        self._latency = collections.defaultdict(lambda: collections.deque(maxlen=LATENCY_SAMPLES))
+        self._latency_lock = threading.Lock()
+
+    def current_token(self):
+        """中央DBの状態 (data_version, 最大の session_id) を返す。check_interval 秒以内の確認結果は再利用する。"""
+        with self._version_lock:
+            now = time.monotonic()
+            if self._token is None or now - self._checked >= self.check_interval:
+                data_version = self._version_conn.execute("PRAGMA data_version").fetchone()[0]
+                max_id = self._version_conn.execute(self._max_id_query).fetchone()[0]
+                self._token = (data_version, max_id)
+                self._checked = now
+            return self._token
+
+    def _reader(self):
+        """このスレッドの読み取り専用接続を返す（なければ作成する）。"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # 使うのはこのスレッドだけだが、終了時に close でまとめて閉じるため check_same_thread=False とする
+            conn = connection.open_connection(self.db_path, self.timeout, "readonly-report", check_same_thread=False)
+            self._local.conn = conn
+            with self._readers_lock:
+                self._readers.append(conn)
+        return conn
+
+    def _drop_reader(self):
+        """失敗した接続を閉じ、次の要求で作り直す。"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            self._local.conn = None
+            with self._readers_lock:
+                self._readers.remove(conn)
+            conn.close()
+
+    def usage(self, query):
+        """
+        /usage の要求に対する JSON の本文を返す。
+
+        Parameters:
+            query (dict): クエリ文字列（parse_qs の結果）
+
+        Raises:
+            ValueError: パラメータが不正な場合
+            sqlite3.Error: 中央DBを読めなかった場合
+
+        Returns:
+            tuple: (本文のバイト列, キャッシュにあった場合は True)
+        """
+        args = {'by': query.get('by', ["user"])[-1]}
+        for name, arg in USAGE_PARAMS.items():
+            if name in query:
+                args[arg] = query[name][-1]
+        if args['by'] not in rollup.GROUP_BY:
+            raise ValueError(f"Unknown grouping {args['by']!r}; choose from {', '.join(rollup.GROUP_BY)}.")
+        if 'date_from' not in args and 'date_to' not in args:
+            today = datetime.date.today()
+            args['date_from'] = (today - datetime.timedelta(days=today.weekday())).isoformat()
+            args['date_to'] = today.isoformat()
+        for arg in ('date_from', 'date_to'):
+            if arg in args:
+                datetime.date.fromisoformat(args[arg])
+
+        key = ('usage',) + tuple(sorted(args.items()))
+        token = self.current_token()
+        body = self.cache.get(key, token)
+        if body is not None:
+            return body, True
+        try:
+            rows = rollup.query_usage_on_connection(self._reader(), **args)
+        except sqlite3.Error:
+            self._drop_reader()
+            raise
+        echo = {'by': args['by']}
+        echo.update((name, args.get(arg)) for name, arg in USAGE_PARAMS.items())
+        body = json.dumps({'query': echo, 'rows': rows}, ensure_ascii=False).encode("utf-8")
+        self.cache.put(key, token, body)
+        return body, False
+
+    def record_latency(self, endpoint, cached, elapsed_ms):
+        """応答時間を記録する。"""
+        with self._latency_lock:
+            self._latency[(endpoint, "hit" if cached else "miss")].append(elapsed_ms)
+
+    def stats(self):
+        """/stats の本文（キャッシュの統計と、エンドポイント・ヒット／ミスごとの応答時間）を返す。"""
+        with self._latency_lock:
+            samples = {key: sorted(values) for key, values in self._latency.items()}
+        latency = {}
+        for (endpoint, outcome), values in sorted(samples.items()):
+            latency.setdefault(endpoint, {})[outcome] = {
+                'count': len(values),
+                'p50_ms': round(percentile(values, 50), 3),
+                'p95_ms': round(percentile(values, 95), 3),
+                'max_ms': round(values[-1], 3),
+            }
+        with self._readers_lock:
+            readers = len(self._readers)
+        return json.dumps({'cache': self.cache.stats(), 'latency': latency, 'readers': readers,
+                           'token': list(self._token) if self._token else None},
+                          ensure_ascii=False).encode("utf-8")
+
+    def close(self):
+        """すべての接続を閉じる。"""
+        with self._readers_lock:
+            for conn in self._readers:
+                conn.close()
+            self._readers.clear()
+        self._version_conn.close()
+
+
+class _UsageHandler(BaseHTTPRequestHandler):
+    """GET /usage と GET /stats を処理する。"""
+
+    server_version = "PCActivityTrackerUsage/1.0"
+
+    def do_GET(self):
+        started = time.perf_counter()
+        url = urlsplit(self.path)
+        service = self.server.service
+        cached = False
+        try:
+            if url.path == "/usage":
+                body, cached = service.usage(parse_qs(url.query))
+            elif url.path == "/stats":
+                body = service.stats()
+            else:
+                self._send(404, {'error': f"Unknown path {url.path}"})
+                return
+        except ValueError as e:
+            self._send(400, {'error': str(e)})
+            return
+        except sqlite3.Error as e:
+            logging.warning("Usage query failed: %s", e)
+            self._send(503, {'error': str(e)})
+            return
+        self._send(200, body, cached if url.path == "/usage" else None)
+        service.record_latency(url.path, cached, (time.perf_counter() - started) * 1000)
+
+    def _send(self, status, body, cached=None):
+        if isinstance(body, dict):
+            body = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        if cached is not None:
+            self.send_header("X-Cache", "hit" if cached else "miss")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug("%s - %s", self.address_string(), format % args)
+
+
+class _PooledHTTPServer(HTTPServer):
+    """要求を固定数のスレッドのプールで処理する HTTPServer（ThreadingHTTPServer は要求ごとにスレッドを作成する）。"""
+
+    def __init__(self, address, handler, service, workers):
+        super().__init__(address, handler)
+        self.service = service
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="usage-api")
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=True)
+        self.service.close()
+
+
+def create_server(db_path, host="127.0.0.1", port=8470, workers=4, max_entries=256, max_bytes=16 * 1024 * 1024,
+                  ttl=300.0, check_interval=1.0, timeout=5.0):
+    """
+    利用集計の API サーバーを作成する（serve_forever で開始し、server_close で接続とスレッドを閉じる）。
+
+    Raises:
+        RuntimeError: スキーマバージョンが daily_usage に対応していない場合
+
+    Returns:
+        HTTPServer: サーバー
+    """
+    service = UsageService(db_path, UsageCache(max_entries, max_bytes, ttl), check_interval, timeout)
+    try:
+        return _PooledHTTPServer((host, port), _UsageHandler, service, workers)
+    except OSError:
+        service.close()
+        raise
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="PCActivityTracker 利用集計の HTTP JSON API")
+    parser.add_argument("db_path", help="中央SQLiteデータベースファイルのパス")
+    parser.add_argument("--host", default="127.0.0.1", help="待ち受けるアドレス")
+    parser.add_argument("--port", type=int, default=8470, help="待ち受けるポート")
+    parser.add_argument("--workers", type=int, default=4, help="要求を処理するスレッド数")
+    parser.add_argument("--max-entries", type=int, default=256, help="キャッシュする結果の最大件数")
+    parser.add_argument("--max-bytes", type=int, default=16 * 1024 * 1024, help="キャッシュする結果の合計の最大バイト数")
+    parser.add_argument("--ttl", type=float, default=300.0, help="キャッシュした結果を使う最長の時間（秒）")
+    parser.add_argument("--check-interval", type=float, default=1.0,
+                        help="中央DBの更新（data_version・最大の session_id）を確認する最短の間隔（秒）")
+    parser.add_argument("--timeout", type=float, default=5.0, help="SQLite接続時のタイムアウト秒数")
+    args = parser.parse_args(argv)
+    try:
+        server = create_server(args.db_path, args.host, args.port, args.workers, args.max_entries, args.max_bytes,
+                               args.ttl, args.check_interval, args.timeout)
+    except RuntimeError as e:
+        parser.error(str(e))
+    logging.info("Serving usage API for %s on http://%s:%d/ with %d worker(s).", args.db_path, args.host,
+                 server.server_address[1], args.workers)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
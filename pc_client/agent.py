@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+"""
+agent.py - 常駐エージェント（起動後も終了せず、現在のセッションの最終確認時刻を一定間隔で記録する）
+
+電源断やハングアップでは shutdown.exe が実行されず、セッションは未終了のまま残ります。
+config.ini の [Agent] enabled = True の場合、startup.exe は起動記録の後も常駐し、
+現在のセッションの最終確認時刻（ハートビート）を中央DBの session_heartbeats に記録します。
+シャットダウンが記録されなかったセッションは、この時刻で終了させることができます。
+
+負荷を小さくするため、以下のように動作します。
+  ・ハートビートは interval 秒（既定5分）ごとに1回、1行の UPSERT だけを書き込む（その間はスリープするのみ）
+  ・共有がロックされている場合は busy_timeout（既定0.2秒）だけ待って書き込みを見送り、retry_interval 秒後に
+    その時点の時刻で書き込む（見送った分のハートビートはまとめて1回になる）
+  ・共有が応答しない場合はタイムアウト付きのプローブで確認し、接続を試みない
+  ・接続は書き込みのたびに開いて閉じ、共有上のファイルを開いたままにしない
+CPU時間とメモリ使用量（ピーク）は1時間ごとにログへ出力します（pc_server_test/measure_agent.py で計測）。
+
+提供する機能:
+  ・HeartbeatAgent: ハートビートの記録（write_heartbeat）と常駐ループ（run）
+  ・footprint: このプロセスのCPU時間とメモリ使用量（ピーク）を取得
+"""
+
+import logging
+import os
+import sys
+import threading
+import time
+
+# session_heartbeats を作成する移行のバージョン（central_db_setup/init_db.py の MIGRATIONS）
+HEARTBEAT_SCHEMA_VERSION = 7
+
+# CPU時間とメモリ使用量をログに出力する間隔（秒）
+REPORT_INTERVAL = 3600
+
+# 起動記録の開始時刻と一致する未終了セッション（idx_sessions_open を使用）
+_FIND_SESSION_QUERY = """
+    SELECT s.session_id FROM sessions AS s
+    WHERE s.pc_key = (SELECT pc_key FROM pcs WHERE pc_id = :pc_id)
+      AND s.user_key = (SELECT user_key FROM users WHERE user_account = :user_account)
+      AND s.shutdown_ts IS NULL
+      AND s.start_ts = CAST(strftime('%s', :start_time, 'utc') AS INTEGER)
+    ORDER BY s.session_id DESC LIMIT 1
+"""
+
+# セッションが未終了の場合のみ最終確認時刻を記録する（終了済みなら0行）
+_UPSERT_QUERY = """
+    INSERT INTO session_heartbeats (session_id, last_seen_ts)
+    SELECT session_id, :last_seen_ts FROM sessions WHERE session_id = :session_id AND shutdown_ts IS NULL
+    ON CONFLICT (session_id) DO UPDATE SET last_seen_ts = excluded.last_seen_ts
+"""
+
+
+def footprint():
+    """
+    このプロセスのCPU時間（ユーザー + システム）とメモリ使用量のピークを返す。
+
+    Returns:
+        dict: cpu_seconds, peak_rss_kb（取得できない場合は None）
+    """
+    peak = None
+    if sys.platform == "win32":
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                        ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                        ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                        ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            peak = counters.PeakWorkingSetSize // 1024
+    else:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == "darwin":
+            peak //= 1024  # macOS はバイト単位
+    return {'cpu_seconds': round(time.process_time(), 3), 'peak_rss_kb': peak}
+
+
+class HeartbeatAgent:
+    """
+    現在のセッションの最終確認時刻を一定間隔で記録する常駐エージェント。
+
+    Parameters:
+        resolve_db_path (callable): 書き込み先のデータベースのパスを返す引数なしの関数（書き込みのたびに呼び出す）
+        record_data (dict): 起動記録の情報（pc_id, user_account, start_time）
+        interval (float): ハートビートを書き込む間隔（秒）
+        retry_interval (float): 書き込みを見送った場合に次に試みるまでの間隔（秒）
+        busy_timeout (float): ロックの解放を待つ最大時間（秒）。超えた場合は書き込みを見送る
+        probe_timeout (float): 共有の存在確認のタイムアウト（秒）
+        spool_path (str or None): スプールファイルのパス。未反映のイベントが残っている場合は書き込みの前に反映を試みる
+    """
+
+    def __init__(self, resolve_db_path, record_data, interval=300.0, retry_interval=60.0, busy_timeout=0.2,
+                 probe_timeout=2.0, spool_path=None):
+        self.resolve_db_path = resolve_db_path
+        self.record_data = {key: record_data[key] for key in ('pc_id', 'user_account', 'start_time')}
+        self.interval = interval
+        self.retry_interval = min(retry_interval, interval)
+        self.busy_timeout = busy_timeout
+        self.probe_timeout = probe_timeout
+        self.spool_path = spool_path
+        self.session_id = None
+        self.counts = {'written': 0, 'busy': 0, 'unavailable': 0, 'no_session': 0}
+        self.stop_event = threading.Event()
+
+    def _flush_spool(self, db_path):
+        """起動記録がスプールに残っている場合に、再試行せずに1回だけ反映を試みる。"""
+        import spool
+        import utils
+        import retry
+        import connection
+        if os.path.exists(self.spool_path) or os.path.exists(self.spool_path + spool.FLUSHING_SUFFIX):
+            utils.flush_spool_with_retry(db_path, self.spool_path, 0, self.busy_timeout, self.busy_timeout,
+                                         retry_policy=retry.RetryPolicy(max_retries=0))
+            # 常駐中は共有上のファイルを開いたままにしない
+            connection.close_connection(db_path)
+
+    def write_heartbeat(self):
+        """
+        現在のセッションの最終確認時刻を1回書き込む。
+
+        Raises:
+            RuntimeError: データベースのスキーマが session_heartbeats に対応していない場合
+
+        Returns:
+            str: 結果（"written"、ロックで見送った場合は "busy"、共有が利用できない場合は "unavailable"、
+                 現在のセッションの起動記録がまだ反映されていない場合は "no_session"）
+        """
+        import sqlite3
+        import connection
+        import failover
+        import retry
+        db_path = self.resolve_db_path()
+        if not failover.probe_targets([db_path], self.probe_timeout):
+            return "unavailable"
+        if self.spool_path:
+            self._flush_spool(db_path)
+
+        conn = None
+        try:
+            conn = connection.open_connection(db_path, self.busy_timeout)
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version < HEARTBEAT_SCHEMA_VERSION:
+                raise RuntimeError(f"Database schema version {version} has no session_heartbeats table; "
+                                   f"run init_db.py to migrate to version {HEARTBEAT_SCHEMA_VERSION} or later.")
+            if self.session_id is None:
+                row = conn.execute(_FIND_SESSION_QUERY, self.record_data).fetchone()
+                if row is None:
+                    return "no_session"
+                self.session_id = row[0]
+            cursor = conn.execute(_UPSERT_QUERY, {'session_id': self.session_id, 'last_seen_ts': int(time.time())})
+            if cursor.rowcount == 0:
+                # セッションが終了済み、または削除された場合は次回に検索し直す
+                self.session_id = None
+                return "no_session"
+            return "written"
+        except sqlite3.Error as e:
+            if retry.is_retryable(e):
+                return "busy"
+            raise
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def run(self, max_runtime=None):
+        """
+        stop() が呼び出されるか max_runtime 秒が経過するまで、ハートビートを書き込み続ける。
+        共有の切断など一時的なエラーは記録して続行し、スキーマが対応していない場合は終了する。
+
+        Parameters:
+            max_runtime (float or None): 最大実行時間（秒、計測用。None の場合は無制限）
+
+        Returns:
+            dict: 結果ごとの書き込みの回数（written, busy, unavailable, no_session）
+        """
+        import sqlite3
+        started = time.monotonic()
+        next_report = started + REPORT_INTERVAL
+        delay = self.interval
+        logging.info("Agent started (interval=%.0fs, session %s@%s since %s).", self.interval,
+                     self.record_data['user_account'], self.record_data['pc_id'], self.record_data['start_time'])
+        while True:
+            if max_runtime is not None:
+                delay = min(delay, max(0.0, started + max_runtime - time.monotonic()))
+            if self.stop_event.wait(delay) or (max_runtime is not None and time.monotonic() - started >= max_runtime):
+                break
+            try:
+                result = self.write_heartbeat()
+            except RuntimeError as e:
+                logging.warning("Agent stopped: %s", e)
+                break
+            except (sqlite3.Error, OSError) as e:
+                logging.warning("Heartbeat failed: %s", e)
+                result = "unavailable"
+            self.counts[result] += 1
+            # 書き込めた場合は次の間隔まで、見送った場合は retry_interval 後にその時点の時刻で書き込む
+            delay = self.interval if result == "written" else self.retry_interval
+            logging.debug("Heartbeat %s (session_id=%s).", result, self.session_id)
+            if time.monotonic() >= next_report:
+                next_report += REPORT_INTERVAL
+                logging.info("Agent heartbeats: %s; footprint: %s", self.counts, footprint())
+        logging.info("Agent stopped (heartbeats: %s; footprint: %s).", self.counts, footprint())
+        return self.counts
+
+    def stop(self):
+        """run のループを終了させる（別スレッドから呼び出す）。"""
+        self.stop_event.set()
@@ -0,0 +1,301 @@
+#!/usr/bin/env python
+"""
+connection.py - SQLite 接続の作成と PRAGMA 設定（プロファイル）を一元管理する関数群
+
+接続の用途ごとに PRAGMA の組み合わせ（プロファイル）を定義し、接続の作成時に適用します。
+クライアント（startup.exe / shutdown.exe）は config.ini の [Database] profile で選択したプロファイルを使い、
+1つのプロセス内では同じデータベースへの接続を1本だけ作成して再利用します（get_connection）。
+
+プロファイル:
+  ・share-safe      : ネットワーク共有上のDBへ複数のPCが書き込む場合（既定）。
+                      ロールバックジャーナル (journal_mode=DELETE) と synchronous=FULL を使う。
+                      WAL は共有メモリ (-shm) を使うため、ネットワーク共有上では使用できない
+  ・local-collector : DBと同じサーバー上で単一のプロセスが書き込む場合（集約サービス collector.py など）。
+                      journal_mode=WAL と synchronous=NORMAL で、コミットごとの fsync を減らす
+  ・readonly-report : 集計・レポート用の読み取り専用接続。mode=ro で開き、query_only を設定する。
+                      immutable を指定した場合は、ロックと変更の確認も行わない（書き込みのないスナップショット専用）
+
+提供する機能:
+  ・ConnectionProfile: プロファイル（PRAGMA の組み合わせと読み取り専用の指定）
+  ・get_profile: プロファイル名と PRAGMA の上書き指定からプロファイルを取得
+  ・configure: このプロセスで使用する既定のプロファイルを設定
+  ・open_connection: プロファイルを適用した新しい接続を作成
+  ・get_connection: このプロセスで再利用する接続を取得（なければ作成）
+  ・release_on_error: 接続でエラーが発生した場合の後始末（ロック競合以外のエラーでは接続を破棄）
+  ・close_connection: 指定したデータベースの再利用中の接続を閉じる（ファイルが削除・再作成された場合など）
+  ・close_connections: 再利用中の接続をすべて閉じる（プロセス終了時に自動で呼び出す）
+"""
+
+import atexit
+import logging
+import os
+import re
+import sqlite3
+
+DEFAULT_PROFILE = "share-safe"
+
+# config.ini や呼び出し側から上書きできる PRAGMA（SQL に埋め込むため、名前と値は検証する）
+ALLOWED_PRAGMAS = (
+    "journal_mode", "synchronous", "cache_size", "temp_store", "busy_timeout",
+    "wal_autocheckpoint", "mmap_size", "locking_mode", "query_only", "foreign_keys",
+)
+
+# データベースファイルに記録され、他の接続にも影響する PRAGMA（現在の値と異なる場合のみ変更する）
+PERSISTENT_PRAGMAS = ("journal_mode",)
+
+_VALUE_PATTERN = re.compile(r"^(-?\d+|[A-Za-z_]+)$")
+
+
+class ConnectionProfile:
+    """
+    接続のプロファイル。
+
+    Parameters:
+        name (str): プロファイル名
+        pragmas (dict): 接続時に適用する PRAGMA（名前: 値、記述順に適用する）
+        readonly (bool): True の場合は mode=ro で開く（UNCパスなど URI で開けない場合は query_only のみ）
+        immutable (bool): True の場合は immutable=1 で開く（readonly の場合のみ有効）
+    """
+
+    def __init__(self, name, pragmas, readonly=False, immutable=False):
+        self.name = name
+        self.pragmas = dict(pragmas)
+        self.readonly = readonly
+        self.immutable = immutable
+
+    def with_overrides(self, pragmas):
+        """PRAGMA の一部を上書きしたプロファイルを返す（元のプロファイルは変更しない）。"""
+        return ConnectionProfile(self.name, dict(self.pragmas, **pragmas), self.readonly, self.immutable)
+
+    def __repr__(self):
+        return ("ConnectionProfile(name=%r, pragmas=%r, readonly=%r, immutable=%r)"
+                % (self.name, self.pragmas, self.readonly, self.immutable))
+
+
+PROFILES = {
+    "share-safe": ConnectionProfile("share-safe", {
+        "journal_mode": "DELETE",
+        "synchronous": "FULL",
+        "cache_size": -2000,
+        "temp_store": "DEFAULT",
+    }),
+    "local-collector": ConnectionProfile("local-collector", {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -16000,
+        "temp_store": "MEMORY",
+        "wal_autocheckpoint": 1000,
+    }),
+    "readonly-report": ConnectionProfile("readonly-report", {
+        "query_only": "ON",
+        "cache_size": -32000,
+        "temp_store": "MEMORY",
+    }, readonly=True),
+}
+
+# このプロセスの既定のプロファイル（configure で変更する）と、再利用中の接続
+_default_profile = PROFILES[DEFAULT_PROFILE]
+_connections = {}
+_owner_pid = None
+
+
+def parse_pragmas(text):
+    """
+    "synchronous=NORMAL, cache_size=-8000" 形式の文字列を PRAGMA の dict に変換する。
+
+    Raises:
+        ValueError: 許可されていない PRAGMA 名や不正な値が含まれる場合
+
+    Returns:
+        dict: PRAGMA 名と値
+    """
+    pragmas = {}
+    for item in (text or "").split(","):
+        if not item.strip():
+            continue
+        name, sep, value = item.partition("=")
+        name, value = name.strip().lower(), value.strip()
+        if not sep or name not in ALLOWED_PRAGMAS or not _VALUE_PATTERN.match(value):
+            raise ValueError(f"Invalid PRAGMA setting '{item.strip()}' "
+                             f"(allowed: {', '.join(ALLOWED_PRAGMAS)})")
+        pragmas[name] = int(value) if value.lstrip("-").isdigit() else value.upper()
+    return pragmas
+
+
+def get_profile(name=None, pragmas=None, immutable=None):
+    """
+    プロファイル名からプロファイルを取得し、PRAGMA の上書き指定を反映する。
+
+    Parameters:
+        name (str or None): プロファイル名（None の場合は configure で設定した既定のプロファイル）
+        pragmas (dict or str or None): 上書きする PRAGMA（文字列の場合は parse_pragmas の形式）
+        immutable (bool or None): immutable の指定（None の場合はプロファイルの設定のまま）
+
+    Raises:
+        ValueError: 未知のプロファイル名、または不正な PRAGMA が指定された場合
+
+    Returns:
+        ConnectionProfile: プロファイル
+    """
+    if name is None:
+        profile = _default_profile
+    else:
+        key = name.strip().lower()
+        if key not in PROFILES:
+            raise ValueError(f"Unknown database profile '{name}' (available: {', '.join(PROFILES)})")
+        profile = PROFILES[key]
+    if isinstance(pragmas, str):
+        pragmas = parse_pragmas(pragmas)
+    if pragmas:
+        profile = profile.with_overrides(pragmas)
+    if immutable is not None and immutable != profile.immutable:
+        profile = ConnectionProfile(profile.name, profile.pragmas, profile.readonly, immutable)
+    return profile
+
+
+def configure(name=None, pragmas=None, immutable=None):
+    """
+    このプロセスで使用する既定のプロファイルを設定する。設定を変更した場合、再利用中の接続は閉じる。
+
+    Returns:
+        ConnectionProfile: 設定したプロファイル
+    """
+    global _default_profile
+    _default_profile = get_profile(name or DEFAULT_PROFILE, pragmas, immutable)
+    close_connections()
+    logging.debug("Database profile: %r", _default_profile)
+    return _default_profile
+
+
+def _readonly_uri(db_path, immutable):
+    """
+    読み取り専用で開くための URI を返す。UNCパス（\\\\server\\share\\...）は SQLite の URI で
+    表せないため None を返す（この場合は通常どおり開き、query_only で書き込みを禁止する）。
+    """
+    if db_path.startswith("\\\\") or db_path.startswith("//"):
+        return None
+    from urllib.parse import quote
+    path = os.path.abspath(db_path).replace(os.sep, "/")
+    if not path.startswith("/"):
+        path = "/" + path  # Windows のドライブ文字 (C:/...) の前に区切りを付ける
+    return "file:%s?mode=ro%s" % (quote(path), "&immutable=1" if immutable else "")
+
+
+def _apply_pragmas(conn, profile, timeout):
+    pragmas = dict(profile.pragmas)
+    pragmas.setdefault("busy_timeout", int(timeout * 1000))
+    for name, value in pragmas.items():
+        if name in PERSISTENT_PRAGMAS:
+            if profile.readonly:
+                continue
+            current = conn.execute(f"PRAGMA {name}").fetchone()[0]
+            if str(current).upper() == str(value).upper():
+                continue
+            try:
+                conn.execute(f"PRAGMA {name} = {value}")
+            except sqlite3.OperationalError as e:
+                # 他の接続が使用中の場合など、変更できなくても接続自体は利用する
+                logging.warning("Could not set PRAGMA %s = %s (currently %s): %s", name, value, current, e)
+            continue
+        conn.execute(f"PRAGMA {name} = {value}")
+
+
+def open_connection(db_path, timeout, profile=None, check_same_thread=True):
+    """
+    プロファイルを適用した新しい接続を作成する（isolation_level=None、トランザクションは呼び出し側で管理する）。
+
+    Parameters:
+        db_path (str): データベースファイルのパス
+        timeout (float): SQLite接続時のタイムアウト秒数（busy_timeout の既定値にも使用）
+        profile (ConnectionProfile or str or None): プロファイル（None の場合は既定のプロファイル）
+        check_same_thread (bool): False の場合は作成したスレッド以外からの使用を許可する
+
+    Returns:
+        sqlite3.Connection: 接続
+    """
+    if not isinstance(profile, ConnectionProfile):
+        profile = get_profile(profile)
+    uri = _readonly_uri(db_path, profile.immutable) if profile.readonly else None
+    conn = sqlite3.connect(uri or db_path, timeout=timeout, isolation_level=None,
+                           check_same_thread=check_same_thread, uri=uri is not None)
+    try:
+        _apply_pragmas(conn, profile, timeout)
+    except sqlite3.Error:
+        conn.close()
+        raise
+    return conn
+
+
+def get_connection(db_path, timeout, profile=None):
+    """
+    このプロセスで再利用する接続を返す。同じデータベース・プロファイル・タイムアウトの接続が
+    既にあればそれを返し、なければ open_connection で作成する。
+    前回の処理が途中で失敗してトランザクションが残っている場合はロールバックしてから返す。
+
+    Parameters:
+        db_path (str): データベースファイルのパス
+        timeout (float): SQLite接続時のタイムアウト秒数
+        profile (ConnectionProfile or str or None): プロファイル（None の場合は既定のプロファイル）
+
+    Returns:
+        sqlite3.Connection: 接続（isolation_level=None）
+    """
+    global _owner_pid
+    if _owner_pid != os.getpid():
+        # fork で引き継いだ接続は親プロセスのものなので使用しない
+        _connections.clear()
+        _owner_pid = os.getpid()
+    if not isinstance(profile, ConnectionProfile):
+        profile = get_profile(profile)
+    key = (os.path.abspath(db_path), profile.name, repr(profile.pragmas), profile.immutable, timeout)
+    conn = _connections.get(key)
+    if conn is None:
+        conn = open_connection(db_path, timeout, profile)
+        _connections[key] = conn
+    elif conn.in_transaction:
+        conn.execute("ROLLBACK")
+    return conn
+
+
+def release_on_error(conn, error):
+    """
+    接続でエラーが発生した場合に、残っているトランザクションをロールバックする。
+    ロック競合（再試行で解消するエラー）以外の場合は、接続を閉じて再利用の対象から外す
+    （ネットワーク共有の切断などで接続が使えなくなった場合に、次の試行で接続し直すため）。
+
+    Parameters:
+        conn (sqlite3.Connection): エラーが発生した接続
+        error (Exception): 発生したエラー
+    """
+    import retry
+    try:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+    except sqlite3.Error as e:
+        logging.debug("Rollback failed: %s", e)
+    if retry.is_retryable(error):
+        return
+    for key, cached in list(_connections.items()):
+        if cached is conn:
+            del _connections[key]
+    conn.close()
+
+
+def close_connection(db_path):
+    """指定したデータベースの再利用中の接続（全プロファイル）を閉じる。"""
+    path = os.path.abspath(db_path)
+    for key in [key for key in _connections if key[0] == path]:
+        _connections.pop(key).close()
+
+
+def close_connections():
+    """再利用中の接続をすべて閉じる。"""
+    for conn in _connections.values():
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+    _connections.clear()
+
+
+atexit.register(close_connections)
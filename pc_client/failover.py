@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+"""
+failover.py - 複数のデータベースの候補（プライマリの共有、セカンダリの共有、ローカルの代替）から
+利用可能なものを選択する関数群
+
+ネットワーク共有が応答しない場合、os.path.exists の呼び出し自体が長時間戻らないことがあります。
+本モジュールは候補ごとの存在確認（プローブ）を別スレッドで同時に実行し、プローブごとのタイムアウトを
+過ぎた候補は利用不可として扱います。候補には優先順位があり、優先順位の高い候補の結果を待ってから
+利用可能な最初の候補を選択します（応答の速い下位の候補が先に返っても、上位の候補の結果を待つ）。
+
+前回利用できた候補（last-known-good）はローカルの状態ファイルに記録し、次回はその候補と
+それより優先順位の高い候補だけを先にプローブします。通常はプライマリが記録されているため、
+プライマリ1つのプローブで選択が終わります。セカンダリが記録されている場合もプライマリは同時に確認するため、
+プライマリが復旧すればプライマリに戻ります。
+
+提供する機能:
+  ・probe_targets: 候補を同時にプローブし、利用可能な最も優先順位の高い候補を返す
+  ・select_target: 前回利用できた候補を優先してプローブし、選択した候補を状態ファイルに記録する
+  ・wait_for_target: 利用可能な候補が見つかるまで、間隔を伸ばしながら（バックオフ）select_target を繰り返す
+  ・load_last_good / save_last_good: 前回利用できた候補の読み込み・記録
+"""
+
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+# プローブ1回あたりのタイムアウト（秒）の既定値
+DEFAULT_PROBE_TIMEOUT = 2.0
+
+
+def _probe(path, results):
+    """パスの存在を確認し、(path, 結果, 所要時間) を results に入れる（プローブ用のスレッドで実行）。"""
+    started = time.perf_counter()
+    try:
+        ok = os.path.exists(path)
+    except OSError:
+        ok = False
+    results.put((path, ok, time.perf_counter() - started))
+
+
+def probe_targets(paths, timeout=DEFAULT_PROBE_TIMEOUT):
+    """
+    候補のパスを同時にプローブし、利用可能な候補のうち最も優先順位の高いものを返す。
+    プローブはデーモンスレッドで実行するため、応答しない共有のプローブが残っていてもプロセスは終了できる。
+
+    Parameters:
+        paths (list): 候補のパス（優先順位の高い順）
+        timeout (float): プローブのタイムアウト（秒）。この時間内に応答しない候補は利用不可とする
+
+    Returns:
+        str or None: 選択した候補のパス（利用可能な候補がない場合は None）
+    """
+    if not paths:
+        return None
+    results = queue.Queue()
+    for path in paths:
+        threading.Thread(target=_probe, args=(path, results), name="db-probe", daemon=True).start()
+    status = {}
+    deadline = time.monotonic() + timeout
+    while True:
+        for path in paths:
+            if status.get(path) is None:
+                break  # 優先順位の高い候補の結果を待つ
+            if status[path]:
+                return path
+        else:
+            return None
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            for path in paths:
+                if status.get(path) is None:
+                    logging.warning("Database target %s did not respond within %.1f seconds.", path, timeout)
+            return next((path for path in paths if status.get(path)), None)
+        try:
+            path, ok, elapsed = results.get(timeout=remaining)
+        except queue.Empty:
+            continue
+        status[path] = ok
+        logging.debug("Probed database target %s: %s (%.3f seconds).", path, "available" if ok else "not found", elapsed)
+
+
+def load_last_good(state_path):
+    """状態ファイルから前回利用できた候補のパスを読み込む（記録がない・読めない場合は None）。"""
+    if not state_path:
+        return None
+    try:
+        with open(state_path, "r", encoding="utf-8") as f:
+            return json.load(f).get("path")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def save_last_good(state_path, path):
+    """
+    前回利用できた候補のパスを状態ファイルに記録する（一時ファイルへの書き込みと置き換えで、途中で壊れないようにする）。
+    """
+    if not state_path:
+        return
+    temp_path = state_path + ".tmp"
+    try:
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump({"path": path, "selected_at": time.strftime("%Y-%m-%d %H:%M:%S")}, f, ensure_ascii=False)
+        os.replace(temp_path, state_path)
+    except OSError as e:
+        logging.warning("Could not record the selected database target in %s: %s", state_path, e)
+
+
+def select_target(targets, probe_timeout=DEFAULT_PROBE_TIMEOUT, state_path=None):
+    """
+    利用可能な候補を1回選択する。前回利用できた候補とそれより優先順位の高い候補を先に同時にプローブし、
+    いずれも利用できない場合に残りの候補をプローブする。選択した候補が前回と異なる場合は状態ファイルに記録する。
+
+    Parameters:
+        targets (list): 候補のパス（優先順位の高い順）
+        probe_timeout (float): プローブのタイムアウト（秒）
+        state_path (str or None): 前回利用できた候補を記録する状態ファイルのパス（None の場合は記録しない）
+
+    Returns:
+        str or None: 選択した候補のパス（利用可能な候補がない場合は None）
+    """
+    last_good = load_last_good(state_path)
+    if last_good in targets:
+        split = targets.index(last_good) + 1
+        groups = [targets[:split], targets[split:]]
+    else:
+        groups = [targets]
+
+    chosen = None
+    for group in groups:
+        chosen = probe_targets(group, probe_timeout)
+        if chosen:
+            break
+    if chosen and chosen != last_good:
+        if chosen != targets[0]:
+            logging.warning("Primary database %s is not available; using %s.", targets[0], chosen)
+        save_last_good(state_path, chosen)
+    return chosen
+
+
+def wait_for_target(targets, probe_timeout=DEFAULT_PROBE_TIMEOUT, max_wait=60, base_delay=1.0, max_delay=10.0,
+                    state_path=None):
+    """
+    利用可能な候補が見つかるまで select_target を繰り返す。繰り返しの間隔は base_delay から
+    decorrelated jitter（retry.RetryPolicy と同じ方式）で max_delay まで伸ばす。
+
+    Parameters:
+        targets (list): 候補のパス（優先順位の高い順）
+        probe_timeout (float): プローブのタイムアウト（秒）
+        max_wait (float): 最初のプローブからの最大待機時間（秒）
+        base_delay (float): 最初の待機間隔の基準（秒）
+        max_delay (float): 待機間隔の上限（秒）
+        state_path (str or None): 前回利用できた候補を記録する状態ファイルのパス
+
+    Raises:
+        Exception: max_wait 秒以内に利用可能な候補が見つからなかった場合
+
+    Returns:
+        str: 選択した候補のパス
+    """
+    import retry
+    policy = retry.RetryPolicy(base_delay=base_delay, max_delay=max_delay)
+    started = time.monotonic()
+    delay = None
+    while True:
+        chosen = select_target(targets, probe_timeout, state_path)
+        if chosen:
+            logging.info("Network share %s is available.", chosen)
+            return chosen
+        delay = policy.next_delay(delay)
+        remaining = max_wait - (time.monotonic() - started)
+        if remaining <= 0:
+            raise Exception(f"No database target is available after waiting {max_wait} seconds "
+                            f"(tried: {', '.join(targets)}).")
+        delay = min(delay, remaining)
+        logging.warning("No database target available. Waiting %.1f seconds...", delay)
+        time.sleep(delay)
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+"""
+logsetup.py - startup.exe / shutdown.exe のログ設定（キュー経由の非同期出力とローテーション）
+
+ログの出力先の設定はこのモジュールの configure だけで行います（utils.py などは import 時にログ設定を行わない）。
+  ・ルートロガーには QueueHandler だけを設定し、呼び出し側はメッセージをキューへ入れるだけで処理を続ける
+    （ネットワーク共有の待機中やシャットダウン時に、ログファイルへの書き込みを待たない）
+  ・ファイルへの書き込みは別スレッドの QueueListener が行う
+  ・ログファイルはサイズ（max_bytes）または時刻（when、例: "midnight"）で切り替え、backup_count 世代だけ残す
+  ・終了時（atexit）にキューに残ったログを書き出す。書き出しは flush_timeout 秒で打ち切り、終了を遅らせない
+起動・シャットダウンのイベントを記録するまでは buffer でログをメモリに溜めるだけにし、logging.handlers
+（socket、pickle などを読み込む）の import と書き出しスレッドの開始は、イベントの記録後の configure で行います。
+configure は何度呼び出してもよく、溜めたログは設定した出力先へ書き出します。
+
+提供する機能:
+  ・buffer: configure までのログをメモリに溜める（logging 以外のモジュールを読み込まない）
+  ・configure: ログの出力先・レベル・ローテーションを設定する（既存の設定は置き換える）
+  ・configured: configure 済みかを返す
+  ・shutdown: キューに残ったログを書き出してから出力を停止する（flush_timeout 秒まで）
+"""
+
+import logging
+
+LOG_FORMAT = '%(asctime)s [%(levelname)s] %(message)s'
+
+# 設定中のキュー・ハンドラー・書き出しスレッド（configure で作成し、shutdown で停止する）
+_queue_handler = None
+_listener = None
+_flush_timeout = 2.0
+# configure までのログを溜めるハンドラー（buffer で設定する）
+_buffer_handler = None
+# logging.handlers.QueueListener の派生クラス（configure の初回に作成する）
+_listener_class = None
+
+
+class _BufferHandler(logging.Handler):
+    """configure までのログレコードを、書き出さずにリストへ溜めるハンドラー。"""
+
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def buffer():
+    """
+    configure を呼び出すまでのログ（DEBUG 以上）をメモリに溜める。溜めたログは configure で、
+    設定したレベル以上のものだけを書き出す。
+    """
+    global _buffer_handler
+    if _buffer_handler is None:
+        _buffer_handler = _BufferHandler()
+        logging.getLogger().addHandler(_buffer_handler)
+    logging.getLogger().setLevel(logging.DEBUG)
+
+
+def _bounded_listener_class():
+    """
+    停止時に書き出しスレッドの終了を待つ時間に上限を設けた QueueListener の派生クラスを返す。
+    ハンドラーは書き出しスレッド自身がキューを書き出し終えてから閉じる（待ち時間を過ぎても、閉じたハンドラーへは書き込まない）。
+    logging.handlers は import に時間がかかるため、最初の configure で作成する。
+    """
+    global _listener_class
+    if _listener_class is not None:
+        return _listener_class
+    import logging.handlers
+
+    class BoundedListener(logging.handlers.QueueListener):
+        def _monitor(self):
+            try:
+                super()._monitor()
+            finally:
+                for handler in self.handlers:
+                    handler.close()
+
+        def stop(self, timeout=None):
+            """
+            キューに終了の印を入れ、書き出しスレッドの終了を timeout 秒まで待つ。
+
+            Returns:
+                bool: 時間内にキューのログをすべて書き出した場合は True
+            """
+            thread = self._thread
+            if thread is None:
+                return True
+            self._thread = None
+            self.enqueue_sentinel()
+            thread.join(timeout)
+            return not thread.is_alive()
+
+    _listener_class = BoundedListener
+    return _listener_class
+
+
+def _file_handler(log_path, max_bytes, backup_count, when):
+    import logging.handlers
+    if when:
+        return logging.handlers.TimedRotatingFileHandler(log_path, when=when, backupCount=backup_count,
+                                                         encoding="utf-8", delay=True)
+    return logging.handlers.RotatingFileHandler(log_path, maxBytes=max_bytes, backupCount=backup_count,
+                                                encoding="utf-8", delay=True)
+
+
+def configure(log_path=None, level=logging.INFO, console=False, max_bytes=1048576, backup_count=5, when="",
+              flush_timeout=2.0):
+    """
+    ルートロガーの出力を、キュー経由で書き出しスレッドから行うように設定する（既存の設定は置き換える）。
+    buffer で溜めたログのうち level 以上のものは、設定した出力先へ書き出す。
+
+    Parameters:
+        log_path (str or None): ログファイルのパス（None の場合はファイルへ出力しない）
+        level (int): ルートロガーのレベル
+        console (bool): True の場合は標準エラー出力にも出力する
+        max_bytes (int): when を指定しない場合に、ログファイルを切り替えるサイズ（バイト、0 で切り替えない）
+        backup_count (int): 残す古いログファイルの世代数
+        when (str): 時刻で切り替える場合の単位（"midnight"、"D"、"H" など。空の場合はサイズで切り替える）
+        flush_timeout (float): 終了時にキューのログを書き出す最大時間（秒）
+    """
+    global _queue_handler, _listener, _flush_timeout, _buffer_handler
+    import atexit
+    import logging.handlers
+    import queue
+    listener_class = _bounded_listener_class()
+    handlers = []
+    if log_path:
+        handlers.append(_file_handler(log_path, max_bytes, backup_count, when))
+    if console or not handlers:
+        handlers.append(logging.StreamHandler())
+    formatter = logging.Formatter(LOG_FORMAT)
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    root = logging.getLogger()
+    # 書き出しスレッドごとに新しいキューを使う。以前のスレッドが停止の待ち時間内に終わらなくても、
+    # 以前のキューだけを書き出すため、新しいスレッドとログを取り合わない
+    log_queue = queue.SimpleQueue()
+    if _queue_handler is None:
+        _queue_handler = logging.handlers.QueueHandler(log_queue)
+        # 後から登録した関数が先に実行されるため、logging 自体の終了処理より前に書き出しが行われる
+        atexit.register(shutdown)
+    else:
+        _queue_handler.queue = log_queue
+    buffered = _buffer_handler.records if _buffer_handler is not None else []
+    _buffer_handler = None
+    # 以前の設定（basicConfig と buffer を含む）のハンドラーを外し、出力先をキューだけにする
+    for handler in root.handlers[:]:
+        if handler is not _queue_handler:
+            root.removeHandler(handler)
+            handler.close()
+    if _queue_handler not in root.handlers:
+        root.addHandler(_queue_handler)
+    root.setLevel(level)
+
+    # 以前の書き出しスレッドは以前のキューに残ったログを書き出してから停止する
+    # （この間のログは新しいキューに溜まり、新しいスレッドが書き出す）
+    if _listener is not None:
+        _listener.stop(_flush_timeout)
+    _flush_timeout = flush_timeout
+    _listener = listener_class(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    for record in buffered:
+        if record.levelno >= level:
+            _queue_handler.handle(record)
+
+
+def configured():
+    """configure 済み（書き出しスレッドが動作中）であれば True を返す。"""
+    return _listener is not None
+
+
+def shutdown(timeout=None):
+    """
+    キューに残ったログを書き出してから、書き出しスレッドを停止する（atexit からも呼び出される）。
+    書き出しが timeout 秒（None の場合は configure の flush_timeout）で終わらない場合は残りを破棄する。
+
+    Returns:
+        bool: 時間内にすべて書き出した場合（または設定されていない場合）は True
+    """
+    global _listener
+    listener, _listener = _listener, None
+    if listener is None:
+        return True
+    if timeout is None:
+        timeout = _flush_timeout
+    done = listener.stop(timeout)
+    if not done:
+        import sys
+        sys.stderr.write("Log queue was not flushed within %.1f seconds.\n" % timeout)
+    return done
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+"""
+metrics.py - 起動・シャットダウン処理の段階（フェーズ）ごとの所要時間を計測し、1回の実行につき1行の JSON として記録する関数群
+
+シャットダウン記録が欠落した場合などに、時間が共有の待機・スキーマ確認・検索・ロック待ちの再試行・更新の
+どこに費やされたかを application.log からは判別できないため、実行ごとに以下を記録します。
+  ・phases   : フェーズ名ごとの所要時間（ミリ秒。同じフェーズを複数回実行した場合は合計）
+  ・retries  : retry.run_with_retry の処理名ごとの試行回数、ロック待ち時間、バックオフ待機時間
+  ・outcome  : 結果（"ok": 反映済み、"spooled": スプールに残った、"error": 例外で終了）
+  ・values   : 書き込み先のパス (db_path)、経路 (transport) などの付加情報
+
+計測は start_run で開始し、finish_run で config.ini の [Metrics] path（既定: metrics.jsonl）へ追記します。
+計測を開始していない場合、phase などの呼び出しは何もしないため、utils.py の関数は計測の有無に関係なく使用できます。
+記録ファイルは各PCから収集し、central_db_setup/metrics_report.py でフェーズ別・PC別のパーセンタイルを集計します。
+
+提供する機能:
+  ・start_run: この実行の計測を開始する（retry.run_with_retry の結果も自動で記録する）
+  ・phase: with 文でフェーズの所要時間を計測する
+  ・add_timings: 計測済みの所要時間（record_shutdown の timings など）をフェーズとして加える
+  ・set_value / set_outcome: 付加情報・結果を記録する
+  ・finish_run: 計測を終了し、記録ファイルへ1行追記する
+  ・percentile: 最近傍順位法のパーセンタイル（metrics_report.py・load_test.py などの集計で共通に使う）
+"""
+
+import json
+import logging
+import os
+import time
+
+# 実行中の計測（start_run で作成し、finish_run で破棄する）
+_current = None
+
+
+class RunMetrics:
+    """
+    1回の実行（startup.exe / shutdown.exe）の計測結果。
+
+    Attributes:
+        kind (str): 実行の種類（"startup" または "shutdown"）
+        started_at (str): 開始時刻（YYYY-MM-DD HH:MM:SS）
+        phases (dict): フェーズ名と所要時間（ミリ秒）
+        retries (dict): 処理名と再試行の記録（attempts, retries, lock_wait_ms, backoff_ms, succeeded）
+        values (dict): 付加情報
+        outcome (str or None): 結果（未設定の場合は finish_run で決める）
+    """
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.started_at = time.strftime("%Y-%m-%d %H:%M:%S")
+        self.started = time.perf_counter()
+        self.phases = {}
+        self.retries = {}
+        self.values = {}
+        self.outcome = None
+
+    def add_phase(self, name, ms):
+        self.phases[name] = self.phases.get(name, 0.0) + ms
+
+    def on_retry(self, description, stats):
+        """retry.add_listener に登録する関数。同じ処理名の記録は合算する。"""
+        entry = self.retries.setdefault(description, {
+            'attempts': 0, 'retries': 0, 'lock_wait_ms': 0.0, 'backoff_ms': 0.0, 'succeeded': False})
+        entry['attempts'] += stats.attempts
+        entry['retries'] += stats.retries
+        entry['lock_wait_ms'] += stats.total_lock_wait * 1000
+        entry['backoff_ms'] += stats.backoff * 1000
+        entry['succeeded'] = stats.succeeded
+
+    def to_record(self, error=None):
+        import socket
+        record = {
+            'ts': self.started_at,
+            'host': socket.gethostname(),
+            'kind': self.kind,
+            'outcome': self.outcome or ("error" if error else "ok"),
+            'total_ms': round((time.perf_counter() - self.started) * 1000, 3),
+            'phases': {name: round(ms, 3) for name, ms in self.phases.items()},
+            'retries': {description: dict(entry, lock_wait_ms=round(entry['lock_wait_ms'], 3),
+                                          backoff_ms=round(entry['backoff_ms'], 3))
+                        for description, entry in self.retries.items()},
+        }
+        record.update(self.values)
+        if error is not None:
+            record['error'] = "%s: %s" % (type(error).__name__, error)
+        return record
+
+
+class _Phase:
+    """phase が返す計測用のコンテキストマネージャー（例外で抜けた場合も所要時間を記録する）。"""
+
+    __slots__ = ("run", "name", "started")
+
+    def __init__(self, run, name):
+        self.run = run
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.run.add_phase(self.name, (time.perf_counter() - self.started) * 1000)
+        return False
+
+
+class _NoPhase:
+    """計測を開始していない場合に phase が返す、何もしないコンテキストマネージャー。"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NO_PHASE = _NoPhase()
+
+
+def start_run(kind):
+    """
+    この実行の計測を開始する。retry.run_with_retry の終了ごとの結果も記録する。
+
+    Parameters:
+        kind (str): 実行の種類（"startup" または "shutdown"）
+
+    Returns:
+        RunMetrics: 計測中の記録
+    """
+    global _current
+    import retry
+    if _current is not None:
+        retry.remove_listener(_current.on_retry)
+    _current = RunMetrics(kind)
+    retry.add_listener(_current.on_retry)
+    return _current
+
+
+def phase(name):
+    """
+    with 文でフェーズの所要時間を計測する（計測を開始していない場合は何もしない）。
+
+    Parameters:
+        name (str): フェーズ名（例: "select_database"）
+    """
+    if _current is None:
+        return _NO_PHASE
+    return _Phase(_current, name)
+
+
+def add_timings(prefix, timings):
+    """
+    計測済みの所要時間（ミリ秒）を "<prefix>.<名前>" のフェーズとして加える（record_shutdown の timings など）。
+    合計 ('total') は各フェーズの和と重複するため加えない。
+    """
+    if _current is None:
+        return
+    for name, ms in timings.items():
+        if name != 'total':
+            _current.add_phase("%s.%s" % (prefix, name), ms)
+
+
+def set_value(key, value):
+    """付加情報（書き込み先のパスなど）を記録する（計測を開始していない場合は何もしない）。"""
+    if _current is not None:
+        _current.values[key] = value
+
+
+def set_outcome(outcome):
+    """結果を記録する（"spooled" など。記録しない場合は finish_run で "ok" または "error" とする）。"""
+    if _current is not None:
+        _current.outcome = outcome
+
+
+def finish_run(path, error=None, max_bytes=1048576):
+    """
+    計測を終了し、記録ファイルへ1行の JSON を追記する。記録ファイルへの書き込みに失敗しても例外は送出しない。
+    ファイルが max_bytes を超えた場合は "<path>.1" に置き換えてから追記する（古い記録は1世代のみ残す）。
+
+    Parameters:
+        path (str or None): 記録ファイルのパス（None の場合は記録せずに計測だけを終了する）
+        error (Exception or None): 処理が例外で終了した場合の例外
+        max_bytes (int): 記録ファイルの最大サイズ（バイト、0 の場合は無制限）
+
+    Returns:
+        dict or None: 記録した内容（計測を開始していない場合は None）
+    """
+    global _current
+    run, _current = _current, None
+    if run is None:
+        return None
+    import retry
+    retry.remove_listener(run.on_retry)
+    record = run.to_record(error)
+    if not path:
+        return record
+    try:
+        if max_bytes and os.path.exists(path) and os.path.getsize(path) >= max_bytes:
+            os.replace(path, path + ".1")
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    except OSError as e:
+        logging.warning("Could not write metrics to %s: %s", path, e)
+    return record
+
+
+def percentile(sorted_values, pct):
+    """
+    昇順に並んだ値から最近傍順位法でパーセンタイル値を求める（値がなければ None）。
+    順位は ceil(pct / 100 * 件数)（1未満の場合は1）とする。
+
+    Parameters:
+        sorted_values (list): 昇順に並んだ値
+        pct (float): パーセンタイル（0〜100）
+
+    Returns:
+        値または None
+    """
+    import math
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100.0 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
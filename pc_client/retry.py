@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+"""
+retry.py - DB書き込みの再試行（バックオフ）を一元管理する関数群
+
+多数のPCが同時に「database is locked」になった際、一定間隔の再試行では各PCがほぼ同じタイミングで
+再試行を繰り返し、競合が解消されません。本モジュールは指数バックオフと decorrelated jitter
+（前回の待機時間の最大3倍までの乱数）により再試行のタイミングを分散させ、
+全体の待機時間の上限（deadline）を超える再試行は行いません（シャットダウン時間の超過を防ぐ）。
+1回の試行はロック待ち（busy_timeout）で attempt_timeout 秒までブロックしうるため、
+その時間が deadline までに収まらない試行は開始しません。
+
+提供する機能:
+  ・RetryPolicy: 再試行回数、基本間隔、最大間隔、全体の時間上限の設定
+  ・RetryStats: 試行回数、試行ごとのロック待ち時間、バックオフ待機時間の記録
+  ・is_retryable: 再試行すべきエラー（ロック競合）かどうかの判定
+  ・run_with_retry: 関数を再試行ポリシーに従って実行し、結果の要約をログに出力する
+  ・add_listener / remove_listener: run_with_retry の終了ごとに結果 (RetryStats) を受け取る関数の登録・解除
+"""
+
+import logging
+import random
+import time
+
+# 再試行の対象とする sqlite3.OperationalError のメッセージ（小文字）
+RETRYABLE_MESSAGES = (
+    "database is locked",
+    "database table is locked",
+    "database is busy",
+)
+
+# run_with_retry の終了時に (description, stats) を渡して呼び出す関数（負荷試験・計測用）
+_listeners = []
+
+
+class RetryPolicy:
+    """
+    再試行ポリシー。
+
+    Parameters:
+        max_retries (int): 最大再試行回数（初回の試行は含まない）
+        base_delay (float): 再試行間隔の基本値（秒）。初回の待機は base_delay 以上 base_delay*3 以下
+        max_delay (float): 1回あたりの待機時間の上限（秒）
+        deadline (float or None): 初回の試行開始からの全体の時間上限（秒）。None または 0 の場合は無制限
+        attempt_timeout (float): 1回の試行がロック待ちでブロックしうる最大時間（秒、接続の busy_timeout）。
+            deadline までの残り時間がこれより短い場合は再試行しない
+    """
+
+    def __init__(self, max_retries=10, base_delay=0.5, max_delay=5.0, deadline=None, attempt_timeout=0.0):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max(max_delay, base_delay)
+        self.deadline = deadline or None
+        self.attempt_timeout = attempt_timeout or 0.0
+
+    def next_delay(self, previous_delay):
+        """
+        decorrelated jitter により次の待機時間を算出する。
+
+        Parameters:
+            previous_delay (float or None): 前回の待機時間（初回は None）
+
+        Returns:
+            float: 次の待機時間（秒）
+        """
+        upper = self.base_delay * 3 if previous_delay is None else previous_delay * 3
+        return min(self.max_delay, random.uniform(self.base_delay, max(upper, self.base_delay)))
+
+    def __repr__(self):
+        return (f"RetryPolicy(max_retries={self.max_retries}, base_delay={self.base_delay}, "
+                f"max_delay={self.max_delay}, deadline={self.deadline}, attempt_timeout={self.attempt_timeout})")
+
+
+class RetryStats:
+    """
+    run_with_retry の実行結果の記録。
+
+    Attributes:
+        attempts (int): 試行回数（初回を含む）
+        lock_waits (list): 試行ごとの所要時間（秒）。失敗した試行ではロック待ちに費やした時間
+        backoff (float): 再試行間の待機時間の合計（秒）
+        elapsed (float): 全体の所要時間（秒）
+        succeeded (bool): 最終的に成功したかどうか
+    """
+
+    def __init__(self):
+        self.attempts = 0
+        self.lock_waits = []
+        self.backoff = 0.0
+        self.elapsed = 0.0
+        self.succeeded = False
+
+    @property
+    def retries(self):
+        return max(0, self.attempts - 1)
+
+    @property
+    def total_lock_wait(self):
+        """失敗した試行でのロック待ち時間の合計（秒）"""
+        return sum(self.lock_waits[:-1] if self.succeeded else self.lock_waits)
+
+    def summary(self):
+        return ("attempts=%d, lock_wait=%.3fs, backoff=%.3fs, elapsed=%.3fs"
+                % (self.attempts, self.total_lock_wait, self.backoff, self.elapsed))
+
+
+def is_retryable(error):
+    """
+    例外がロック競合による一時的なエラーで、再試行すべきものかを判定する。
+
+    Parameters:
+        error (Exception): 発生した例外
+
+    Returns:
+        bool: 再試行すべき場合は True
+    """
+    import sqlite3
+    if not isinstance(error, sqlite3.OperationalError):
+        return False
+    message = str(error).lower()
+    return any(m in message for m in RETRYABLE_MESSAGES)
+
+
+def add_listener(listener):
+    """
+    run_with_retry の終了ごとに listener(description, stats) を呼び出すよう登録する。
+    負荷試験や計測で、既存の書き込み関数の引数を変えずに再試行回数やロック待ち時間を集計するために使用する。
+
+    Parameters:
+        listener (callable): (description (str), stats (RetryStats)) を受け取る関数
+    """
+    _listeners.append(listener)
+
+
+def remove_listener(listener):
+    """add_listener で登録した関数を解除する（未登録の場合は何もしない）。"""
+    if listener in _listeners:
+        _listeners.remove(listener)
+
+
+def run_with_retry(func, policy, description, stats=None):
+    """
+    func を再試行ポリシーに従って実行する。再試行すべきエラー（is_retryable）の場合のみ、
+    decorrelated jitter 付きの指数バックオフで再試行し、それ以外のエラーは即座に送出する。
+    終了時に試行回数、ロック待ち時間、バックオフ待機時間の要約をログに出力する。
+
+    Parameters:
+        func (callable): 引数なしで呼び出す処理
+        policy (RetryPolicy): 再試行ポリシー
+        description (str): ログ出力用の処理名（例: "Startup insert"）
+        stats (RetryStats or None): 結果を記録するオブジェクト（None の場合は内部で作成）
+
+    Raises:
+        func が送出した例外（再試行回数または時間上限を超えた場合は最後のエラー）
+
+    Returns:
+        func の戻り値
+    """
+    if stats is None:
+        stats = RetryStats()
+    started = time.perf_counter()
+    delay = None
+    try:
+        while True:
+            stats.attempts += 1
+            attempt_started = time.perf_counter()
+            try:
+                result = func()
+            except Exception as e:
+                stats.lock_waits.append(time.perf_counter() - attempt_started)
+                if not is_retryable(e):
+                    logging.error("%s failed with a non-retryable error: %s", description, e)
+                    raise
+                if stats.retries >= policy.max_retries:
+                    logging.error("%s: max retries reached (%d).", description, policy.max_retries)
+                    raise
+                delay = policy.next_delay(delay)
+                if policy.deadline is not None:
+                    # 次の試行のロック待ちも含めて deadline までに終わる場合だけ再試行する
+                    remaining = policy.deadline - (time.perf_counter() - started) - policy.attempt_timeout
+                    if remaining <= 0:
+                        logging.error("%s: retry deadline of %.1f seconds exceeded.", description, policy.deadline)
+                        raise
+                    delay = min(delay, remaining)
+                logging.warning("%s: %s. Retry attempt %d/%d in %.2f seconds...",
+                                description, e, stats.retries + 1, policy.max_retries, delay)
+                time.sleep(delay)
+                stats.backoff += delay
+                continue
+            stats.lock_waits.append(time.perf_counter() - attempt_started)
+            stats.succeeded = True
+            return result
+    finally:
+        stats.elapsed = time.perf_counter() - started
+        level = logging.INFO if stats.succeeded else logging.ERROR
+        logging.log(level, "%s %s (%s).", description, "succeeded" if stats.succeeded else "failed", stats.summary())
+        for listener in list(_listeners):
+            listener(description, stats)
@@ -3,12 +3,14 @@
 shutdown.py - このスクリプトはPCのシャットダウン／中断時に実行され、
 既存の起動レコードに対して shutdown_time および duration を更新します。
 ※ 起動時に記録された user_account は上書きせず、既存の値を保持します。
+※ スプール有効時は、先にローカルのスプールファイルへ記録してからデータベースへ反映するため、
+  ネットワーク共有が利用できない場合も待機せずに終了し、イベントは次回の起動時に反映されます。
+※ 各処理の所要時間（共有の選択、ロック待ち、検索、更新、再試行）は config.ini の [Metrics] path に
+  1回の実行につき1行の JSON として記録されます（metrics.py）。
 """
 
 import os
 import sys
-import socket
-import datetime
 import logging
 
 # グループポリシー経由で実行される場合、カレントディレクトリが不定になるため、スクリプトのあるディレクトリに変更
@@ -18,22 +20,28 @@ else:
     base_dir = os.path.dirname(os.path.abspath(__file__))
 os.chdir(base_dir)
 
-# ログファイルの絶対パスを設定（EXEと同じディレクトリ内に "application.log" を作成）
-log_path = os.path.join(base_dir, "application.log")
-logging.basicConfig(
-    level=logging.INFO,  # 初期値は INFO だが、後ほど debug 値により変更する
-    format='%(asctime)s [%(levelname)s] %(message)s',
-    filename=log_path,
-    filemode='a'
-)
+import logsetup
+
+# シャットダウンのイベントをスプールへ記録するまではログをメモリに溜めるだけにし、記録後に
+# [Logging] と debug の値で設定する（ログはキュー経由で別スレッドが書き込む）
+logsetup.buffer()
+
+import metrics
 
 # 共通のユーティリティ関数を utils.py からインポート
 from utils import (
     load_config,
+    get_spool_path,
+    get_collector,
+    get_shard_path,
+    ensure_shard,
     ensure_table_exists,
-    wait_for_network_share,
     get_start_time_for_duration,
-    compute_duration,
+    get_retry_policy,
+    configure_database,
+    get_metrics_path,
+    get_logging_settings,
+    select_database,
     update_shutdown_info_with_retry,
 )
 
@@ -43,12 +51,16 @@ def get_shutdown_info():
 
     取得項目:
       - pc_id       : ホスト名（PC固有ID）
-      - user_account: 初期値は環境変数 "USERNAME" から取得するが、後で起動レコードの値に置き換え
+      - user_account: 初期値は環境変数 "USERNAME" から取得するが、記録時に起動レコードの値に置き換え
       - shutdown_time: 現在のシャットダウン時刻（YYYY-MM-DD HH:MM:SS形式）
       - weekday     : シャットダウン時の曜日（例："Mon"）
       - session_type: "normal"（初期値）
-      - duration    : 0（初期値、後で算出）
+      - duration    : 0（初期値、記録時にDB内で算出）
     """
+    # 起動時間短縮のため、記録に必要になった時点で import する
+    import socket
+    import datetime
+
     data = {}
     data['pc_id'] = socket.gethostname()
     data['user_account'] = os.environ.get("USERNAME", "unknown")
@@ -60,45 +72,112 @@ def get_shutdown_info():
     return data
 
 def main():
-    # 設定ファイル (config.ini) をロード
-    config = load_config("config.ini")
-    # config.ini の debug の値によりログレベルを変更（Trueなら DEBUG, Falseなら INFO）
-    debug = config.getboolean("General", "debug", fallback=False)
-    new_level = logging.DEBUG if debug else logging.INFO
-    logging.getLogger().setLevel(new_level)
-
-    db_path = config.get("Database", "db_path")
+    # フェーズごとの所要時間を計測し、[Metrics] path に1行の JSON として記録する
+    metrics.start_run("shutdown")
+    config = None
+    try:
+        # 設定ファイル (config.ini) をロード
+        with metrics.phase("config"):
+            config = load_config("config.ini")
+        # [Logging] の出力先・ローテーションと debug の値によるログレベル（Trueなら DEBUG, Falseなら INFO）を適用
+        record_shutdown_event(config, lambda: logsetup.configure(**get_logging_settings(config, "shutdown")))
+    except Exception as e:
+        if not logsetup.configured():
+            # イベントの記録前に失敗した場合も、溜めたログを EXE と同じディレクトリの application.log へ出力する
+            if config:
+                logsetup.configure(**get_logging_settings(config, "shutdown"))
+            else:
+                logsetup.configure(os.path.join(base_dir, "application.log"))
+        metrics.finish_run(get_metrics_path(config) if config else None, e)
+        raise
+    metrics.finish_run(get_metrics_path(config))
+
+def record_shutdown_event(config, on_recorded=None):
+    """
+    設定に従ってシャットダウン情報を収集し、起動レコードを更新する（main から呼び出す）。
+
+    Parameters:
+        config (configparser.ConfigParser): 設定オブジェクト
+        on_recorded (callable or None): イベントをスプールへ記録した後（スプール無効時は書き込みの前）に呼び出す関数
+    """
     max_retries = config.getint("Retry", "max_retries")
     retry_interval = config.getfloat("Retry", "retry_interval")
     timeout = config.getfloat("General", "timeout")
+    # [Database] profile の PRAGMA 設定を、このプロセスで再利用する接続に適用する
+    configure_database(config)
+    spool_path = get_spool_path(config)
+    collector = get_collector(config)
+    retry_policy = get_retry_policy(config)
 
-    # ネットワーク共有上のDBファイルが利用可能になるまで待機
-    wait_for_network_share(db_path)
-
-    # テーブルが存在しない場合は自動で作成する
-    ensure_table_exists(db_path, timeout)
-
-    # シャットダウン時の情報を収集
+    # シャットダウン時の情報を収集（共有の待機より前に取得し、待機時間を shutdown_time に含めない）
     shutdown_info = get_shutdown_info()
+    logging.info("Shutdown info: %s", shutdown_info)
 
-    # 最新の起動レコードから start_time と user_account を取得する
-    # get_start_time_for_duration から返されるタプルが2以上の要素を持つ場合、
-    # 必要な先頭2要素（start_time, user_account）だけを抽出する
-    result = get_start_time_for_duration(db_path, shutdown_info['pc_id'], shutdown_info['user_account'], timeout)
-    if result:
-        start_time_str = result[0]
-        db_user_account = result[1]
-        shutdown_info['duration'] = compute_duration(start_time_str, shutdown_info['shutdown_time'])
-        # 起動時に記録された user_account を保持する
-        shutdown_info['user_account'] = db_user_account
-    else:
-        shutdown_info['duration'] = 0
+    def resolve_db_path():
+        """
+        書き込み先のデータベースを決める（スプール有効時はスプールへの記録後に呼び出される）。
+        [Database] db_path と fallback_paths の候補を同時にプローブし、利用可能な最初の候補を使用する。
+        スプール・集約サービスを使用しない場合は、いずれかが利用可能になるまで間隔を伸ばしながら待機する。
+        スプール有効時にシャードが利用できない場合は None を返す（イベントはスプールに残る）。
+        """
+        db_path = select_database(config, wait=not spool_path and not collector)
+        shard_path = get_shard_path(config, db_path)
+        if shard_path:
+            # 他のPCとロックを共有しないよう、中央DBではなくこのPC専用のシャードファイルへ書き込む
+            # （central_db_setup/shard_merge.py が中央DBへ取り込む）
+            with metrics.phase("ensure_shard"):
+                available = ensure_shard(shard_path, timeout)
+            if available:
+                if not spool_path:
+                    # スプール無効時は、シャードが利用できなかった回の起動が中央DBに記録されている場合がある
+                    with metrics.phase("find_open"):
+                        in_central = _opened_later_in_central(db_path, shard_path)
+                    if in_central:
+                        logging.info("Open session started %s is in %s; updating it there.", in_central, db_path)
+                        return db_path
+                metrics.set_value("shard_path", shard_path)
+                return shard_path
+            if spool_path:
+                # イベントはスプールに残し、シャードが利用可能になってから反映する（起動の記録と同じシャードに書き込む）
+                logging.warning("Shard %s not available; events remain spooled.", shard_path)
+                return None
+            # スプール無効時は記録を失わないよう中央DBへ書き込む
+            logging.warning("Shard %s not available; writing to %s instead.", shard_path, db_path)
+            with metrics.phase("ensure_table"):
+                ensure_table_exists(db_path, timeout)
+        return db_path
 
-    logging.info("Shutdown info: %s", shutdown_info)
+    def _opened_later_in_central(db_path, shard_path):
+        """
+        中央DBの未終了セッションがシャードの未終了セッションより新しい場合は、その開始時刻を返す（それ以外は None）。
+        中央DBを読めない場合はシャードの記録を優先する。
+        """
+        import sqlite3
+        pc_id, user_account = shutdown_info['pc_id'], shutdown_info['user_account']
+        try:
+            central = get_start_time_for_duration(db_path, pc_id, user_account, timeout)
+        except sqlite3.Error as e:
+            logging.warning("Could not look up open session in %s: %s", db_path, e)
+            return None
+        if not central:
+            return None
+        shard = get_start_time_for_duration(shard_path, pc_id, user_account, timeout)
+        if shard and shard[0] >= central[0]:
+            return None
+        return central[0]
 
-    # 再試行ロジック付きで、DBの起動レコードをシャットダウン情報で更新または新規挿入する
-    update_shutdown_info_with_retry(db_path, shutdown_info, max_retries, retry_interval, timeout)
-    logging.info("Shutdown record updated successfully.")
+    # 1つの接続・1つのトランザクションで、スキーマ確認、最新の起動レコードの検索、
+    # duration の算出（DB内）、更新（該当がなければ新規挿入）をまとめて実行する。
+    # 起動時に記録された user_account は保持され、shutdown_info に反映される。
+    result = update_shutdown_info_with_retry(resolve_db_path, shutdown_info, max_retries, retry_interval, timeout,
+                                             spool_path=spool_path, collector=collector, retry_policy=retry_policy,
+                                             on_recorded=on_recorded)
+    if result is None:
+        metrics.set_outcome("spooled")
+        logging.info("Shutdown event spooled; it will be applied on the next successful flush.")
+        return
+    logging.info("Shutdown record %s successfully (session_id=%s, user_account=%s, duration=%d).",
+                 result['action'], result['session_id'], result['user_account'], result['duration'])
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+"""
+spool.py - ローカルの送信待ちファイル（アウトボックス）を扱う関数群
+
+起動／シャットダウンのイベントは、まずEXEと同じディレクトリにある追記専用のスプールファイルへ
+1行1イベントの JSON として書き込み、fsync してから中央データベースへ反映します。
+ネットワーク共有が利用できない場合や書き込みがロックで失敗した場合でもイベントは失われず、
+次回の起動時（または共有が利用可能になった時点）にまとめて反映されます。
+
+各イベントには一意な event_id を付与しており、反映側 (utils.apply_events) で適用済みの
+event_id を記録するため、途中で失敗した反映を再実行しても二重登録にはなりません。
+
+提供する機能:
+  ・new_event: event_id を付与したイベントを作成する
+  ・append_event: イベントをスプールファイルへ追記し fsync する
+  ・read_events: スプールファイルからイベントを読み込む（途中で途切れた行は読み飛ばす）
+  ・flush_spool: スプールファイルのイベントを指定された反映関数に渡し、成功したら削除する
+                （<spool>.lock の排他ロックにより、同時に反映するのは1つのプロセスだけ）
+"""
+
+import json
+import logging
+import os
+import time
+
+FLUSHING_SUFFIX = ".flushing"
+
+# 反映中であることを示すロックファイル（常駐エージェントと shutdown.exe などが同時に反映しないようにする）
+LOCK_SUFFIX = ".lock"
+
+# 他のプロセスが反映中の場合に、ロックの解放を待つ最大時間（秒）と確認間隔
+LOCK_WAIT = 5.0
+LOCK_POLL = 0.1
+
+
+def new_event(kind, record_data):
+    """
+    一意な event_id を付与したイベントを作成する。
+
+    Parameters:
+        kind (str): イベント種別（"startup" または "shutdown"）
+        record_data (dict): get_startup_info / get_shutdown_info で収集した情報
+
+    Returns:
+        dict: event_id, kind, record を持つイベント
+    """
+    # uuid4 と同じ128ビットの乱数（uuid モジュールの import を避けて起動を速くする）
+    return {'event_id': os.urandom(16).hex(), 'kind': kind, 'record': dict(record_data)}
+
+
+def append_event(spool_path, event):
+    """
+    イベントを1行の JSON としてスプールファイルへ追記し、fsync でディスクへの書き込みを保証する。
+
+    Parameters:
+        spool_path (str): スプールファイルのパス
+        event (dict): new_event で作成したイベント
+    """
+    line = (json.dumps(event, ensure_ascii=False, separators=(',', ':')) + "\n").encode("utf-8")
+    with open(spool_path, "a+b") as f:
+        # 前回の書き込みが途中で途切れている場合は、改行を補って新しいイベントを別の行にする
+        f.seek(0, os.SEEK_END)
+        if f.tell() > 0:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                line = b"\n" + line
+        f.write(line)
+        f.flush()
+        os.fsync(f.fileno())
+    logging.debug("Spooled %s event %s to %s.", event['kind'], event['event_id'], spool_path)
+
+
+def read_events(path):
+    """
+    スプールファイルからイベントを順番に読み込む。
+    書き込み途中の電源断などで壊れた行は警告を出して読み飛ばす。
+
+    Parameters:
+        path (str): スプールファイルのパス
+
+    Returns:
+        list: イベント（dict）のリスト
+    """
+    events = []
+    with open(path, "rb") as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                event = json.loads(line.decode("utf-8"))
+                event['event_id'], event['kind'], event['record']
+            except (ValueError, KeyError, TypeError) as e:
+                logging.warning("Skipping corrupt spool line %d in %s: %s", line_no, path, e)
+                continue
+            events.append(event)
+    return events
+
+
+def _try_lock(f):
+    """ロックファイルの先頭1バイトを排他ロックする（取得できなければ OSError）。プロセスの終了時には OS が解放する。"""
+    if os.name == "nt":
+        import msvcrt
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+    else:
+        import fcntl
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+
+def _unlock(f):
+    if os.name == "nt":
+        import msvcrt
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        import fcntl
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _acquire_lock(lock_path, wait):
+    """
+    ロックファイルを開いて排他ロックを取得する。他のプロセスが保持している場合は wait 秒まで待つ。
+
+    Returns:
+        file or None: ロックを保持しているファイル（取得できなかった場合は None）
+    """
+    f = open(lock_path, "a+b")
+    deadline = time.monotonic() + wait
+    while True:
+        try:
+            _try_lock(f)
+            return f
+        except OSError:
+            if time.monotonic() >= deadline:
+                f.close()
+                return None
+            time.sleep(LOCK_POLL)
+
+
+def flush_spool(spool_path, apply_batch, lock_wait=LOCK_WAIT):
+    """
+    スプールファイルのイベントを apply_batch に渡して反映し、成功したらファイルを削除する。
+
+    反映中のファイルは "<spool_path>.flushing" に名前を変更してから処理するため、
+    反映中に追記されたイベントは新しいスプールファイルに書き込まれ、取りこぼしは発生しない。
+    反映に失敗した場合は .flushing ファイルを残し、次回の flush_spool で先に再処理する。
+    名前の変更から削除までは "<spool_path>.lock" の排他ロックを保持し、常駐エージェントと shutdown.exe などが
+    同時に反映しないようにする。lock_wait 秒待ってもロックを取得できない場合は反映せずに戻る
+    （イベントはスプールに残り、ロックを保持しているプロセスか次回の反映で処理される）。
+
+    Parameters:
+        spool_path (str): スプールファイルのパス
+        apply_batch (callable): イベントのリストを受け取り、1トランザクションで反映する関数。
+                                戻り値は event_id をキーとする結果の辞書
+        lock_wait (float): 他のプロセスが反映中の場合に待つ最大時間（秒）
+
+    Raises:
+        apply_batch が送出した例外（スプールファイルはそのまま残る）
+        OSError: スプールファイルの名前の変更・削除に失敗した場合
+
+    Returns:
+        dict: event_id をキーとする反映結果（反映するイベントがない、または他のプロセスが反映中の場合は空）
+    """
+    flushing_path = spool_path + FLUSHING_SUFFIX
+    results = {}
+    lock = _acquire_lock(spool_path + LOCK_SUFFIX, lock_wait)
+    if lock is None:
+        logging.info("Another process is flushing %s; leaving events spooled.", spool_path)
+        return results
+    try:
+        # 前回失敗して残った .flushing を先に処理し、その後現在のスプールを処理する
+        for _ in range(2):
+            if not os.path.exists(flushing_path):
+                try:
+                    os.replace(spool_path, flushing_path)
+                except FileNotFoundError:
+                    break
+            try:
+                events = read_events(flushing_path)
+            except FileNotFoundError:
+                # ロックを使わない旧バージョンのプロセスが反映済み
+                continue
+            if events:
+                results.update(apply_batch(events))
+            try:
+                os.remove(flushing_path)
+            except FileNotFoundError:
+                pass
+            logging.info("Flushed %d spooled event(s) from %s.", len(events), spool_path)
+    finally:
+        _unlock(lock)
+        lock.close()
+    return results
@@ -2,48 +2,94 @@
 """
 startup.py - このスクリプトはPCの起動／ログオン時に実行され、以下の処理を行います。
   1. 設定ファイル (config.ini) から必要なパラメータを読み込む。
-  2. ネットワーク共有上のSQLiteデータベースが利用可能になるまで待機する。
-  3. データベースに 'session_logs' テーブルが存在しない場合は自動作成する。
-  4. 起動時の情報（PC固有ID、ログオンユーザー、起動時刻、曜日など）を取得する。
-  5. 再試行ロジック付きで、直接データベースに起動ログレコードを挿入する。
+  2. 起動時の情報（PC固有ID、ログオンユーザー、起動時刻、曜日など）を取得する。
+  3. ネットワーク共有上のSQLiteデータベースが利用可能になるまで待機する（スプール無効時のみ）。
+  4. データベースに 'session_logs' テーブルが存在しない場合は自動作成する（スプール無効時のみ）。
+  5. 起動ログをローカルのスプールへ書き込み、再試行ロジック付きでスプール全体（前回までの未反映分を含む）を
+     データベースへ反映する。スプール無効時は直接データベースに起動ログレコードを挿入する。
   6. config.ini の "show_console" 設定に応じて、実行時のコンソールウィンドウを表示または非表示にする。
+  7. 各処理（共有の選択、スキーマ確認、スプール、書き込み、再試行）の所要時間を計測し、
+     config.ini の [Metrics] path に1回の実行につき1行の JSON として記録する（metrics.py）。
+  8. config.ini の [Agent] enabled が True の場合は終了せずに常駐し、現在のセッションの最終確認時刻を
+     一定間隔で記録する（agent.py）。電源断などでシャットダウンが記録されなかった場合の終了時刻の推定に使用する。
 """
 
-import os
-import socket
-import datetime
-import time
-import configparser
 import logging
-import random
-import ctypes
+
+import logsetup
+import metrics
 
 # 共通処理は utils.py に定義している
 from utils import (
     load_config,
+    get_spool_path,
+    get_collector,
+    get_shard_path,
+    ensure_shard,
+    get_retry_policy,
+    configure_database,
+    get_metrics_path,
+    get_logging_settings,
+    get_agent_settings,
     ensure_table_exists,
-    wait_for_network_share,
+    select_database,
     get_startup_info,
     insert_startup_info_with_retry,
 )
 
-# ログ設定：ファイル出力やハンドラーの追加が必要な場合は適宜調整してください
-logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+# 起動ログをスプールへ記録するまではログをメモリに溜めるだけにし、記録後に [Logging] startup_path と
+# debug の値で設定する（ログはキュー経由で別スレッドが出力する）
+logsetup.buffer()
 
 def hide_console():
     """
     Windows API を利用して、コンソールウィンドウを非表示にする。
     ※本番環境では画面表示を避け、バックグラウンドで起動ログの処理を行うために使用します。
     """
+    import ctypes
     whnd = ctypes.windll.kernel32.GetConsoleWindow()
     if whnd:
         # 0: SW_HIDE
         ctypes.windll.user32.ShowWindow(whnd, 0)
 
 def main():
-    # 設定ファイル (config.ini) の読み込み（UTF-8 エンコーディング）
-    config = load_config("config.ini")
+    # フェーズごとの所要時間を計測し、[Metrics] path に1行の JSON として記録する
+    metrics.start_run("startup")
+    config = None
+    try:
+        # 設定ファイル (config.ini) の読み込み（UTF-8 エンコーディング）
+        with metrics.phase("config"):
+            config = load_config("config.ini")
+        startup_info = record_startup(config, lambda: logsetup.configure(**get_logging_settings(config, "startup")))
+    except Exception as e:
+        if not logsetup.configured():
+            # 起動ログの記録前に失敗した場合も、溜めたログを出力する（設定ファイルの読み込み前はコンソールのみ）
+            if config:
+                logsetup.configure(**get_logging_settings(config, "startup"))
+            else:
+                logsetup.configure(console=True)
+        metrics.finish_run(get_metrics_path(config) if config else None, e)
+        raise
+    metrics.finish_run(get_metrics_path(config))
+
+    # [Agent] enabled の場合は常駐し、現在のセッションの最終確認時刻（ハートビート）を一定間隔で記録する
+    agent_settings = get_agent_settings(config)
+    if agent_settings:
+        import agent
+        agent.HeartbeatAgent(lambda: select_database(config), startup_info, spool_path=get_spool_path(config),
+                             **agent_settings).run()
+
+def record_startup(config, on_recorded=None):
+    """
+    設定に従って起動情報を収集し、データベースへ記録する（main から呼び出す）。
+
+    Parameters:
+        config (configparser.ConfigParser): 設定オブジェクト
+        on_recorded (callable or None): 起動ログをスプールへ記録した後（スプール無効時は書き込みの前）に呼び出す関数
 
+    Returns:
+        dict: 記録した起動情報
+    """
     # config.ini の設定に従い、コンソールウィンドウの表示/非表示を切り替え
     # "show_console" が False ならコンソールを非表示にする（デフォルトは True）
     show_console = config.getboolean("General", "show_console", fallback=True)
@@ -51,24 +97,59 @@ def main():
         hide_console()
 
     # 設定ファイルから各種パラメータを取得
-    db_path = config.get("Database", "db_path")
     max_retries = config.getint("Retry", "max_retries")
     retry_interval = config.getfloat("Retry", "retry_interval")
     timeout = config.getfloat("General", "timeout")
-
-    # ネットワーク共有上のDBファイルが利用可能になるまで待機する
-    wait_for_network_share(db_path)
-
-    # DBにテーブルが存在しない場合は自動で作成する
-    ensure_table_exists(db_path, timeout)
+    # [Database] profile の PRAGMA 設定を、このプロセスで再利用する接続に適用する
+    configure_database(config)
+    spool_path = get_spool_path(config)
+    collector = get_collector(config)
+    retry_policy = get_retry_policy(config)
 
     # 起動時の情報（pc_id, user_account, start_time, weekday等）を取得する
+    # （共有の待機より前に取得し、待機時間が起動時刻に含まれないようにする）
     startup_info = get_startup_info()
     logging.info("Startup info: %s", startup_info)
 
+    def resolve_db_path():
+        """
+        書き込み先のデータベースを決める（スプール有効時はスプールへの記録後に呼び出される）。
+        [Database] db_path と fallback_paths の候補を同時にプローブし、利用可能な最初の候補を使用する。
+        スプール・集約サービスを使用しない場合は、いずれかが利用可能になるまで間隔を伸ばしながら待機する。
+        スプール有効時にシャードが利用できない場合は None を返す（イベントはスプールに残る）。
+        """
+        wait = not spool_path and not collector
+        db_path = select_database(config, wait=wait)
+        shard_path = get_shard_path(config, db_path)
+        if shard_path:
+            # 他のPCとロックを共有しないよう、中央DBではなくこのPC専用のシャードファイルへ書き込む
+            # （central_db_setup/shard_merge.py が中央DBへ取り込む）
+            with metrics.phase("ensure_shard"):
+                available = ensure_shard(shard_path, timeout)
+            if available:
+                metrics.set_value("shard_path", shard_path)
+                return shard_path
+            if spool_path:
+                # イベントはスプールに残し、シャードが利用可能になってから反映する
+                # （中央DBへ書き込むと、シャットダウンがシャードに記録され、セッションが分かれるため）
+                logging.warning("Shard %s not available; events remain spooled.", shard_path)
+                return None
+            # スプール無効時は記録を失わないよう中央DBへ書き込む（シャットダウンは中央DBの未終了セッションも確認する）
+            logging.warning("Shard %s not available; writing to %s instead.", shard_path, db_path)
+            wait = True
+        if wait:
+            # DBにテーブルが存在しない場合は自動で作成する
+            with metrics.phase("ensure_table"):
+                ensure_table_exists(db_path, timeout)
+        return db_path
+
     # 再試行ロジックを用い、ネットワーク共有上のSQLite DBに起動ログを安全に挿入する
-    insert_startup_info_with_retry(db_path, startup_info, max_retries, retry_interval, timeout)
-    logging.info("Startup record inserted successfully.")
+    # （スプール有効時は先にローカルへ書き込み、共有が利用できなければ次回に反映する）
+    insert_startup_info_with_retry(resolve_db_path, startup_info, max_retries, retry_interval, timeout,
+                                   spool_path=spool_path, collector=collector, retry_policy=retry_policy,
+                                   on_recorded=on_recorded)
+    logging.info("Startup record processed successfully.")
+    return startup_info
 
 if __name__ == "__main__":
     main()
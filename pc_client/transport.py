@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""
+transport.py - 集約サービス (central_db_setup/collector.py) へイベントを送信するクライアント側の関数群
+
+config.ini の [Transport] mode が "collector" の場合、各PCはネットワーク共有上のSQLiteファイルへ
+直接書き込む代わりに、TCP で集約サービスへイベントを送信します。集約サービスは受け取ったイベントを
+まとめて1つのトランザクションでコミットした後に応答を返します。
+
+通信形式（1接続につき1リクエスト、UTF-8 の JSON を改行で区切る。1リクエストは MAX_EVENTS_PER_REQUEST 件まで）:
+    リクエスト: {"events": [{"event_id": ..., "kind": "startup" | "shutdown", "record": {...}}, ...]}
+    応答:       {"ok": true, "results": {event_id: 結果, ...}} または {"ok": false, "error": "..."}
+
+提供する機能:
+  ・CollectorError: 集約サービスへの送信に失敗したことを表す例外
+  ・send_events: イベントのリストを集約サービスへ送信し、コミット結果を受け取る
+"""
+
+import json
+import socket
+
+# 1リクエストで送るイベントの最大件数（スプールの未反映分が多い場合は分けて送る）。
+# 1件は数百バイトのため、集約サービスの1リクエストの上限（collector.py の MAX_REQUEST_BYTES）に収まる
+MAX_EVENTS_PER_REQUEST = 100
+
+
+class CollectorError(Exception):
+    """集約サービスに接続できない、または集約サービスがイベントを反映できなかった場合の例外。"""
+
+
+def send_events(collector, events):
+    """
+    イベントのリストを MAX_EVENTS_PER_REQUEST 件ずつのリクエストに分けて集約サービスへ送信し、
+    それぞれのコミット完了の応答を待つ。途中のリクエストで失敗した場合、それまでのリクエストはコミット済みだが、
+    再送しても event_id により二重には記録されない。
+
+    Parameters:
+        collector (tuple): (host, port, timeout) 集約サービスのアドレスとタイムアウト秒数
+        events (list): event_id, kind, record を持つイベントのリスト
+
+    Raises:
+        CollectorError: 接続・送受信に失敗した場合、または集約サービスがエラーを返した場合
+
+    Returns:
+        dict: event_id をキーとする反映結果（utils.apply_events と同形式）
+    """
+    results = {}
+    for i in range(0, len(events), MAX_EVENTS_PER_REQUEST):
+        results.update(_send_request(collector, events[i:i + MAX_EVENTS_PER_REQUEST]))
+    return results
+
+
+def _send_request(collector, events):
+    """1接続で1リクエストを送信し、応答の反映結果を返す。"""
+    host, port, timeout = collector
+    payload = (json.dumps({'events': events}, ensure_ascii=False, separators=(',', ':')) + "\n").encode("utf-8")
+    try:
+        with socket.create_connection((host, port), timeout=timeout) as sock:
+            sock.sendall(payload)
+            with sock.makefile("rb") as f:
+                line = f.readline()
+    except OSError as e:
+        raise CollectorError(f"collector {host}:{port} unreachable: {e}") from e
+    if not line:
+        raise CollectorError(f"collector {host}:{port} closed the connection without a response")
+    try:
+        response = json.loads(line.decode("utf-8"))
+    except ValueError as e:
+        raise CollectorError(f"invalid response from collector {host}:{port}: {e}") from e
+    if not response.get('ok'):
+        raise CollectorError(f"collector {host}:{port} returned an error: {response.get('error')}")
+    return response.get('results', {})
@@ -3,30 +3,83 @@
 utils.py - startup.py と shutdown.py で共通に利用するユーティリティ関数群
 
 提供する機能:
+  ・get_base_dir: 設定ファイル等の基準ディレクトリ（スクリプトまたはEXEのあるディレクトリ）を取得
   ・load_config: 設定ファイル (config.ini) の読み込み（UTF-8）
-  ・ensure_table_exists: 'session_logs' テーブルの存在確認・自動作成
+  ・get_spool_path: [Spool] 設定からスプールファイルのパスを取得（無効時は None）
+  ・get_collector: [Transport] 設定から集約サービスの接続先を取得（直接書き込み時は None）
+  ・get_logging_settings: [Logging] と [General] debug の設定からログ設定 (logsetup.configure) の引数を取得
+  ・get_metrics_path: [Metrics] 設定からフェーズ別の計測結果の記録ファイルのパスを取得（無効時は None）
+  ・get_agent_settings: [Agent] 設定から常駐エージェント (agent.HeartbeatAgent) の設定を取得（無効時は None）
+  ・configure_database: [Database] 設定から接続のプロファイル（PRAGMA の組み合わせ）と書き込み方式を設定
+  ・set_write_mode: 起動・シャットダウンの記録方式（"update" または "events"）を設定
+  ・get_schema_version: PRAGMA user_version からスキーマバージョンを取得
+  ・ensure_table_exists: スキーマバージョンの確認（未初期化の場合のみ 'session_logs' テーブルを自動作成）
+  ・get_db_targets: [Database] 設定からデータベースの候補（db_path と fallback_paths）を優先順位の順に取得
+  ・select_database: 候補を同時にプローブし、利用可能な最初の候補を選択（必要なら利用可能になるまで待機）
   ・wait_for_network_share: ネットワーク共有上のSQLiteファイルが利用可能になるまで待機
   ・compute_duration: 起動時刻とシャットダウン時刻から利用時間（秒）を計算（負の場合は0）
+  ・get_retry_policy: [Retry] 設定から再試行ポリシー (retry.RetryPolicy) を作成
   ・execute_db_write: 汎用DB書き込み関数（再試行ロジック付き）
-  ・get_start_time_for_duration: 指定PC・ユーザーの未更新起動レコードから start_time を取得
+  ・get_start_time_for_duration: 指定PC・ユーザーの未更新起動レコードから start_time と user_account を取得
   ・get_startup_info: 起動／ログオン時の情報を収集（shutdown_timeは空、duration=0）
   ・insert_startup_record: 起動情報のレコードをDBに挿入する
   ・insert_startup_info_with_retry: 起動情報の挿入を再試行ロジック付きで実行する
   ・update_shutdown_record: シャットダウン時の情報で、未更新の起動レコードを更新する
   ・insert_shutdown_record: 対象がない場合にシャットダウン情報を新規挿入する
-  ・update_shutdown_info_with_retry: シャットダウン情報の更新／挿入を再試行ロジック付きで実行する
+  ・record_shutdown: シャットダウン情報の検索・duration算出・更新（または挿入）を1接続・1トランザクションで実行する
+  ・apply_events_to_sessions: イベントをトランザクション中のカーソルで session_logs へ反映する（pair_events.py と共通）
+  ・apply_events: スプールのイベントを1接続・1トランザクションでDBへ反映する（event_id により冪等）
+  ・flush_spool_with_retry: スプールファイルのイベントを再試行ロジック付きでDBへ反映する（共有が無ければ待機しない）
+  ・update_shutdown_info_with_retry: record_shutdown を再試行ロジック付きで実行する
 """
 
-import configparser
+# 起動／シャットダウン時の起動時間を短縮するため、モジュールの読み込み時に必要なものは最小限とし、
+# sqlite3、datetime、socket、configparser などは使用する関数内で import する（遅延 import）。
+# また、ログ設定などの副作用はモジュールの読み込み時には行わない（呼び出し側のスクリプトが logsetup.configure で設定する）。
+# 各処理の所要時間は metrics.phase で計測する（startup.py / shutdown.py が計測を開始していない場合は何もしない）。
+# DBへの接続は connection.get_connection により、1つのプロセス内で同じデータベースへの接続を1本だけ作成して再利用する。
 import os
-import sqlite3
 import time
 import logging
-import random
-import datetime
-import socket
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+import metrics
+import spool
+
+# クライアントが前提とするスキーマバージョン（central_db_setup/init_db.py の移行番号に対応）
+SCHEMA_VERSION = 2
+
+# session_logs がコンパクト形式 (sessions / pcs / users) の互換ビューに置き換えられたスキーマバージョン。
+# このバージョン以上ではシャットダウンの記録に sessions を直接扱うクエリを使用する
+COMPACT_SCHEMA_VERSION = 5
+
+# 追記専用のイベントログ session_events が作成されたスキーマバージョン
+EVENT_LOG_SCHEMA_VERSION = 8
+
+# PC・ユーザーごとの未終了セッションの参照 open_sessions が作成されたスキーマバージョン。
+# このバージョン以上ではシャットダウンの記録で未終了セッションを検索せず、open_sessions の主キーで取得する
+OPEN_SESSIONS_SCHEMA_VERSION = 9
+
+WRITE_MODES = ("update", "events")
+
+# 起動・シャットダウンの記録方式（configure_database / set_write_mode で設定する）。
+#   update: session_logs へ起動レコードを挿入し、シャットダウン時に未終了のレコードを検索して更新する
+#   events: session_events へ1行を追記するだけにする（session_logs へは central_db_setup/pair_events.py が反映する）
+_write_mode = "update"
+
+
+def get_base_dir():
+    """
+    設定ファイルやスプールファイルの基準ディレクトリを返す。
+    通常はスクリプトがあるディレクトリ、EXE化時はEXEファイルのあるディレクトリ。
+
+    Returns:
+        str: 基準ディレクトリの絶対パス
+    """
+    import sys
+    if getattr(sys, 'frozen', False):
+        # EXE化された状態の場合、EXEがあるディレクトリを基準とする
+        return os.path.dirname(sys.executable)
+    return os.path.dirname(os.path.abspath(__file__))
 
 
 def load_config(config_path="config.ini"):
@@ -39,13 +92,8 @@ def load_config(config_path="config.ini"):
     Returns:
         configparser.ConfigParser: 読み込んだ設定オブジェクト
     """
-    import sys
-    if getattr(sys, 'frozen', False):
-        # EXE化された状態の場合、EXEがあるディレクトリを基準とする
-        base_dir = os.path.dirname(sys.executable)
-    else:
-        base_dir = os.path.dirname(os.path.abspath(__file__))
-    full_path = os.path.join(base_dir, config_path)
+    import configparser
+    full_path = os.path.join(get_base_dir(), config_path)
     if not os.path.exists(full_path):
         raise FileNotFoundError(f"Configuration file '{full_path}' not found.")
     config = configparser.ConfigParser()
@@ -54,17 +102,220 @@ def load_config(config_path="config.ini"):
     return config
 
 
+def get_spool_path(config):
+    """
+    config.ini の [Spool] セクションからスプールファイルのパスを取得する。
+    相対パスの場合は get_base_dir() を基準とする。
 
-def ensure_table_exists(db_path, timeout):
+    Parameters:
+        config (configparser.ConfigParser): 設定オブジェクト
+
+    Returns:
+        str or None: スプールファイルの絶対パス（スプールが無効の場合は None）
+    """
+    if not config.getboolean("Spool", "enabled", fallback=False):
+        return None
+    path = config.get("Spool", "path", fallback="outbox.spool")
+    return os.path.join(get_base_dir(), path)
+
+
+def get_logging_settings(config, kind):
     """
-    SQLiteデータベース内に 'session_logs' テーブルが存在しない場合、
-    CREATE TABLE IF NOT EXISTS を実行してテーブルを自動作成する。
+    config.ini の [Logging] セクションと [General] debug から、ログ設定 (logsetup.configure) の引数を取得する。
+    常駐エージェントとして長時間ファイルを開いたままにする startup.exe と、shutdown.exe は別のファイルへ出力する
+    （他方が開いているファイルを切り替えられないため）。相対パスの場合は get_base_dir() を基準とする。
 
     Parameters:
-        db_path (str): データベースファイルのパス
-        timeout (float): SQLite接続時のタイムアウト秒数
+        config (configparser.ConfigParser): 設定オブジェクト
+        kind (str): 実行の種類（"startup" または "shutdown"）
+
+    Returns:
+        dict: logsetup.configure のキーワード引数（log_path, level, console, max_bytes, backup_count, when,
+              flush_timeout）
+    """
+    if kind == "startup":
+        path = config.get("Logging", "startup_path", fallback="startup.log").strip()
+    else:
+        path = config.get("Logging", "path", fallback="application.log").strip()
+    debug = config.getboolean("General", "debug", fallback=False)
+    return {
+        'log_path': os.path.join(get_base_dir(), path) if path else None,
+        'level': logging.DEBUG if debug else logging.INFO,
+        # startup.exe は従来どおりコンソールにも出力する（show_console = False の場合は非表示）
+        'console': kind == "startup",
+        'max_bytes': config.getint("Logging", "max_bytes", fallback=1048576),
+        'backup_count': config.getint("Logging", "backup_count", fallback=5),
+        'when': config.get("Logging", "when", fallback="").strip(),
+        'flush_timeout': config.getfloat("Logging", "flush_timeout", fallback=2.0),
+    }
+
+
+def get_metrics_path(config):
+    """
+    config.ini の [Metrics] セクションから、フェーズ別の計測結果を追記する記録ファイルのパスを取得する。
+    相対パスの場合は get_base_dir() を基準とする。
+
+    Parameters:
+        config (configparser.ConfigParser): 設定オブジェクト
+
+    Returns:
+        str or None: 記録ファイルの絶対パス（計測が無効の場合は None）
+    """
+    if not config.getboolean("Metrics", "enabled", fallback=False):
+        return None
+    path = config.get("Metrics", "path", fallback="metrics.jsonl")
+    return os.path.join(get_base_dir(), path)
+
+
+def get_agent_settings(config):
+    """
+    config.ini の [Agent] セクションから、常駐エージェント (agent.HeartbeatAgent) の設定を取得する。
+    シャード書き込み (mode = shard) ではセッションが中央DBに取り込まれるまで記録できないため、使用しない。
+
+    Parameters:
+        config (configparser.ConfigParser): 設定オブジェクト
+
+    Returns:
+        dict or None: HeartbeatAgent のキーワード引数（interval, retry_interval, busy_timeout, probe_timeout）。
+                      無効の場合は None
+    """
+    if not config.getboolean("Agent", "enabled", fallback=False):
+        return None
+    if config.get("Transport", "mode", fallback="sqlite").strip().lower() == "shard":
+        logging.warning("Agent mode is not supported with [Transport] mode = shard; heartbeats are disabled.")
+        return None
+    return {
+        'interval': config.getfloat("Agent", "interval", fallback=300.0),
+        'retry_interval': config.getfloat("Agent", "retry_interval", fallback=60.0),
+        'busy_timeout': config.getfloat("Agent", "busy_timeout", fallback=0.2),
+        'probe_timeout': config.getfloat("Database", "probe_timeout", fallback=2.0),
+    }
+
+
+def get_collector(config):
+    """
+    config.ini の [Transport] セクションから集約サービスの接続先を取得する。
+
+    Parameters:
+        config (configparser.ConfigParser): 設定オブジェクト
+
+    Returns:
+        tuple or None: (host, port, timeout)（mode が "collector" 以外の場合は None）
+    """
+    if config.get("Transport", "mode", fallback="sqlite").strip().lower() != "collector":
+        return None
+    return (
+        config.get("Transport", "host", fallback="127.0.0.1"),
+        config.getint("Transport", "port", fallback=8765),
+        config.getfloat("Transport", "timeout", fallback=3.0),
+    )
+
+
+def get_shard_path(config, db_path):
+    """
+    config.ini の [Transport] mode が "shard" の場合に、このPC専用のシャードファイルのパスを返す。
+    シャードファイルは shard_dir（相対パスの場合は中央データベースと同じフォルダーが基準）に
+    "<pc_id>.sqlite3" として作成され、central_db_setup/shard_merge.py が中央データベースへ取り込む。
+
+    Parameters:
+        config (configparser.ConfigParser): 設定オブジェクト
+        db_path (str): 中央データベースファイルのパス
+
+    Returns:
+        str or None: シャードファイルのパス（mode が "shard" 以外の場合は None）
+    """
+    import socket
+    if config.get("Transport", "mode", fallback="sqlite").strip().lower() != "shard":
+        return None
+    shard_dir = config.get("Transport", "shard_dir", fallback="shards").strip()
+    if not os.path.isabs(shard_dir):
+        shard_dir = os.path.join(os.path.dirname(db_path), shard_dir)
+    return os.path.join(shard_dir, socket.gethostname() + ".sqlite3")
+
+
+def configure_database(config):
+    """
+    config.ini の [Database] セクションの profile と pragmas から、このプロセスで使用する
+    接続のプロファイル（connection.PROFILES）を設定する。
+    あわせて write_mode から起動・シャットダウンの記録方式（set_write_mode）を設定する。
+
+    Parameters:
+        config (configparser.ConfigParser): 設定オブジェクト
+
+    Raises:
+        ValueError: 未知のプロファイル名、不正な PRAGMA、または未知の write_mode が指定された場合
+
+    Returns:
+        connection.ConnectionProfile: 設定したプロファイル
+    """
+    import connection
+    set_write_mode(config.get("Database", "write_mode", fallback="update"))
+    return connection.configure(
+        config.get("Database", "profile", fallback=connection.DEFAULT_PROFILE),
+        config.get("Database", "pragmas", fallback=""),
+    )
+
+
+def set_write_mode(mode):
+    """
+    このプロセスの起動・シャットダウンの記録方式を設定する。
+    "events" の場合、スキーマバージョンが EVENT_LOG_SCHEMA_VERSION 以上のデータベースへは
+    session_events への INSERT だけで記録する（それより古いデータベースへは従来どおり記録する）。
+
+    Parameters:
+        mode (str): WRITE_MODES のいずれか
+
+    Raises:
+        ValueError: 未知の記録方式が指定された場合
+    """
+    global _write_mode
+    mode = mode.strip().lower()
+    if mode not in WRITE_MODES:
+        raise ValueError(f"Unknown write_mode '{mode}' (expected one of {', '.join(WRITE_MODES)}).")
+    _write_mode = mode
+
+
+def _use_event_log(version):
+    """記録方式が "events" で、スキーマバージョン version のデータベースが session_events に対応していれば True を返す。"""
+    if _write_mode != "events":
+        return False
+    if version < EVENT_LOG_SCHEMA_VERSION:
+        logging.warning("write_mode = events requires schema version %d (database is %d); updating session_logs "
+                        "directly. Run central_db_setup/init_db.py to migrate.", EVENT_LOG_SCHEMA_VERSION, version)
+        return False
+    return True
+
+
+def get_schema_version(conn):
     """
-    create_table_query = """
+    PRAGMA user_version から中央データベースのスキーマバージョンを取得する。
+    バージョンは central_db_setup/init_db.py のスキーマ移行により更新される。
+
+    Parameters:
+        conn (sqlite3.Connection): データベース接続
+
+    Returns:
+        int: スキーマバージョン（未初期化の場合は 0）
+    """
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def _ensure_schema(conn):
+    """
+    既に開いている接続に対してスキーマの確認を行う（ensure_table_exists の本体）。
+    PRAGMA user_version が SCHEMA_VERSION 以上であれば何もしない。
+
+    Parameters:
+        conn (sqlite3.Connection): データベース接続
+
+    Returns:
+        int: 確認時点のスキーマバージョン
+    """
+    version = get_schema_version(conn)
+    if version >= SCHEMA_VERSION:
+        logging.debug("Database schema version %d is up to date.", version)
+        return version
+    conn.execute("""
     CREATE TABLE IF NOT EXISTS session_logs (
         session_id INTEGER PRIMARY KEY AUTOINCREMENT,
         pc_id TEXT NOT NULL,
@@ -75,38 +326,216 @@ def ensure_table_exists(db_path, timeout):
         session_type TEXT,
         weekday TEXT
     );
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS spool_events (
+        event_id TEXT PRIMARY KEY,
+        kind TEXT NOT NULL,
+        applied_at DATETIME NOT NULL
+    ) WITHOUT ROWID;
+    """)
+    logging.warning("Database schema version is %d (expected %d). Run central_db_setup/init_db.py to create indexes.",
+                    version, SCHEMA_VERSION)
+    logging.info("Ensured that tables 'session_logs' and 'spool_events' exist in the database.")
+    return version
+
+
+# シャードファイルのスキーマ。中央データベースの session_logs / spool_events と同じ形式に加えて、
+# 行の追加・更新ごとに shard_changes へ連番を記録し、取り込み側が前回以降の変更だけを読めるようにする
+_SHARD_SCHEMA = [
     """
+    CREATE TABLE IF NOT EXISTS session_logs (
+        session_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        pc_id TEXT NOT NULL,
+        user_account TEXT NOT NULL,
+        start_time DATETIME NOT NULL,
+        shutdown_time DATETIME,
+        duration INTEGER,
+        session_type TEXT,
+        weekday TEXT
+    )
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_session_logs_open
+        ON session_logs (pc_id, user_account, start_time)
+        WHERE shutdown_time IS NULL OR shutdown_time = ''
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS spool_events (
+        event_id TEXT PRIMARY KEY,
+        kind TEXT NOT NULL,
+        applied_at DATETIME NOT NULL
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS shard_changes (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        session_id INTEGER NOT NULL
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS shard_changes_insert AFTER INSERT ON session_logs
+    BEGIN
+        INSERT INTO shard_changes (session_id) VALUES (NEW.session_id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS shard_changes_update AFTER UPDATE ON session_logs
+    BEGIN
+        INSERT INTO shard_changes (session_id) VALUES (NEW.session_id);
+    END
+    """,
+    # シャード作成時の識別子（シャードが削除・再作成された場合に取り込み側で検出する）
+    """
+    CREATE TABLE IF NOT EXISTS shard_info (
+        name TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    ) WITHOUT ROWID
+    """,
+    "INSERT OR IGNORE INTO shard_info (name, value) VALUES ('uid', lower(hex(randomblob(16))))",
+]
+
+
+def ensure_shard(shard_path, timeout):
+    """
+    このPC専用のシャードファイルを作成し、スキーマを確認する（作成済みなら PRAGMA の読み取り1回のみ）。
+    シャードのフォルダーが利用できない場合は作成せずに False を返す（イベントはスプールに残る）。
+
+    Parameters:
+        shard_path (str): get_shard_path で取得したシャードファイルのパス
+        timeout (float): SQLite接続時のタイムアウト秒数
+
+    Returns:
+        bool: シャードファイルが利用可能な場合は True
+    """
+    import sqlite3
+    import connection
+    if not os.path.isdir(os.path.dirname(shard_path)):
+        logging.warning("Shard directory %s not available.", os.path.dirname(shard_path))
+        return False
+    if not os.path.exists(shard_path):
+        # シャードファイルが削除された後に残っている接続は使わない（新しいファイルを作成する）
+        connection.close_connection(shard_path)
+    conn = None
     try:
-        with sqlite3.connect(db_path, timeout=timeout) as conn:
-            cursor = conn.cursor()
-            cursor.execute(create_table_query)
-            conn.commit()
-            logging.info("Ensured that table 'session_logs' exists in the database.")
+        conn = connection.get_connection(shard_path, timeout)
+        if get_schema_version(conn) >= SCHEMA_VERSION:
+            return True
+        conn.execute("BEGIN IMMEDIATE")
+        for statement in _SHARD_SCHEMA:
+            conn.execute(statement)
+        conn.execute(f"PRAGMA user_version = {int(SCHEMA_VERSION)}")
+        conn.execute("COMMIT")
+        logging.info("Created shard database %s.", shard_path)
+        return True
+    except sqlite3.Error as e:
+        if conn is not None:
+            connection.release_on_error(conn, e)
+        logging.error("Could not prepare shard database %s: %s", shard_path, e)
+        return False
+
+
+def ensure_table_exists(db_path, timeout):
+    """
+    SQLiteデータベースのスキーマが利用可能な状態かを確認する。
+    PRAGMA user_version が SCHEMA_VERSION 以上であれば、init_db.py によりテーブルと
+    インデックスが作成済みのため、DDL は実行せずに戻る（PRAGMA の読み取り1回のみ）。
+    未初期化の場合に限り、CREATE TABLE IF NOT EXISTS で 'session_logs' テーブルを作成する。
+    （インデックスの作成は全件走査を伴うため、クライアントからは行わず init_db.py に任せる）
+
+    Parameters:
+        db_path (str): データベースファイルのパス
+        timeout (float): SQLite接続時のタイムアウト秒数
+    """
+    import sqlite3
+    import connection
+    conn = None
+    try:
+        conn = connection.get_connection(db_path, timeout)
+        _ensure_schema(conn)
     except sqlite3.Error as e:
         logging.error("Error ensuring table exists: %s", e)
+        if conn is not None:
+            connection.release_on_error(conn, e)
         raise
 
 
+def get_db_targets(config):
+    """
+    config.ini の [Database] セクションから、データベースの候補を優先順位の順に取得する。
+    db_path（プライマリ）の後に fallback_paths（1行に1つ、またはセミコロン区切り）の候補が続く。
+    相対パスの場合は get_base_dir() を基準とする（ローカルの代替DBなど）。
+
+    Parameters:
+        config (configparser.ConfigParser): 設定オブジェクト
+
+    Returns:
+        list: 候補のパスのリスト（重複は除く）
+    """
+    targets = []
+    paths = [config.get("Database", "db_path")]
+    paths += config.get("Database", "fallback_paths", fallback="").replace(";", "\n").splitlines()
+    for path in paths:
+        path = path.strip()
+        if not path:
+            continue
+        if not os.path.isabs(path) and not path.startswith("\\\\"):
+            path = os.path.join(get_base_dir(), path)
+        if path not in targets:
+            targets.append(path)
+    return targets
+
+
+def select_database(config, wait=False):
+    """
+    get_db_targets の候補を failover.select_target で同時にプローブし、利用可能な最初の候補を返す。
+    前回利用できた候補は [Database] state_file（既定: db_target.state）に記録し、次回はその候補を先にプローブする。
+
+    Parameters:
+        config (configparser.ConfigParser): 設定オブジェクト
+        wait (bool): True の場合は利用可能な候補が見つかるまで間隔を伸ばしながら待機する
+                     （False の場合は1回だけプローブし、見つからなければプライマリを返す）
+
+    Raises:
+        Exception: wait が True で、[Database] max_wait 秒以内に利用可能な候補が見つからなかった場合
+
+    Returns:
+        str: 選択したデータベースファイルのパス
+    """
+    import failover
+    targets = get_db_targets(config)
+    probe_timeout = config.getfloat("Database", "probe_timeout", fallback=failover.DEFAULT_PROBE_TIMEOUT)
+    state_path = os.path.join(get_base_dir(), config.get("Database", "state_file", fallback="db_target.state"))
+    # 候補が見つからずに終了した場合も、どの共有で時間がかかったかを計測結果に残す
+    metrics.set_value("db_path", targets[0])
+    with metrics.phase("select_database"):
+        if wait:
+            db_path = failover.wait_for_target(targets, probe_timeout,
+                                               max_wait=config.getfloat("Database", "max_wait", fallback=60),
+                                               state_path=state_path)
+        else:
+            db_path = failover.select_target(targets, probe_timeout, state_path) or targets[0]
+    metrics.set_value("db_path", db_path)
+    return db_path
+
+
 def wait_for_network_share(db_path, wait_interval=5, max_wait=60):
     """
     ネットワーク共有上のSQLiteファイル (db_path) が利用可能になるまで待機する。
+    存在確認はタイムアウト付きのプローブ（failover.probe_targets）で行い、応答しない共有でも待機が伸びない。
+    確認の間隔は1秒から wait_interval 秒まで伸ばす。
 
     Parameters:
         db_path (str): ネットワーク共有上のSQLiteデータベースファイルのパス（UNCパス等）
-        wait_interval (int): 存在チェックの間隔（秒）
+        wait_interval (int): 存在チェックの間隔の上限（秒）
         max_wait (int): 最大待機時間（秒）
 
     Raises:
         Exception: 指定された最大待機時間内に利用可能にならなかった場合
     """
-    waited = 0
-    while not os.path.exists(db_path):
-        logging.warning("Network share %s not available. Waiting %d seconds...", db_path, wait_interval)
-        time.sleep(wait_interval)
-        waited += wait_interval
-        if waited >= max_wait:
-            raise Exception(f"Network share {db_path} is not available after waiting {max_wait} seconds.")
-    logging.info("Network share %s is available.", db_path)
+    import failover
+    failover.wait_for_target([db_path], max_wait=max_wait, base_delay=min(1.0, wait_interval),
+                             max_delay=wait_interval)
 
 
 def compute_duration(start_time_str, shutdown_time_str):
@@ -121,6 +550,7 @@ def compute_duration(start_time_str, shutdown_time_str):
     Returns:
         int: 利用時間（秒）
     """
+    import datetime
     fmt = "%Y-%m-%d %H:%M:%S"
     try:
         start_time = datetime.datetime.strptime(start_time_str, fmt)
@@ -135,10 +565,56 @@ def compute_duration(start_time_str, shutdown_time_str):
         return 0
 
 
-def execute_db_write(query, params, db_path, timeout, max_retries, retry_interval):
+def get_retry_policy(config):
+    """
+    config.ini の [Retry] セクションから再試行ポリシーを作成する。
+
+    Parameters:
+        config (configparser.ConfigParser): 設定オブジェクト
+
+    Returns:
+        retry.RetryPolicy: 再試行ポリシー
+    """
+    import retry
+    return retry.RetryPolicy(
+        max_retries=config.getint("Retry", "max_retries"),
+        base_delay=config.getfloat("Retry", "retry_interval"),
+        max_delay=config.getfloat("Retry", "max_interval", fallback=5.0),
+        deadline=config.getfloat("Retry", "deadline", fallback=0),
+        # 1回の試行は接続の busy_timeout（[General] timeout）までロックを待つ
+        attempt_timeout=config.getfloat("General", "timeout", fallback=5.0),
+    )
+
+
+def _resolve_policy(max_retries, retry_interval, retry_policy):
+    """retry_policy が指定されていればそれを、なければ max_retries と retry_interval から作成したポリシーを返す。"""
+    import retry
+    if retry_policy is not None:
+        return retry_policy
+    return retry.RetryPolicy(max_retries=max_retries, base_delay=retry_interval)
+
+
+def _execute_on_shared(db_path, timeout, query, params):
+    """
+    再利用中の接続で1つの SQL を実行する（自動コミット）。エラー時は connection.release_on_error で後始末する。
+
+    Returns:
+        sqlite3.Cursor: 実行したカーソル
+    """
+    import sqlite3
+    import connection
+    conn = connection.get_connection(db_path, timeout)
+    try:
+        return conn.execute(query, params)
+    except sqlite3.Error as e:
+        connection.release_on_error(conn, e)
+        raise
+
+
+def execute_db_write(query, params, db_path, timeout, max_retries, retry_interval, retry_policy=None):
     """
     SQLiteデータベースに対して指定された SQL クエリを実行する汎用関数。
-    "database is locked" エラー発生時、指定された再試行回数までランダムジッター付きで再試行します。
+    "database is locked" エラー発生時、retry.run_with_retry により指数バックオフ（decorrelated jitter）で再試行します。
 
     Parameters:
         query (str): 実行するSQLクエリ（INSERT、UPDATE、DELETE など）
@@ -147,6 +623,7 @@ def execute_db_write(query, params, db_path, timeout, max_retries, retry_interva
         timeout (float): SQLite接続時のタイムアウト秒数
         max_retries (int): 最大再試行回数
         retry_interval (float): 再試行の基本間隔（秒）
+        retry_policy (retry.RetryPolicy or None): 再試行ポリシー（指定時は max_retries, retry_interval より優先）
 
     Raises:
         sqlite3.OperationalError: 再試行回数を超えた場合に例外をスロー
@@ -154,34 +631,37 @@ def execute_db_write(query, params, db_path, timeout, max_retries, retry_interva
     Returns:
         None
     """
-    attempt = 0
-    while True:
-        try:
-            with sqlite3.connect(db_path, timeout=timeout) as conn:
-                cursor = conn.cursor()
-                cursor.execute(query, params)
-                conn.commit()
-            logging.info("Database write successful on attempt %d.", attempt + 1)
-            break
-        except sqlite3.OperationalError as e:
-            if "database is locked" in str(e).lower():
-                attempt += 1
-                if attempt > max_retries:
-                    logging.error("Max retries reached (%d). Unable to execute write query.", max_retries)
-                    raise e
-                else:
-                    sleep_time = retry_interval * random.uniform(1.0, 1.5)
-                    logging.warning("Database is locked. Retry attempt %d/%d in %.2f seconds...", attempt, max_retries, sleep_time)
-                    time.sleep(sleep_time)
-            else:
-                logging.error("OperationalError during DB write: %s", e)
-                raise e
+    import retry
+
+    def write_once():
+        _execute_on_shared(db_path, timeout, query, params)
+
+    policy = _resolve_policy(max_retries, retry_interval, retry_policy)
+    retry.run_with_retry(write_once, policy, "Database write")
+
+
+# open_sessions の主キーの条件（パラメータは pc_id, user_account の順）
+_OPEN_SESSIONS_KEY = """o.pc_key = (SELECT pc_key FROM pcs WHERE pc_id = ?)
+          AND o.user_key = (SELECT user_key FROM users WHERE user_account = ?)"""
+
+
+def _has_open_sessions(db_path, timeout):
+    """再利用中の接続のデータベースに open_sessions があれば True を返す（PRAGMA の読み取りのみ）。"""
+    import sqlite3
+    import connection
+    conn = connection.get_connection(db_path, timeout)
+    try:
+        return get_schema_version(conn) >= OPEN_SESSIONS_SCHEMA_VERSION
+    except sqlite3.Error as e:
+        connection.release_on_error(conn, e)
+        raise
 
 
 def get_start_time_for_duration(db_path, pc_id, user_account, timeout):
     """
     指定された pc_id と user_account に対して、shutdown_time が未設定の最新の起動レコードから
-    start_time を取得する。該当レコードがなければ None を返す。
+    start_time と user_account を取得する。該当レコードがなければ None を返す。
+    open_sessions がある場合（スキーマバージョン9以上）は、検索せずに主キーで取得する。
 
     Parameters:
         db_path (str): データベースファイルのパス
@@ -190,18 +670,23 @@ def get_start_time_for_duration(db_path, pc_id, user_account, timeout):
         timeout (float): SQLite接続時のタイムアウト秒数
 
     Returns:
-        str or None: 取得された起動時刻 (YYYY-MM-DD HH:MM:SS) または None
+        tuple or None: (start_time (YYYY-MM-DD HH:MM:SS), user_account) または None
     """
-    with sqlite3.connect(db_path, timeout=timeout) as conn:
-        cursor = conn.cursor()
+    if _has_open_sessions(db_path, timeout):
+        query = f"""
+        SELECT datetime(o.start_ts, 'unixepoch', 'localtime'), ? FROM open_sessions AS o
+        WHERE {_OPEN_SESSIONS_KEY}
+        """
+        params = (user_account, pc_id, user_account)
+    else:
         query = """
-        SELECT start_time FROM session_logs
+        SELECT start_time, user_account FROM session_logs
         WHERE pc_id = ? AND user_account = ? AND (shutdown_time IS NULL OR shutdown_time = '')
         ORDER BY start_time DESC LIMIT 1
         """
-        cursor.execute(query, (pc_id, user_account))
-        result = cursor.fetchone()
-        return result[0] if result else None
+        params = (pc_id, user_account)
+    result = _execute_on_shared(db_path, timeout, query, params).fetchone()
+    return (result[0], result[1]) if result else None
 
 # --------------- Startup Functions ---------------
 def get_startup_info():
@@ -220,6 +705,8 @@ def get_startup_info():
     Returns:
         dict: 取得された起動情報
     """
+    import datetime
+    import socket
     data = {}
     data['pc_id'] = socket.gethostname()
     data['user_account'] = os.environ.get("USERNAME", "unknown")
@@ -232,9 +719,95 @@ def get_startup_info():
     return data
 
 
+# コンパクト形式のデータベースでは session_logs は互換ビューであり、INSTEAD OF トリガーが
+# pcs / users への登録と sessions への挿入（時刻の UNIX 秒への変換）を行う
+_STARTUP_INSERT_QUERY = """
+    INSERT INTO session_logs
+        (pc_id, user_account, start_time, shutdown_time, duration, session_type, weekday)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+def _startup_params(record_data):
+    """起動情報の辞書を _STARTUP_INSERT_QUERY のパラメータに変換する。"""
+    return (
+        record_data['pc_id'],
+        record_data['user_account'],
+        record_data['start_time'],
+        record_data['shutdown_time'],
+        record_data['duration'],
+        record_data['session_type'],
+        record_data['weekday']
+    )
+
+
+# write_mode = events の場合の記録。event_id が記録済みのイベント（スプールの再送など）は読み飛ばす
+# pair_events.py --keep-days で削除したイベントの event_id は spool_events に残るため、
+# 長期間オフラインだったPCのスプールから同じイベントが届いても再び追記しない
+_EVENT_INSERT_QUERY = """
+    INSERT OR IGNORE INTO session_events (event_id, kind, pc_id, user_account, event_time, session_type)
+    SELECT ?1, ?2, ?3, ?4, ?5, ?6
+    WHERE NOT EXISTS (SELECT 1 FROM spool_events WHERE event_id = ?1)
+"""
+
+
+def _event_params(event):
+    """spool.new_event 形式のイベントを _EVENT_INSERT_QUERY のパラメータに変換する。"""
+    record = event['record']
+    return (
+        event['event_id'],
+        event['kind'],
+        record['pc_id'],
+        record['user_account'],
+        record['start_time'] if event['kind'] == "startup" else record['shutdown_time'],
+        record['session_type']
+    )
+
+
+def _append_events(conn, events):
+    """
+    イベントを session_events へ追記する（write_mode = events の場合の記録。検索・更新は行わない）。
+    1件の場合は自動コミットの INSERT 1回、複数件の場合は1つのトランザクションで executemany する。
+
+    Parameters:
+        conn (sqlite3.Connection): isolation_level=None で開いたデータベース接続
+        events (list): event_id, kind, record を持つイベントのリスト（時系列順）
+
+    Returns:
+        dict: event_id をキーとする反映結果（起動は "event"、シャットダウンは action が "event"、session_id が None、
+              duration が 0 の、record_shutdown と同形式の dict。利用時間は pair_events.py が算出する）
+    """
+    import sqlite3
+    if len(events) == 1:
+        conn.execute(_EVENT_INSERT_QUERY, _event_params(events[0]))
+    elif events:
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(_EVENT_INSERT_QUERY, [_event_params(e) for e in events])
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+    results = {}
+    for event in events:
+        if event['kind'] == "shutdown":
+            results[event['event_id']] = {
+                'action': "event",
+                'session_id': None,
+                'user_account': event['record']['user_account'],
+                'duration': 0,
+            }
+        else:
+            results[event['event_id']] = "event"
+    return results
+
+
 def insert_startup_record(db_path, record_data, timeout):
     """
-    指定された SQLite データベースに接続し、起動情報の新規レコードを挿入する。
+    再利用中の接続で、起動情報の新規レコードを挿入する。
+    スキーマバージョン9以上では、同じ文の中でトリガーが open_sessions の参照を新しいセッションに置き換える。
+    write_mode = events の場合は session_events へ起動イベントを1行追記する。
 
     Parameters:
         db_path (str): データベースファイルのパス
@@ -244,62 +817,87 @@ def insert_startup_record(db_path, record_data, timeout):
     Returns:
         None
     """
-    with sqlite3.connect(db_path, timeout=timeout) as conn:
-        cursor = conn.cursor()
-        query = """
-            INSERT INTO session_logs
-                (pc_id, user_account, start_time, shutdown_time, duration, session_type, weekday)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        """
-        cursor.execute(query, (
-            record_data['pc_id'],
-            record_data['user_account'],
-            record_data['start_time'],
-            record_data['shutdown_time'],
-            record_data['duration'],
-            record_data['session_type'],
-            record_data['weekday']
-        ))
-        conn.commit()
+    if _write_mode == "events":
+        import sqlite3
+        import connection
+        conn = connection.get_connection(db_path, timeout)
+        try:
+            if _use_event_log(get_schema_version(conn)):
+                _append_events(conn, [spool.new_event("startup", record_data)])
+                return
+        except sqlite3.Error as e:
+            connection.release_on_error(conn, e)
+            raise
+    _execute_on_shared(db_path, timeout, _STARTUP_INSERT_QUERY, _startup_params(record_data))
 
 
-def insert_startup_info_with_retry(db_path, record_data, max_retries, retry_interval, timeout):
+def _resolve_db_path(db_path):
+    """db_path が関数の場合は呼び出して書き込み先のパスを決め、文字列の場合はそのまま返す。"""
+    return db_path() if callable(db_path) else db_path
+
+
+def insert_startup_info_with_retry(db_path, record_data, max_retries, retry_interval, timeout, spool_path=None,
+                                   collector=None, retry_policy=None, on_recorded=None):
     """
     SQLiteへの書き込み時に「database is locked」エラーが発生した場合、
-    指定された再試行回数と再試行間隔で起動情報の新規レコード挿入を再試行する。
+    retry.run_with_retry により指数バックオフ（decorrelated jitter）で起動情報の新規レコード挿入を再試行する。
+    spool_path が指定された場合は、先にローカルのスプールファイルへイベントを書き込み（fsync）、
+    その後 flush_spool_with_retry でスプール全体（過去の未反映分を含む）をDBへ反映する。
+    collector が指定された場合は集約サービス経由で書き込み、送信に失敗した場合は同じ event_id のイベントとして
+    apply_events でDBへ直接反映する（応答待ちのタイムアウトで集約サービスが既にコミットしていた場合も二重に記録しない）。
+    db_path に関数を指定した場合は、スプールへの記録（または集約サービスへの送信の失敗）の後に呼び出して
+    書き込み先を決める（候補のプローブや共有の待機でイベントの記録が遅れないようにする）。
+    on_recorded はスプールへの記録の直後（スプール無効時は送信・書き込みの前）に1回呼び出す
+    （呼び出し側のログ出力の設定など、イベントの記録に必要ない処理を記録の後に回すため）。
 
     Parameters:
-        db_path (str): SQLiteデータベースファイルのパス
+        db_path (str or callable): SQLiteデータベースファイルのパス、またはパスを返す引数なしの関数
         record_data (dict): 挿入する起動情報
         max_retries (int): 最大再試行回数
         retry_interval (float): 再試行の基本間隔（秒）
         timeout (float): SQLite接続時のタイムアウト秒数
+        spool_path (str or None): スプールファイルのパス（None の場合はDBへ直接挿入）
+        collector (tuple or None): 集約サービスの (host, port, timeout)（None の場合はDBへ直接書き込む）
+        retry_policy (retry.RetryPolicy or None): 再試行ポリシー（指定時は max_retries, retry_interval より優先）
+        on_recorded (callable or None): イベントの記録後に呼び出す引数なしの関数
 
     Raises:
-        sqlite3.OperationalError: 再試行回数超過時にスロー
+        sqlite3.OperationalError: 再試行回数超過時にスロー（スプール使用時は送出せず、イベントはスプールに残る）
 
     Returns:
         None
     """
-    attempt = 0
-    while True:
+    if spool_path:
+        # イベントの記録を最優先とし、DB反映に必要なモジュールは記録後に読み込む
+        with metrics.phase("spool_append"):
+            spool.append_event(spool_path, spool.new_event("startup", record_data))
+        if on_recorded:
+            on_recorded()
+        flush_spool_with_retry(_resolve_db_path(db_path), spool_path, max_retries, retry_interval, timeout,
+                               collector=collector, retry_policy=retry_policy)
+        return
+    if on_recorded:
+        on_recorded()
+    import retry
+    import transport
+    if collector:
+        event = spool.new_event("startup", record_data)
         try:
-            insert_startup_record(db_path, record_data, timeout)
-            logging.info("Startup record inserted successfully on attempt %d.", attempt + 1)
-            break
-        except sqlite3.OperationalError as e:
-            if "database is locked" in str(e).lower():
-                attempt += 1
-                if attempt > max_retries:
-                    logging.error("Max retries reached (%d). Unable to insert startup record.", max_retries)
-                    raise e
-                else:
-                    sleep_time = retry_interval * random.uniform(1.0, 1.5)
-                    logging.warning("Database is locked. Retry attempt %d/%d in %.2f seconds...", attempt, max_retries, sleep_time)
-                    time.sleep(sleep_time)
-            else:
-                logging.error("OperationalError during startup DB insert: %s", e)
-                raise e
+            with metrics.phase("collector"):
+                transport.send_events(collector, [event])
+            metrics.set_value("transport", "collector")
+            logging.info("Startup record sent to collector %s:%d.", collector[0], collector[1])
+            return
+        except transport.CollectorError as e:
+            logging.warning("%s. Falling back to direct database write.", e)
+        _apply_fallback_event(db_path, event, max_retries, retry_interval, timeout, retry_policy, "startup_insert")
+        return
+
+    db_path = _resolve_db_path(db_path)
+    policy = _resolve_policy(max_retries, retry_interval, retry_policy)
+    metrics.set_value("transport", "sqlite")
+    with metrics.phase("startup_insert"):
+        retry.run_with_retry(lambda: insert_startup_record(db_path, record_data, timeout), policy, "Startup insert")
 
 
 # --------------- Shutdown Functions ---------------
@@ -318,6 +916,8 @@ def get_shutdown_info():
     Returns:
         dict: 取得されたシャットダウン情報
     """
+    import datetime
+    import socket
     data = {}
     data['pc_id'] = socket.gethostname()
     data['user_account'] = os.environ.get("USERNAME", "unknown")
@@ -331,8 +931,9 @@ def get_shutdown_info():
 
 def update_shutdown_record(db_path, record_data, timeout):
     """
-    指定されたデータベースに接続し、対象PC・ユーザーの最新の起動レコードで
+    再利用中の接続で、対象PC・ユーザーの最新の起動レコードで
     shutdown_time が未設定のものを更新する。更新項目は shutdown_time, session_type, duration, weekday。
+    open_sessions がある場合（スキーマバージョン9以上）は、open_sessions が参照する1件のみを更新する。
 
     Parameters:
         db_path (str): データベースファイルのパス
@@ -342,23 +943,28 @@ def update_shutdown_record(db_path, record_data, timeout):
     Returns:
         int: 更新された行数
     """
-    with sqlite3.connect(db_path, timeout=timeout) as conn:
-        cursor = conn.cursor()
+    if _has_open_sessions(db_path, timeout):
+        # open_sessions が参照する1件だけを session_id 指定で更新する
+        query = f"""
+        UPDATE session_logs
+        SET shutdown_time = ?, session_type = ?, duration = ?, weekday = ?
+        WHERE session_id = (SELECT o.session_id FROM open_sessions AS o WHERE {_OPEN_SESSIONS_KEY})
+        """
+    else:
         query = """
         UPDATE session_logs
         SET shutdown_time = ?, session_type = ?, duration = ?, weekday = ?
         WHERE pc_id = ? AND user_account = ? AND (shutdown_time IS NULL OR shutdown_time = '')
         """
-        cursor.execute(query, (
-            record_data['shutdown_time'],
-            record_data['session_type'],
-            record_data['duration'],
-            record_data['weekday'],
-            record_data['pc_id'],
-            record_data['user_account']
-        ))
-        conn.commit()
-        return cursor.rowcount
+    cursor = _execute_on_shared(db_path, timeout, query, (
+        record_data['shutdown_time'],
+        record_data['session_type'],
+        record_data['duration'],
+        record_data['weekday'],
+        record_data['pc_id'],
+        record_data['user_account']
+    ))
+    return cursor.rowcount
 
 
 def insert_shutdown_record(db_path, record_data, timeout):
@@ -374,62 +980,543 @@ def insert_shutdown_record(db_path, record_data, timeout):
     Returns:
         None
     """
-    with sqlite3.connect(db_path, timeout=timeout) as conn:
-        cursor = conn.cursor()
-        query = """
-        INSERT INTO session_logs (pc_id, user_account, start_time, shutdown_time, duration, session_type, weekday)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-        """
-        cursor.execute(query, (
-            record_data['pc_id'],
-            record_data['user_account'],
-            record_data['shutdown_time'],  # 起動時刻情報がないため仮に shutdown_time を利用
+    query = """
+    INSERT INTO session_logs (pc_id, user_account, start_time, shutdown_time, duration, session_type, weekday)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    """
+    _execute_on_shared(db_path, timeout, query, (
+        record_data['pc_id'],
+        record_data['user_account'],
+        record_data['shutdown_time'],  # 起動時刻情報がないため仮に shutdown_time を利用
+        record_data['shutdown_time'],
+        record_data['duration'],
+        record_data['session_type'],
+        record_data['weekday']
+    ))
+
+
+# コンパクト形式 (COMPACT_SCHEMA_VERSION 以上) 用のクエリ。時刻の文字列は SQL 内で UNIX 秒（UTC）に変換する
+_COMPACT_EPOCH = "CAST(strftime('%s', :shutdown_time, 'utc') AS INTEGER)"
+
+_COMPACT_FIND_OPEN_QUERY = f"""
+    SELECT s.session_id, :user_account, COALESCE(MAX(0, {_COMPACT_EPOCH} - s.start_ts), 0)
+    FROM sessions AS s
+    WHERE s.pc_key = (SELECT pc_key FROM pcs WHERE pc_id = :pc_id)
+      AND s.user_key = (SELECT user_key FROM users WHERE user_account = :user_account)
+      AND s.shutdown_ts IS NULL
+    ORDER BY s.start_ts DESC LIMIT 1
+"""
+
+# open_sessions がある場合（OPEN_SESSIONS_SCHEMA_VERSION 以上）の未終了セッションの取得（主キーの参照のみ）
+_POINTER_FIND_OPEN_QUERY = f"""
+    SELECT o.session_id, :user_account, COALESCE(MAX(0, {_COMPACT_EPOCH} - o.start_ts), 0)
+    FROM open_sessions AS o
+    WHERE o.pc_key = (SELECT pc_key FROM pcs WHERE pc_id = :pc_id)
+      AND o.user_key = (SELECT user_key FROM users WHERE user_account = :user_account)
+"""
+
+_COMPACT_UPDATE_SHUTDOWN_QUERY = f"""
+    UPDATE sessions SET shutdown_ts = {_COMPACT_EPOCH}, session_type = :session_type, duration = :duration
+    WHERE session_id = :session_id
+"""
+
+_COMPACT_INSERT_SHUTDOWN_QUERIES = (
+    "INSERT OR IGNORE INTO pcs (pc_id) VALUES (:pc_id)",
+    "INSERT OR IGNORE INTO users (user_account) VALUES (:user_account)",
+    f"""
+    INSERT INTO sessions (pc_key, user_key, start_ts, shutdown_ts, duration, session_type)
+    VALUES ((SELECT pc_key FROM pcs WHERE pc_id = :pc_id),
+            (SELECT user_key FROM users WHERE user_account = :user_account),
+            {_COMPACT_EPOCH}, {_COMPACT_EPOCH}, 0, :session_type)
+    """,
+)
+
+
+def _find_open_session(cursor, record_data, compact=False, pointer=False):
+    """
+    対象PC・ユーザーの最新の未終了セッションを検索し、シャットダウン時刻までの利用時間をSQL内で算出する。
+    （WHERE 句は init_db.py の部分インデックス idx_session_logs_open / idx_sessions_open と同一の式にしている）
+    pointer が True の場合は検索せず、open_sessions の主キーで取得する。
+
+    Parameters:
+        cursor (sqlite3.Cursor): トランザクション中のカーソル
+        record_data (dict): シャットダウン情報
+        compact (bool): コンパクト形式 (sessions テーブル) を直接検索する場合は True
+        pointer (bool): open_sessions から取得する場合は True（スキーマバージョン9以上）
+
+    Returns:
+        tuple or None: (session_id, user_account, duration) または None
+    """
+    if pointer:
+        cursor.execute(_POINTER_FIND_OPEN_QUERY, record_data)
+        return cursor.fetchone()
+    if compact:
+        cursor.execute(_COMPACT_FIND_OPEN_QUERY, record_data)
+        return cursor.fetchone()
+    cursor.execute("""
+    SELECT session_id, user_account,
+           COALESCE(MAX(0, CAST(strftime('%s', ?) AS INTEGER) - CAST(strftime('%s', start_time) AS INTEGER)), 0)
+    FROM session_logs
+    WHERE pc_id = ? AND user_account = ? AND (shutdown_time IS NULL OR shutdown_time = '')
+    ORDER BY start_time DESC LIMIT 1
+    """, (record_data['shutdown_time'], record_data['pc_id'], record_data['user_account']))
+    return cursor.fetchone()
+
+
+def _write_shutdown(cursor, record_data, row, compact=False):
+    """
+    _find_open_session の結果に基づき、該当セッション1件を session_id 指定で更新する。
+    該当がなければ、起動時刻を shutdown_time で代替したレコードを新規挿入する。
+
+    Parameters:
+        cursor (sqlite3.Cursor): トランザクション中のカーソル
+        record_data (dict): シャットダウン情報
+        row (tuple or None): _find_open_session の結果
+        compact (bool): コンパクト形式 (sessions テーブル) を直接更新する場合は True
+
+    Returns:
+        tuple: (action ("update" または "insert"), session_id, user_account, duration)
+    """
+    if compact:
+        if row:
+            session_id, user_account, duration = row
+            cursor.execute(_COMPACT_UPDATE_SHUTDOWN_QUERY,
+                           dict(record_data, session_id=session_id, duration=duration))
+            return "update", session_id, user_account, duration
+        for query in _COMPACT_INSERT_SHUTDOWN_QUERIES:
+            cursor.execute(query, record_data)
+        return "insert", cursor.lastrowid, record_data['user_account'], 0
+
+    if row:
+        session_id, user_account, duration = row
+        cursor.execute("""
+        UPDATE session_logs
+        SET shutdown_time = ?, session_type = ?, duration = ?, weekday = ?
+        WHERE session_id = ?
+        """, (
             record_data['shutdown_time'],
-            record_data['duration'],
             record_data['session_type'],
-            record_data['weekday']
+            duration,
+            record_data['weekday'],
+            session_id
         ))
-        conn.commit()
+        return "update", session_id, user_account, duration
+
+    user_account = record_data['user_account']
+    cursor.execute("""
+    INSERT INTO session_logs (pc_id, user_account, start_time, shutdown_time, duration, session_type, weekday)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, (
+        record_data['pc_id'],
+        user_account,
+        record_data['shutdown_time'],  # 起動時刻情報がないため仮に shutdown_time を利用
+        record_data['shutdown_time'],
+        0,
+        record_data['session_type'],
+        record_data['weekday']
+    ))
+    return "insert", cursor.lastrowid, user_account, 0
 
 
-def update_shutdown_info_with_retry(db_path, record_data, max_retries, retry_interval, timeout):
+def record_shutdown(db_path, record_data, timeout):
     """
-    SQLiteへの書き込み時に「database is locked」エラーが発生した場合、
-    指定された再試行回数および再試行間隔で再試行する。ランダムジッター付き。
+    シャットダウン情報の記録を再利用中の接続上の1つのトランザクション (BEGIN IMMEDIATE) で実行する。
+      1. スキーマバージョンの確認（PRAGMA の読み取りのみ）
+      2. 対象PC・ユーザーの最新の未終了セッションを検索し、利用時間 (duration) をSQL内で算出
+         （スキーマバージョン9以上では open_sessions の主キーで取得する）
+      3. 該当レコード1件のみを session_id 指定で更新（該当がなければ新規挿入）
+    検索と更新の間に書き込みロックを保持するため、他PCの書き込みと競合しない。
+    record_data の duration と user_account（起動時に記録された値）は結果で上書きされる。
+    write_mode = events の場合は 2, 3 の代わりに session_events へシャットダウンイベントを1行追記し、
+    action は "event"、session_id は None、duration は 0 になる（利用時間は pair_events.py が算出する）。
 
     Parameters:
-        db_path (str): SQLiteデータベースファイルのパス
+        db_path (str): データベースファイルのパス
+        record_data (dict): シャットダウン情報
+        timeout (float): SQLite接続時のタイムアウト秒数
+
+    Returns:
+        dict: action ("update" または "insert")、session_id、user_account、duration、
+              timings（各処理段階の所要時間（ミリ秒））
+    """
+    import sqlite3
+    import connection
+    timings = {}
+    started = time.perf_counter()
+    conn = connection.get_connection(db_path, timeout)
+    try:
+        mark = time.perf_counter()
+        timings['connect'] = (mark - started) * 1000
+
+        version = _ensure_schema(conn)
+        compact = version >= COMPACT_SCHEMA_VERSION
+        pointer = version >= OPEN_SESSIONS_SCHEMA_VERSION
+        now = time.perf_counter()
+        timings['schema'] = (now - mark) * 1000
+        mark = now
+
+        if _use_event_log(version):
+            # 検索を行わず、イベントの追記（自動コミットの INSERT 1回）だけで記録する
+            event = spool.new_event("shutdown", record_data)
+            result = _append_events(conn, [event])[event['event_id']]
+            now = time.perf_counter()
+            timings['write'] = (now - mark) * 1000
+            timings['total'] = (now - started) * 1000
+            metrics.add_timings("shutdown", timings)
+            logging.info("Shutdown event appended timing[ms]: %s",
+                         ", ".join("%s=%.1f" % (k, v) for k, v in timings.items()))
+            return dict(result, timings=timings)
+
+        # 書き込みロックを先に取得し、検索から更新までを他の書き込みと直列化する
+        conn.execute("BEGIN IMMEDIATE")
+        now = time.perf_counter()
+        timings['lock'] = (now - mark) * 1000
+        mark = now
+
+        cursor = conn.cursor()
+        row = _find_open_session(cursor, record_data, compact, pointer)
+        now = time.perf_counter()
+        timings['select'] = (now - mark) * 1000
+        mark = now
+
+        action, session_id, user_account, duration = _write_shutdown(cursor, record_data, row, compact)
+        now = time.perf_counter()
+        timings['write'] = (now - mark) * 1000
+        mark = now
+
+        conn.execute("COMMIT")
+        now = time.perf_counter()
+        timings['commit'] = (now - mark) * 1000
+    except sqlite3.Error as e:
+        connection.release_on_error(conn, e)
+        raise
+    timings['total'] = (time.perf_counter() - started) * 1000
+
+    metrics.add_timings("shutdown", timings)
+    record_data['user_account'] = user_account
+    record_data['duration'] = duration
+    logging.info("Shutdown %s (session_id=%s) timing[ms]: %s", action, session_id,
+                 ", ".join("%s=%.1f" % (k, v) for k, v in timings.items()))
+    return {
+        'action': action,
+        'session_id': session_id,
+        'user_account': user_account,
+        'duration': duration,
+        'timings': timings,
+    }
+
+
+def apply_events_to_sessions(cursor, events, compact=False, pointer=False):
+    """
+    イベントのリストを、トランザクション中のカーソルで session_logs（コンパクト形式では sessions）へ反映する。
+    連続する起動イベントは executemany でまとめて挿入し、シャットダウンイベントは
+    record_shutdown と同じ検索・更新処理を順番に適用する。未知の種別のイベントは読み飛ばす。
+    （apply_events_on_connection と central_db_setup/pair_events.py から利用する）
+
+    Parameters:
+        cursor (sqlite3.Cursor): トランザクション中のカーソル
+        events (list): event_id, kind, record を持つイベントのリスト（時系列順）
+        compact (bool): コンパクト形式 (sessions テーブル) を直接更新する場合は True
+        pointer (bool): 未終了セッションを open_sessions から取得する場合は True（スキーマバージョン9以上）
+
+    Returns:
+        dict: event_id をキーとする反映結果（起動は "insert"、シャットダウンは action, session_id,
+              user_account, duration を持つ dict）
+    """
+    results = {}
+    startup_batch = []
+
+    def flush_startups():
+        if startup_batch:
+            cursor.executemany(_STARTUP_INSERT_QUERY, [_startup_params(e['record']) for e in startup_batch])
+            for e in startup_batch:
+                results[e['event_id']] = "insert"
+            del startup_batch[:]
+
+    for event in events:
+        if event['kind'] == "startup":
+            startup_batch.append(event)
+        elif event['kind'] == "shutdown":
+            # シャットダウンは直前の起動イベントを参照するため、先に溜まった起動イベントを挿入する
+            flush_startups()
+            record_data = event['record']
+            row = _find_open_session(cursor, record_data, compact, pointer)
+            action, session_id, user_account, duration = _write_shutdown(cursor, record_data, row, compact)
+            results[event['event_id']] = {
+                'action': action,
+                'session_id': session_id,
+                'user_account': user_account,
+                'duration': duration,
+            }
+        else:
+            logging.warning("Ignoring event %s with unknown kind '%s'.", event['event_id'], event['kind'])
+    flush_startups()
+    return results
+
+
+def apply_events_on_connection(conn, events):
+    """
+    イベントのリストを、既に開いている接続上の1つのトランザクション (BEGIN IMMEDIATE) で中央DBへ反映する。
+    spool_events テーブルに記録済みの event_id は適用済みとして読み飛ばすため、
+    途中で失敗した反映を再実行しても二重登録にはならない。
+    反映処理は apply_events_to_sessions を参照。write_mode = events の場合は session_events へ追記するだけにする
+    （event_id の一意制約により、再実行しても二重登録にはならない）。
+    （apply_events と集約サービス central_db_setup/collector.py から利用する）
+
+    Parameters:
+        conn (sqlite3.Connection): isolation_level=None で開いたデータベース接続
+        events (list): event_id, kind, record を持つイベントのリスト（時系列順）
+
+    Returns:
+        dict: event_id をキーとする反映結果（起動は "insert"、シャットダウンは record_shutdown と同形式の dict、
+              session_events へ追記した場合は "event"）
+    """
+    import sqlite3
+    import datetime
+    timings = {}
+    mark = time.perf_counter()
+    try:
+        version = _ensure_schema(conn)
+        if _use_event_log(version):
+            results = _append_events(conn, events)
+            timings['write'] = (time.perf_counter() - mark) * 1000
+            metrics.add_timings("apply", timings)
+            logging.info("Appended %d event(s) to session_events.", len(events))
+            return results
+        compact = version >= COMPACT_SCHEMA_VERSION
+        conn.execute("BEGIN IMMEDIATE")
+        now = time.perf_counter()
+        timings['lock'] = (now - mark) * 1000
+        mark = now
+        cursor = conn.cursor()
+
+        # 適用済みの event_id を除外する（SQLite のパラメータ数上限を考慮して分割して問い合わせる）
+        applied = set()
+        ids = [event['event_id'] for event in events]
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            cursor.execute("SELECT event_id FROM spool_events WHERE event_id IN (%s)" % ",".join("?" * len(chunk)), chunk)
+            applied.update(r[0] for r in cursor.fetchall())
+        pending = []
+        for event in events:
+            # 同じバッチ内で重複した event_id（クライアントの再送など）も1回だけ適用する
+            if event['event_id'] not in applied:
+                applied.add(event['event_id'])
+                pending.append(event)
+        if len(pending) < len(events):
+            logging.info("Skipping %d already applied event(s).", len(events) - len(pending))
+
+        results = apply_events_to_sessions(cursor, pending, compact, version >= OPEN_SESSIONS_SCHEMA_VERSION)
+
+        applied_at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        cursor.executemany(
+            "INSERT OR IGNORE INTO spool_events (event_id, kind, applied_at) VALUES (?, ?, ?)",
+            [(e['event_id'], e['kind'], applied_at) for e in pending]
+        )
+        now = time.perf_counter()
+        timings['write'] = (now - mark) * 1000
+        mark = now
+        conn.execute("COMMIT")
+        timings['commit'] = (time.perf_counter() - mark) * 1000
+    except sqlite3.Error:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    metrics.add_timings("apply", timings)
+    logging.info("Applied %d event(s) to the database.", len(pending))
+    return results
+
+
+def apply_events(db_path, events, timeout):
+    """
+    スプールから読み込んだイベントを、再利用中の接続上の1つのトランザクションで中央DBへ反映する。
+    （処理内容は apply_events_on_connection を参照）
+
+    Parameters:
+        db_path (str): データベースファイルのパス
+        events (list): spool.read_events で読み込んだイベントのリスト（時系列順）
+        timeout (float): SQLite接続時のタイムアウト秒数
+
+    Returns:
+        dict: event_id をキーとする反映結果
+    """
+    import sqlite3
+    import connection
+    conn = connection.get_connection(db_path, timeout)
+    try:
+        return apply_events_on_connection(conn, events)
+    except sqlite3.Error as e:
+        connection.release_on_error(conn, e)
+        raise
+
+
+def flush_spool_with_retry(db_path, spool_path, max_retries, retry_interval, timeout, collector=None,
+                           retry_policy=None):
+    """
+    スプールファイルのイベントを apply_events で中央DBへ反映する。
+    collector が指定された場合は先に集約サービスへ送信し、接続できなければDBへ直接反映する。
+    ネットワーク共有が利用できない（タイムアウト付きのプローブに応答しない）場合は待機せずに戻り、
+    イベントはスプールに残したまま次回に反映する。
+    「database is locked」エラーの場合は retry.run_with_retry により再試行し、それでも失敗した場合も
+    例外は送出せずイベントをスプールに残す。スプールファイルの操作の失敗 (OSError) も同様に扱う。
+    db_path が None の場合（スプール有効時にシャードが利用できない場合）もイベントをスプールに残す。
+
+    Parameters:
+        db_path (str or None): SQLiteデータベースファイルのパス
+        spool_path (str): スプールファイルのパス
+        max_retries (int): 最大再試行回数
+        retry_interval (float): 再試行の基本間隔（秒）
+        timeout (float): SQLite接続時のタイムアウト秒数
+        collector (tuple or None): 集約サービスの (host, port, timeout)
+        retry_policy (retry.RetryPolicy or None): 再試行ポリシー（指定時は max_retries, retry_interval より優先）
+
+    Returns:
+        dict or None: event_id をキーとする反映結果（反映できなかった場合は None）
+    """
+    import sqlite3
+    import retry
+    import transport
+    if collector:
+        try:
+            with metrics.phase("collector"):
+                results = spool.flush_spool(spool_path, lambda events: transport.send_events(collector, events))
+            metrics.set_value("transport", "collector")
+            metrics.set_value("events", len(results))
+            return results
+        except transport.CollectorError as e:
+            logging.warning("%s. Falling back to direct database write.", e)
+        except OSError as e:
+            logging.error("Spool flush failed: %s. Events remain spooled in %s.", e, spool_path)
+            metrics.set_outcome("spooled")
+            return None
+
+    if db_path is None:
+        # 書き込み先が決まらない（シャードが利用できない）場合は、次回に反映する
+        logging.warning("No database to write to. Events remain spooled in %s.", spool_path)
+        metrics.set_outcome("spooled")
+        return None
+
+    import failover
+    metrics.set_value("transport", "sqlite")
+    with metrics.phase("probe"):
+        available = failover.probe_targets([db_path])
+    if not available:
+        logging.warning("Network share %s not available. Events remain spooled in %s.", db_path, spool_path)
+        metrics.set_outcome("spooled")
+        return None
+
+    policy = _resolve_policy(max_retries, retry_interval, retry_policy)
+    try:
+        with metrics.phase("spool_flush"):
+            results = retry.run_with_retry(
+                lambda: spool.flush_spool(spool_path, lambda events: apply_events(db_path, events, timeout)),
+                policy, "Spool flush")
+    except (sqlite3.Error, OSError) as e:
+        # OSError: スプールファイルの名前の変更・削除の失敗（他のプロセスが開いている場合など）
+        logging.error("Spool flush failed: %s. Events remain spooled in %s.", e, spool_path)
+        metrics.set_outcome("spooled")
+        return None
+    metrics.set_value("events", len(results))
+    return results
+
+
+def _apply_fallback_event(db_path, event, max_retries, retry_interval, timeout, retry_policy, phase):
+    """
+    集約サービスへの送信に失敗したイベントを、同じ event_id のまま apply_events でDBへ直接反映する。
+    応答の受信がタイムアウトしただけで集約サービスが既にコミットしていた場合も、spool_events
+    （write_mode = events の場合は session_events の event_id）により二重に記録しない。
+
+    Returns:
+        str or dict or None: apply_events の該当イベントの結果（反映済みだった場合は None）
+    """
+    import retry
+    db_path = _resolve_db_path(db_path)
+    policy = _resolve_policy(max_retries, retry_interval, retry_policy)
+    metrics.set_value("transport", "sqlite")
+    with metrics.phase(phase):
+        results = retry.run_with_retry(lambda: apply_events(db_path, [event], timeout), policy,
+                                       "Fallback write of %s event" % event['kind'])
+    result = results.get(event['event_id'])
+    if result is None:
+        logging.info("Event %s had already been committed by the collector.", event['event_id'])
+    return result
+
+
+def update_shutdown_info_with_retry(db_path, record_data, max_retries, retry_interval, timeout, spool_path=None,
+                                    collector=None, retry_policy=None, on_recorded=None):
+    """
+    record_shutdown によるシャットダウン情報の更新／挿入を実行し、
+    「database is locked」エラーが発生した場合は retry.run_with_retry により指数バックオフ（decorrelated jitter）で再試行する。
+    spool_path が指定された場合は、先にローカルのスプールファイルへイベントを書き込み（fsync）、
+    その後 flush_spool_with_retry でスプール全体をDBへ反映する。
+    collector が指定された場合は集約サービス経由で書き込み、送信に失敗した場合は同じ event_id のイベントとして
+    DBへ直接反映する（集約サービスが既にコミットしていた場合は action が "duplicate" の結果を返す）。
+    db_path に関数を指定した場合と on_recorded の扱いは insert_startup_info_with_retry と同じ。
+
+    Parameters:
+        db_path (str or callable): SQLiteデータベースファイルのパス、またはパスを返す引数なしの関数
         record_data (dict): 更新するシャットダウン情報
         max_retries (int): 最大再試行回数
         retry_interval (float): 再試行基本間隔（秒）
         timeout (float): SQLite接続時のタイムアウト秒数
+        spool_path (str or None): スプールファイルのパス（None の場合はDBへ直接書き込む）
+        collector (tuple or None): 集約サービスの (host, port, timeout)（None の場合はDBへ直接書き込む）
+        retry_policy (retry.RetryPolicy or None): 再試行ポリシー（指定時は max_retries, retry_interval より優先）
+        on_recorded (callable or None): イベントの記録後に呼び出す引数なしの関数
 
     Raises:
-        sqlite3.OperationalError: 再試行回数超過時にエラーをスロー
+        sqlite3.OperationalError: 再試行回数超過時にエラーをスロー（スプール使用時は送出しない）
 
     Returns:
-        None
+        dict or None: record_shutdown の結果（スプール使用時に反映できなかった場合は None）
     """
-    attempt = 0
-    while True:
+    event = spool.new_event("shutdown", record_data)
+    if spool_path:
+        # イベントの記録を最優先とし、DB反映に必要なモジュールは記録後に読み込む
+        with metrics.phase("spool_append"):
+            spool.append_event(spool_path, event)
+        if on_recorded:
+            on_recorded()
+        results = flush_spool_with_retry(_resolve_db_path(db_path), spool_path, max_retries, retry_interval, timeout,
+                                         collector=collector, retry_policy=retry_policy)
+        result = results.get(event['event_id']) if results else None
+        if result:
+            record_data['user_account'] = result['user_account']
+            record_data['duration'] = result['duration']
+        return result
+    if on_recorded:
+        on_recorded()
+    import retry
+    import transport
+    if collector:
         try:
-            affected = update_shutdown_record(db_path, record_data, timeout)
-            if affected == 0:
-                insert_shutdown_record(db_path, record_data, timeout)
-            break
-        except sqlite3.OperationalError as e:
-            if "database is locked" in str(e).lower():
-                attempt += 1
-                if attempt > max_retries:
-                    logging.error("Max retries reached (%d). Unable to update shutdown record.", max_retries)
-                    raise e
-                else:
-                    sleep_time = retry_interval * random.uniform(1.0, 1.5)
-                    logging.warning("Database is locked. Retry attempt %d/%d in %.2f seconds...", attempt, max_retries, sleep_time)
-                    time.sleep(sleep_time)
-            else:
-                logging.error("OperationalError during DB update: %s", e)
-                raise e
+            with metrics.phase("collector"):
+                result = transport.send_events(collector, [event]).get(event['event_id'])
+            metrics.set_value("transport", "collector")
+            logging.info("Shutdown record sent to collector %s:%d.", collector[0], collector[1])
+            if result:
+                record_data['user_account'] = result['user_account']
+                record_data['duration'] = result['duration']
+            return result
+        except transport.CollectorError as e:
+            logging.warning("%s. Falling back to direct database write.", e)
+        result = _apply_fallback_event(db_path, event, max_retries, retry_interval, timeout, retry_policy,
+                                       "shutdown_update")
+        if result is None:
+            # 集約サービスが応答の前にコミットしていた（利用時間は記録済みのセッションにある）
+            return {'action': "duplicate", 'session_id': None, 'user_account': record_data['user_account'],
+                    'duration': record_data['duration']}
+        if isinstance(result, dict):
+            record_data['user_account'] = result['user_account']
+            record_data['duration'] = result['duration']
+        return result
+
+    db_path = _resolve_db_path(db_path)
+    policy = _resolve_policy(max_retries, retry_interval, retry_policy)
+    metrics.set_value("transport", "sqlite")
+    with metrics.phase("shutdown_update"):
+        return retry.run_with_retry(lambda: record_shutdown(db_path, record_data, timeout), policy,
+                                    "Shutdown update")
 
 
 # ---------------------------
@@ -439,11 +1526,14 @@ if __name__ == "__main__":
     import socket
     import datetime
 
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+
     config = load_config("config.ini")
     db_path = config.get("Database", "db_path")
     max_retries = config.getint("Retry", "max_retries")
     retry_interval = config.getfloat("Retry", "retry_interval")
     timeout = config.getfloat("General", "timeout")
+    configure_database(config)
 
     # シャットダウン情報のサンプルを生成
     shutdown_info = {
@@ -455,13 +1545,7 @@ if __name__ == "__main__":
         "duration": 0
     }
 
-    # 起動レコードから start_time を取得し、duration を算出する
-    start_time_str = get_start_time_for_duration(db_path, shutdown_info['pc_id'], shutdown_info['user_account'], timeout)
-    if start_time_str:
-        shutdown_info['duration'] = compute_duration(start_time_str, shutdown_info['shutdown_time'])
-    else:
-        shutdown_info['duration'] = 0
-
+    # 1トランザクションで最新の起動レコードを更新する（duration はDB内で算出される）
     logging.info("Shutdown info: %s", shutdown_info)
-    update_shutdown_info_with_retry(db_path, shutdown_info, max_retries, retry_interval, timeout)
-    logging.info("Shutdown record updated successfully.")
+    result = update_shutdown_info_with_retry(db_path, shutdown_info, max_retries, retry_interval, timeout)
+    logging.info("Shutdown record %s successfully (duration=%d).", result['action'], result['duration'])
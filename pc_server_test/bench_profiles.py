@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+"""
+bench_profiles.py - 接続プロファイル（pc_client/connection.py の PRAGMA の組み合わせ）ごとの性能を比較するスクリプト
+
+プロファイルごとに新しい一時データベースを作成し（journal_mode はファイルに記録されるため）、以下を計測して
+JSON で出力します。config.ini の [Database] profile / pragmas や集約サービスの --profile を選ぶ際の根拠に使用します。
+
+  ・connect_ms   : 接続の作成とプロファイルの適用にかかる時間（プロセス内で接続を再利用しない場合の1回あたりの費用）
+  ・sequential   : 1プロセスが再利用中の接続で起動記録とシャットダウン記録を繰り返した場合の
+                   処理ごとのレイテンシと、1秒あたりの処理数（ロック競合のない状態での書き込み費用）
+  ・concurrent   : load_test.py による多数クライアントの同時書き込み（スループット、p50/p95/p99、再試行回数）
+  ・read         : 書き込み後のDBに対する集計クエリのレイテンシ（share-safe と readonly-report の比較）
+
+ローカルディスク上での計測のため、ネットワーク共有上での fsync の費用は含まれません。
+local-collector（WAL）はネットワーク共有上のDBには使用できないため、共有上のクライアントには share-safe を使います。
+
+使い方:
+    python bench_profiles.py --ops 500 --clients 50 --output profiles.json
+    python bench_profiles.py --profiles share-safe --pragmas synchronous=NORMAL
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BASE_DIR, os.pardir, "pc_client"))
+sys.path.insert(0, os.path.join(BASE_DIR, os.pardir, "central_db_setup"))
+
+import connection  # noqa: E402
+import init_db  # noqa: E402
+import load_test  # noqa: E402
+import utils  # noqa: E402
+
+WRITE_PROFILES = ("share-safe", "local-collector")
+
+# 集計クエリ（日次集計やレポートと同じ形の、全件を読む GROUP BY）
+READ_QUERY = """
+    SELECT pc_id, user_account, COUNT(*), SUM(duration) FROM session_logs
+    GROUP BY pc_id, user_account
+"""
+
+
+def measure_connect(db_path, profile, repeat=20):
+    """接続の作成とプロファイルの適用にかかる時間（ミリ秒）の一覧を返す。"""
+    values = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        conn = connection.open_connection(db_path, 5.0, profile)
+        values.append((time.perf_counter() - started) * 1000)
+        conn.close()
+    return values
+
+
+def measure_sequential(db_path, ops, timeout=5.0):
+    """
+    再利用中の接続で、起動記録とシャットダウン記録を ops 回ずつ交互に実行する。
+
+    Returns:
+        dict: startup / shutdown のレイテンシの要約と ops_per_sec
+    """
+    latencies = {'startup': [], 'shutdown': []}
+    started = time.perf_counter()
+    for i in range(ops):
+        startup_info = utils.get_startup_info()
+        startup_info.update(pc_id="BENCHPC%03d" % (i % 100), user_account="bench%03d" % (i % 100))
+        mark = time.perf_counter()
+        utils.insert_startup_record(db_path, startup_info, timeout)
+        latencies['startup'].append((time.perf_counter() - mark) * 1000)
+
+        shutdown_info = utils.get_shutdown_info()
+        shutdown_info.update(pc_id=startup_info['pc_id'], user_account=startup_info['user_account'])
+        mark = time.perf_counter()
+        utils.record_shutdown(db_path, shutdown_info, timeout)
+        latencies['shutdown'].append((time.perf_counter() - mark) * 1000)
+    wall = time.perf_counter() - started
+    return {
+        'operations': ops * 2,
+        'ops_per_sec': round(ops * 2 / wall, 2) if wall > 0 else None,
+        'latency_ms': {kind: load_test.latency_summary(values) for kind, values in latencies.items()},
+    }
+
+
+def measure_read(db_path, profile, queries):
+    """集計クエリを queries 回実行したレイテンシ（ミリ秒）の要約を返す（接続は1本を再利用する）。"""
+    conn = connection.open_connection(db_path, 5.0, profile)
+    try:
+        values = []
+        for _ in range(queries):
+            started = time.perf_counter()
+            conn.execute(READ_QUERY).fetchall()
+            values.append((time.perf_counter() - started) * 1000)
+    finally:
+        conn.close()
+    return load_test.latency_summary(values)
+
+
+def run_concurrent(db_path, profile_name, pragmas, clients):
+    """load_test.run_load_test で同時書き込みを計測し、比較に使う項目だけを返す。"""
+    options = {
+        'db_path': db_path, 'clients': clients, 'processes': 0, 'pattern': "burst", 'duration': 5.0,
+        'mode': "both", 'hold': 0.0, 'max_retries': 10, 'retry_interval': 0.05, 'max_interval': 1.0,
+        'deadline': 0, 'timeout': 5.0, 'warmup': 2.0, 'init': False, 'verbose': False,
+        'profile': profile_name, 'pragmas': pragmas,
+    }
+    report = load_test.run_load_test(options)
+    return {key: report[key] for key in ('operations', 'failed', 'wall_seconds', 'throughput_ops_per_sec',
+                                         'latency_ms', 'retries', 'lock_wait_seconds_total')}
+
+
+def benchmark(profiles=WRITE_PROFILES, pragmas="", ops=500, clients=50, queries=50):
+    """
+    プロファイルごとに計測を行い、レポート（dict）を返す。
+
+    Parameters:
+        profiles (tuple): 比較する書き込み用のプロファイル名
+        pragmas (str): 全プロファイルに適用する PRAGMA の上書き（connection.parse_pragmas の形式）
+        ops (int): sequential で実行する起動・シャットダウン記録の組の数
+        clients (int): concurrent の模擬クライアント数（0 の場合は計測しない）
+        queries (int): read で実行する集計クエリの回数
+
+    Returns:
+        dict: 計測結果のレポート
+    """
+    report = {
+        'revision': load_test._git_revision(),
+        'sqlite_version': sqlite3.sqlite_version,
+        'config': {'profiles': list(profiles), 'pragmas': pragmas, 'ops': ops, 'clients': clients,
+                   'queries': queries},
+        'profiles': {},
+    }
+    temp_dir = tempfile.mkdtemp(prefix="pcat_profiles_")
+    try:
+        read_db = None
+        for name in profiles:
+            profile = connection.configure(name, pragmas)
+            db_path = os.path.join(temp_dir, name + ".sqlite3")
+            init_db.init_db(db_path)
+            result = {
+                'pragmas': profile.pragmas,
+                'connect_ms': load_test.latency_summary(measure_connect(db_path, profile)),
+                'sequential': measure_sequential(db_path, ops),
+            }
+            connection.close_connections()
+            if clients:
+                result['concurrent'] = run_concurrent(db_path, name, pragmas, clients)
+            with sqlite3.connect(db_path) as conn:
+                result['journal_mode'] = conn.execute("PRAGMA journal_mode").fetchone()[0]
+            report['profiles'][name] = result
+            if read_db is None and result['journal_mode'] != "wal":
+                read_db = db_path
+
+        # 読み取りの比較は WAL ではないDB（ネットワーク共有上と同じ形式）で行う
+        if read_db and queries:
+            report['read'] = {name: measure_read(read_db, connection.get_profile(name), queries)
+                              for name in ("share-safe", "readonly-report")}
+    finally:
+        connection.close_connections()
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="PCActivityTracker 接続プロファイルの性能比較")
+    parser.add_argument("--profiles", default=",".join(WRITE_PROFILES),
+                        help="比較する書き込み用プロファイル（カンマ区切り）")
+    parser.add_argument("--pragmas", default="", help="全プロファイルに適用する PRAGMA の上書き（例: cache_size=-8000）")
+    parser.add_argument("--ops", type=int, default=500, help="1プロセスで実行する起動・シャットダウン記録の組の数")
+    parser.add_argument("--clients", type=int, default=50, help="同時書き込みの模擬クライアント数（0 で省略）")
+    parser.add_argument("--queries", type=int, default=50, help="集計クエリの実行回数（0 で省略）")
+    parser.add_argument("--output", help="結果の JSON を書き込むファイル（省略時は標準出力）")
+    args = parser.parse_args(argv)
+
+    logging.getLogger().setLevel(logging.WARNING)
+    profiles = tuple(p.strip() for p in args.profiles.split(",") if p.strip())
+    for name in profiles:
+        connection.get_profile(name)  # 未知のプロファイル名はここで ValueError にする
+    report = benchmark(profiles, args.pragmas, args.ops, args.clients, args.queries)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+"""
+bench_queries.py - 模擬データベース（generate_fleet.py）に対するクエリ・集計・出力の所要時間を計測するスクリプト
+
+実運用の件数のデータで、インデックスやクエリの変更の効果をコミット間で比較するため、以下を計測して
+JSON で出力します。計測は元のファイルの一時コピーに対して行い、元のファイルは変更しません。
+
+  ・shutdown  : utils.record_shutdown によるシャットダウン記録（未終了セッションの検索と更新）の
+                段階ごと（select / write / total）のレイテンシ。未終了セッションがあるPC・ユーザーと、
+                ない（新規挿入になる）PC・ユーザーを半数ずつ、ランダムに選ぶ
+  ・rollup    : rollup.py の作り直し (rebuild)、シャットダウン記録後の増分更新 (refresh)、
+                直近30日のユーザー別・PC別の参照 (query) のレイテンシ（スキーマバージョン3以上）
+  ・export    : export.py による直近30日の期間指定の出力、全件の増分出力（初回）と、その直後の増分出力の所要時間
+  ・plans     : 検索・集計の主なクエリの EXPLAIN QUERY PLAN（使用しているインデックスの確認用）
+
+使い方:
+    python generate_fleet.py fleet.sqlite3 --pcs 500 --years 3
+    python bench_queries.py fleet.sqlite3 --lookups 200 --output queries.json
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BASE_DIR, os.pardir, "pc_client"))
+sys.path.insert(0, os.path.join(BASE_DIR, os.pardir, "central_db_setup"))
+
+import connection  # noqa: E402
+import export  # noqa: E402
+import init_db  # noqa: E402
+import load_test  # noqa: E402
+import rollup  # noqa: E402
+import utils  # noqa: E402
+
+# daily_usage を作成する移行のバージョン
+ROLLUP_SCHEMA_VERSION = 3
+
+# session_logs がコンパクト形式 (sessions) の互換ビューになるバージョン
+COMPACT_SCHEMA_VERSION = 5
+
+# 未終了セッションの参照 open_sessions を作成する移行のバージョン
+OPEN_SESSIONS_SCHEMA_VERSION = 9
+
+# 計測結果と合わせて実行計画を出力するクエリ（従来の形式の session_logs テーブル）
+PLAN_QUERIES = {
+    'open_session': """
+        SELECT session_id FROM session_logs
+        WHERE pc_id = :pc_id AND user_account = :user_account AND (shutdown_time IS NULL OR shutdown_time = '')
+        ORDER BY start_time DESC LIMIT 1
+    """,
+    'range_by_start': """
+        SELECT COUNT(*) FROM session_logs WHERE start_time >= :date_from AND start_time < :date_to
+    """,
+    'usage_by_pc': """
+        SELECT pc_id, COUNT(*), SUM(duration) FROM session_logs
+        WHERE start_time >= :date_from AND start_time < :date_to GROUP BY pc_id
+    """,
+}
+
+# コンパクト形式では、クライアントや export.py と同じく sessions を直接検索する
+COMPACT_PLAN_QUERIES = {
+    'open_session': """
+        SELECT session_id FROM sessions
+        WHERE pc_key = (SELECT pc_key FROM pcs WHERE pc_id = :pc_id)
+          AND user_key = (SELECT user_key FROM users WHERE user_account = :user_account)
+          AND shutdown_ts IS NULL
+        ORDER BY start_ts DESC LIMIT 1
+    """,
+    'range_by_start': """
+        SELECT COUNT(*) FROM sessions
+        WHERE start_ts >= CAST(strftime('%s', :date_from, 'utc') AS INTEGER)
+          AND start_ts < CAST(strftime('%s', :date_to, 'utc') AS INTEGER)
+    """,
+    'usage_by_pc': """
+        SELECT pc_key, COUNT(*), SUM(duration) FROM sessions
+        WHERE start_ts >= CAST(strftime('%s', :date_from, 'utc') AS INTEGER)
+          AND start_ts < CAST(strftime('%s', :date_to, 'utc') AS INTEGER)
+        GROUP BY pc_key
+    """,
+}
+
+
+# open_sessions がある場合、シャットダウンの記録は未終了セッションを検索せず主キーで取得する
+POINTER_PLAN_QUERIES = {
+    'open_session': """
+        SELECT o.session_id FROM open_sessions AS o
+        WHERE o.pc_key = (SELECT pc_key FROM pcs WHERE pc_id = :pc_id)
+          AND o.user_key = (SELECT user_key FROM users WHERE user_account = :user_account)
+    """,
+}
+
+
+def _sample_targets(conn, count, rng):
+    """
+    シャットダウン記録の対象とする (pc_id, user_account, 最新の開始時刻, 未終了の有無) を選ぶ。
+    未終了セッションがある組とない組を半数ずつ選ぶ。
+    """
+    open_pairs = conn.execute("""
+        SELECT pc_id, user_account, MAX(start_time) FROM session_logs
+        WHERE shutdown_time IS NULL OR shutdown_time = '' GROUP BY pc_id, user_account
+    """).fetchall()
+    all_pairs = conn.execute("""
+        SELECT pc_id, user_account, MAX(start_time) FROM session_logs GROUP BY pc_id, user_account
+    """).fetchall()
+    opened = {(pc, user) for pc, user, _ in open_pairs}
+    closed = [row for row in all_pairs if (row[0], row[1]) not in opened]
+    half = count // 2
+    targets = [row + (True,) for row in rng.sample(open_pairs, min(half, len(open_pairs)))]
+    targets += [row + (False,) for row in rng.sample(closed, min(count - len(targets), len(closed)))]
+    rng.shuffle(targets)
+    return targets
+
+
+def bench_shutdown(db_path, count, rng, timeout=5.0):
+    """utils.record_shutdown を count 回実行し、段階ごとのレイテンシを返す。"""
+    conn = sqlite3.connect(db_path)
+    try:
+        targets = _sample_targets(conn, count, rng)
+    finally:
+        conn.close()
+    timings = {'select': [], 'write': [], 'total': []}
+    actions = {'update': 0, 'insert': 0}
+    for pc_id, user_account, last_start, _ in targets:
+        shutdown = datetime.datetime.strptime(last_start, "%Y-%m-%d %H:%M:%S") + datetime.timedelta(hours=1)
+        record = {'pc_id': pc_id, 'user_account': user_account,
+                  'shutdown_time': shutdown.strftime("%Y-%m-%d %H:%M:%S"), 'weekday': shutdown.strftime("%a"),
+                  'session_type': "normal", 'duration': 0}
+        result = utils.record_shutdown(db_path, record, timeout)
+        actions[result['action']] += 1
+        for name in timings:
+            timings[name].append(result['timings'][name])
+    connection.close_connection(db_path)
+    report = {name: load_test.latency_summary(values) for name, values in timings.items()}
+    report['actions'] = actions
+    return report
+
+
+def bench_rollup(db_path, date_from, date_to, repeat, timeout=5.0):
+    """rollup.py の作り直し・増分更新・参照の所要時間を返す（作り直しは1回のみ）。"""
+    rebuild = rollup.rebuild_rollups(db_path, timeout)
+    report = {'rebuild_ms': rebuild['elapsed_ms'], 'rebuild_sessions': rebuild['new_sessions']}
+    for by in ("user", "pc"):
+        values = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            rollup.query_usage(db_path, date_from, date_to, by=by, timeout=timeout)
+            values.append((time.perf_counter() - started) * 1000)
+        report['query_' + by] = load_test.latency_summary(values)
+    return report
+
+
+def bench_export(db_path, work_dir, date_from, date_to, timeout=5.0):
+    """export.py の期間指定の出力と増分出力（初回・2回目）の所要時間を返す。"""
+    state_path = os.path.join(work_dir, "export.state")
+    ranged = export.export_sessions(db_path, os.path.join(work_dir, "range.csv"), date_from=date_from,
+                                    date_to=date_to, timeout=timeout)
+    first = export.export_sessions(db_path, os.path.join(work_dir, "full.jsonl"), "jsonl", state_path=state_path,
+                                   timeout=timeout)
+    second = export.export_sessions(db_path, os.path.join(work_dir, "next.jsonl"), "jsonl", state_path=state_path,
+                                    timeout=timeout)
+    return {
+        'range': {'rows': ranged['rows'], 'elapsed_ms': round(ranged['elapsed'] * 1000, 1)},
+        'incremental_first': {'rows': first['rows'], 'elapsed_ms': round(first['elapsed'] * 1000, 1)},
+        'incremental_next': {'rows': second['rows'], 'elapsed_ms': round(second['elapsed'] * 1000, 1)},
+    }
+
+
+def query_plans(db_path, params):
+    """
+    PLAN_QUERIES（コンパクト形式では COMPACT_PLAN_QUERIES、open_sessions がある場合は POINTER_PLAN_QUERIES で上書き）の
+    EXPLAIN QUERY PLAN の結果（detail 列の一覧）を返す。
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        version = init_db.get_schema_version(conn)
+        queries = COMPACT_PLAN_QUERIES if version >= COMPACT_SCHEMA_VERSION else PLAN_QUERIES
+        if version >= OPEN_SESSIONS_SCHEMA_VERSION:
+            queries = dict(queries, **POINTER_PLAN_QUERIES)
+        return {name: [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + query, params)]
+                for name, query in queries.items()}
+    finally:
+        conn.close()
+
+
+def benchmark(db_path, lookups=200, repeat=20, seed=1, timeout=5.0):
+    """
+    db_path の一時コピーに対して各計測を行い、結果のレポート（dict）を返す。
+
+    Parameters:
+        db_path (str): 計測対象のデータベース（generate_fleet.py で作成したもの）
+        lookups (int): シャットダウン記録の回数（0 で省略）
+        repeat (int): 集計の参照の繰り返し回数
+        seed (int): 対象のPC・ユーザーを選ぶ乱数の種
+        timeout (float): SQLite接続時のタイムアウト秒数
+
+    Returns:
+        dict: 計測結果
+    """
+    rng = random.Random(seed)
+    work_dir = tempfile.mkdtemp(prefix="pcat_queries_")
+    try:
+        copy_path = os.path.join(work_dir, "central_db.sqlite3")
+        shutil.copyfile(db_path, copy_path)
+        with sqlite3.connect(copy_path) as conn:
+            version = init_db.get_schema_version(conn)
+            sessions, first, last, sample = conn.execute(
+                "SELECT COUNT(*), MIN(start_time), MAX(start_time), MAX(pc_id) FROM session_logs").fetchone()
+            user = conn.execute("SELECT user_account FROM session_logs WHERE pc_id = ? LIMIT 1",
+                                (sample,)).fetchone()
+        conn.close()
+        if not sessions:
+            raise ValueError(f"Database {db_path} has no sessions; create one with generate_fleet.py first.")
+        last_day = datetime.datetime.strptime(last[:10], "%Y-%m-%d").date()
+        date_from = (last_day - datetime.timedelta(days=29)).isoformat()
+        date_to = last_day.isoformat()
+
+        report = {
+            'revision': load_test._git_revision(),
+            'database': {'path': db_path, 'schema_version': version, 'sessions': sessions, 'first': first,
+                         'last': last, 'size_mb': round(os.path.getsize(db_path) / 1048576, 1)},
+            'window': {'from': date_from, 'to': date_to},
+            'plans': query_plans(copy_path, {'pc_id': sample, 'user_account': user[0] if user else "",
+                                             'date_from': date_from, 'date_to': date_to}),
+        }
+        if version >= ROLLUP_SCHEMA_VERSION:
+            report['rollup'] = bench_rollup(copy_path, date_from, date_to, repeat, timeout)
+        if lookups:
+            report['shutdown'] = bench_shutdown(copy_path, lookups, rng, timeout)
+            if version >= ROLLUP_SCHEMA_VERSION:
+                refresh = rollup.refresh_rollups(copy_path, timeout)
+                report['rollup']['refresh_ms'] = refresh['elapsed_ms']
+        report['export'] = bench_export(copy_path, work_dir, date_from, date_to, timeout)
+    finally:
+        connection.close_connections()
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="PCActivityTracker クエリ・集計・出力の性能計測")
+    parser.add_argument("db_path", help="計測対象のSQLiteデータベース（generate_fleet.py で作成したもの）")
+    parser.add_argument("--lookups", type=int, default=200, help="シャットダウン記録の回数（0 で省略）")
+    parser.add_argument("--repeat", type=int, default=20, help="集計の参照の繰り返し回数")
+    parser.add_argument("--seed", type=int, default=1, help="対象のPC・ユーザーを選ぶ乱数の種")
+    parser.add_argument("--output", help="結果の JSON を書き込むファイル（省略時は標準出力）")
+    args = parser.parse_args(argv)
+
+    logging.getLogger().setLevel(logging.WARNING)
+    report = benchmark(args.db_path, args.lookups, args.repeat, args.seed)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+"""
+generate_fleet.py - 多数のPC・ユーザー・数年分のセッションを持つ模擬データベースを作成するスクリプト
+
+pc_server_test/central_db.sqlite3 は数件のデータしかなく、実運用の件数でのクエリプラン、インデックス、
+集計・出力の速度を評価できないため、以下のような利用パターンのセッションを生成します（--seed で再現可能）。
+  ・事務用PC（既定 80%）: 主な利用者が1人。平日はほぼ毎日、朝（8:50 前後）にログオンして夕方に終了し、
+    一部の日は昼休みで2つのセッションに分かれる。休日の利用はまれ
+  ・共用PC: 複数の利用者が 9〜20時の間に短いセッションを繰り返す。休日も一部利用される
+  ・孤立セッション（--orphan-rate）: シャットダウンが記録されず shutdown_time が空のまま残る
+  ・障害による空白（--crash-rate）: その日の最後のセッションが終了せず、PCが数日間使われない
+  ・終了時刻が生成の終了日時より後のセッションは利用中（未終了）とする
+曜日はクライアントと同じく開始時刻の "%a"（"Mon" など）、session_type は "normal" です。
+
+スキーマは init_db.py の移行で作成します（session_logs の列はクライアントの ensure_table_exists と同じ）。
+--schema-version 0 の場合はクライアントが自動作成する状態（ensure_table_exists のみ、インデックスなし）になります。
+行は従来形式の session_logs に一括で挿入し、5 以上を指定した場合はその後の移行でコンパクト形式へ変換します。
+
+一括挿入の高速化:
+  ・ジャーナルと同期を無効にし（journal_mode=OFF, synchronous=OFF）、1つのトランザクションで挿入する
+  ・session_logs のインデックスを一旦削除し、挿入後に作り直す（行ごとの索引更新を避ける）
+  ・日ごとに生成した行を開始時刻順に並べ、executemany にジェネレーターで渡す（全件をメモリに保持しない）
+  ・時刻の文字列は日付の文字列と時分秒から組み立てる（行ごとの datetime 変換を避ける）
+作成中のファイルは破損しても構わない模擬データ専用です。運用中のデータベースには使用しないでください。
+
+使い方:
+    python generate_fleet.py fleet.sqlite3 --pcs 500 --users 600 --years 3
+    python generate_fleet.py fleet_legacy.sqlite3 --pcs 200 --years 1 --schema-version 3 --seed 7
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import random
+import sqlite3
+import sys
+import time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BASE_DIR, os.pardir, "pc_client"))
+sys.path.insert(0, os.path.join(BASE_DIR, os.pardir, "central_db_setup"))
+
+import connection  # noqa: E402
+import init_db  # noqa: E402
+import utils  # noqa: E402
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+
+# この版までは session_logs がテーブル（行を直接挿入できる）
+LEGACY_SCHEMA_VERSION = 3
+
+INSERT_QUERY = """
+    INSERT INTO session_logs (pc_id, user_account, start_time, shutdown_time, duration, session_type, weekday)
+    VALUES (?, ?, ?, ?, ?, 'normal', ?)
+"""
+
+
+def _clock(day_strings, day, seconds):
+    """日の番号と、その日の0時からの秒数から "YYYY-MM-DD HH:MM:SS" を組み立てる（翌日以降にも対応）。"""
+    day += seconds // 86400
+    seconds %= 86400
+    return "%s %02d:%02d:%02d" % (day_strings[day], seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+class Fleet:
+    """
+    PCごとの種類・利用者・障害による空白の状態を持ち、日ごとのセッションを生成する。
+
+    Parameters:
+        pcs (int): PCの台数
+        users (int): 利用者の人数
+        shared_ratio (float): 共用PCの割合
+        orphan_rate (float): セッションが孤立セッションになる確率
+        crash_rate (float): PCが1日のうちに障害を起こす確率
+        rng (random.Random): 乱数生成器
+    """
+
+    def __init__(self, pcs, users, shared_ratio, orphan_rate, crash_rate, rng):
+        self.rng = rng
+        self.orphan_rate = orphan_rate
+        self.crash_rate = crash_rate
+        self.users = ["user%04d" % i for i in range(1, users + 1)]
+        self.pcs = []
+        for i in range(1, pcs + 1):
+            shared = rng.random() < shared_ratio
+            self.pcs.append({
+                'pc_id': ("LAB%04d" if shared else "PC%04d") % i,
+                'shared': shared,
+                # 事務用PCは主な利用者1人、共用PCは利用者の集まりから選ぶ
+                'users': rng.sample(self.users, min(len(self.users), rng.randint(5, 40) if shared else 1)),
+                'down_until': -1,
+            })
+        self.stats = {'sessions': 0, 'orphans': 0, 'crashes': 0, 'open': 0}
+
+    def _sessions(self, pc, weekend):
+        """1台の1日分の (利用者, 開始秒, 終了秒) の一覧を返す。"""
+        rng = self.rng
+        if pc['shared']:
+            if rng.random() > (0.25 if weekend else 0.9):
+                return []
+            result = []
+            at = int(rng.uniform(9, 11) * 3600)
+            for _ in range(rng.randint(1, 6)):
+                length = int(rng.uniform(0.5, 3) * 3600)
+                if at + length > 20 * 3600:
+                    break
+                result.append((rng.choice(pc['users']), at, at + length))
+                at += length + int(rng.uniform(0.1, 1.5) * 3600)
+            return result
+        if rng.random() > (0.04 if weekend else 0.92):
+            return []
+        user = pc['users'][0]
+        start = int(rng.gauss(8.83, 0.4) * 3600)
+        end = start + int(min(14, max(0.5, rng.gauss(8.5, 1.0))) * 3600) + rng.randrange(3600)
+        if rng.random() < 0.25:
+            # 昼休みにシャットダウン（またはログオフ）し、午後に再びログオンする
+            lunch = int(rng.uniform(11.8, 12.5) * 3600)
+            if start < lunch < end - 3600:
+                back = lunch + int(rng.uniform(0.6, 1.2) * 3600)
+                return [(user, start, lunch), (user, back, end)]
+        return [(user, start, end)]
+
+    def day_rows(self, day, day_strings, weekday, now_day, now_seconds):
+        """
+        1日分の全PCのセッションを、挿入する行（開始時刻順）のリストとして返す。
+
+        Parameters:
+            day (int): 日の番号（day_strings の添字）
+            day_strings (list): 日の番号ごとの "YYYY-MM-DD"
+            weekday (int): 曜日（月曜日 = 0）
+            now_day, now_seconds (int): 生成の終了日時（これより後に終了するセッションは未終了にする）
+        """
+        rng = self.rng
+        weekend = weekday >= 5
+        name = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")[weekday]
+        rows = []
+        for pc in self.pcs:
+            if pc['down_until'] >= day:
+                continue
+            sessions = self._sessions(pc, weekend)
+            crashed = sessions and rng.random() < self.crash_rate
+            for index, (user, start, end) in enumerate(sessions):
+                if day == now_day and start >= now_seconds:
+                    break
+                orphan = rng.random() < self.orphan_rate or (crashed and index == len(sessions) - 1)
+                still_open = day * 86400 + end > now_day * 86400 + now_seconds
+                if orphan or still_open:
+                    shutdown, duration = "", 0
+                    self.stats['open' if still_open and not orphan else 'orphans'] += 1
+                else:
+                    shutdown, duration = _clock(day_strings, day, end), end - start
+                rows.append((start, pc['pc_id'], user, _clock(day_strings, day, start), shutdown, duration, name))
+            if crashed:
+                # 障害の後、復旧するまで数日間使われない
+                pc['down_until'] = day + rng.randint(1, 14)
+                self.stats['crashes'] += 1
+        rows.sort(key=lambda row: row[0])
+        self.stats['sessions'] += len(rows)
+        return [row[1:] for row in rows]
+
+
+def _bulk_insert(conn, rows_iter):
+    """
+    session_logs のインデックスを外した状態で、1つのトランザクションで行を挿入してからインデックスを作り直す。
+
+    Returns:
+        float: インデックスの作り直しにかかった時間（ミリ秒）
+    """
+    indexes = conn.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = 'session_logs' AND sql IS NOT NULL"
+    ).fetchall()
+    conn.execute("BEGIN")
+    for name, _ in indexes:
+        conn.execute(f"DROP INDEX {name}")
+    conn.executemany(INSERT_QUERY, rows_iter)
+    started = time.perf_counter()
+    for _, sql in indexes:
+        conn.execute(sql)
+    conn.execute("COMMIT")
+    return (time.perf_counter() - started) * 1000
+
+
+def generate(db_path, pcs=200, users=250, years=1.0, end=None, seed=1, shared_ratio=0.2, orphan_rate=0.02,
+             crash_rate=0.002, schema_version=None):
+    """
+    模擬データベースを作成する（既存のファイルは置き換える）。
+
+    Parameters:
+        db_path (str): 作成するデータベースファイルのパス
+        pcs (int): PCの台数
+        users (int): 利用者の人数
+        years (float): 生成する期間（年）
+        end (str or None): 生成の終了日時（"YYYY-MM-DD HH:MM:SS"、None の場合は現在時刻）
+        seed (int): 乱数の種
+        shared_ratio (float): 共用PCの割合
+        orphan_rate (float): セッションが孤立セッションになる確率
+        crash_rate (float): PCが1日のうちに障害を起こす確率
+        schema_version (int or None): 移行先のスキーマバージョン（None の場合は最新、0 の場合は ensure_table_exists のみ）
+
+    Returns:
+        dict: 生成した件数（sessions, orphans, open, crashes）、スキーマバージョン、ファイルサイズ、所要時間
+    """
+    now = datetime.datetime.strptime(end, "%Y-%m-%d %H:%M:%S") if end else datetime.datetime.now().replace(
+        microsecond=0)
+    first = now.date() - datetime.timedelta(days=int(years * 365))
+    days = (now.date() - first).days + 1
+    # 日をまたぐセッションのため、終了日の翌日まで日付の文字列を用意する
+    day_strings = [(first + datetime.timedelta(days=i)).isoformat() for i in range(days + 1)]
+    now_seconds = now.hour * 3600 + now.minute * 60 + now.second
+
+    for path in (db_path, db_path + "-journal"):
+        if os.path.exists(path):
+            os.remove(path)
+    started = time.perf_counter()
+    if schema_version == 0:
+        utils.ensure_table_exists(db_path, 5.0)
+        connection.close_connection(db_path)
+    else:
+        init_db.init_db(db_path, target=LEGACY_SCHEMA_VERSION if schema_version is None
+                        else min(schema_version, LEGACY_SCHEMA_VERSION))
+
+    fleet = Fleet(pcs, users, shared_ratio, orphan_rate, crash_rate, random.Random(seed))
+
+    def rows():
+        for day in range(days):
+            yield from fleet.day_rows(day, day_strings, (first.weekday() + day) % 7, days - 1, now_seconds)
+
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        conn.execute("PRAGMA journal_mode=OFF")
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.execute("PRAGMA cache_size=-65536")
+        index_ms = _bulk_insert(conn, rows())
+        inserted = time.perf_counter()
+        conn.execute("ANALYZE")
+    finally:
+        conn.close()
+    if schema_version is None or schema_version > LEGACY_SCHEMA_VERSION:
+        # 試験用のDBのため、移行5も1つのトランザクションで適用する（target を明示する）
+        init_db.init_db(db_path, target=init_db.LATEST_VERSION if schema_version is None else schema_version)
+    with sqlite3.connect(db_path) as conn:
+        version = init_db.get_schema_version(conn)
+        conn.execute("ANALYZE")
+    conn.close()
+
+    result = dict(fleet.stats)
+    result.update({
+        'pcs': pcs, 'users': users, 'days': days, 'from': day_strings[0], 'to': now.strftime("%Y-%m-%d %H:%M:%S"),
+        'seed': seed, 'schema_version': version, 'size_mb': round(os.path.getsize(db_path) / 1048576, 1),
+        'insert_s': round(inserted - started, 3), 'index_ms': round(index_ms, 1),
+        'elapsed': round(time.perf_counter() - started, 3),
+    })
+    result['rows_per_second'] = round(result['sessions'] / result['insert_s']) if result['insert_s'] else None
+    logging.info("Generated %d session(s) (%d orphaned, %d open) for %d PC(s) over %d day(s) in %.1f seconds.",
+                 result['sessions'], result['orphans'], result['open'], pcs, days, result['elapsed'])
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="PCActivityTracker 模擬データベースの作成")
+    parser.add_argument("db_path", help="作成するSQLiteデータベースファイルのパス（既存のファイルは置き換える）")
+    parser.add_argument("--pcs", type=int, default=200, help="PCの台数")
+    parser.add_argument("--users", type=int, default=250, help="利用者の人数")
+    parser.add_argument("--years", type=float, default=1.0, help="生成する期間（年）")
+    parser.add_argument("--end", help="生成の終了日時（YYYY-MM-DD HH:MM:SS、省略時は現在時刻）")
+    parser.add_argument("--seed", type=int, default=1, help="乱数の種（同じ値で同じデータを生成する）")
+    parser.add_argument("--shared-ratio", type=float, default=0.2, help="共用PCの割合")
+    parser.add_argument("--orphan-rate", type=float, default=0.02, help="セッションが孤立セッションになる確率")
+    parser.add_argument("--crash-rate", type=float, default=0.002, help="PCが1日のうちに障害を起こす確率")
+    parser.add_argument("--schema-version", type=int,
+                        help="移行先のスキーマバージョン（省略時は最新、0 はクライアントの自動作成のみ）")
+    parser.add_argument("--output", help="結果の JSON を書き込むファイル（省略時は標準出力）")
+    args = parser.parse_args(argv)
+
+    result = generate(args.db_path, args.pcs, args.users, args.years, args.end, args.seed, args.shared_ratio,
+                      args.orphan_rate, args.crash_rate, args.schema_version)
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+"""
+load_test.py - 多数のPCが同時に起動／シャットダウンした場合の書き込み性能を計測する負荷試験スクリプト
+
+multiprocessing で N 個の模擬クライアント（プロセス）を起動し、各クライアントが実際の
+utils.insert_startup_info_with_retry と utils.update_shutdown_info_with_retry を使って
+ローカルのSQLiteファイルへ書き込みます。到着パターン（一斉 / 漸増 / 一定間隔）を指定でき、
+スループット、処理ごとの p50/p95/p99 レイテンシ、ロック再試行回数、失敗率を JSON で出力します。
+再試行設定、PRAGMA、スキーマ変更の効果をコミット間で比較するために使用します。
+
+到着パターン:
+  ・burst : 全クライアントが同時に開始する（始業時刻のログオン集中）
+  ・ramp  : 開始間隔が徐々に短くなる（到着率が --duration 秒かけて直線的に増加）
+  ・steady: --duration 秒の間に一定間隔で開始する
+
+使い方:
+    python load_test.py --clients 300 --pattern burst --output result.json
+    python load_test.py --clients 100 --pattern ramp --duration 10 --retry-interval 0.1
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BASE_DIR, os.pardir, "pc_client"))
+sys.path.insert(0, os.path.join(BASE_DIR, os.pardir, "central_db_setup"))
+
+import connection  # noqa: E402
+import retry  # noqa: E402
+import utils  # noqa: E402
+from metrics import percentile  # noqa: E402
+
+PATTERNS = ("burst", "ramp", "steady")
+
+
+def arrival_offsets(clients, pattern, duration):
+    """
+    各クライアントの開始時刻（試験開始からの秒数）を到着パターンに従って算出する。
+
+    Parameters:
+        clients (int): クライアント数
+        pattern (str): "burst" / "ramp" / "steady"
+        duration (float): 到着を分散させる時間（秒）
+
+    Returns:
+        list: クライアントごとの開始オフセット（秒）
+    """
+    if pattern == "burst" or clients <= 1:
+        return [0.0] * clients
+    if pattern == "steady":
+        return [duration * i / clients for i in range(clients)]
+    # ramp: 到着率が直線的に増加する場合、累積到着数は時間の2乗に比例する
+    return [duration * (i / clients) ** 0.5 for i in range(clients)]
+
+
+def latency_summary(values_ms):
+    values = sorted(values_ms)
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'mean': round(sum(values) / len(values), 3),
+        'p50': round(percentile(values, 50), 3),
+        'p95': round(percentile(values, 95), 3),
+        'p99': round(percentile(values, 99), 3),
+        'max': round(values[-1], 3),
+    }
+
+
+def _run_client(task):
+    """
+    1台分の模擬クライアント（子プロセスで実行）。開始時刻まで待機し、起動記録とシャットダウン記録を行う。
+
+    Returns:
+        list: 処理ごとの結果（kind, ok, latency_ms, attempts, lock_wait, error）
+    """
+    index, start_at, options = task
+    logging.getLogger().setLevel(logging.DEBUG if options['verbose'] else logging.CRITICAL)
+    connection.configure(options['profile'], options['pragmas'])
+    collected = []
+    listener = lambda description, stats: collected.append(stats)
+    retry.add_listener(listener)
+    policy = retry.RetryPolicy(options['max_retries'], options['retry_interval'],
+                               options['max_interval'], options['deadline'], options['timeout'])
+
+    delay = start_at - time.time()
+    if delay > 0:
+        time.sleep(delay)
+
+    pc_id = "LOADPC%04d" % index
+    user = "loaduser%04d" % index
+    results = []
+
+    def measure(kind, func):
+        del collected[:]
+        started = time.perf_counter()
+        error = None
+        try:
+            func()
+        except Exception as e:
+            error = "%s: %s" % (type(e).__name__, e)
+        latency = (time.perf_counter() - started) * 1000
+        attempts = sum(s.attempts for s in collected)
+        lock_wait = sum(s.total_lock_wait for s in collected)
+        results.append({'kind': kind, 'ok': error is None, 'latency_ms': latency,
+                        'attempts': attempts, 'lock_wait': lock_wait, 'error': error})
+
+    if options['mode'] in ("startup", "both"):
+        startup_info = utils.get_startup_info()
+        startup_info.update(pc_id=pc_id, user_account=user)
+        measure("startup", lambda: utils.insert_startup_info_with_retry(
+            options['db_path'], startup_info, options['max_retries'], options['retry_interval'],
+            options['timeout'], retry_policy=policy))
+        if options['hold'] > 0:
+            time.sleep(options['hold'])
+    if options['mode'] in ("shutdown", "both"):
+        shutdown_info = utils.get_shutdown_info()
+        shutdown_info.update(pc_id=pc_id, user_account=user)
+        measure("shutdown", lambda: utils.update_shutdown_info_with_retry(
+            options['db_path'], shutdown_info, options['max_retries'], options['retry_interval'],
+            options['timeout'], retry_policy=policy))
+
+    retry.remove_listener(listener)
+    return results
+
+
+def _git_revision():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR,
+                             capture_output=True, text=True, timeout=5)
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_load_test(options):
+    """
+    負荷試験を実行し、結果のレポート（dict）を返す。
+
+    Parameters:
+        options (dict): コマンドライン引数から作成した設定
+
+    Returns:
+        dict: スループット、レイテンシ、再試行回数、失敗率などのレポート
+    """
+    if options['init']:
+        import init_db
+        logging.getLogger().setLevel(logging.WARNING)
+        init_db.init_db(options['db_path'], options['timeout'])
+
+    clients = options['clients']
+    processes = options['processes'] or clients
+    offsets = arrival_offsets(clients, options['pattern'], options['duration'])
+    with multiprocessing.Pool(processes=processes) as pool:
+        # 全プロセスの起動を待ってから開始時刻を決めるため、開始までに余裕を持たせる
+        start_at = time.time() + options['warmup']
+        tasks = [(i, start_at + offsets[i], options) for i in range(clients)]
+        per_client = pool.map(_run_client, tasks, chunksize=1)
+    wall = time.time() - start_at
+
+    ops = [r for client_results in per_client for r in client_results]
+    failed = [r for r in ops if not r['ok']]
+    retries = [max(0, r['attempts'] - 1) for r in ops]
+    report = {
+        'revision': _git_revision(),
+        'sqlite_version': sqlite3.sqlite_version,
+        'config': {k: v for k, v in options.items() if k not in ('verbose',)},
+        'operations': len(ops),
+        'succeeded': len(ops) - len(failed),
+        'failed': len(failed),
+        'failure_rate': round(len(failed) / len(ops), 4) if ops else 0.0,
+        'wall_seconds': round(wall, 3),
+        'throughput_ops_per_sec': round((len(ops) - len(failed)) / wall, 2) if wall > 0 else None,
+        'latency_ms': {
+            'all': latency_summary([r['latency_ms'] for r in ops if r['ok']]),
+        },
+        'retries': {
+            'total': sum(retries),
+            'max_per_operation': max(retries) if retries else 0,
+            'operations_with_retries': sum(1 for n in retries if n > 0),
+        },
+        'lock_wait_seconds_total': round(sum(r['lock_wait'] for r in ops), 3),
+        'errors': sorted({r['error'] for r in failed})[:10],
+    }
+    for kind in ("startup", "shutdown"):
+        values = [r['latency_ms'] for r in ops if r['ok'] and r['kind'] == kind]
+        if values:
+            report['latency_ms'][kind] = latency_summary(values)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="PCActivityTracker 書き込み経路の負荷試験")
+    parser.add_argument("--db", dest="db_path", default=None,
+                        help="書き込み先のSQLiteファイル（省略時は一時ファイルを作成）")
+    parser.add_argument("--clients", type=int, default=50, help="模擬クライアント数")
+    parser.add_argument("--processes", type=int, default=0, help="プロセス数（0 の場合はクライアント数と同じ）")
+    parser.add_argument("--pattern", choices=PATTERNS, default="burst", help="到着パターン")
+    parser.add_argument("--duration", type=float, default=5.0, help="ramp / steady で到着を分散させる時間（秒）")
+    parser.add_argument("--mode", choices=("startup", "shutdown", "both"), default="both", help="実行する処理")
+    parser.add_argument("--hold", type=float, default=0.0, help="起動記録からシャットダウン記録までの待機時間（秒）")
+    parser.add_argument("--max-retries", type=int, default=10)
+    parser.add_argument("--retry-interval", type=float, default=0.5)
+    parser.add_argument("--max-interval", type=float, default=5.0)
+    parser.add_argument("--deadline", type=float, default=0, help="再試行全体の時間上限（秒、0 で無制限）")
+    parser.add_argument("--timeout", type=float, default=5.0, help="SQLite接続時のタイムアウト秒数")
+    parser.add_argument("--profile", choices=sorted(connection.PROFILES), default=connection.DEFAULT_PROFILE,
+                        help="クライアントの接続プロファイル（config.ini の [Database] profile）")
+    parser.add_argument("--pragmas", default="", help="プロファイルの PRAGMA の上書き（例: synchronous=NORMAL）")
+    parser.add_argument("--warmup", type=float, default=2.0, help="プロセス起動から一斉開始までの待機時間（秒）")
+    parser.add_argument("--no-init", dest="init", action="store_false",
+                        help="init_db.py によるスキーマ移行を行わない（移行前のスキーマで比較する場合）")
+    parser.add_argument("--output", help="結果の JSON を書き込むファイル（省略時は標準出力）")
+    parser.add_argument("--verbose", action="store_true", help="子プロセスのログを出力する")
+    args = parser.parse_args(argv)
+
+    options = vars(args).copy()
+    temp_dir = None
+    if not options['db_path']:
+        temp_dir = tempfile.mkdtemp(prefix="pcat_load_")
+        options['db_path'] = os.path.join(temp_dir, "central_db.sqlite3")
+
+    try:
+        report = run_load_test(options)
+    finally:
+        # 一時ファイルのDBは試験ごとに作り直すため、結果の出力前に削除する
+        if temp_dir:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0 if report['failed'] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+"""
+measure_agent.py - 常駐エージェント（pc_client/agent.py）のCPU時間・メモリ使用量・書き込み回数を計測するスクリプト
+
+一時データベースに未終了のセッションを1件作成し、子プロセスで HeartbeatAgent を指定時間だけ実行して、
+以下を JSON で出力します。常駐による負荷が十分に小さいこと（interval を変えた場合の比較）の確認に使用します。
+
+  ・counts           : 結果ごとの書き込みの回数（written / busy / unavailable / no_session）
+  ・cpu_seconds      : エージェントの実行中に消費したCPU時間（import 後から終了まで）と、実行時間に対する割合
+  ・peak_rss_kb      : import 直後と終了時のメモリ使用量のピーク（KB）
+  ・last_seen_lag_s  : 終了時点で記録されている最終確認時刻と終了時刻の差（秒）
+
+--busy を指定すると、計測中に別スレッドが排他ロックを繰り返し取得し、共有が混雑している状態を模擬します
+（ロック中のハートビートは busy_timeout で見送られ、retry_interval 後に書き込まれることを確認できます）。
+
+使い方:
+    python measure_agent.py --duration 60 --interval 5
+    python measure_agent.py --duration 60 --interval 5 --retry-interval 1 --busy 0.5
+"""
+
+import argparse
+import datetime
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CLIENT_DIR = os.path.normpath(os.path.join(BASE_DIR, os.pardir, "pc_client"))
+sys.path.insert(0, os.path.join(BASE_DIR, os.pardir, "central_db_setup"))
+
+import init_db  # noqa: E402
+
+PC_ID = "MEASUREPC"
+USER_ACCOUNT = "measure"
+
+# 子プロセスで実行する処理（startup.py の常駐と同じく HeartbeatAgent.run を呼び出す）
+DRIVER = r"""
+import json, sys, time
+sys.path.insert(0, sys.argv[1])
+import agent
+before = agent.footprint()
+heartbeat = agent.HeartbeatAgent(lambda: sys.argv[2], json.loads(sys.argv[3]), **json.loads(sys.argv[4]))
+started = time.perf_counter()
+counts = heartbeat.run(max_runtime=float(sys.argv[5]))
+print(json.dumps({'counts': counts, 'before': before, 'after': agent.footprint(),
+                  'wall_seconds': time.perf_counter() - started, 'finished_at': time.time()}))
+"""
+
+
+def _hold_locks(db_path, busy, stop, period=1.0):
+    """period 秒のうち busy の割合だけ排他ロックを保持することを、stop が設定されるまで繰り返す（別スレッドで実行）。"""
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    try:
+        while not stop.is_set():
+            conn.execute("BEGIN EXCLUSIVE")
+            time.sleep(period * busy)
+            conn.execute("COMMIT")
+            stop.wait(period * (1 - busy))
+    finally:
+        conn.close()
+
+
+def measure(duration=60.0, interval=5.0, retry_interval=1.0, busy_timeout=0.2, busy=0.0, python=None):
+    """
+    エージェントを子プロセスで duration 秒実行し、計測結果（dict）を返す。
+
+    Parameters:
+        duration (float): エージェントの実行時間（秒）
+        interval (float): ハートビートの間隔（秒）
+        retry_interval (float): 書き込みを見送った場合の再試行の間隔（秒）
+        busy_timeout (float): ロックの解放を待つ最大時間（秒）
+        busy (float): 計測中に排他ロックを保持する時間の割合（0 で模擬しない）
+        python (str or None): 子プロセスの Python（None の場合は実行中の Python）
+
+    Returns:
+        dict: 計測結果
+    """
+    temp_dir = tempfile.mkdtemp(prefix="pcat_agent_")
+    stop = threading.Event()
+    locker = None
+    try:
+        db_path = os.path.join(temp_dir, "central_db.sqlite3")
+        init_db.init_db(db_path)
+        start_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with sqlite3.connect(db_path) as conn:
+            conn.execute("INSERT INTO session_logs (pc_id, user_account, start_time, duration, session_type) "
+                         "VALUES (?, ?, ?, 0, 'normal')", (PC_ID, USER_ACCOUNT, start_time))
+        conn.close()
+
+        if busy > 0:
+            locker = threading.Thread(target=_hold_locks, args=(db_path, busy, stop), daemon=True)
+            locker.start()
+        record = {'pc_id': PC_ID, 'user_account': USER_ACCOUNT, 'start_time': start_time}
+        options = {'interval': interval, 'retry_interval': retry_interval, 'busy_timeout': busy_timeout}
+        proc = subprocess.run(
+            [python or sys.executable, "-c", DRIVER, CLIENT_DIR, db_path, json.dumps(record), json.dumps(options),
+             str(duration)],
+            capture_output=True, text=True, check=True)
+        child = json.loads(proc.stdout.strip().splitlines()[-1])
+        stop.set()
+        if locker is not None:
+            locker.join()
+
+        with sqlite3.connect(db_path) as conn:
+            row = conn.execute("SELECT MAX(last_seen_ts) FROM session_heartbeats").fetchone()
+        conn.close()
+        cpu = child['after']['cpu_seconds'] - child['before']['cpu_seconds']
+        return {
+            'config': {'duration': duration, 'interval': interval, 'retry_interval': retry_interval,
+                       'busy_timeout': busy_timeout, 'busy': busy},
+            'counts': child['counts'],
+            'cpu_seconds': round(cpu, 3),
+            'cpu_percent': round(cpu / child['wall_seconds'] * 100, 4) if child['wall_seconds'] else None,
+            'peak_rss_kb': {'after_import': child['before']['peak_rss_kb'], 'at_exit': child['after']['peak_rss_kb']},
+            'last_seen_lag_s': round(child['finished_at'] - row[0], 1) if row and row[0] else None,
+        }
+    finally:
+        stop.set()
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="PCActivityTracker 常駐エージェントの負荷の計測")
+    parser.add_argument("--duration", type=float, default=60.0, help="エージェントの実行時間（秒）")
+    parser.add_argument("--interval", type=float, default=5.0, help="ハートビートの間隔（秒）")
+    parser.add_argument("--retry-interval", type=float, default=1.0, help="書き込みを見送った場合の再試行の間隔（秒）")
+    parser.add_argument("--busy-timeout", type=float, default=0.2, help="ロックの解放を待つ最大時間（秒）")
+    parser.add_argument("--busy", type=float, default=0.0, help="排他ロックを保持する時間の割合（0〜1、混雑の模擬）")
+    parser.add_argument("--python", help="計測に使用する Python（省略時は実行中の Python）")
+    parser.add_argument("--output", help="結果の JSON を書き込むファイル（省略時は標準出力）")
+    args = parser.parse_args(argv)
+    if not 0 <= args.busy < 1:
+        parser.error("--busy must be between 0 and 1")
+
+    report = measure(args.duration, args.interval, args.retry_interval, args.busy_timeout, args.busy, args.python)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+"""
+measure_startup.py - 起動／シャットダウン時のイベント記録までの時間（コールドスタート）を計測するスクリプト
+
+startup.exe / shutdown.exe はプロセス起動のたびにモジュールの import から処理を始めるため、
+import の増加はそのままシャットダウン時の処理時間の増加になります。本スクリプトは pc_client の
+モジュールを一時フォルダーへ複製し、計測用の config.ini（スプール有効、ログ・計測結果・DBは一時フォルダー内）を
+置いて、実際の startup.py / shutdown.py をそのまま `python -X importtime` の子プロセスで実行します
+（ログ設定や計測などのモジュールも含め、エントリーポイントが読み込むすべての import が計測対象になる）。
+イベントの記録時点は spool.append_event の完了で判定し、以下を JSON で出力します。
+コミット間で比較し、import の追加による退行を検出するために使用します。
+
+  ・time_to_event_ms    : プロセス起動からイベントがスプールに記録されるまでの時間（実行ごとの中央値など）
+  ・interpreter_ms      : 何も import しない Python の起動時間（比較用の基準値）
+  ・phases_ms           : エントリーポイント自身が記録した各フェーズの所要時間（metrics.py の phases）
+  ・modules_loaded      : イベント記録時点で読み込まれているモジュール数
+  ・deferred_ok         : イベント記録時点で DEFERRED_MODULES（記録後に読み込むべきモジュール）が未読み込みなら True
+  ・imports             : イベント記録までの最上位の import ごとの累積時間と、自身の時間が長い import の上位
+                          （マイクロ秒）。after_event は記録後に読み込まれた最上位のモジュール
+
+使い方:
+    python measure_startup.py --kind shutdown --runs 10
+    python measure_startup.py --kind startup --output startup_latency.json
+"""
+
+import argparse
+import glob
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CLIENT_DIR = os.path.normpath(os.path.join(BASE_DIR, os.pardir, "pc_client"))
+
+# イベントの記録より後に読み込むべきモジュール（ログの書き出し、共有のプローブ）
+DEFERRED_MODULES = ("logging.handlers", "failover")
+
+# イベント記録の時点を -X importtime の出力の中で示す行
+EVENT_MARKER = "measure_startup: event recorded"
+
+# 計測用の config.ini（{dir} は一時フォルダー）
+CONFIG_TEMPLATE = """[Database]
+db_path = {dir}/central_db.sqlite3
+profile = share-safe
+[Retry]
+max_retries = 0
+retry_interval = 0.1
+[General]
+debug = False
+timeout = 1.0
+show_console = True
+[Logging]
+path = {dir}/application.log
+startup_path = {dir}/startup.log
+[Spool]
+enabled = True
+path = {dir}/measure.spool
+[Metrics]
+enabled = True
+path = {dir}/metrics.jsonl
+[Agent]
+enabled = False
+[Transport]
+mode = sqlite
+"""
+
+# 子プロセスで実行する処理。エントリーポイント（argv[2]）を __main__ として実行し、最初の spool.append_event の
+# 完了時刻と、その時点のモジュール数・DEFERRED_MODULES（argv[4:]）の読み込み状況を出力する。
+# 完了時には標準エラー出力（-X importtime の出力先）に EVENT_MARKER（argv[3]）の行を書き込む
+# （spool は計測用の置き換えのために先に import するが、utils も import 時に読み込むため合計時間は変わらない）
+DRIVER = r"""
+import json, sys, time
+sys.path.insert(0, sys.argv[1])
+import spool
+recorded = []
+append_event = spool.append_event
+def timed_append(*args, **kwargs):
+    result = append_event(*args, **kwargs)
+    if not recorded:
+        recorded.append([time.time(), len(sys.modules), [m for m in sys.argv[4:] if m in sys.modules]])
+        sys.stderr.write(sys.argv[3] + "\n")
+    return result
+spool.append_event = timed_append
+with open(sys.argv[2], encoding="utf-8") as f:
+    code = compile(f.read(), sys.argv[2], "exec")
+exec(code, {'__name__': "__main__", '__file__': sys.argv[2]})
+print(json.dumps(recorded[0] if recorded else None))
+"""
+
+
+def parse_importtime(stderr):
+    """
+    `-X importtime` の出力を解析する。
+
+    Parameters:
+        stderr (str): 子プロセスの標準エラー出力
+
+    Returns:
+        tuple: イベント記録までと記録後の、(module, self_us, cumulative_us, depth) のリスト（出力順）
+    """
+    before, after = [], []
+    entries = before
+    for line in stderr.splitlines():
+        if line == EVENT_MARKER:
+            entries = after
+            continue
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        try:
+            fields = line[len("import time:"):].split("|")
+            self_us, cumulative_us, name = int(fields[0]), int(fields[1]), fields[2]
+        except (ValueError, IndexError):
+            continue
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        entries.append((name.strip(), self_us, cumulative_us, depth))
+    return before, after
+
+
+def prepare_client(temp_dir):
+    """
+    pc_client のモジュールと計測用の config.ini を一時フォルダーへ置き、そのフォルダーを返す
+    （utils.get_base_dir が一時フォルダーになり、設定・スプール・ログは一時フォルダー内で完結する）。
+    """
+    client_dir = os.path.join(temp_dir, "client")
+    os.makedirs(client_dir)
+    for path in glob.glob(os.path.join(CLIENT_DIR, "*.py")):
+        shutil.copy2(path, client_dir)
+    with open(os.path.join(client_dir, "config.ini"), "w", encoding="utf-8") as f:
+        f.write(CONFIG_TEMPLATE.format(dir=temp_dir.replace("\\", "/")))
+    return client_dir
+
+
+def _last_phases(metrics_path):
+    """計測結果ファイルの最後の記録のフェーズ別の所要時間を返す（記録がなければ空の dict）。"""
+    try:
+        with open(metrics_path, "r", encoding="utf-8") as f:
+            lines = f.read().splitlines()
+        return json.loads(lines[-1]).get('phases', {}) if lines else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def run_once(python, kind, client_dir):
+    """
+    エントリーポイント（startup.py / shutdown.py）を子プロセスで1回実行し、計測結果を返す。
+
+    Returns:
+        dict: time_to_event_ms, modules_loaded, deferred_loaded, phases_ms, imports（イベント記録までの importtime）、
+              after_event（記録後に読み込まれた最上位のモジュール）
+    """
+    launched = time.time()
+    proc = subprocess.run([python, "-X", "importtime", "-c", DRIVER, client_dir,
+                           os.path.join(client_dir, kind + ".py"), EVENT_MARKER, *DEFERRED_MODULES],
+                          capture_output=True, text=True, timeout=60)
+    if proc.returncode != 0:
+        raise RuntimeError(f"measurement process failed:\n{proc.stderr}")
+    measured = json.loads(proc.stdout.strip().splitlines()[-1])
+    if measured is None:
+        raise RuntimeError(f"{kind}.py did not append an event to the spool:\n{proc.stderr}")
+    recorded_at, modules_loaded, deferred_loaded = measured
+    imports, after_event = parse_importtime(proc.stderr)
+    return {
+        'time_to_event_ms': (recorded_at - launched) * 1000,
+        'modules_loaded': modules_loaded,
+        'deferred_loaded': deferred_loaded,
+        'phases_ms': _last_phases(os.path.join(os.path.dirname(client_dir), "metrics.jsonl")),
+        'imports': imports,
+        'after_event': [name for name, _, _, depth in after_event if depth == 0],
+    }
+
+
+def interpreter_baseline(python):
+    """何も import しない Python プロセスの起動から終了直前までの時間（ミリ秒）"""
+    launched = time.time()
+    proc = subprocess.run([python, "-c", "import time; print(time.time())"],
+                          capture_output=True, text=True, timeout=60)
+    return (float(proc.stdout.strip()) - launched) * 1000
+
+
+def summarize(values):
+    return {
+        'median': round(statistics.median(values), 3),
+        'min': round(min(values), 3),
+        'max': round(max(values), 3),
+    }
+
+
+def measure(kind="shutdown", runs=5, top=15, python=None):
+    """
+    イベント記録までの時間を runs 回計測し、レポート（dict）を返す。
+
+    Parameters:
+        kind (str): "startup" または "shutdown"
+        runs (int): 計測回数（初回はディスクキャッシュの影響を受けるため、中央値を比較に使う）
+        top (int): 自身の時間が長い import を何件出力するか
+        python (str or None): 計測に使う Python（省略時は実行中の Python）
+
+    Returns:
+        dict: 計測結果のレポート
+    """
+    python = python or sys.executable
+    with tempfile.TemporaryDirectory(prefix="pcat_startup_") as temp_dir:
+        client_dir = prepare_client(temp_dir)
+        samples = [run_once(python, kind, client_dir) for _ in range(runs)]
+        baseline = [interpreter_baseline(python) for _ in range(runs)]
+
+    # import の内訳は中央値に最も近い実行のものを使う
+    totals = [s['time_to_event_ms'] for s in samples]
+    median = statistics.median(totals)
+    representative = min(samples, key=lambda s: abs(s['time_to_event_ms'] - median))
+    imports = representative['imports']
+    top_level = [(name, cumulative) for name, _, cumulative, depth in imports if depth == 0]
+    slowest = sorted(imports, key=lambda e: e[1], reverse=True)[:top]
+
+    return {
+        'kind': kind,
+        'python': python,
+        'python_version': sys.version.split()[0],
+        'runs': runs,
+        'time_to_event_ms': summarize(totals),
+        'interpreter_ms': summarize(baseline),
+        'phases_ms': {name: round(value, 3) for name, value in representative['phases_ms'].items()},
+        'modules_loaded': representative['modules_loaded'],
+        'deferred_ok': not any(s['deferred_loaded'] for s in samples),
+        'deferred_loaded': sorted({m for s in samples for m in s['deferred_loaded']}),
+        'imports': {
+            'total_us': sum(cumulative for _, cumulative in top_level),
+            'top_level': [{'module': name, 'cumulative_us': cumulative}
+                          for name, cumulative in sorted(top_level, key=lambda e: e[1], reverse=True)],
+            'slowest_self': [{'module': name, 'self_us': self_us, 'cumulative_us': cumulative}
+                             for name, self_us, cumulative, _ in slowest],
+            'after_event': representative['after_event'],
+        },
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="PCActivityTracker クライアントのイベント記録までの時間を計測する")
+    parser.add_argument("--kind", choices=("startup", "shutdown"), default="shutdown", help="計測する処理")
+    parser.add_argument("--runs", type=int, default=5, help="計測回数")
+    parser.add_argument("--top", type=int, default=15, help="自身の時間が長い import を何件出力するか")
+    parser.add_argument("--python", help="計測に使う Python 実行ファイル（省略時は実行中の Python）")
+    parser.add_argument("--output", help="結果の JSON を書き込むファイル（省略時は標準出力）")
+    args = parser.parse_args(argv)
+
+    report = measure(args.kind, args.runs, args.top, args.python)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())